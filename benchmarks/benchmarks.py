@@ -0,0 +1,124 @@
+"""Benchmarks of combining pipeline outputs and annotating splicing events
+
+Run with airspeed velocity from the repository root, e.g.
+``asv run --quick`` or ``asv continuous master HEAD``. The inputs are
+generated once per benchmark class by ``setup_cache``, at sizes close to a
+real single-cell experiment (hundreds of samples, ~100k events).
+"""
+import os
+
+from rnaseek.create_gffutils_db import create_db
+from rnaseek.miso import SpliceAnnotator, miso_ids_to_intervals
+from rnaseek.scripts.combine_miso_output import CombineMiso
+from rnaseek.scripts.combine_sailfish_output import CombineSailfish
+from rnaseek.scripts.combine_star_mapping_stats import CombineSTARLogFinalOut
+
+from . import synthetic
+
+N_EVENTS = 100000
+
+
+class CombineMisoSuite(object):
+    params = [10, 100]
+    param_names = ['n_samples']
+    timeout = 1200
+
+    def setup_cache(self):
+        return dict((n, synthetic.write_miso_summaries(
+            'miso_{}'.format(n), n_samples=n, n_events=N_EVENTS // 10))
+            for n in self.params)
+
+    def time_combine_miso(self, globs, n_samples):
+        CombineMiso(globs[n_samples], out_dir='combined_miso',
+                    n_progress=100).run()
+
+    def peakmem_combine_miso(self, globs, n_samples):
+        CombineMiso(globs[n_samples], out_dir='combined_miso',
+                    n_progress=100).run()
+
+    def peakmem_combine_miso_compact(self, globs, n_samples):
+        CombineMiso(globs[n_samples], out_dir='combined_miso',
+                    n_progress=100, compact=True).run()
+
+
+class CombineSailfishSuite(object):
+    params = [10, 100]
+    param_names = ['n_samples']
+    timeout = 1200
+
+    def setup_cache(self):
+        return dict((n, synthetic.write_sailfish_quants(
+            'sailfish_{}'.format(n), n_samples=n, n_transcripts=N_EVENTS))
+            for n in self.params)
+
+    def time_combine_sailfish(self, globs, n_samples):
+        CombineSailfish(globs[n_samples], 'combined_sailfish', 100).run()
+
+    def peakmem_combine_sailfish(self, globs, n_samples):
+        CombineSailfish(globs[n_samples], 'combined_sailfish', 100).run()
+
+
+class CombineSTARSuite(object):
+    params = [100, 1000]
+    param_names = ['n_samples']
+    timeout = 600
+
+    def setup_cache(self):
+        return dict((n, synthetic.write_star_logs('star_{}'.format(n), n))
+                    for n in self.params)
+
+    def time_combine_star(self, globs, n_samples):
+        CombineSTARLogFinalOut(globs[n_samples], 'combined_star', 100).run()
+
+    def peakmem_combine_star(self, globs, n_samples):
+        CombineSTARLogFinalOut(globs[n_samples], 'combined_star', 100).run()
+
+
+class SpliceAnnotatorSuite(object):
+    params = [1000, N_EVENTS]
+    param_names = ['n_events']
+    timeout = 600
+
+    def setup(self, n_events):
+        self.miso_ids = synthetic.se_events(n_events).event_name.tolist()
+
+    def time_miso_ids_to_intervals(self, n_events):
+        miso_ids_to_intervals(self.miso_ids, 'SE')
+
+    def time_splice_annotator(self, n_events):
+        SpliceAnnotator(self.miso_ids, 'SE', 'synthetic')
+
+    def peakmem_splice_annotator(self, n_events):
+        SpliceAnnotator(self.miso_ids, 'SE', 'synthetic')
+
+
+class AnnotationSuite(object):
+    """Lookups of events in a gffutils database, which go one query per exon"""
+    n_events = 2000
+    timeout = 1200
+
+    def setup_cache(self):
+        events = synthetic.se_events(self.n_events)
+        gtf = synthetic.write_gtf(events, 'annotation.gtf')
+        genome = synthetic.write_genome(events, 'genome.fa')
+        db = create_db(gtf, 'annotation.db', fast=True)
+        return events.event_name.tolist(), db.dbfn, genome
+
+    def setup(self, cache):
+        import gffutils
+        miso_ids, db_filename, genome = cache
+        self.db = gffutils.FeatureDB(db_filename)
+        self.annotator = SpliceAnnotator(miso_ids, 'SE', 'synthetic')
+        # Set after construction, so no bedtools sequences are made
+        self.annotator.genome_fasta = os.path.abspath(genome)
+        try:
+            os.mkdir('converted')
+        except OSError:
+            pass
+
+    def time_convert_miso_ids_to_everything(self, cache):
+        self.annotator.convert_miso_ids_to_everything(
+            self.annotator.miso_ids, self.db, 'SE', 'converted')
+
+    def time_isoform_translations(self, cache):
+        self.annotator.isoform_translations(self.db)
@@ -0,0 +1,293 @@
+"""Generators of synthetic inputs at realistic scale for the benchmarks
+
+Everything is generated from a seeded random state, so the same parameters
+always give the same files.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+MISO_SUMMARY_COLUMNS = ['event_name', 'miso_posterior_mean', 'ci_low',
+                        'ci_high', 'isoforms', 'counts', 'assigned_counts',
+                        'chrom', 'strand', 'mRNA_starts', 'mRNA_ends']
+
+# Exon and intron lengths of the synthetic skipped exon events, and the
+# distance between consecutive events on a chromosome
+EXON_LENGTH = 60
+INTRON_LENGTH = 120
+EVENT_SPACING = 500
+
+
+def makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError:
+        pass
+
+
+def se_events(n_events, n_chromosomes=4, seed=0):
+    """Coordinates of synthetic skipped exon events
+
+    Returns
+    -------
+    events : pandas.DataFrame
+        One row per event with the columns "chrom", "strand", the 1-based
+        "start" and "stop" of "exon1", "exon2" and "exon3" (e.g.
+        "exon1_start") and the MISO ID as "event_name"
+    """
+    random_state = np.random.RandomState(seed)
+    i = np.arange(n_events)
+    chrom = np.array(['chr{}'.format(x + 1) for x in i % n_chromosomes])
+    offset = (i // n_chromosomes) * EVENT_SPACING + 1
+    strand = np.where(random_state.rand(n_events) < 0.5, '+', '-')
+    events = pd.DataFrame({'chrom': chrom, 'strand': strand})
+    for j in range(3):
+        start = offset + j * (EXON_LENGTH + INTRON_LENGTH)
+        events['exon{}_start'.format(j + 1)] = start
+        events['exon{}_stop'.format(j + 1)] = start + EXON_LENGTH - 1
+
+    # Exons are listed 5' to 3', so backwards on the "-" strand
+    exons = []
+    for j in range(3):
+        exons.append(events.chrom + ':' +
+                     events['exon{}_start'.format(j + 1)].astype(str) + ':' +
+                     events['exon{}_stop'.format(j + 1)].astype(str) + ':' +
+                     events.strand)
+    forward = exons[0] + '@' + exons[1] + '@' + exons[2]
+    reverse = exons[2] + '@' + exons[1] + '@' + exons[0]
+    events['event_name'] = np.where(events.strand == '+', forward, reverse)
+    return events
+
+
+def write_genome(events, filename, seed=0):
+    """Write a random genome fasta (and its index) covering all the events"""
+    random_state = np.random.RandomState(seed)
+    lengths = events.groupby('chrom').exon3_stop.max() + EVENT_SPACING
+    with open(filename, 'w') as f:
+        for chrom, length in lengths.items():
+            f.write('>{}\n'.format(chrom))
+            bases = np.array(list('ACGT'))[random_state.randint(0, 4, length)]
+            sequence = ''.join(bases)
+            for i in range(0, length, 60):
+                f.write(sequence[i:i + 60] + '\n')
+    from pyfaidx import Fasta
+    Fasta(filename)
+    return filename
+
+
+def write_gtf(events, filename):
+    """Write a GTF with the two transcripts of every skipped exon event
+
+    Each event is its own gene, with an exclusion ("_1") and inclusion
+    ("_2") transcript whose exons are all coding
+    """
+    lines = []
+    for i, event in enumerate(events.itertuples()):
+        chrom, strand = event.chrom, event.strand
+        gene = 'ENSG{:011d}.1'.format(i)
+        gene_attributes = 'gene_id "{}"; gene_type "protein_coding"; ' \
+                          'gene_name "GENE{}";'.format(gene, i)
+        lines.append('\t'.join([chrom, 'HAVANA', 'gene',
+                                str(event.exon1_start), str(event.exon3_stop),
+                                '.', strand, '.', gene_attributes]))
+        exons = [(event.exon1_start, event.exon1_stop),
+                 (event.exon2_start, event.exon2_stop),
+                 (event.exon3_start, event.exon3_stop)]
+        for t, included in enumerate(((0, 2), (0, 1, 2))):
+            transcript = 'ENST{:011d}.1'.format(i * 2 + t)
+            attributes = '{} transcript_id "{}"; transcript_type ' \
+                         '"protein_coding";'.format(gene_attributes,
+                                                    transcript)
+            lines.append('\t'.join([chrom, 'HAVANA', 'transcript',
+                                    str(event.exon1_start),
+                                    str(event.exon3_stop), '.', strand, '.',
+                                    attributes]))
+            ordered = included if strand == '+' else included[::-1]
+            coding = 0
+            for n, j in enumerate(ordered):
+                start, stop = exons[j]
+                exon_attributes = '{} exon_number {};'.format(attributes,
+                                                              n + 1)
+                frame = str((3 - coding % 3) % 3)
+                coding += stop - start + 1
+                lines.append('\t'.join([chrom, 'HAVANA', 'exon', str(start),
+                                        str(stop), '.', strand, '.',
+                                        exon_attributes]))
+                lines.append('\t'.join([chrom, 'HAVANA', 'CDS', str(start),
+                                        str(stop), '.', strand, frame,
+                                        exon_attributes]))
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return filename
+
+
+def miso_summary(events, seed=0):
+    """A MISO summary table of the events, with random PSIs and counts"""
+    random_state = np.random.RandomState(seed)
+    n = events.shape[0]
+    psi = random_state.beta(0.5, 0.5, n)
+    width = random_state.uniform(0.01, 0.8, n)
+    counts = random_state.poisson(30, (n, 4))
+    event_name = events.event_name
+    starts = events.exon1_start.astype(str)
+    stops = events.exon3_stop.astype(str)
+    return pd.DataFrame(
+        {'event_name': event_name,
+         'miso_posterior_mean': psi.round(2),
+         'ci_low': np.maximum(psi - width / 2, 0).round(2),
+         'ci_high': np.minimum(psi + width / 2, 1).round(2),
+         'isoforms': "'" + event_name + ".A','" + event_name + ".B'",
+         'counts': ['(0,0):{},(1,0):{},(1,1):{},(0,1):{}'.format(*x)
+                    for x in counts],
+         'assigned_counts': ['0:{},1:{}'.format(a + c, b + d)
+                             for a, b, c, d in counts],
+         'chrom': events.chrom, 'strand': events.strand,
+         'mRNA_starts': starts + ',' + starts,
+         'mRNA_ends': stops + ',' + stops},
+        columns=MISO_SUMMARY_COLUMNS)
+
+
+def write_miso_summaries(directory, n_samples, n_events,
+                         splice_types=('SE', 'MXE'), seed=0):
+    """Write MISO summaries as <directory>/miso/<sample_id>/<splice_type>/
+    summary/<splice_type>.miso_summary
+
+    Returns
+    -------
+    glob_command : str
+        Glob of all the written summary files, for ``CombineMiso``
+    """
+    events = se_events(n_events, seed=seed)
+    for i in range(n_samples):
+        sample_id = 'sample{}'.format(i)
+        for j, splice_type in enumerate(splice_types):
+            summary_dir = os.path.join(directory, 'miso', sample_id,
+                                       splice_type, 'summary')
+            makedirs(summary_dir)
+            # Each sample only has some of the events, as in real data
+            summary = miso_summary(events, seed=seed + i * len(splice_types)
+                                   + j)
+            keep = np.random.RandomState(seed + i).rand(n_events) < 0.8
+            summary.loc[keep].to_csv(
+                os.path.join(summary_dir,
+                             '{}.miso_summary'.format(splice_type)),
+                sep='\t', index=False)
+    return os.path.join(directory, 'miso', '*', '*', 'summary',
+                        '*.miso_summary')
+
+
+def write_sailfish_quants(directory, n_samples, n_transcripts,
+                          n_spikeins=92, seed=0):
+    """Write Sailfish quantifications as <directory>/<sample_id>.sailfish/
+    quant_bias_corrected.sf
+
+    Returns
+    -------
+    glob_command : str
+        Glob of the sailfish output directories, for ``CombineSailfish``
+    """
+    random_state = np.random.RandomState(seed)
+    # About 4 transcripts per gene, in the GENCODE transcript fasta format
+    transcripts = ['ENST{0:011d}.1|ENSG{1:011d}.1|OTTHUMG|OTTHUMT|'
+                   'NAME-00{2}|NAME|1000|protein_coding|'.format(
+                       i, i // 4, i % 4) for i in range(n_transcripts)]
+    names = transcripts + ['ERCC-{:05d}'.format(i) for i in range(n_spikeins)]
+    n = len(names)
+    length = random_state.randint(200, 10000, n)
+    for i in range(n_samples):
+        sample_dir = os.path.join(directory, 'sample{}.sailfish'.format(i))
+        makedirs(sample_dir)
+        reads = random_state.negative_binomial(1, 0.01, n).astype(float)
+        rpkm = reads / length * 1e3 / max(reads.sum(), 1) * 1e6
+        tpm = rpkm / rpkm.sum() * 1e6
+        quant = pd.DataFrame({'transcript': names, 'length': length,
+                              'tpm': tpm, 'rpkm': rpkm, 'kpkm': rpkm,
+                              'EstimatedNumKmers': reads * 50,
+                              'EstimatedNumReads': reads},
+                             columns=['transcript', 'length', 'tpm', 'rpkm',
+                                      'kpkm', 'EstimatedNumKmers',
+                                      'EstimatedNumReads'])
+        with open(os.path.join(sample_dir, 'quant_bias_corrected.sf'),
+                  'w') as f:
+            f.write('# sailfish (quasi-mapping-based) v0.6.3\n'
+                    '# [ program ] => sailfish\n'
+                    '# [ command ] => quant\n'
+                    '# [ mapping rate ] => 89.0%\n'
+                    '# Transcript\tLength\tTPM\tRPKM\tKPKM\t'
+                    'EstimatedNumKmers\tEstimatedNumReads\n')
+            quant.to_csv(f, sep='\t', header=False, index=False)
+    return os.path.join(directory, '*.sailfish')
+
+
+STAR_LOG_FINAL_OUT = """\
+                                 Started job on |\tJun 03 10:54:56
+                             Started mapping on |\tJun 03 10:55:22
+                                    Finished on |\tJun 03 11:04:31
+       Mapping speed, Million of reads per hour |\t{speed:.2f}
+
+                          Number of input reads |\t{input}
+                      Average input read length |\t{read_length}
+                                    UNIQUE READS:
+                   Uniquely mapped reads number |\t{unique}
+                        Uniquely mapped reads % |\t{unique_percent:.2f}%
+                          Average mapped length |\t{mapped_length:.2f}
+                       Number of splices: Total |\t{splices}
+            Number of splices: Annotated (sjdb) |\t{sjdb}
+                       Number of splices: GT/AG |\t{gtag}
+                       Number of splices: GC/AG |\t{gcag}
+                       Number of splices: AT/AC |\t{atac}
+               Number of splices: Non-canonical |\t{noncanonical}
+                      Mismatch rate per base, % |\t{mismatch:.2f}%
+                         Deletion rate per base |\t0.01%
+                        Deletion average length |\t1.73
+                        Insertion rate per base |\t0.01%
+                       Insertion average length |\t1.40
+                             MULTI-MAPPING READS:
+        Number of reads mapped to multiple loci |\t{multi}
+             % of reads mapped to multiple loci |\t{multi_percent:.2f}%
+        Number of reads mapped to too many loci |\t{too_many}
+             % of reads mapped to too many loci |\t{too_many_percent:.2f}%
+                                  UNMAPPED READS:
+       % of reads unmapped: too many mismatches |\t0.00%
+                 % of reads unmapped: too short |\t{short_percent:.2f}%
+                     % of reads unmapped: other |\t0.50%
+"""
+
+
+def write_star_logs(directory, n_samples, seed=0):
+    """Write STAR's Log.final.out files as <directory>/<sample_id>.Log.final.out
+
+    Returns
+    -------
+    glob_command : str
+        Glob of the written files, for ``CombineSTARLogFinalOut``
+    """
+    random_state = np.random.RandomState(seed)
+    makedirs(directory)
+    for i in range(n_samples):
+        n_input = int(random_state.randint(1e6, 5e7))
+        unique = int(n_input * random_state.uniform(0.6, 0.95))
+        multi = int((n_input - unique) * 0.5)
+        too_many = int((n_input - unique) * 0.01)
+        splices = int(unique * random_state.uniform(0.1, 0.4))
+        gtag = int(splices * 0.98)
+        gcag = int(splices * 0.01)
+        atac = int(splices * 0.001)
+        log = STAR_LOG_FINAL_OUT.format(
+            speed=random_state.uniform(50, 500), input=n_input,
+            read_length=100, unique=unique,
+            unique_percent=100.0 * unique / n_input,
+            mapped_length=random_state.uniform(95, 100), splices=splices,
+            sjdb=int(splices * 0.95), gtag=gtag, gcag=gcag, atac=atac,
+            noncanonical=splices - gtag - gcag - atac,
+            mismatch=random_state.uniform(0.1, 1), multi=multi,
+            multi_percent=100.0 * multi / n_input, too_many=too_many,
+            too_many_percent=100.0 * too_many / n_input,
+            short_percent=100.0 * (n_input - unique - multi - too_many) /
+            n_input - 0.5)
+        filename = os.path.join(directory,
+                                'sample{}.Log.final.out'.format(i))
+        with open(filename, 'w') as f:
+            f.write(log)
+    return os.path.join(directory, '*Log.final.out')
@@ -0,0 +1,185 @@
+"""Per-event statistics of PSI across a cohort, accumulated one file at a time
+
+The count, mean and variance (with Welford's online algorithm, merged as in
+Chan et al.), minimum, maximum, mean confidence interval width and a
+histogram of PSI are kept for every (event_name, splice_type), so they can
+be computed while the summaries are read, without ever making the
+(events, samples) PSI matrix. Accumulators of separate runs are merged
+exactly, in any order.
+"""
+import numpy as np
+import pandas as pd
+
+KEY_NAMES = ['event_name', 'splice_type']
+STATISTICS_COLUMNS = ['n_samples', 'psi_mean', 'psi_variance', 'psi_min',
+                      'psi_max', 'ci_diff_mean']
+
+
+class EventStatistics(object):
+
+    def __init__(self, n_bins=20):
+        """Mergeable online accumulators of PSI for every event
+
+        Parameters
+        ----------
+        n_bins : int, optional
+            Number of equal-width bins of PSI between 0 and 1 in the
+            histogram of each event
+        """
+        self.n_bins = n_bins
+        self.keys = pd.MultiIndex.from_arrays([[], []], names=KEY_NAMES)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.mean = np.zeros(0)
+        self.m2 = np.zeros(0)
+        self.min = np.zeros(0)
+        self.max = np.zeros(0)
+        self.ci_diff_sum = np.zeros(0)
+        self.histogram = np.zeros((0, n_bins), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _positions(self, keys):
+        """Positions of keys in the accumulators, adding the new ones"""
+        positions = self.keys.get_indexer(keys)
+        new = positions < 0
+        if new.any():
+            new_keys = keys[new].unique()
+            n_new = len(new_keys)
+            self.keys = self.keys.append(new_keys).set_names(KEY_NAMES)
+            self.count = np.concatenate([self.count,
+                                         np.zeros(n_new, dtype=np.int64)])
+            self.mean = np.concatenate([self.mean, np.zeros(n_new)])
+            self.m2 = np.concatenate([self.m2, np.zeros(n_new)])
+            self.min = np.concatenate([self.min, np.repeat(np.inf, n_new)])
+            self.max = np.concatenate([self.max, np.repeat(-np.inf, n_new)])
+            self.ci_diff_sum = np.concatenate([self.ci_diff_sum,
+                                               np.zeros(n_new)])
+            self.histogram = np.concatenate(
+                [self.histogram, np.zeros((n_new, self.n_bins),
+                                          dtype=np.int64)])
+            positions[new] = self.keys.get_indexer(keys[new])
+        return positions
+
+    def update(self, event_name, splice_type, psi, ci_diff=None):
+        """Add a batch of PSI values, e.g. one sample's summary
+
+        Parameters
+        ----------
+        event_name : list-like
+            Event of each value. An event may appear more than once
+        splice_type : str or list-like
+            Splice type of all or each of the events
+        psi : list-like
+            PSI values. NaNs are skipped
+        ci_diff : list-like, optional
+            Width of the confidence interval of each value
+        """
+        psi = np.asarray(psi, dtype=float)
+        event_name = np.asarray(event_name, dtype=object)
+        splice_type = np.broadcast_to(
+            np.asarray(splice_type, dtype=object), event_name.shape)
+        ci_diff = np.zeros(psi.shape) if ci_diff is None \
+            else np.asarray(ci_diff, dtype=float)
+        valid = ~np.isnan(psi)
+        keys = pd.MultiIndex.from_arrays(
+            [event_name[valid], splice_type[valid]], names=KEY_NAMES)
+        psi, ci_diff = psi[valid], ci_diff[valid]
+        if len(keys) == 0:
+            return self
+
+        # Statistics of the batch, then merged into the accumulators
+        codes, batch_keys = pd.factorize(keys)
+        n_keys = len(batch_keys)
+        count = np.bincount(codes, minlength=n_keys)
+        mean = np.bincount(codes, weights=psi, minlength=n_keys) / count
+        m2 = np.bincount(codes, weights=(psi - mean[codes]) ** 2,
+                         minlength=n_keys)
+        minimum = np.full(n_keys, np.inf)
+        np.minimum.at(minimum, codes, psi)
+        maximum = np.full(n_keys, -np.inf)
+        np.maximum.at(maximum, codes, psi)
+        bins = np.clip((psi * self.n_bins).astype(np.int64), 0,
+                       self.n_bins - 1)
+        histogram = np.bincount(codes * self.n_bins + bins,
+                                minlength=n_keys * self.n_bins).reshape(
+            n_keys, self.n_bins)
+        self._merge(batch_keys, count, mean, m2, minimum, maximum,
+                    np.bincount(codes, weights=ci_diff, minlength=n_keys),
+                    histogram)
+        return self
+
+    def _merge(self, keys, count, mean, m2, minimum, maximum, ci_diff_sum,
+               histogram):
+        """Merge the accumulators of unique keys into these"""
+        i = self._positions(keys)
+        n_a, n_b = self.count[i], count
+        n = n_a + n_b
+        delta = mean - self.mean[i]
+        self.mean[i] += delta * n_b / n
+        self.m2[i] += m2 + delta ** 2 * n_a * n_b / n
+        self.count[i] = n
+        self.min[i] = np.minimum(self.min[i], minimum)
+        self.max[i] = np.maximum(self.max[i], maximum)
+        self.ci_diff_sum[i] += ci_diff_sum
+        self.histogram[i] += histogram
+
+    def merge(self, other):
+        """Add the accumulators of another EventStatistics, e.g. of a
+        separate run, to these"""
+        if other.n_bins != self.n_bins:
+            raise ValueError('Cannot merge histograms of {} and {} '
+                             'bins'.format(self.n_bins, other.n_bins))
+        if len(other) > 0:
+            self._merge(other.keys, other.count, other.mean, other.m2,
+                        other.min, other.max, other.ci_diff_sum,
+                        other.histogram)
+        return self
+
+    def to_frame(self):
+        """Table of the statistics of every event
+
+        Returns
+        -------
+        statistics : pandas.DataFrame
+            Indexed by (event_name, splice_type), with the columns in
+            STATISTICS_COLUMNS, where "psi_variance" is the sample variance
+            (NaN for events in only one sample), and then the histogram
+            counts of PSI in "psi_hist_0", "psi_hist_1", ..., of the bins
+            [0, 1/n_bins), [1/n_bins, 2/n_bins), ...
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.where(self.count > 1, self.m2 / (self.count - 1),
+                                np.nan)
+            ci_diff_mean = self.ci_diff_sum / self.count
+        statistics = pd.DataFrame(
+            {'n_samples': self.count, 'psi_mean': self.mean,
+             'psi_variance': variance, 'psi_min': self.min,
+             'psi_max': self.max, 'ci_diff_mean': ci_diff_mean},
+            index=self.keys, columns=STATISTICS_COLUMNS)
+        histogram = pd.DataFrame(
+            self.histogram, index=self.keys,
+            columns=['psi_hist_{}'.format(i) for i in range(self.n_bins)])
+        return pd.concat([statistics, histogram], axis=1).sort_index()
+
+    @classmethod
+    def from_frame(cls, statistics):
+        """Accumulators from a table made by ``to_frame``, e.g. read from a
+        previous run's csv with ``index_col=[0, 1]``"""
+        histogram = statistics.filter(regex='^psi_hist_[0-9]+$')
+        accumulators = cls(n_bins=histogram.shape[1])
+        if statistics.shape[0] == 0:
+            return accumulators
+        count = statistics.n_samples.values.astype(np.int64)
+        accumulators._merge(
+            pd.MultiIndex.from_arrays(
+                [statistics.index.get_level_values(i).astype(str)
+                 for i in range(2)], names=KEY_NAMES),
+            count, statistics.psi_mean.values.astype(float),
+            np.nan_to_num(statistics.psi_variance.values.astype(float)) *
+            (count - 1),
+            statistics.psi_min.values.astype(float),
+            statistics.psi_max.values.astype(float),
+            statistics.ci_diff_mean.values.astype(float) * count,
+            histogram.values.astype(np.int64))
+        return accumulators
@@ -1,3 +1,361 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pybedtools
+from pyfaidx import Fasta
+
+# Columnar representation of intervals shared by all the annotators. Intervals
+# are in BED coordinates: 0-based start, non-inclusive stop
+INTERVAL_COLUMNS = ['event_name', 'feature', 'chrom', 'start', 'stop',
+                    'strand']
+
+BED_COLUMNS = ['chrom', 'start', 'stop', 'name', 'score', 'strand',
+               'thick_start', 'thick_stop', 'item_rgb', 'block_count',
+               'block_sizes', 'block_starts']
+
+try:
+    COMPLEMENT = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+except AttributeError:
+    # Python 2
+    import string
+    COMPLEMENT = string.maketrans('ACGTNacgtn', 'TGCANtgcan')
+
+
+def intervals_to_bedtool(intervals):
+    """Convert a table of intervals to a single six-column bedtool
+
+    Parameters
+    ----------
+    intervals : pandas.DataFrame
+        Table of intervals with the columns in ``INTERVAL_COLUMNS``
+
+    Returns
+    -------
+    bedtool : pybedtools.BedTool
+        Intervals in the same order as the table, named by the event name
+    """
+    bed = pd.DataFrame({'chrom': intervals.chrom, 'start': intervals.start,
+                        'stop': intervals.stop,
+                        'name': intervals.event_name, 'score': '1000',
+                        'strand': intervals.strand},
+                       columns=['chrom', 'start', 'stop', 'name', 'score',
+                                'strand'])
+    return pybedtools.BedTool(bed.to_csv(sep='\t', header=False, index=False),
+                              from_string=True)
+
+
+def count_header_lines(filename):
+    """Count the "track", "browser" and "#" lines at the top of a BED file"""
+    n = 0
+    with open(filename) as f:
+        for line in f:
+            if not line.startswith(('track', 'browser', '#')):
+                break
+            n += 1
+    return n
+
+
+def read_bed(filename, chunksize=100000):
+    """Stream a BED file (3 to 12 columns) as chunks of raw BED rows
+
+    Parameters
+    ----------
+    filename : str
+        Location of the BED file
+    chunksize : int, optional
+        Number of lines to read at once
+
+    Returns
+    -------
+    chunks : iterator of pandas.DataFrame
+        Tables of up to ``chunksize`` rows, with the columns named as the
+        first ``BED_COLUMNS``
+    """
+    reader = pd.read_csv(filename, sep='\t', header=None,
+                         skiprows=count_header_lines(filename),
+                         chunksize=chunksize, dtype={3: str, 5: str})
+    for chunk in reader:
+        chunk.columns = BED_COLUMNS[:chunk.shape[1]]
+        yield chunk
+
+
+def bed_to_intervals(bed):
+    """Convert raw BED rows to the columnar interval representation
+
+    BED3-BED6 rows become single intervals with the feature "interval".
+    BED12 rows are expanded into their blocks, named "exon1", "exon2", ...,
+    and the gaps between blocks, named "intron1", "intron2", ..., numbered
+    from the 5' end of the feature as in MISO IDs.
+
+    Parameters
+    ----------
+    bed : pandas.DataFrame
+        Raw BED rows, as from ``read_bed``
+
+    Returns
+    -------
+    intervals : pandas.DataFrame
+        Table of intervals with the columns in ``INTERVAL_COLUMNS``. Rows
+        without a name are named "chrom:start-stop:strand", in the original
+        1-based coordinates
+    """
+    chrom = bed.chrom.astype(str).values
+    start = bed.start.values.astype(np.int64)
+    stop = bed.stop.values.astype(np.int64)
+    strand = bed.strand.values if 'strand' in bed else \
+        np.repeat('.', bed.shape[0])
+    if 'name' in bed:
+        name = bed['name'].values
+    else:
+        name = pd.Series(chrom) + ':' + pd.Series(start + 1).astype(str) \
+            + '-' + pd.Series(stop).astype(str) + ':' + pd.Series(strand)
+        name = name.values
+
+    if 'block_count' not in bed:
+        return pd.DataFrame({'event_name': name, 'feature': 'interval',
+                             'chrom': chrom, 'start': start, 'stop': stop,
+                             'strand': strand}, columns=INTERVAL_COLUMNS)
+
+    # Expand all the blocks of all the rows at once
+    counts = bed.block_count.values.astype(np.int64)
+    sizes = np.array(','.join(bed.block_sizes.astype(str).str.rstrip(','))
+                     .split(','), dtype=np.int64)
+    offsets = np.array(','.join(bed.block_starts.astype(str).str.rstrip(','))
+                       .split(','), dtype=np.int64)
+    row = np.repeat(np.arange(bed.shape[0]), counts)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    block = np.arange(row.shape[0]) - first
+    minus = strand[row] == '-'
+
+    exon_start = start[row] + offsets
+    exon_stop = exon_start + sizes
+    exon_number = np.where(minus, counts[row] - block, block + 1)
+
+    # Introns are between consecutive blocks of the same row
+    has_next = np.zeros(row.shape[0], dtype=bool)
+    has_next[:-1] = row[1:] == row[:-1]
+    intron = np.nonzero(has_next)[0]
+    intron_number = np.where(minus[intron], counts[row[intron]] - 1 -
+                             block[intron], block[intron] + 1)
+
+    exons = pd.DataFrame(
+        {'event_name': name[row], 'chrom': chrom[row],
+         'feature': ['exon{}'.format(n) for n in exon_number],
+         'start': exon_start, 'stop': exon_stop, 'strand': strand[row]},
+        columns=INTERVAL_COLUMNS)
+    introns = pd.DataFrame(
+        {'event_name': name[row[intron]], 'chrom': chrom[row[intron]],
+         'feature': ['intron{}'.format(n) for n in intron_number],
+         'start': exon_stop[intron], 'stop': exon_start[intron + 1],
+         'strand': strand[row[intron]]},
+        columns=INTERVAL_COLUMNS)
+    return pd.concat([exons, introns], ignore_index=True)
+
+
+def reverse_complement(seq):
+    """Reverse complement a DNA sequence
+
+    >>> reverse_complement('AACGTN')
+    'NACGTT'
+    """
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def read_clusters(chromosome, start, stop, max_gap=1000):
+    """Read the bases under many intervals of one chromosome
+
+    The intervals are sorted and clustered wherever they overlap or are at
+    most ``max_gap`` bases apart, and only the clusters are read, so about
+    only the bases under the intervals are read however unsorted and spread
+    out they are.
+
+    Parameters
+    ----------
+    chromosome : pyfaidx.FastaRecord
+        Chromosome of an indexed genome opened with ``as_raw=True``, or
+        anything else sliced into strings
+    start, stop : numpy.ndarray
+        Intervals, in BED coordinates
+    max_gap : int, optional
+        Largest number of bases between intervals to read them together
+
+    Returns
+    -------
+    bases : str
+        The bases of the clusters, one after the other
+    first, last : numpy.ndarray
+        Where each interval starts and stops in ``bases``, in the order of
+        ``start``. Intervals past the end of the chromosome are cut at its
+        end
+    """
+    start = np.asarray(start, dtype=np.int64)
+    stop = np.asarray(stop, dtype=np.int64)
+    order = np.argsort(start, kind='mergesort')
+    start, stop = start[order], stop[order]
+
+    # A new cluster starts wherever an interval starts more than max_gap
+    # after every interval before it has stopped
+    first_in_cluster = np.ones(start.shape[0], dtype=bool)
+    first_in_cluster[1:] = start[1:] > \
+        np.maximum.accumulate(stop)[:-1] + max_gap
+    cluster = np.cumsum(first_in_cluster) - 1
+    cluster_start = start[first_in_cluster]
+    cluster_stop = np.maximum.reduceat(stop,
+                                       np.nonzero(first_in_cluster)[0]) \
+        if start.shape[0] > 0 else stop
+
+    pieces = [str(chromosome[int(a):int(b)])
+              for a, b in zip(cluster_start, cluster_stop)]
+    lengths = np.array([len(x) for x in pieces], dtype=np.int64)
+    piece_stop = np.cumsum(lengths)[cluster]
+    offset = piece_stop - lengths[cluster] - cluster_start[cluster]
+    first = np.empty(start.shape[0], dtype=np.int64)
+    last = np.empty(start.shape[0], dtype=np.int64)
+    first[order] = np.minimum(offset + start, piece_stop)
+    last[order] = np.minimum(offset + stop, piece_stop)
+    return ''.join(pieces), first, last
+
+
+def interval_sequences(intervals, genome, sequences=True, max_gap=1000):
+    """Get the lengths, GC content and sequences of many intervals at once
+
+    The genome is read in clusters of nearby intervals with
+    ``read_clusters``, and the GC content of every interval is computed
+    from a cumulative sum over the bases read.
+
+    Parameters
+    ----------
+    intervals : pandas.DataFrame
+        Table of intervals with the columns in ``INTERVAL_COLUMNS``
+    genome : pyfaidx.Fasta
+        Indexed genome, opened with ``as_raw=True``
+    sequences : bool, optional
+        If True, also get the sequence of each interval, reverse complemented
+        for intervals on the "-" strand
+    max_gap : int, optional
+        Largest number of bases between intervals to read them together
+
+    Returns
+    -------
+    annotations : pandas.DataFrame
+        A table with the same index as ``intervals`` and the columns
+        "length", "gc" and (if ``sequences``) "sequence". Intervals on
+        chromosomes missing from the genome have NaN GC content
+    """
+    length = (intervals.stop - intervals.start).values
+    gc = np.repeat(np.nan, intervals.shape[0])
+    seqs = np.repeat(None, intervals.shape[0])
+
+    for chrom, index in intervals.groupby('chrom').indices.items():
+        if chrom not in genome:
+            continue
+        start = intervals.start.values[index].astype(np.int64)
+        stop = intervals.stop.values[index].astype(np.int64)
+        bases, first, last = read_clusters(genome[chrom], start, stop,
+                                           max_gap)
+        bases = bases.upper()
+        encoded = np.frombuffer(bases.encode('ascii'), dtype=np.uint8)
+        is_gc = (encoded == ord('G')) | (encoded == ord('C'))
+        cumulative = np.concatenate([[0], np.cumsum(is_gc)])
+        n_gc = cumulative[last] - cumulative[first]
+        gc[index] = n_gc / np.maximum(stop - start, 1).astype(float)
+
+        if sequences:
+            strands = intervals.strand.values[index]
+            for i, a, b, strand in zip(index, first, last, strands):
+                seq = bases[a:b]
+                seqs[i] = reverse_complement(seq) if strand == '-' else seq
+
+    annotations = pd.DataFrame({'length': length, 'gc': gc},
+                               index=intervals.index,
+                               columns=['length', 'gc'])
+    if sequences:
+        annotations['sequence'] = seqs
+    return annotations
+
 
 class BedAnnotator(object):
-    pass
\ No newline at end of file
+
+    def __init__(self, bed_filename, genome_fasta=None, chunksize=100000):
+        """Annotate arbitrary intervals from BED or BED12 files
+
+        The BED file is streamed in chunks of ``chunksize`` lines, so
+        millions of intervals can be annotated without reading the file into
+        memory at once.
+
+        Parameters
+        ----------
+        bed_filename : str
+            Location of a BED3-BED6 file of single intervals, or BED12 file
+            of features with blocks (e.g. exons of transcripts)
+        genome_fasta : str, optional
+            Location of the (indexed!) genome fasta file. If not given, only
+            lengths are computed
+        chunksize : int, optional
+            Number of BED lines to annotate at once
+        """
+        if chunksize < 1:
+            raise ValueError('"chunksize" must be 1 or greater')
+        self.bed_filename = bed_filename
+        self.genome_fasta = genome_fasta
+        self.chunksize = chunksize
+
+    def intervals(self):
+        """Iterate over chunks of the BED file as tables of intervals"""
+        for bed in read_bed(self.bed_filename, self.chunksize):
+            yield bed_to_intervals(bed)
+
+    def annotate(self, sequences=False):
+        """Iterate over chunks of annotated intervals
+
+        Parameters
+        ----------
+        sequences : bool, optional
+            If True, also add the sequence of each interval
+
+        Returns
+        -------
+        annotated : iterator of pandas.DataFrame
+            Tables of intervals with the added columns "length", and if a
+            genome fasta was given, "gc" and (if ``sequences``) "sequence"
+        """
+        genome = None
+        if self.genome_fasta is not None:
+            genome = Fasta(self.genome_fasta, as_raw=True)
+
+        for intervals in self.intervals():
+            if genome is None:
+                intervals['length'] = intervals.stop - intervals.start
+                yield intervals
+            else:
+                yield pd.concat([intervals, interval_sequences(
+                    intervals, genome, sequences=sequences)], axis=1)
+
+    def write(self, filename, sequences=False, n_progress=10):
+        """Annotate all intervals and write them as they are computed
+
+        Parameters
+        ----------
+        filename : str
+            Comma-separated file to write. Each chunk is appended to it as
+            soon as it has been annotated
+        sequences : bool, optional
+            If True, also write the sequence of each interval
+        n_progress : int, optional
+            Number of chunks to show per iterative progress
+        """
+        filename = os.path.abspath(os.path.expanduser(filename))
+        sys.stdout.write('Annotating intervals in {} ...\n'.format(
+            self.bed_filename))
+        n_intervals = 0
+        for i, annotated in enumerate(self.annotate(sequences=sequences)):
+            annotated.to_csv(filename, mode='w' if i == 0 else 'a',
+                             header=i == 0, index=False)
+            n_intervals += annotated.shape[0]
+            if (i + 1) % n_progress == 0:
+                sys.stdout.write('\t{} intervals annotated\n'.format(
+                    n_intervals))
+        sys.stdout.write('\tWrote {} intervals to {}\n'.format(n_intervals,
+                                                               filename))
@@ -0,0 +1,309 @@
+"""Compare PSI between many samples or groups of samples at once
+
+MISO's ``compare_miso`` compares one pair of samples at a time. Here, the
+posterior of PSI of every event in every sample is binned into a histogram,
+and the difference in PSI (delta PSI) and its Bayes factor are computed for
+every contrast of a chunk of events at once, with chunks of events compared
+in parallel.
+
+As in MISO, the Bayes factor is the ratio of the prior to the posterior
+density of delta PSI at zero, where the prior of each PSI is uniform, so
+the prior density of delta PSI at zero is 1. With binned posteriors, the
+posterior density at zero is the probability that both PSIs fall in the
+same bin, divided by the bin width.
+"""
+import itertools
+import multiprocessing
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .posteriors import PosteriorStore
+
+COMPARISON_COLUMNS = ['event_name', 'splice_type', 'contrast', 'psi_1',
+                      'psi_2', 'delta_psi', 'bayes_factor']
+
+# Largest number of (event, contrast, bin) values of the pooled posteriors
+# gathered at once, so memory doesn't grow with the number of contrasts
+CONTRAST_BLOCK_VALUES = 1 << 22
+
+
+def all_pairs(sample_ids):
+    """Contrasts of every pair of samples
+
+    >>> all_pairs(['a', 'b', 'c'])
+    [('a', 'b'), ('a', 'c'), ('b', 'c')]
+    """
+    return list(itertools.combinations(sample_ids, 2))
+
+
+def _contrast_name(group):
+    return group if isinstance(group, str) else ','.join(group)
+
+
+def contrast_weights(contrasts, sample_ids):
+    """Matrices to average samples into the groups of each contrast
+
+    Parameters
+    ----------
+    contrasts : list of (group1, group2) tuples, or dict
+        Each group is a sample id, or a list of sample ids whose posteriors
+        are pooled. A dict maps names of contrasts to their groups, otherwise
+        contrasts are named "<group1>_vs_<group2>"
+    sample_ids : list-like
+        All the sample ids, in the order of the posteriors
+
+    Returns
+    -------
+    weights : numpy.ndarray
+        (n_groups, n_samples) indicator of the samples in each group
+    first, second : numpy.ndarray
+        Group of the first and second side of each contrast
+    names : list of str
+        Name of each contrast
+    """
+    if not isinstance(contrasts, dict):
+        contrasts = dict(('{}_vs_{}'.format(_contrast_name(x),
+                                            _contrast_name(y)), (x, y))
+                         for x, y in contrasts)
+    sample_ids = pd.Index(sample_ids)
+    groups = []
+    first, second = [], []
+    for group1, group2 in contrasts.values():
+        for group, sides in ((group1, first), (group2, second)):
+            group = (group,) if isinstance(group, str) else tuple(group)
+            if group not in groups:
+                groups.append(group)
+            sides.append(groups.index(group))
+
+    weights = np.zeros((len(groups), len(sample_ids)))
+    for i, group in enumerate(groups):
+        positions = sample_ids.get_indexer(group)
+        if (positions < 0).any():
+            missing = [x for x, j in zip(group, positions) if j < 0]
+            raise ValueError('Samples {} are not in the posteriors'.format(
+                ', '.join(missing)))
+        weights[i, positions] = 1
+    return weights, np.array(first), np.array(second), list(contrasts)
+
+
+def bin_posterior_samples(psi, n_bins=100):
+    """Histograms of posterior samples of PSI
+
+    Parameters
+    ----------
+    psi : numpy.ndarray
+        (events, samples, draws) posterior samples, NaN where missing
+
+    Returns
+    -------
+    histograms : numpy.ndarray
+        (events, samples, n_bins) probability of each bin of PSI, which are
+        all 0 where an event has no posterior samples in a sample
+    means : numpy.ndarray
+        (events, samples) posterior mean of PSI
+    """
+    psi = np.asarray(psi, dtype=np.float32)
+    n_events, n_samples = psi.shape[:2]
+    valid = ~np.isnan(psi)
+    bins = np.clip((np.nan_to_num(psi) * n_bins).astype(np.int64), 0,
+                   n_bins - 1)
+    cells = np.arange(n_events * n_samples).reshape(n_events, n_samples, 1)
+    histograms = np.bincount((cells * n_bins + bins)[valid],
+                             minlength=n_events * n_samples * n_bins)
+    histograms = histograms.reshape(n_events, n_samples, n_bins).astype(float)
+    n_draws = valid.sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        histograms /= np.maximum(n_draws, 1)[:, :, np.newaxis]
+        means = np.where(n_draws > 0,
+                         np.nansum(psi, axis=2) / n_draws, np.nan)
+    return histograms, means
+
+
+def bin_summary_posteriors(mean, ci_low, ci_high, n_bins=100):
+    """Histograms of PSI approximated from MISO summaries
+
+    Each posterior is approximated by the beta distribution with the same
+    mean, and a standard deviation of a quarter of the width of the 95%
+    confidence interval
+
+    Parameters
+    ----------
+    mean, ci_low, ci_high : numpy.ndarray
+        (events, samples) "miso_posterior_mean", "ci_low" and "ci_high",
+        NaN where missing
+
+    Returns
+    -------
+    histograms, means : numpy.ndarray
+        As in ``bin_posterior_samples``
+    """
+    mean = np.clip(np.asarray(mean, dtype=float), 1e-6, 1 - 1e-6)
+    sd = (np.asarray(ci_high, dtype=float) -
+          np.asarray(ci_low, dtype=float)) / 4
+    # The variance of a beta distribution is less than mean * (1 - mean)
+    variance = np.clip(sd ** 2, 1e-12, mean * (1 - mean) * (1 - 1e-6))
+    concentration = mean * (1 - mean) / variance - 1
+    alpha = (mean * concentration)[:, :, np.newaxis]
+    beta = ((1 - mean) * concentration)[:, :, np.newaxis]
+
+    centers = (np.arange(n_bins) + 0.5) / n_bins
+    with np.errstate(invalid='ignore'):
+        log_density = (alpha - 1) * np.log(centers) + \
+            (beta - 1) * np.log(1 - centers)
+        log_density -= log_density.max(axis=2)[:, :, np.newaxis]
+        histograms = np.exp(log_density)
+        histograms /= histograms.sum(axis=2)[:, :, np.newaxis]
+    means = np.where(np.isnan(histograms[:, :, 0]), np.nan, mean)
+    return np.nan_to_num(histograms), means
+
+
+def compare_binned(histograms, means, weights, first, second,
+                   bf_max=1e12):
+    """Delta PSI and Bayes factors of every contrast of a chunk of events
+
+    Parameters
+    ----------
+    histograms : numpy.ndarray
+        (events, samples, bins) binned posteriors
+    means : numpy.ndarray
+        (events, samples) posterior means of PSI
+    weights, first, second : numpy.ndarray
+        Groups of samples and the groups of each contrast, as from
+        ``contrast_weights``
+    bf_max : float, optional
+        Bayes factors are capped at this, as the posteriors may not overlap
+        at all
+
+    Returns
+    -------
+    psi_1, psi_2, bayes_factor : numpy.ndarray
+        (events, contrasts) mean PSI of the first and second group of each
+        contrast, and the Bayes factor of their difference. NaN where a group
+        has no samples with the event
+    """
+    n_bins = histograms.shape[2]
+    available = ~np.isnan(means)
+    # Pool the posteriors of the samples with the event in each group
+    n_samples = available.astype(float) @ weights.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pooled = np.einsum('gs,esb->egb', weights, histograms) / \
+            n_samples[:, :, np.newaxis]
+        pooled_means = np.where(available, means, 0) @ weights.T / n_samples
+
+        # The overlap of the pooled posteriors of each contrast, a block of
+        # contrasts at a time
+        overlap = np.empty((pooled.shape[0], len(first)))
+        block = max(CONTRAST_BLOCK_VALUES // max(pooled.shape[0] * n_bins, 1),
+                    1)
+        for i in range(0, len(first), block):
+            overlap[:, i:i + block] = np.einsum(
+                'ecb,ecb->ec', pooled[:, first[i:i + block]],
+                pooled[:, second[i:i + block]])
+        bayes_factor = np.minimum(1.0 / (overlap * n_bins), bf_max)
+    psi_1 = pooled_means[:, first]
+    psi_2 = pooled_means[:, second]
+    bayes_factor[np.isnan(psi_1) | np.isnan(psi_2)] = np.nan
+    return psi_1, psi_2, bayes_factor
+
+
+def _compare_chunk(args):
+    """Bin the posteriors of a chunk of events and compare them"""
+    source, chunk, n_bins, weights, first, second, bf_max = args
+    if source == 'store':
+        directory, start, stop = chunk
+        histograms, means = bin_posterior_samples(
+            PosteriorStore(directory).take(slice(start, stop)), n_bins)
+    else:
+        histograms, means = bin_summary_posteriors(*chunk, n_bins=n_bins)
+    return compare_binned(histograms, means, weights, first, second, bf_max)
+
+
+def compare_miso(posteriors, contrasts=None, n_bins=100, n_jobs=1,
+                 chunk_size=1000, bf_max=1e12, filename=None):
+    """Delta PSI and Bayes factors of many contrasts of samples at once
+
+    Parameters
+    ----------
+    posteriors : rnaseek.posteriors.PosteriorStore or pandas.DataFrame
+        Posterior samples of PSI, or a tall summary from CombineMiso with the
+        columns "event_name", "splice_type", "sample_id",
+        "miso_posterior_mean", "ci_low" and "ci_high", whose posteriors are
+        approximated from their mean and confidence interval
+    contrasts : list of (group1, group2) tuples, or dict, optional
+        Which samples, or groups of samples, to compare, as in
+        ``contrast_weights``. Defaults to every pair of samples
+    n_bins : int, optional
+        Number of bins of PSI in the posterior histograms
+    n_jobs : int, optional
+        Number of processes to compare chunks of events with
+    chunk_size : int, optional
+        Number of events each process compares at a time
+    bf_max : float, optional
+        Maximum Bayes factor
+    filename : str, optional
+        If given, where to write the comparisons as a csv
+
+    Returns
+    -------
+    comparisons : pandas.DataFrame
+        Long table with the columns in COMPARISON_COLUMNS, with one row per
+        event and contrast where both groups have the event
+    """
+    if isinstance(posteriors, PosteriorStore):
+        events = posteriors.events.index
+        sample_ids = posteriors.samples
+        chunks = [('store', (posteriors.directory, i, i + chunk_size))
+                  for i in range(0, len(events), chunk_size)]
+    else:
+        summary = posteriors.pivot_table(
+            index=['event_name', 'splice_type'], columns='sample_id',
+            values=['miso_posterior_mean', 'ci_low', 'ci_high'],
+            observed=True)
+        events = summary.index
+        sample_ids = summary['miso_posterior_mean'].columns
+        values = [summary[x].reindex(columns=sample_ids).values
+                  for x in ('miso_posterior_mean', 'ci_low', 'ci_high')]
+        chunks = [('summary', [x[i:i + chunk_size] for x in values])
+                  for i in range(0, len(events), chunk_size)]
+
+    if contrasts is None:
+        contrasts = all_pairs(list(sample_ids))
+    weights, first, second, names = contrast_weights(contrasts, sample_ids)
+    tasks = [(source, chunk, n_bins, weights, first, second, bf_max)
+             for source, chunk in chunks]
+    sys.stdout.write('Comparing {} events in {} contrasts ...\n'.format(
+        len(events), len(names)))
+
+    pool = multiprocessing.Pool(n_jobs) if n_jobs > 1 else None
+    try:
+        compared = pool.map(_compare_chunk, tasks) if pool is not None \
+            else [_compare_chunk(x) for x in tasks]
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if len(compared) > 0:
+        psi_1, psi_2, bayes_factor = (np.concatenate(x) for x in
+                                      zip(*compared))
+    else:
+        psi_1 = psi_2 = bayes_factor = np.zeros((0, len(names)))
+    n_contrasts = len(names)
+    comparisons = pd.DataFrame(
+        {'event_name': np.repeat(events.get_level_values(0), n_contrasts),
+         'splice_type': np.repeat(events.get_level_values(1), n_contrasts),
+         'contrast': np.tile(names, len(events)),
+         'psi_1': psi_1.ravel(), 'psi_2': psi_2.ravel(),
+         'delta_psi': (psi_1 - psi_2).ravel(),
+         'bayes_factor': bayes_factor.ravel()},
+        columns=COMPARISON_COLUMNS)
+    comparisons = comparisons.dropna(subset=['bayes_factor']).reset_index(
+        drop=True)
+    sys.stdout.write('\tDone.\n')
+
+    if filename is not None:
+        comparisons.to_csv(filename, index=False)
+        sys.stdout.write('\tWrote {}\n'.format(filename))
+    return comparisons
@@ -0,0 +1,283 @@
+import gzip
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyBigWig
+except ImportError:
+    pyBigWig = None
+
+from .bed import INTERVAL_COLUMNS
+
+CONSERVATION_STATISTICS = ['mean', 'max', 'fraction_conserved']
+
+
+def exon_flanks(intervals, length=100):
+    """Intronic flanks upstream and downstream of exons
+
+    Parameters
+    ----------
+    intervals : pandas.DataFrame
+        Table of exon intervals, in BED coordinates
+    length : int, optional
+        Number of intronic bases in each flank
+
+    Returns
+    -------
+    flanks : pandas.DataFrame
+        Table of intervals, with the features named "<exon>_upstream" and
+        "<exon>_downstream" relative to the strand of the exon
+    """
+    minus = (intervals.strand == '-').values
+    before = pd.DataFrame({'start': np.maximum(intervals.start - length, 0),
+                           'stop': intervals.start})
+    after = pd.DataFrame({'start': intervals.stop,
+                          'stop': intervals.stop + length})
+    flanks = []
+    for name, genomic in (('upstream', (before, after)),
+                          ('downstream', (after, before))):
+        df = intervals.copy()
+        df['feature'] = df.feature + '_' + name
+        df['start'] = np.where(minus, genomic[1].start, genomic[0].start)
+        df['stop'] = np.where(minus, genomic[1].stop, genomic[0].stop)
+        flanks.append(df)
+    return pd.concat(flanks, ignore_index=True)[INTERVAL_COLUMNS]
+
+
+def wig_to_binary(wig_filename, out_dir, chromosome_sizes):
+    """Convert a fixedStep/variableStep wig file to binary-packed arrays
+
+    Each chromosome is written as a float32 NumPy array with one value per
+    base (NaN where there's no data), which can then be memory-mapped and
+    read sequentially by ``ConservationScorer``.
+
+    Parameters
+    ----------
+    wig_filename : str
+        Location of the (possibly gzipped) wig file, e.g. phyloP scores
+    out_dir : str
+        Directory to write "<chrom>.npy" files to. Will be created if it
+        doesn't exist
+    chromosome_sizes : dict or str
+        Mapping of chromosome names to their lengths, or the location of a
+        genome fasta index (".fai") or chrom.sizes file
+    """
+    if not isinstance(chromosome_sizes, dict):
+        sizes = pd.read_csv(chromosome_sizes, sep='\t', header=None,
+                            usecols=[0, 1], index_col=0)
+        chromosome_sizes = sizes[1].to_dict()
+    try:
+        os.makedirs(out_dir)
+    except OSError:
+        pass
+
+    arrays = {}
+
+    def flush(chrom, positions, values):
+        if chrom not in arrays:
+            filename = os.path.join(out_dir, '{}.npy'.format(chrom))
+            arrays[chrom] = np.lib.format.open_memmap(
+                filename, mode='w+', dtype=np.float32,
+                shape=(chromosome_sizes[chrom],))
+            arrays[chrom][:] = np.nan
+        arrays[chrom][positions] = np.array(values, dtype=np.float32)
+
+    if wig_filename.endswith('.gz'):
+        wig = io.TextIOWrapper(gzip.open(wig_filename, 'rb'))
+    else:
+        wig = open(wig_filename)
+    chrom, step, span, position = None, 1, 1, 0
+    variable = False
+    positions, values = [], []
+    with wig as f:
+        for line in f:
+            if line.startswith(('fixedStep', 'variableStep')):
+                if len(values) > 0:
+                    flush(chrom, np.concatenate(positions), values)
+                    positions, values = [], []
+                fields = dict(x.split('=') for x in line.split()[1:])
+                variable = line.startswith('variableStep')
+                chrom = fields['chrom']
+                step = int(fields.get('step', 1))
+                span = int(fields.get('span', 1))
+                # Wig coordinates are 1-based
+                position = int(fields.get('start', 1)) - 1
+            elif line.startswith(('track', 'browser', '#')):
+                continue
+            else:
+                if variable:
+                    start, value = line.split()
+                    position = int(start) - 1
+                else:
+                    value = line
+                positions.append(np.arange(position, position + span))
+                values.extend([value] * span)
+                position += step
+                if len(values) >= 1000000:
+                    flush(chrom, np.concatenate(positions), values)
+                    positions, values = [], []
+    if len(values) > 0:
+        flush(chrom, np.concatenate(positions), values)
+    for array in arrays.values():
+        array.flush()
+
+
+class ConservationScorer(object):
+
+    def __init__(self, track, threshold=1.0, block_size=10000000):
+        """Summarize conservation scores of many intervals in one sweep
+
+        Intervals are sorted by chromosome and position, and the track is
+        read sequentially in blocks of nearby intervals, instead of being
+        queried once per interval.
+
+        Parameters
+        ----------
+        track : str
+            Location of a bigWig file (e.g. phyloP or phastCons scores), which
+            requires pyBigWig, or a directory of binary-packed "<chrom>.npy"
+            arrays from ``wig_to_binary``
+        threshold : float, optional
+            Bases with a score at least this high are counted as conserved
+        block_size : int, optional
+            Maximum number of bases of the track to read at once
+        """
+        self.track = track
+        self.threshold = threshold
+        self.block_size = block_size
+        if os.path.isdir(track):
+            self.bigwig = None
+        else:
+            if pyBigWig is None:
+                raise ImportError('pyBigWig is needed to read bigWig files. '
+                                  'Either install it, or convert the track '
+                                  'to binary-packed arrays with '
+                                  'wig_to_binary')
+            self.bigwig = pyBigWig.open(track)
+
+    def chromosomes(self):
+        """Names of the chromosomes in the track"""
+        if self.bigwig is not None:
+            return set(self.bigwig.chroms())
+        return set(x[:-len('.npy')] for x in os.listdir(self.track)
+                   if x.endswith('.npy'))
+
+    def values(self, chrom, start, stop):
+        """Scores of every base from start to stop, NaN where missing"""
+        if self.bigwig is not None:
+            stop = min(stop, self.bigwig.chroms(chrom))
+            # Straight into an array, unless pyBigWig was built without numpy
+            if getattr(pyBigWig, 'numpy', 0):
+                values = self.bigwig.values(chrom, int(start), int(stop),
+                                            numpy=True)
+            else:
+                values = self.bigwig.values(chrom, int(start), int(stop))
+            return np.asarray(values, dtype=float)
+        array = np.load(os.path.join(self.track, '{}.npy'.format(chrom)),
+                        mmap_mode='r')
+        return np.array(array[start:stop], dtype=float)
+
+    def _blocks(self, start, stop):
+        """Split sorted intervals into blocks spanning at most block_size"""
+        blocks = []
+        first = 0
+        block_start, block_stop = start[0], stop[0]
+        for i in range(1, start.shape[0]):
+            if max(block_stop, stop[i]) - block_start > self.block_size:
+                blocks.append((first, i, block_start, block_stop))
+                first, block_start, block_stop = i, start[i], stop[i]
+            else:
+                block_stop = max(block_stop, stop[i])
+        blocks.append((first, start.shape[0], block_start, block_stop))
+        return blocks
+
+    def summarize(self, intervals):
+        """Mean, max and fraction of conserved bases of each interval
+
+        Parameters
+        ----------
+        intervals : pandas.DataFrame
+            Table of intervals, in BED coordinates
+
+        Returns
+        -------
+        summaries : pandas.DataFrame
+            A table with the same index as ``intervals`` and the columns in
+            ``CONSERVATION_STATISTICS``. Bases without scores are ignored,
+            and intervals without any scores are NaN
+        """
+        n = intervals.shape[0]
+        summaries = np.repeat(np.nan, n * 3).reshape(n, 3)
+        chromosomes = self.chromosomes()
+
+        order = np.lexsort((intervals.start.values, intervals.chrom.values))
+        chrom = intervals.chrom.values[order]
+        boundaries = np.nonzero(chrom[1:] != chrom[:-1])[0] + 1
+        for rows in np.split(order, boundaries):
+            if rows.shape[0] == 0 or \
+                    intervals.chrom.values[rows[0]] not in chromosomes:
+                continue
+            name = intervals.chrom.values[rows[0]]
+            start = intervals.start.values[rows].astype(np.int64)
+            stop = intervals.stop.values[rows].astype(np.int64)
+            for first, last, block_start, block_stop in self._blocks(start,
+                                                                     stop):
+                values = self.values(name, block_start, block_stop)
+                block = rows[first:last]
+                a = np.minimum(start[first:last] - block_start,
+                               values.shape[0])
+                b = np.minimum(stop[first:last] - block_start,
+                               values.shape[0])
+                summaries[block] = self._summarize_block(values, a, b)
+
+        return pd.DataFrame(summaries, index=intervals.index,
+                            columns=CONSERVATION_STATISTICS)
+
+    def _summarize_block(self, values, a, b):
+        known = ~np.isnan(values)
+        filled = np.where(known, values, 0)
+        cumulative = [np.concatenate([[0], np.cumsum(x)])
+                      for x in (filled, known, known & (filled >=
+                                                        self.threshold))]
+        total, n_known, n_conserved = (x[b] - x[a] for x in cumulative)
+
+        # Maximum of each (possibly overlapping) interval with interleaved
+        # reduceat indices, padded so the last stop is a valid index
+        padded = np.concatenate([np.where(known, values, -np.inf), [-np.inf]])
+        nonempty = b > a
+        maximum = np.repeat(-np.inf, a.shape[0])
+        if nonempty.any():
+            indices = np.column_stack([a[nonempty], b[nonempty]]).ravel()
+            maximum[nonempty] = np.maximum.reduceat(padded, indices)[::2]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            summaries = np.column_stack([total / n_known, maximum,
+                                         n_conserved / n_known.astype(float)])
+        summaries[n_known == 0] = np.nan
+        return summaries
+
+    def score_intervals(self, intervals):
+        """Summarize the conservation of every feature of every event
+
+        Parameters
+        ----------
+        intervals : pandas.DataFrame
+            Table of intervals, e.g. ``SpliceAnnotator.intervals`` with the
+            ``exon_flanks`` of its exons
+
+        Returns
+        -------
+        summaries : pandas.DataFrame
+            A (n_events, n_features * 3) table with (feature, statistic)
+            columns
+        """
+        summaries = self.summarize(intervals)
+        summaries.index = pd.MultiIndex.from_arrays(
+            [intervals.event_name.values, intervals.feature.values],
+            names=['event_name', 'feature'])
+        summaries = summaries.unstack('feature')
+        summaries.columns = summaries.columns.swaplevel(0, 1)
+        return summaries.sort_index(axis=1)
@@ -1,7 +1,64 @@
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
 import gffutils
+import numpy as np
+import pandas as pd
+from gffutils import constants
+from gffutils.iterators import DataIterator
+from gffutils.version import version as gffutils_version
 
 gene_transcript = set(('gene', 'transcript'))
 
+ID_SPEC = {'gene': 'gene_id', 'transcript': 'transcript_id',
+           'exon': 'fancy_id', 'CDS': 'fancy_id', 'start_codon': 'fancy_id',
+           'stop_codon': 'fancy_id', 'UTR': 'fancy_id'}
+
+GTF_COLUMNS = ['seqid', 'source', 'featuretype', 'start', 'end', 'score',
+               'strand', 'frame', 'attributes']
+
+# Fields that must match for features with the same ID to be merged. The
+# "source" is merged too, as with force_merge_fields=['source']
+MERGE_FIELDS = ['id', 'seqid', 'featuretype', 'start', 'end', 'score',
+                'strand', 'frame']
+
+# key "value"; pairs of GTF attributes, whose values may also be unquoted
+GTF_ATTRIBUTE_REGEX = re.compile(
+    r'\s*([^\s;"]+)\s+(?:"([^"]*)"|([^\s;"]+))\s*;?')
+
+# The database is built once and not written to again, so there's no need
+# for a rollback journal or syncing to disk until the very end
+FAST_PRAGMAS = {'journal_mode': 'OFF', 'synchronous': 'OFF',
+                'locking_mode': 'EXCLUSIVE', 'temp_store': 'MEMORY',
+                'cache_size': -1000000, 'main.page_size': 4096}
+
+# Everything besides the GTF itself that changes the built database, so that
+# cached databases are rebuilt when any of it changes
+BUILD_OPTIONS = {'id_spec': ID_SPEC, 'merge_strategy': 'merge',
+                 'force_merge_fields': ['source'], 'infer_gene_extent': False,
+                 'gffutils': gffutils_version}
+
+# Same indexes as gffutils creates for GTF files, built after the data is
+# loaded rather than maintained during it
+INDEXES = (('relationsparent', 'relations (parent)'),
+           ('relationschild', 'relations (child)'),
+           ('featuretype', 'features (featuretype)'),
+           ('seqidstartend', 'features (seqid, start, end)'),
+           ('seqidstartendstrand', 'features (seqid, start, end, strand)'))
+
+
 def transform(f):
     if f.featuretype in gene_transcript:
         return f
@@ -13,15 +70,497 @@ def transform(f):
         f.attributes['fancy_id'] = [exon_id]
         return f
 
-def create_db(gff_filename, db_filename):
+
+def create_db(gff_filename, db_filename=None, fast=False, cache_dir=None,
+              cache_size=None):
+    """Create a gffutils database of a GTF file with "fancy" exon ids
+
+    Parameters
+    ----------
+    gff_filename : str
+        Location of the GTF file, e.g. from GENCODE
+    db_filename : str, optional
+        Location of the database to create. Overwritten if it exists. Only
+        optional if a cache directory is used
+    fast : bool, optional
+        If True, build the database with ``create_db_fast``, which gives an
+        equivalent database much faster than ``gffutils.create_db``
+    cache_dir : str, optional
+        Directory of an ``AnnotationCache`` to reuse previously built
+        databases of the same GTF from. Defaults to the environment variable
+        RNASEEK_ANNOTATION_CACHE, if it is set
+    cache_size : int, optional
+        Maximum number of bytes of databases to keep in the cache
+
+    Returns
+    -------
+    db : gffutils.FeatureDB
+        The created database
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('RNASEEK_ANNOTATION_CACHE')
+    if cache_dir is not None:
+        cache = AnnotationCache(cache_dir, max_bytes=cache_size)
+        return cache.create_db(gff_filename, db_filename, fast=fast)
+    if db_filename is None:
+        raise ValueError('"db_filename" is required when not using an '
+                         'annotation cache')
+    return build_db(gff_filename, db_filename, fast=fast)
+
+
+def build_db(gff_filename, db_filename, fast=False):
+    """Build a gffutils database of a GTF file, without any caching"""
+    if fast:
+        return create_db_fast(gff_filename, db_filename)
     return gffutils.create_db(gff_filename,
                               db_filename, merge_strategy='merge',
-                               id_spec={'gene': 'gene_id',
-                                        'transcript': 'transcript_id',
-                                        'exon': 'fancy_id', 'CDS': 'fancy_id',
-                                        'start_codon': 'fancy_id',
-                                        'stop_codon': 'fancy_id',
-                                        'UTR': 'fancy_id'},
+                               id_spec=ID_SPEC,
                                transform=transform, force=True, verbose=True,
                                infer_gene_extent=False,
-                               force_merge_fields=['source'])
\ No newline at end of file
+                               force_merge_fields=['source'])
+
+
+@contextlib.contextmanager
+def locked(filename, blocking=True, shared=False):
+    """Hold a lock on a lockfile, yielding whether it was acquired
+
+    The lock is exclusive, or if ``shared``, only exclusive of exclusive
+    locks. It is released when the process exits, even if it crashes, so
+    there are no stale lockfiles to clean up.
+    """
+    with open(filename, 'a') as f:
+        if fcntl is None:
+            yield True
+            return
+        flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(f, flags)
+        except (IOError, OSError):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class AnnotationCache(object):
+
+    def __init__(self, cache_dir, max_bytes=None):
+        """Content-addressed cache of gffutils databases built from GTFs
+
+        Databases are stored as "<key>.db", where the key is a hash of the
+        contents of the GTF file and ``BUILD_OPTIONS``, so the same GTF is
+        only built once no matter where it's copied to or what it's named.
+        Builds are written to a temporary file and renamed, so a database in
+        the cache is always complete, and a lockfile per key makes concurrent
+        jobs wait for a build in progress instead of repeating it. Jobs hold
+        a shared lock while they open or copy a database, so it can't be
+        evicted from under them.
+
+        Parameters
+        ----------
+        cache_dir : str
+            Directory to store the databases in. Will be created if it
+            doesn't exist
+        max_bytes : int, optional
+            After every build, the least recently used databases are deleted
+            until the cache is at most this size. If None, nothing is ever
+            deleted
+        """
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError:
+            if not os.path.isdir(self.cache_dir):
+                raise
+
+    def key(self, gff_filename):
+        """Hash of a GTF file's contents and the build options"""
+        sha1 = hashlib.sha1(json.dumps(BUILD_OPTIONS,
+                                       sort_keys=True).encode('utf-8'))
+        with open(gff_filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def path(self, key):
+        """Location of the database with this key"""
+        return os.path.join(self.cache_dir, '{}.db'.format(key))
+
+    def create_db(self, gff_filename, db_filename=None, fast=False):
+        """Get the database of a GTF file, building it only if it's missing
+
+        Parameters
+        ----------
+        gff_filename : str
+            Location of the GTF file
+        db_filename : str, optional
+            If given, the cached database is copied to this location, which
+            can be changed without changing the cache. Otherwise the cached
+            database is opened read-only, as other jobs share it
+        fast : bool, optional
+            If the database needs to be built, build it with
+            ``create_db_fast``
+
+        Returns
+        -------
+        db : gffutils.FeatureDB
+            The cached database, or the one at ``db_filename``
+        """
+        key = self.key(gff_filename)
+        path = self.path(key)
+        with locked(path + '.lock', shared=True):
+            if os.path.exists(path):
+                # Reading a database counts as using it, for evicting the
+                # least recently used
+                os.utime(path, None)
+                return self._open(path, db_filename)
+
+        with locked(path + '.lock'):
+            # Another job may have built it while we waited for the lock
+            if not os.path.exists(path):
+                tmp_filename = '{}.{}.tmp'.format(path, os.getpid())
+                try:
+                    build_db(gff_filename, tmp_filename, fast=fast)
+                    os.rename(tmp_filename, path)
+                finally:
+                    if os.path.exists(tmp_filename):
+                        os.remove(tmp_filename)
+            db = self._open(path, db_filename)
+        self.evict(keep=(key,))
+        return db
+
+    @staticmethod
+    def _open(path, db_filename=None):
+        """Open a cached database read-only, or copy it to ``db_filename``
+        and open the copy"""
+        if db_filename is None:
+            return gffutils.FeatureDB(sqlite3.connect(
+                'file:{}?mode=ro'.format(path), uri=True))
+        db_filename = os.path.abspath(db_filename)
+        tmp_filename = '{}.{}.tmp'.format(db_filename, os.getpid())
+        try:
+            shutil.copyfile(path, tmp_filename)
+            os.rename(tmp_filename, db_filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+        return gffutils.FeatureDB(db_filename)
+
+    def databases(self):
+        """Keys, sizes and last used times of the cached databases
+
+        Returns
+        -------
+        databases : pandas.DataFrame
+            One row per database indexed by key, with the columns "bytes"
+            and "last_used", sorted from least to most recently used
+        """
+        keys, sizes, last_used = [], [], []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.db'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+            except OSError:
+                # Evicted by another job
+                continue
+            keys.append(filename[:-len('.db')])
+            sizes.append(stat.st_size)
+            last_used.append(stat.st_mtime)
+        databases = pd.DataFrame({'bytes': sizes, 'last_used': last_used},
+                                 index=pd.Index(keys, name='key'),
+                                 columns=['bytes', 'last_used'])
+        return databases.sort_values('last_used')
+
+    def evict(self, keep=()):
+        """Delete least recently used databases until under ``max_bytes``
+
+        Databases that are being built, opened or evicted by another job,
+        or whose keys are in ``keep``, are never deleted. Jobs that already have a
+        database open can keep reading it after it's deleted.
+        """
+        if self.max_bytes is None:
+            return
+        databases = self.databases()
+        total = databases.bytes.sum()
+        for key, size in databases.bytes.items():
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            path = self.path(key)
+            with locked(path + '.lock', blocking=False) as acquired:
+                if acquired and os.path.exists(path):
+                    os.remove(path)
+                    total -= size
+
+
+def read_gtf(gff_filename):
+    """Read a (possibly gzipped) GTF file into a table of features
+
+    Parameters
+    ----------
+    gff_filename : str
+        Location of the GTF file
+
+    Returns
+    -------
+    gtf : pandas.DataFrame
+        One row per feature with the columns in ``GTF_COLUMNS``, in file
+        order
+    directives : list of str
+        "##" directive lines, without the "##"
+    """
+    opener = gzip.open if gff_filename.endswith('.gz') else open
+    directives = []
+    with opener(gff_filename, 'rt') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            if line.startswith('##'):
+                directives.append(line[2:].strip())
+    gtf = pd.read_csv(gff_filename, sep='\t', header=None, names=GTF_COLUMNS,
+                      comment=None, quoting=3, dtype=str,
+                      keep_default_na=False)
+    gtf = gtf.loc[~gtf.seqid.str.startswith('#')].reset_index(drop=True)
+    gtf['start'] = gtf.start.astype(np.int64)
+    gtf['end'] = gtf.end.astype(np.int64)
+    return gtf, directives
+
+
+def parse_attributes(attributes):
+    """Parse GTF attribute strings to lists of (key, value) pairs"""
+    return [[(key, quoted if quoted or unquoted == '' else unquoted)
+             for key, quoted, unquoted in GTF_ATTRIBUTE_REGEX.findall(x)]
+            for x in attributes]
+
+
+def gff_bins(start, end):
+    """Vectorized ``gffutils.bins.bins(start, end, one=True)``"""
+    from gffutils.bins import FIRST_SHIFT, NEXT_SHIFT, OFFSETS, MAX_CHROM_SIZE
+
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+    bins = np.ones(start.shape[0], dtype=np.int64)
+    found = (start < 0) | (end < 0) | (start >= MAX_CHROM_SIZE) | \
+        (end >= MAX_CHROM_SIZE)
+    first, last = (start - 1) >> FIRST_SHIFT, end >> FIRST_SHIFT
+    for offset in OFFSETS:
+        fits = ~found & (first == last)
+        bins[fits] = offset + first[fits]
+        found |= fits
+        first, last = first >> NEXT_SHIFT, last >> NEXT_SHIFT
+    return bins
+
+
+def fancy_ids(gtf):
+    """IDs of all features in a GTF table at once, as from ``transform``
+
+    Parameters
+    ----------
+    gtf : pandas.DataFrame
+        Table of features, from ``read_gtf``
+
+    Returns
+    -------
+    fancy : pandas.Series
+        The "fancy_id" attribute of each feature, which is null for genes and
+        transcripts
+    """
+    fancy = gtf.featuretype + ':' + gtf.seqid + ':' + \
+        gtf.start.astype(str) + '-' + gtf.end.astype(str) + ':' + gtf.strand
+    cds = gtf.featuretype == 'CDS'
+    fancy[cds] = fancy[cds] + ':' + gtf.frame[cds]
+    fancy[gtf.featuretype.isin(gene_transcript)] = None
+    return fancy
+
+
+def merge_features(gtf, pairs, autoincrements):
+    """Merge features with the same ID as gffutils' "merge" strategy does
+
+    Features with the same ID and all of ``MERGE_FIELDS`` are merged into one
+    with the union of their attributes and sources. Features with the same ID
+    that differ otherwise are given a unique ID of "<id>_<n>".
+
+    Parameters
+    ----------
+    gtf : pandas.DataFrame
+        Table of features with an "id" column, in file order
+    pairs : list
+        Attribute (key, value) pairs of each feature
+    autoincrements : dict
+        Last number used for each autoincremented ID, updated in place
+
+    Returns
+    -------
+    features : pandas.DataFrame
+        One row per merged feature, with the columns of the gffutils
+        "features" table
+    duplicates : pandas.DataFrame
+        The original ("idspecid") and unique ("newid") ID of each feature
+        whose ID was made unique
+    group : numpy.ndarray
+        Index of the merged feature that each row of ``gtf`` went into
+    """
+    group = gtf.groupby(MERGE_FIELDS, sort=False).ngroup().values
+    first = pd.Series(np.arange(gtf.shape[0])).groupby(group).first().values
+    features = gtf.iloc[first].reset_index(drop=True)
+
+    # Groups after the first with the same ID get a unique ID, in file order
+    n = features.groupby('id', sort=False).cumcount().values
+    unique = np.nonzero(n > 0)[0]
+    duplicates = pd.DataFrame({'idspecid': features.id.values[unique],
+                               'newid': features.id.values[unique] + '_' +
+                               n[unique].astype(str)},
+                              columns=['idspecid', 'newid'])
+    features.loc[unique, 'id'] = duplicates.newid.values
+    for idspecid, count in duplicates.idspecid.value_counts().items():
+        autoincrements[idspecid] = autoincrements.get(idspecid, 0) + \
+            int(count)
+
+    # Only a small fraction of features are merged, so the others are
+    # converted to JSON directly
+    attributes = np.repeat(None, features.shape[0])
+    sizes = np.bincount(group, minlength=features.shape[0])
+    single = sizes[group] == 1
+    for row in np.nonzero(single)[0]:
+        attributes[group[row]] = json_attributes(pairs[row])
+    merged = {}
+    for row in np.nonzero(~single)[0]:
+        merged.setdefault(group[row], []).extend(pairs[row])
+    for g, merged_pairs in merged.items():
+        attributes[g] = json_attributes(merged_pairs)
+
+    # Sources of merged features are joined, if they differ
+    sources = pd.DataFrame({'group': group, 'source': gtf.source.values})
+    sources = sources.drop_duplicates().sort_values(['group', 'source'])
+    sources = sources.loc[sources.group.duplicated(keep=False)]
+    sources = sources.groupby('group').source.agg(','.join)
+    features.loc[sources.index, 'source'] = sources.values
+    features['attributes'] = attributes
+    return features, duplicates, group
+
+
+def json_attributes(pairs):
+    """JSON of the attributes dict of (key, value) pairs, without repeats"""
+    attributes = {}
+    for key, value in pairs:
+        values = attributes.setdefault(key, [])
+        if value not in values:
+            values.append(value)
+    return json.dumps(attributes, separators=(',', ':'))
+
+
+def rows(df, columns):
+    """Rows of a table as tuples of Python objects, for executemany"""
+    return zip(*[df[column].tolist() for column in columns])
+
+
+def create_db_fast(gff_filename, db_filename):
+    """Create the same database as ``create_db``, but in bulk
+
+    Instead of parsing, identifying and merging features one at a time with
+    a database lookup for every duplicate ID, the whole GTF is read into a
+    table, the "fancy_id"s are computed as columns, and features with the
+    same ID are merged with a single group-by. The features and relations
+    are then bulk-inserted in sorted order, with SQLite tuned for a one-shot
+    load, and the indexes are created afterwards. The database is written to
+    a temporary file and renamed when complete, so several genomes can be
+    built at once, and readers never see a partial database.
+
+    Parameters
+    ----------
+    gff_filename : str
+        Location of the (possibly gzipped) GTF file
+    db_filename : str
+        Location of the database to create. Overwritten if it exists
+
+    Returns
+    -------
+    db : gffutils.FeatureDB
+        The created database
+    """
+    dialect = DataIterator(gff_filename).dialect
+    gtf, directives = read_gtf(gff_filename)
+    if gtf.shape[0] == 0:
+        raise ValueError('No lines parsed -- was an empty file provided?')
+    pairs = parse_attributes(gtf.attributes.values)
+
+    fancy = fancy_ids(gtf)
+    firsts = [dict(reversed(x)) for x in pairs]
+    gene_id = pd.Series([x.get('gene_id') for x in firsts])
+    transcript_id = pd.Series([x.get('transcript_id') for x in firsts])
+    for i, fancy_id in enumerate(fancy.tolist()):
+        if not pd.isnull(fancy_id):
+            pairs[i].append(('fancy_id', fancy_id))
+
+    # IDs from the id_spec, or "<featuretype>_<n>" if there are none
+    ids = fancy.copy()
+    ids[gtf.featuretype == 'gene'] = gene_id
+    ids[gtf.featuretype == 'transcript'] = transcript_id
+    missing = ids.isnull() | ~gtf.featuretype.isin(ID_SPEC)
+    n = gtf.loc[missing].groupby('featuretype').cumcount() + 1
+    ids[missing] = gtf.featuretype[missing] + '_' + n.astype(str)
+    autoincrements = dict((featuretype, int(count)) for featuretype, count
+                          in gtf.featuretype[missing].value_counts().items())
+    gtf['id'] = ids.values
+
+    features, duplicates, group = merge_features(gtf, pairs, autoincrements)
+    features['extra'] = '[]'
+    features['bin'] = gff_bins(features.start.values, features.end.values)
+    features = features.sort_values(['seqid', 'start', 'end', 'featuretype'],
+                                    kind='mergesort')
+
+    # Relations of each line to its transcript (level 1) and gene (level 2),
+    # and of its transcript to its gene, as gffutils does for GTF files
+    final_id = features.sort_index().id.values[group]
+    relations = pd.concat([
+        pd.DataFrame({'parent': transcript_id, 'child': final_id, 'level': 1}),
+        pd.DataFrame({'parent': gene_id, 'child': final_id, 'level': 2}),
+        pd.DataFrame({'parent': gene_id, 'child': transcript_id,
+                      'level': 1})], ignore_index=True)
+    relations = relations.dropna().drop_duplicates().sort_values(
+        ['parent', 'child', 'level'])
+
+    db_filename = os.path.abspath(db_filename)
+    tmp_filename = '{}.{}.tmp'.format(db_filename, os.getpid())
+    if os.path.exists(tmp_filename):
+        os.remove(tmp_filename)
+    conn = sqlite3.connect(tmp_filename)
+    try:
+        c = conn.cursor()
+        c.executescript(';\n'.join('PRAGMA {}={}'.format(*pragma)
+                                   for pragma in FAST_PRAGMAS.items()))
+        c.executescript(constants.SCHEMA)
+        c.executemany(constants._INSERT, rows(features, constants._keys))
+        c.executemany('INSERT INTO relations (parent, child, level) '
+                      'VALUES (?, ?, ?)',
+                      rows(relations, ['parent', 'child', 'level']))
+        c.executemany('INSERT INTO duplicates (idspecid, newid) '
+                      'VALUES (?, ?)',
+                      rows(duplicates, ['idspecid', 'newid']))
+        c.executemany('INSERT INTO directives VALUES (?)',
+                      ((x,) for x in directives))
+        c.execute('INSERT INTO meta (version, dialect) VALUES (?, ?)',
+                  (gffutils_version, json.dumps(dialect,
+                                                separators=(',', ':'))))
+        c.executemany('INSERT INTO autoincrements VALUES (?, ?)',
+                      autoincrements.items())
+        for name, columns in INDEXES:
+            c.execute('CREATE INDEX {} ON {}'.format(name, columns))
+        c.execute('ANALYZE features')
+        conn.commit()
+    except BaseException:
+        # Don't leave a partial database behind
+        conn.close()
+        os.remove(tmp_filename)
+        raise
+    finally:
+        conn.close()
+    os.rename(tmp_filename, db_filename)
+    return gffutils.FeatureDB(db_filename)
@@ -0,0 +1,152 @@
+"""Find pipeline output files in one pass, with metadata from their paths
+
+A glob command like "miso/*/*/summary/*.miso_summary" is walked once with
+``os.scandir``, only descending into directories that can match, and every
+file is stat'ed once. Sample ids and other metadata are then extracted from
+all the paths at once with a regex template of named groups, e.g.
+"(?P<sample_id>[^/]+)/[^/]+/summary/[^/]+$".
+"""
+import fnmatch
+import glob
+import os
+import re
+import sys
+
+import pandas as pd
+
+FILE_COLUMNS = ['filename', 'size', 'mtime']
+
+
+def _walk(directory, patterns, prefix):
+    """Yield (path, stat_result) of everything matching the glob patterns,
+    one pattern per path component"""
+    pattern, rest = patterns[0], patterns[1:]
+    if not glob.has_magic(pattern):
+        path = prefix + pattern
+        try:
+            stat = os.stat(os.path.join(directory, pattern))
+        except OSError:
+            return
+        if not rest:
+            yield path, stat
+        elif os.path.isdir(os.path.join(directory, pattern)):
+            for x in _walk(os.path.join(directory, pattern), rest,
+                           path + '/'):
+                yield x
+        return
+
+    regex = re.compile(fnmatch.translate(pattern))
+    hidden = pattern.startswith('.')
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in sorted(entries, key=lambda x: x.name):
+        # As with glob, wildcards don't match hidden files
+        if (entry.name.startswith('.') and not hidden) or \
+                not regex.match(entry.name):
+            continue
+        path = prefix + entry.name
+        if not rest:
+            try:
+                yield path, entry.stat()
+            except OSError:
+                continue
+        elif entry.is_dir():
+            for x in _walk(entry.path, rest, path + '/'):
+                yield x
+
+
+def walk_glob(glob_command):
+    """Paths and stat results of the files matched by a glob command
+
+    Unlike calling ``glob.iglob`` to count the files and then again to read
+    them, the file system is only walked once, and the paths come back
+    sorted.
+
+    Parameters
+    ----------
+    glob_command : str
+        Glob of "*", "?" and "[...]" wildcards, which don't match "/". The
+        paths are given relative to the same directory as the glob, as with
+        ``glob.glob``
+
+    Returns
+    -------
+    paths : list of (str, os.stat_result) tuples
+    """
+    glob_command = os.path.expanduser(glob_command)
+    parts = glob_command.split('/')
+    if parts[0] == '':
+        directory, prefix, parts = '/', '/', parts[1:]
+    else:
+        directory, prefix = '.', ''
+    parts = [x for x in parts if x != '']
+    if not parts:
+        return []
+    return list(_walk(directory, parts, prefix))
+
+
+def file_table(paths, template=None, dtypes=None):
+    """Table of files with their size, modification time and metadata
+
+    Parameters
+    ----------
+    paths : list of str or list of (str, os.stat_result) tuples
+        Files to tabulate. Files without a stat result are stat'ed here
+    template : str, optional
+        Regular expression with named groups, searched for in every path.
+        Each group becomes a column. Files that don't match are dropped
+    dtypes : dict, optional
+        Mapping of group names to the type to convert them to, e.g.
+        {'iteration': int}
+
+    Returns
+    -------
+    files : pandas.DataFrame
+        A table with the columns "filename", "size", "mtime" and the named
+        groups of the template, in the order of the paths
+    """
+    paths = [x if isinstance(x, tuple) else (x, os.stat(x)) for x in paths]
+    files = pd.DataFrame({'filename': [x[0] for x in paths],
+                          'size': [x[1].st_size for x in paths],
+                          'mtime': [x[1].st_mtime for x in paths]},
+                         columns=FILE_COLUMNS)
+    files['filename'] = files.filename.astype(object)
+    if template is None:
+        return files
+
+    regex = re.compile(template)
+    matched = files.filename.map(lambda x: regex.search(x) is not None)
+    n_unmatched = int((~matched).sum())
+    if n_unmatched > 0:
+        sys.stderr.write('Skipping {} files that do not match the template '
+                         '{}\n'.format(n_unmatched, template))
+    files = files.loc[matched.values].reset_index(drop=True)
+    metadata = files.filename.str.extract(regex, expand=True)
+    for name, dtype in (dtypes or {}).items():
+        metadata[name] = metadata[name].astype(dtype)
+    return pd.concat([files, metadata], axis=1)
+
+
+def discover_files(glob_command, template=None, dtypes=None):
+    """Find files matching a glob and extract metadata from their paths
+
+    Parameters
+    ----------
+    glob_command : str
+        Where to find the files, e.g. "./miso/*/*/summary/*.miso_summary"
+    template : str, optional
+        Regular expression with named groups to extract from each path
+    dtypes : dict, optional
+        Mapping of group names to the type to convert them to
+
+    Returns
+    -------
+    files : pandas.DataFrame
+        See ``file_table``
+
+    >>> discover_files('/nonexistent/*.txt').shape
+    (0, 3)
+    """
+    return file_table(walk_glob(glob_command), template, dtypes)
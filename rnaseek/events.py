@@ -0,0 +1,164 @@
+"""Integer ids of MISO events, to store their long names only once
+
+MISO event names like "chr16:89288500:89288591:+@chr16:89289000:..." are
+often more than 100 characters, and are repeated in every row of every
+sample's summary. An EventDictionary gives each name a stable integer id,
+which is what tables are keyed on instead, with the names themselves kept
+once in a miso_event_ids.csv alongside them. Ids are never reassigned, so
+the dictionary of a previous run can be extended by the next one.
+"""
+import numpy as np
+import pandas as pd
+
+EVENT_IDS_CSV = 'miso_event_ids.csv'
+
+
+class EventDictionary(object):
+
+    def __init__(self, event_names=None):
+        """Stable integer ids of MISO event names
+
+        Parameters
+        ----------
+        event_names : list-like, optional
+            Names to give ids to, in sorted order
+        """
+        self.event_names = pd.Index([], dtype=object, name='event_name')
+        if event_names is not None:
+            self.intern(event_names)
+
+    def __len__(self):
+        return len(self.event_names)
+
+    @staticmethod
+    def _factorize(event_names):
+        """Codes of each name into its unique names, without converting
+        every name of a categorical to a string"""
+        if isinstance(event_names, (pd.Series, pd.Index)):
+            event_names = event_names.values
+        if isinstance(event_names, pd.Categorical):
+            return event_names.codes, np.asarray(event_names.categories,
+                                                 dtype=object)
+        codes, uniques = pd.factorize(np.asarray(event_names, dtype=object))
+        return codes, np.asarray(uniques, dtype=object)
+
+    def get_ids(self, event_names):
+        """Integer ids of event names, or -1 for the ones not seen before
+
+        Parameters
+        ----------
+        event_names : list-like
+            Names of events, which may repeat, e.g. a column of a summary
+
+        Returns
+        -------
+        ids : numpy.ndarray
+            int32 id of each name, and -1 for missing names
+        """
+        codes, uniques = self._factorize(event_names)
+        ids = self.event_names.get_indexer(uniques).astype(np.int32)
+        return np.where(codes < 0, np.int32(-1), ids[codes])
+
+    def intern(self, event_names):
+        """Integer ids of event names, adding the ones not seen before
+
+        New names get the next ids in sorted order, so the same names get the
+        same ids whatever order they are read in
+
+        Parameters
+        ----------
+        event_names : list-like
+            Names of events, which may repeat, e.g. a column of a summary
+
+        Returns
+        -------
+        ids : numpy.ndarray
+            int32 id of each name, and -1 for missing names
+        """
+        codes, uniques = self._factorize(event_names)
+        uniques = uniques[self.event_names.get_indexer(uniques) < 0]
+        if len(uniques) > 0:
+            self.event_names = pd.Index(
+                np.concatenate([self.event_names.values, np.sort(uniques)]),
+                dtype=object, name='event_name')
+        return self.get_ids(event_names)
+
+    def names(self, ids):
+        """Event names of integer ids"""
+        ids = np.asarray(ids)
+        if ((ids < 0) | (ids >= len(self))).any():
+            raise ValueError('Event ids must be between 0 and {}'.format(
+                len(self) - 1))
+        return self.event_names.values[ids]
+
+    def encode(self, df):
+        """Replace the "event_name" column or index level of a table with
+        their "event_id"
+
+        Any names not seen before are added to the dictionary
+        """
+        df = df.copy()
+        if 'event_name' in df.columns:
+            position = df.columns.get_loc('event_name')
+            ids = self.intern(df['event_name'])
+            del df['event_name']
+            df.insert(position, 'event_id', ids)
+        if 'event_name' in df.index.names:
+            df.index = self._replace_level(
+                df.index, 'event_name', 'event_id', self.intern)
+        return df
+
+    def decode(self, df):
+        """Replace the "event_id" column or index level of a table with their
+        "event_name", the inverse of ``encode``"""
+        df = df.copy()
+        if 'event_id' in df.columns:
+            position = df.columns.get_loc('event_id')
+            names = self.names(df['event_id'].values)
+            del df['event_id']
+            df.insert(position, 'event_name', names)
+        if 'event_id' in df.index.names:
+            df.index = self._replace_level(
+                df.index, 'event_id', 'event_name',
+                lambda x: self.names(np.asarray(x)))
+        return df
+
+    @staticmethod
+    def _replace_level(index, old, new, convert):
+        levels = [index.get_level_values(i) for i in range(index.nlevels)]
+        names = list(index.names)
+        i = names.index(old)
+        levels[i] = convert(levels[i])
+        names[i] = new
+        if index.nlevels == 1:
+            return pd.Index(levels[0], name=new)
+        return pd.MultiIndex.from_arrays(levels, names=names)
+
+    def to_frame(self):
+        """Table of the event names, indexed by their "event_id"
+
+        This is how the dictionary is written, as miso_event_ids.csv
+        """
+        return pd.DataFrame(
+            {'event_name': self.event_names.values},
+            index=pd.Index(np.arange(len(self), dtype=np.int32),
+                           name='event_id'))
+
+    @classmethod
+    def read(cls, filename):
+        """Read a dictionary written from ``to_frame``
+
+        Raises
+        ------
+        ValueError
+            If the event ids are not 0, 1, 2, ... in order
+        """
+        df = pd.read_csv(filename, index_col=0, dtype={'event_name': str},
+                         keep_default_na=False)
+        if not np.array_equal(df.index.values, np.arange(df.shape[0])):
+            raise ValueError('The event ids of {} are not 0, 1, 2, ... in '
+                             'order'.format(filename))
+        dictionary = cls()
+        dictionary.event_names = pd.Index(df.event_name.values, dtype=object,
+                                          name='event_name')
+        return dictionary
@@ -1,3 +1,322 @@
+import gzip
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Lookup tables from ASCII to nucleotide codes (A=0, C=1, G=2, T/U=3, and 4
+# for anything else), so whole batches of sequences are encoded at once
+NUCLEOTIDE_CODES = np.repeat(np.uint8(4), 256)
+for i, bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu')):
+    for base in bases:
+        NUCLEOTIDE_CODES[ord(base)] = i
+
+# Kyte-Doolittle hydropathy index of each amino acid, for GRAVY scores.
+# Anything that isn't one of the 20 amino acids, like stops ("*") or unknown
+# residues ("X"), is NaN and ignored
+KYTE_DOOLITTLE = {'A': 1.8, 'R': -4.5, 'N': -3.5, 'D': -3.5, 'C': 2.5,
+                  'Q': -3.5, 'E': -3.5, 'G': -0.4, 'H': -3.2, 'I': 4.5,
+                  'L': 3.8, 'K': -3.9, 'M': 1.9, 'F': 2.8, 'P': -1.6,
+                  'S': -0.8, 'T': -0.7, 'W': -0.9, 'Y': -1.3, 'V': 4.2}
+HYDROPATHY = np.repeat(np.nan, 256)
+for amino_acid, hydropathy in KYTE_DOOLITTLE.items():
+    HYDROPATHY[ord(amino_acid)] = hydropathy
+    HYDROPATHY[ord(amino_acid.lower())] = hydropathy
+
+# Largest number of cells of the (n_sequences, 4**k) matrix of k-mer counts
+# made at once by ``FastaAnnotator``, i.e. 128 MB of counts
+MAX_KMER_CELLS = 1 << 24
+
+
+def read_fasta(filename, chunksize=10000):
+    """Stream a (possibly gzipped) fasta file in batches of records
+
+    This is a minimal reader that only keeps the current batch in memory,
+    and doesn't create a ``SeqRecord`` per sequence.
+
+    Parameters
+    ----------
+    filename : str
+        Location of the fasta file. Files ending in ".gz" are decompressed
+    chunksize : int, optional
+        Number of records per batch
+
+    Returns
+    -------
+    batches : iterator of (names, sequences) tuples
+        Lists of up to ``chunksize`` record names (the first word of the
+        header) and sequences, as bytes
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    names, sequences, lines = [], [], []
+    name = None
+    with opener(filename, 'rb') as f:
+        for line in f:
+            if line.startswith(b'>'):
+                if name is not None:
+                    names.append(name)
+                    sequences.append(b''.join(lines))
+                    if len(names) == chunksize:
+                        yield names, sequences
+                        names, sequences = [], []
+                words = line[1:].split()
+                name = words[0].decode('ascii') if words else ''
+                lines = []
+            else:
+                lines.append(line.strip())
+    if name is not None:
+        names.append(name)
+        sequences.append(b''.join(lines))
+    if len(names) > 0:
+        yield names, sequences
+
+
+def concatenate(sequences):
+    """Concatenate sequences into one uint8 array of ASCII codes
+
+    Parameters
+    ----------
+    sequences : list of bytes or str
+        Sequences to concatenate
+
+    Returns
+    -------
+    buffer : numpy.ndarray
+        ASCII codes of all the sequences, one after the other
+    lengths : numpy.ndarray
+        Length of each sequence
+    """
+    sequences = [x if isinstance(x, bytes) else x.encode('ascii')
+                 for x in sequences]
+    lengths = np.array([len(x) for x in sequences], dtype=np.int64)
+    buffer = np.frombuffer(b''.join(sequences), dtype=np.uint8)
+    return buffer, lengths
+
+
+def sequence_index(lengths):
+    """Index of the sequence that each position of a buffer comes from"""
+    return np.repeat(np.arange(lengths.shape[0]), lengths)
+
+
+def gc_content(sequences):
+    """Fraction of G and C bases in many nucleotide sequences at once
+
+    >>> gc_content(['GGCA', 'ATAT', ''])
+    array([0.75, 0.  ,  nan])
+    """
+    buffer, lengths = concatenate(sequences)
+    codes = NUCLEOTIDE_CODES[buffer]
+    n_gc = np.bincount(sequence_index(lengths),
+                       weights=((codes == 1) | (codes == 2)),
+                       minlength=lengths.shape[0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return n_gc / lengths
+
+
+def kmer_names(k):
+    """All k-mers of length k, in the order of ``kmer_counts`` columns
+
+    >>> kmer_names(1)
+    ['A', 'C', 'G', 'T']
+    """
+    kmers = ['']
+    for i in range(k):
+        kmers = [kmer + base for kmer in kmers for base in 'ACGT']
+    return kmers
+
+
+def valid_windows(codes, lengths, k):
+    """Whether the window of length k starting at each position is valid
+
+    Parameters
+    ----------
+    codes : numpy.ndarray
+        Nucleotide codes of concatenated sequences, from ``NUCLEOTIDE_CODES``
+    lengths : numpy.ndarray
+        Length of each of the concatenated sequences
+    k : int
+        Length of the windows
+
+    Returns
+    -------
+    valid : numpy.ndarray
+        False where the window runs off the end of its sequence or has a base
+        other than A, C, G or T/U
+    """
+    n = codes.shape[0]
+    # Count the non-ACGT bases in each window with a cumulative sum
+    n_other = np.concatenate([[0], np.cumsum(codes >= 4)])
+    stop = np.minimum(np.arange(n) + k, n)
+    valid = (n_other[stop] - n_other[:n]) == 0
+
+    # Remove windows crossing into the next sequence
+    position = np.arange(n) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    valid &= position <= np.repeat(lengths, lengths) - k
+    return valid
+
+
+def kmer_hashes(codes, lengths, k):
+    """Base-4 hash of the k-mer starting at each position of a buffer
+
+    Parameters
+    ----------
+    codes : numpy.ndarray
+        Nucleotide codes of concatenated sequences, from ``NUCLEOTIDE_CODES``
+    lengths : numpy.ndarray
+        Length of each of the concatenated sequences
+    k : int
+        Length of the k-mers, at most 31
+
+    Returns
+    -------
+    hashes : numpy.ndarray
+        Hash of the k-mer starting at each position, from 0 to 4**k - 1, or
+        -1 where the k-mer runs off the end of its sequence or has a base
+        other than A, C, G or T/U
+    """
+    n = codes.shape[0]
+    hashes = np.zeros(n, dtype=np.int64)
+    for j in range(k):
+        shifted = np.zeros(n, dtype=np.int64)
+        shifted[:max(n - j, 0)] = codes[j:]
+        hashes = hashes * 4 + np.where(shifted < 4, shifted, 0)
+    hashes[~valid_windows(codes, lengths, k)] = -1
+    return hashes
+
+
+def kmer_counts(sequences, k=3):
+    """Count every k-mer in many nucleotide sequences at once
+
+    Parameters
+    ----------
+    sequences : list of bytes or str
+        Nucleotide sequences
+    k : int, optional
+        Length of the k-mers
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        A (n_sequences, 4**k) matrix of counts, whose columns are ordered as
+        ``kmer_names(k)``. K-mers with bases other than A, C, G or T/U are
+        not counted. This is dense, with 8 bytes per sequence and k-mer, so
+        count large batches or long k-mers a few sequences at a time
+    """
+    buffer, lengths = concatenate(sequences)
+    hashes = kmer_hashes(NUCLEOTIDE_CODES[buffer], lengths, k)
+    valid = hashes >= 0
+    n_kmers = 4 ** k
+    flat = sequence_index(lengths)[valid] * n_kmers + hashes[valid]
+    counts = np.bincount(flat, minlength=lengths.shape[0] * n_kmers)
+    return counts.reshape(lengths.shape[0], n_kmers)
+
+
+def gravy(sequences):
+    """Grand average of hydropathicity (GRAVY) of many protein sequences
+
+    The mean Kyte-Doolittle hydropathy of the residues of each sequence,
+    ignoring stops and unknown residues
+
+    >>> gravy(['MA*', 'KR'])
+    array([ 1.85, -4.2 ])
+    """
+    buffer, lengths = concatenate(sequences)
+    hydropathy = HYDROPATHY[buffer]
+    known = ~np.isnan(hydropathy)
+    index = sequence_index(lengths)
+    total = np.bincount(index[known], weights=hydropathy[known],
+                        minlength=lengths.shape[0])
+    n_known = np.bincount(index[known], minlength=lengths.shape[0])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / n_known
+
 
 class FastaAnnotator(object):
-    pass
\ No newline at end of file
+
+    def __init__(self, fasta_filename, molecule='dna', k=None,
+                 chunksize=10000):
+        """Compute per-sequence features of (large) fasta files in batches
+
+        The fasta file is streamed ``chunksize`` records at a time, so memory
+        use doesn't depend on the size of the file. This can also be used on
+        the exon and intron fastas of a ``SpliceAnnotator``.
+
+        Parameters
+        ----------
+        fasta_filename : str
+            Location of the fasta file, which may be gzipped
+        molecule : 'dna' | 'protein', optional
+            Whether the sequences are nucleotides (DNA or RNA) or amino acids
+        k : int, optional
+            If given, count the k-mers of nucleotide sequences
+        chunksize : int, optional
+            Number of records to annotate at once. When counting k-mers, at
+            most ``MAX_KMER_CELLS // 4**k`` records (and at least one) are
+            annotated at once, so the dense counts stay within 128 MB per
+            batch, e.g. 256 records for k=8. Every k-mer is still a column,
+            so k above 12 can't be kept within that limit
+        """
+        if molecule not in ('dna', 'protein'):
+            raise ValueError('"molecule" must be either "dna" or "protein"')
+        if chunksize < 1:
+            raise ValueError('"chunksize" must be 1 or greater')
+        if k is not None and molecule != 'dna':
+            raise ValueError('k-mers can only be counted for "dna" sequences')
+        self.fasta_filename = fasta_filename
+        self.molecule = molecule
+        self.k = k
+        self.chunksize = chunksize
+        if k is not None:
+            self.chunksize = min(chunksize, max(MAX_KMER_CELLS // 4 ** k, 1))
+
+    def annotate(self):
+        """Iterate over tables of features of each batch of sequences
+
+        Returns
+        -------
+        annotated : iterator of pandas.DataFrame
+            Tables indexed by sequence name, with the columns "length", and
+            "gc" for nucleotides or "gravy" for proteins, and the count of
+            each k-mer if ``k`` was given
+        """
+        for names, sequences in read_fasta(self.fasta_filename,
+                                           self.chunksize):
+            features = pd.DataFrame(
+                {'length': [len(x) for x in sequences]},
+                index=pd.Index(names, name='name'))
+            if self.molecule == 'dna':
+                features['gc'] = gc_content(sequences)
+            else:
+                features['gravy'] = gravy(sequences)
+            if self.k is not None:
+                kmers = pd.DataFrame(kmer_counts(sequences, self.k),
+                                     index=features.index,
+                                     columns=kmer_names(self.k))
+                features = pd.concat([features, kmers], axis=1)
+            yield features
+
+    def write(self, filename, n_progress=10):
+        """Annotate all sequences and write them as they are computed
+
+        Parameters
+        ----------
+        filename : str
+            Comma-separated file to write. Each batch is appended to it as
+            soon as it has been annotated
+        n_progress : int, optional
+            Number of batches to show per iterative progress
+        """
+        filename = os.path.abspath(os.path.expanduser(filename))
+        sys.stdout.write('Annotating sequences in {} ...\n'.format(
+            self.fasta_filename))
+        n_sequences = 0
+        for i, features in enumerate(self.annotate()):
+            features.to_csv(filename, mode='w' if i == 0 else 'a',
+                            header=i == 0)
+            n_sequences += features.shape[0]
+            if (i + 1) % n_progress == 0:
+                sys.stdout.write('\t{} sequences annotated\n'.format(
+                    n_sequences))
+        sys.stdout.write('\tWrote {} sequences to {}\n'.format(n_sequences,
+                                                               filename))
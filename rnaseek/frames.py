@@ -0,0 +1,359 @@
+"""Reading frames of skipped (SE) and mutually exclusive (MXE) exon events
+
+Whether an event keeps the reading frame only depends on the difference in
+coding length between its isoforms, modulo 3, and whether a frameshift
+makes the transcript a target of nonsense-mediated decay (NMD) depends on
+where the premature stop codon (PTC) falls relative to the last exon-exon
+junction (the "50-nt rule": a PTC more than 50 nt upstream of the last
+junction triggers NMD). Both are worked out for every event at once from a
+table of the coding sequences (CDS) of every transcript, without
+translating any proteins. The last junction is taken from the exons of each
+transcript when they are given, as it may be in the 3' UTR, after the last
+CDS.
+"""
+import numpy as np
+import pandas as pd
+
+# Coding sequences of transcripts, in BED coordinates, with the GTF frame:
+# the number of bases from the 5' end of the CDS to the first whole codon
+CDS_COLUMNS = ['transcript_id', 'chrom', 'start', 'stop', 'strand', 'frame']
+EXON_COLUMNS = CDS_COLUMNS[:-1]
+
+# "CDS:<chrom>:<start>-<stop>:<strand>:<frame>" ids of CDS in the gffutils
+# databases from ``rnaseek.create_gffutils_db``
+FANCY_CDS_REGEX = r'^CDS:(?P<chrom>.+):(?P<start>[0-9]+)-(?P<stop>[0-9]+):' \
+                  r'(?P<strand>[+-]):(?P<frame>[0-2.])$'
+FANCY_EXON_REGEX = r'^exon:(?P<chrom>.+):(?P<start>[0-9]+)-(?P<stop>[0-9]+):' \
+                   r'(?P<strand>[+-])$'
+
+FRAME_CLASSES = ['noncoding', 'frame_preserving', 'frame_shifting', 'nmd']
+FRAME_COLUMNS = ['length_difference', 'frame_shift', 'n_transcripts',
+                 'nmd_distance', 'classification']
+
+
+def parse_fancy_cds_ids(fancy_ids, featuretype='CDS'):
+    """Coordinates and frames of CDS from their gffutils "fancy_id"s
+
+    Parameters
+    ----------
+    fancy_ids : list-like
+        Ids of CDS made by ``rnaseek.create_gffutils_db.transform``, e.g.
+        "CDS:chr1:100-200:+:0"
+    featuretype : 'CDS' | 'exon', optional
+        Whether the ids are of CDS, or of exons, e.g. "exon:chr1:100-200:+"
+
+    Returns
+    -------
+    cds : pandas.DataFrame
+        The columns "chrom", "start", "stop", "strand" and (for CDS) "frame",
+        in BED coordinates, with a frame of "." as 0
+
+    >>> parse_fancy_cds_ids(['CDS:chr1:100-200:+:2']).values.tolist()
+    [['chr1', 99, 200, '+', 2]]
+    """
+    fancy_ids = pd.Series(list(fancy_ids), dtype=object)
+    regex = FANCY_CDS_REGEX if featuretype == 'CDS' else FANCY_EXON_REGEX
+    parsed = fancy_ids.str.extract(regex, expand=True)
+    if parsed.chrom.isnull().any():
+        bad = fancy_ids[parsed.chrom.isnull()].iloc[0]
+        raise ValueError('"{}" is not the id of a {}'.format(bad, featuretype))
+    table = pd.DataFrame(
+        {'chrom': parsed.chrom.values,
+         'start': parsed.start.astype(np.int64).values - 1,
+         'stop': parsed.stop.astype(np.int64).values,
+         'strand': parsed.strand.values}, columns=EXON_COLUMNS[1:])
+    if featuretype == 'CDS':
+        table['frame'] = parsed.frame.replace('.', '0').astype(np.int8).values
+    return table
+
+
+def cds_table_from_db(db, featuretype='CDS'):
+    """Table of the CDS of every transcript in a gffutils database
+
+    The coordinates and frames come from the "fancy_id" of each CDS, and a
+    CDS shared by several transcripts gets one row per transcript
+
+    Parameters
+    ----------
+    db : gffutils.FeatureDB
+        Database created by ``rnaseek.create_gffutils_db.create_db``
+    featuretype : 'CDS' | 'exon', optional
+        Whether to get the CDS, or the exons
+
+    Returns
+    -------
+    cds : pandas.DataFrame
+        Table with the columns in CDS_COLUMNS, or EXON_COLUMNS for exons
+    """
+    fancy_ids, transcript_ids = [], []
+    for feature in db.features_of_type(featuretype):
+        fancy_id = feature.attributes['fancy_id'][0]
+        for transcript_id in feature.attributes['transcript_id']:
+            fancy_ids.append(fancy_id)
+            transcript_ids.append(transcript_id)
+    cds = parse_fancy_cds_ids(fancy_ids, featuretype)
+    cds.insert(0, 'transcript_id', transcript_ids)
+    return cds
+
+
+def cds_table_from_gtf(gtf, featuretype='CDS'):
+    """Table of the CDS of every transcript in a GTF file
+
+    Parameters
+    ----------
+    gtf : str or pandas.DataFrame
+        Location of a GTF file, or a table of its features from
+        ``rnaseek.create_gffutils_db.read_gtf``
+    featuretype : 'CDS' | 'exon', optional
+        Whether to get the CDS, or the exons
+
+    Returns
+    -------
+    cds : pandas.DataFrame
+        Table with the columns in CDS_COLUMNS, or EXON_COLUMNS for exons
+    """
+    if isinstance(gtf, str):
+        from .create_gffutils_db import read_gtf
+
+        gtf, _ = read_gtf(gtf)
+    gtf = gtf.loc[gtf.featuretype == featuretype]
+    transcript_ids = gtf.attributes.str.extract(
+        r'(?:^|;)\s*transcript_id\s+"?([^";]+)"?', expand=False)
+    return pd.DataFrame(
+        {'transcript_id': transcript_ids.values,
+         'chrom': gtf.seqid.values,
+         'start': gtf.start.values.astype(np.int64) - 1,
+         'stop': gtf.end.values.astype(np.int64),
+         'strand': gtf.strand.values,
+         'frame': pd.Series(gtf.frame.values).replace(
+             '.', '0').astype(np.int8).values},
+        columns=CDS_COLUMNS if featuretype == 'CDS' else EXON_COLUMNS)
+
+
+def index_cds(cds, exons=None):
+    """Order the CDS of each transcript and find their coding positions
+
+    Parameters
+    ----------
+    cds : pandas.DataFrame
+        Table with the columns in CDS_COLUMNS
+    exons : pandas.DataFrame, optional
+        Table with the columns in EXON_COLUMNS, e.g. from
+        ``cds_table_from_gtf(gtf, 'exon')``, to find the last exon-exon
+        junction of transcripts whose last exons are UTR. Without them, the
+        last junction is taken to be at the 5' end of the last CDS, which is
+        too early for those transcripts
+
+    Returns
+    -------
+    indexed : pandas.DataFrame
+        The CDS in 5' to 3' order within each transcript, with the genomic
+        positions of their "five_prime" and "three_prime" ends (as BED
+        boundaries), their "rank" in the transcript, their "coding_start"
+        and "coding_stop" (the coding length up to their 5' and 3' ends),
+        their "reading_frame" (where the codons start in coding positions,
+        modulo 3, from the frame), and the "last_junction" of the transcript
+        (its distance in nt from the start of the CDS, which is past the end
+        of the CDS if its last exons are UTR)
+    """
+    plus = (cds.strand == '+').values
+    cds = cds.assign(
+        five_prime=np.where(plus, cds.start.values, cds.stop.values),
+        three_prime=np.where(plus, cds.stop.values, cds.start.values))
+    # Sort along the transcript: by start on "+", and by -stop on "-"
+    order = np.lexsort((np.where(plus, cds.start.values, -cds.stop.values),
+                        cds.transcript_id.values.astype(str)))
+    cds = cds.iloc[order].reset_index(drop=True)
+    grouped = cds.groupby('transcript_id', sort=False)
+    lengths = (cds.stop - cds.start).values
+    cds['rank'] = grouped.cumcount().values
+    cds['coding_stop'] = pd.Series(lengths).groupby(
+        cds.transcript_id.values, sort=False).cumsum().values
+    cds['coding_start'] = cds.coding_stop.values - lengths
+    # The frame is the number of bases before the first whole codon, so
+    # this is the same for every CDS of a transcript read in one frame
+    cds['reading_frame'] = (cds.coding_start.values +
+                            cds.frame.values.astype(np.int64)) % 3
+    last = grouped['rank'].transform('max').values == cds['rank'].values
+    last_junction = pd.Series(
+        np.where(last, cds.coding_start.values, 0)).groupby(
+        cds.transcript_id.values, sort=False).transform('max').values
+    if exons is not None:
+        last_junction = _utr_last_junction(cds.loc[last], exons,
+                                           cds.transcript_id.values,
+                                           last_junction)
+    cds['last_junction'] = last_junction
+    return cds
+
+
+def _utr_last_junction(last_cds, exons, transcript_ids, last_junction):
+    """The last exon-exon junction of each CDS's transcript, from its exons
+
+    The junction is the 3' end of the second to last exon, at as many nt of
+    mRNA past the 3' end of the last CDS (or before, if negative) as there
+    are between them, where transcripts have exons
+    """
+    exons = exons[['transcript_id', 'start', 'stop', 'strand']].merge(
+        last_cds[['transcript_id', 'three_prime', 'coding_stop']],
+        on='transcript_id')
+    plus = (exons.strand == '+').values
+    start = exons.start.values.astype(np.int64)
+    stop = exons.stop.values.astype(np.int64)
+    lengths = stop - start
+    # Bases of each exon 5' of the end of the last CDS, and whether it is
+    # the last exon, which isn't 5' of the last junction
+    before_cds = np.clip(np.where(plus, exons.three_prime.values - start,
+                                  stop - exons.three_prime.values),
+                         0, lengths)
+    along = pd.Series(np.where(plus, start, -stop))
+    last_exon = along.values == along.groupby(
+        exons.transcript_id.values).transform('max').values
+    sums = pd.DataFrame(
+        {'before_cds': before_cds,
+         'before_junction': np.where(last_exon, 0, lengths),
+         'coding_stop': exons.coding_stop.values}).groupby(
+        exons.transcript_id.values).agg(
+        {'before_cds': 'sum', 'before_junction': 'sum', 'coding_stop': 'max'})
+    junction = sums.coding_stop + sums.before_junction - sums.before_cds
+    junction = junction.reindex(transcript_ids).values
+    return np.where(np.isnan(junction), last_junction,
+                    junction).astype(np.int64)
+
+
+def reading_frames(intervals, splice_type, cds, nmd_distance=50,
+                   exons=None):
+    """Classify the effect of SE or MXE events on the reading frame
+
+    Each event is classified in the coding transcripts that splice its
+    upstream flanking exon to its downstream flanking exon through either
+    isoform, with its alternative exons fully coding (the coding length
+    between the flanking exons is that of the isoform's alternative exons)
+    and in the same frame (by the frames of the flanking exons' CDS), as:
+
+    - "noncoding": no transcript has CDS ending at the 3' end of the
+      upstream exon and starting at the 5' end of the downstream exon
+    - "frame_preserving": the coding lengths of the isoforms differ by a
+      multiple of 3
+    - "nmd": the frame shifts, and in at least one transcript the last
+      exon-exon junction is more than ``nmd_distance`` nt downstream of the
+      3' end of the downstream exon, so a PTC in the shifted frame anywhere
+      up to there triggers NMD
+    - "frame_shifting": the frame shifts, but the downstream exon is the last
+      coding exon, or is within ``nmd_distance`` nt of the last junction
+
+    As the exact position of the PTC is not known without the sequence, it
+    is assumed to fall no further than the downstream flanking exon
+
+    Parameters
+    ----------
+    intervals : pandas.DataFrame
+        Exon intervals of the events, as from
+        ``rnaseek.miso.miso_ids_to_intervals``
+    splice_type : 'SE' | 'MXE'
+        Type of splicing event
+    cds : pandas.DataFrame
+        Table with the columns in CDS_COLUMNS, e.g. from
+        ``cds_table_from_db`` or ``cds_table_from_gtf``, or already indexed
+        with ``index_cds`` to reuse for several calls
+    nmd_distance : int, optional
+        Minimum distance of a PTC upstream of the last exon-exon junction to
+        trigger NMD
+    exons : pandas.DataFrame, optional
+        Table with the columns in EXON_COLUMNS, to find the last junctions of
+        transcripts whose last exons are UTR, as in ``index_cds``. Not used
+        if ``cds`` is already indexed
+
+    Returns
+    -------
+    frames : pandas.DataFrame
+        Indexed by event_name, in the order of ``intervals``, with the
+        columns "length_difference" (coding length of isoform2 minus
+        isoform1), "frame_shift" (that modulo 3), "n_transcripts" (coding
+        transcripts with the flanking exons), "nmd_distance" (the largest
+        distance from the 3' end of the downstream exon to the last junction
+        in those transcripts) and "classification", one of FRAME_CLASSES
+
+    Raises
+    ------
+    ValueError
+        If the splice type is not SE or MXE
+    """
+    from .miso import splice_type_schema
+
+    if splice_type not in ('SE', 'MXE'):
+        raise ValueError('Reading frames can only be classified for SE and '
+                         'MXE events, not {}'.format(splice_type))
+    schema = splice_type_schema(splice_type)
+    if 'coding_stop' not in cds:
+        cds = index_cds(cds, exons)
+
+    empty = intervals.iloc[:0]
+    exons = dict(list(intervals.groupby('feature', sort=False)))
+    exons = dict((name, exons.get(name, empty)) for name in schema['exons'])
+    upstream = exons[schema['exons'][0]]
+    downstream = exons[schema['exons'][-1]]
+    event_names = upstream.event_name.values
+    n_events = event_names.shape[0]
+
+    # Coding length of the alternative exons of isoform1 and isoform2, which
+    # share their first and last exons
+    alternative = np.zeros((2, n_events), dtype=np.int64)
+    for j, isoform in enumerate(schema['isoforms']):
+        for i in isoform[1:-1]:
+            exon = exons[schema['exons'][i]]
+            alternative[j] += (exon.stop.values.astype(np.int64) -
+                               exon.start.values.astype(np.int64))
+    difference = alternative[1] - alternative[0]
+
+    # Transcripts with a CDS ending at the 3' end of the upstream exon, and
+    # a later CDS starting at the 5' end of the downstream exon
+    plus = upstream.strand.values == '+'
+    events = pd.DataFrame(
+        {'event': np.arange(n_events), 'chrom': upstream.chrom.values,
+         'strand': upstream.strand.values,
+         'three_prime': np.where(plus, upstream.stop.values,
+                                 upstream.start.values).astype(np.int64),
+         'five_prime': np.where(plus, downstream.start.values,
+                                downstream.stop.values).astype(np.int64)})
+    keys = ['chrom', 'strand']
+    up = events[['event', 'three_prime'] + keys].merge(
+        cds[['transcript_id', 'three_prime', 'rank', 'coding_stop',
+             'reading_frame'] + keys],
+        on=['three_prime'] + keys)
+    down = events[['event', 'five_prime'] + keys].merge(
+        cds[['transcript_id', 'five_prime', 'rank', 'coding_start',
+             'coding_stop', 'reading_frame', 'last_junction'] + keys],
+        on=['five_prime'] + keys)
+    matched = up[['event', 'transcript_id', 'rank', 'coding_stop',
+                  'reading_frame']].merge(
+        down[['event', 'transcript_id', 'rank', 'coding_start',
+              'coding_stop', 'reading_frame', 'last_junction']],
+        on=['event', 'transcript_id'], suffixes=('_up', '_down'))
+    between = (matched.coding_start - matched.coding_stop_up).values
+    isoform = (between == alternative[0][matched.event.values]) | \
+        (between == alternative[1][matched.event.values])
+    in_frame = matched.reading_frame_up.values == \
+        matched.reading_frame_down.values
+    matched = matched.loc[(matched.rank_down > matched.rank_up).values &
+                          isoform & in_frame]
+
+    event = matched.event.values
+    n_transcripts = np.bincount(event, minlength=n_events)
+    distance = np.full(n_events, np.iinfo(np.int64).min)
+    np.maximum.at(distance, event, (matched.last_junction -
+                                    matched.coding_stop_down).values)
+
+    frame_shift = difference % 3
+    classification = np.where(
+        n_transcripts == 0, 'noncoding', np.where(
+            frame_shift == 0, 'frame_preserving', np.where(
+                distance > nmd_distance, 'nmd', 'frame_shifting')))
+    return pd.DataFrame(
+        {'length_difference': difference, 'frame_shift': frame_shift,
+         'n_transcripts': n_transcripts,
+         'nmd_distance': np.where(n_transcripts > 0,
+                                  np.maximum(distance, 0), 0),
+         'classification': pd.Categorical(classification,
+                                           categories=FRAME_CLASSES)},
+        index=pd.Index(event_names, name='event_name'),
+        columns=FRAME_COLUMNS)
@@ -0,0 +1,139 @@
+"""Time and memory used by each stage of a pipeline, as a JSON run report"""
+import contextlib
+import datetime
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def log_to_stderr():
+    """Send the JSON lines of finished stages to stderr, e.g. for a
+    scheduler to scrape"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    return handler
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of this process, where possible
+
+    Only Linux allows this (by writing "5" to /proc/self/clear_refs).
+    Elsewhere the peak is the highest since the process started.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        pass
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, or None if unknown"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on Mac OS X
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def frame_bytes(df):
+    """Memory used by a pandas DataFrame or Series, including strings"""
+    return int(df.memory_usage(deep=True).sum()) if df.ndim == 2 else \
+        int(df.memory_usage(deep=True))
+
+
+def file_bytes(filenames):
+    """Total size of files, e.g. the inputs or outputs of a stage"""
+    return int(sum(os.path.getsize(x) for x in filenames))
+
+
+class RunReport(object):
+
+    def __init__(self, name, log=False):
+        """Record the wall time, CPU time, peak memory, rows and bytes of
+        every stage of a run
+
+        Parameters
+        ----------
+        name : str
+            Name of the pipeline, e.g. "combine_miso"
+        log : bool, optional
+            If True, also log every finished stage as one line of JSON to the
+            "rnaseek.instrumentation" logger
+
+        Examples
+        --------
+        >>> report = RunReport('example')
+        >>> with report.stage('read') as stage:
+        ...     stage['rows'] = 10
+        >>> [x['rows'] for x in report.stages]
+        [10]
+        """
+        self.name = name
+        self.log = log
+        self.stages = []
+        self.started = datetime.datetime.now()
+        self._wall = time.time()
+        self._cpu = time.process_time()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure one stage of the run
+
+        Yields a dict for the stage's record, where the number of "rows" and
+        "bytes" the stage handled can be set. The record is kept even if the
+        stage raises an exception, with "failed" set to True
+        """
+        record = {'stage': name, 'rows': None, 'bytes': None}
+        reset_peak_rss()
+        wall, cpu = time.time(), time.process_time()
+        try:
+            yield record
+        except BaseException:
+            record['failed'] = True
+            raise
+        finally:
+            record['wall_seconds'] = time.time() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            record['peak_rss_bytes'] = peak_rss()
+            self.stages.append(record)
+            if self.log:
+                logger.info(json.dumps(dict(record, run=self.name)))
+
+    def to_dict(self):
+        """The report as a JSON-serializable dict"""
+        return {'name': self.name,
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'started': self.started.isoformat(),
+                'wall_seconds': time.time() - self._wall,
+                'cpu_seconds': time.process_time() - self._cpu,
+                'peak_rss_bytes': max([x['peak_rss_bytes'] for x in
+                                       self.stages if x['peak_rss_bytes']] or
+                                      [peak_rss()]),
+                'stages': self.stages}
+
+    def write(self, filename):
+        """Write the report as JSON"""
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return filename
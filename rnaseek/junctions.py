@@ -0,0 +1,375 @@
+"""Combine STAR's per-sample splice junction counts (SJ.out.tab files) into
+one sparse junction x sample matrix"""
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from .matrix import SparseMatrix
+
+SJ_OUT_TAB_COLUMNS = ['chrom', 'intron_start', 'intron_end', 'strand',
+                      'motif', 'annotated', 'unique_reads', 'multi_reads',
+                      'max_overhang']
+
+# STAR codes the strand as 0 (undefined), 1 (+) and 2 (-), and the intron
+# motif as 0 (non-canonical) through 6
+STRANDS = np.array(['.', '+', '-'])
+MOTIFS = ['non-canonical', 'GT/AG', 'CT/AC', 'GC/AG', 'CT/GC', 'AT/AC',
+          'GT/AT']
+
+# Metadata of each junction, with the intron in BED coordinates
+JUNCTION_COLUMNS = ['chrom', 'start', 'stop', 'strand', 'motif', 'annotated']
+COUNT_LAYERS = ['unique_reads', 'multi_reads']
+
+
+def read_sj_out_tab(filename):
+    """Read a STAR SJ.out.tab file
+
+    Parameters
+    ----------
+    filename : str
+        Location of the SJ.out.tab file
+
+    Returns
+    -------
+    junctions : pandas.DataFrame
+        The columns in JUNCTION_COLUMNS, where "start" and "stop" are the
+        intron in BED coordinates and "strand" is "+", "-" or ".", and the
+        columns in COUNT_LAYERS
+    """
+    df = pd.read_csv(filename, sep='\t', header=None,
+                     names=SJ_OUT_TAB_COLUMNS,
+                     dtype={'chrom': str, 'intron_start': np.int64,
+                            'intron_end': np.int64, 'strand': np.int8,
+                            'motif': np.int8, 'annotated': np.int8,
+                            'unique_reads': np.uint32,
+                            'multi_reads': np.uint32,
+                            'max_overhang': np.int32})
+    return pd.DataFrame({'chrom': df.chrom.values,
+                         'start': df.intron_start.values - 1,
+                         'stop': df.intron_end.values,
+                         'strand': STRANDS[df.strand.values],
+                         'motif': df.motif.values,
+                         'annotated': df.annotated.values.astype(bool),
+                         'unique_reads': df.unique_reads.values,
+                         'multi_reads': df.multi_reads.values},
+                        columns=JUNCTION_COLUMNS + COUNT_LAYERS)
+
+
+class JunctionIndex(object):
+
+    def __init__(self, stranded=False):
+        """Intern junction coordinates into integer ids
+
+        Ids are given in order of first appearance. The introns of each
+        chromosome are hashed as one 64-bit integer of their start and stop,
+        so a whole sample's junctions are looked up at once.
+
+        Parameters
+        ----------
+        stranded : bool, optional
+            If True, the same intron on different strands are different
+            junctions, and junctions need a "strand" column
+        """
+        self.stranded = stranded
+        self.n_junctions = 0
+        self._keys = {}
+        self._ids = {}
+        self._metadata = []
+
+    def _groups(self, junctions):
+        """Yield the group, positions and 64-bit keys of the junctions of
+        each chromosome (and strand)"""
+        start = junctions.start.values.astype(np.uint64)
+        stop = junctions.stop.values.astype(np.uint64)
+        by = ['chrom', 'strand'] if self.stranded else 'chrom'
+        for group, positions in junctions.groupby(
+                by, sort=False).indices.items():
+            keys = (start[positions] << np.uint64(32)) | stop[positions]
+            yield group, positions, keys
+
+    def get_ids(self, junctions):
+        """Integer ids of junctions, or -1 for the ones not seen before
+
+        Parameters
+        ----------
+        junctions : pandas.DataFrame
+            Table with at least "chrom", "start" and "stop" columns (and
+            "strand", if stranded)
+
+        Returns
+        -------
+        ids : numpy.ndarray
+            Id of each junction
+        """
+        ids = np.repeat(np.int64(-1), junctions.shape[0])
+        for group, positions, keys in self._groups(junctions):
+            if group not in self._keys:
+                continue
+            found = self._keys[group].get_indexer(keys)
+            ids[positions[found >= 0]] = self._ids[group][found[found >= 0]]
+        return ids
+
+    def intern(self, junctions):
+        """Integer ids of junctions, adding the ones not seen before
+
+        Parameters
+        ----------
+        junctions : pandas.DataFrame
+            Table with at least "chrom", "start" and "stop" columns (and
+            "strand", if stranded), and no junction more than once
+
+        Returns
+        -------
+        ids : numpy.ndarray
+            Id of each junction
+        """
+        ids = self.get_ids(junctions)
+        for group, positions, keys in self._groups(junctions):
+            new = ids[positions] < 0
+            if not new.any():
+                continue
+
+            # New junctions get the next ids, so the metadata are kept in
+            # order of their ids
+            new_ids = np.arange(self.n_junctions,
+                                self.n_junctions + new.sum())
+            ids[positions[new]] = new_ids
+            self.n_junctions += new_ids.shape[0]
+            if group in self._keys:
+                self._keys[group] = self._keys[group].append(
+                    pd.Index(keys[new]))
+                self._ids[group] = np.concatenate([self._ids[group], new_ids])
+            else:
+                self._keys[group] = pd.Index(keys[new])
+                self._ids[group] = new_ids
+            self._metadata.append(
+                junctions.iloc[positions[new]][JUNCTION_COLUMNS])
+        return ids
+
+    def junctions(self):
+        """Metadata of every junction, in order of their ids"""
+        if len(self._metadata) == 0:
+            return pd.DataFrame(columns=JUNCTION_COLUMNS)
+        return pd.concat(self._metadata, ignore_index=True)
+
+
+def combine_junctions(filenames, sample_ids, n_jobs=1):
+    """Combine SJ.out.tab files into a sparse junction x sample matrix
+
+    The files are read in parallel, and each sample's junctions are interned
+    into a global index as they come in, so only the nonzero counts are
+    ever kept.
+
+    Parameters
+    ----------
+    filenames : list of str
+        Locations of SJ.out.tab files
+    sample_ids : list of str
+        Sample id of each file
+    n_jobs : int, optional
+        Number of processes to read files with
+
+    Returns
+    -------
+    counts : rnaseek.matrix.SparseMatrix
+        A (n_junctions, n_samples) matrix with the layers in COUNT_LAYERS,
+        and the junctions in JUNCTION_COLUMNS as the row metadata, sorted by
+        chromosome, start and stop
+    """
+    index = JunctionIndex()
+    rows, columns = [], []
+    counts = dict((layer, []) for layer in COUNT_LAYERS)
+
+    pool = multiprocessing.Pool(n_jobs) if n_jobs > 1 else None
+    try:
+        reader = pool.imap(read_sj_out_tab, filenames) if pool is not None \
+            else (read_sj_out_tab(x) for x in filenames)
+        for i, junctions in enumerate(reader):
+            rows.append(index.intern(junctions))
+            columns.append(np.repeat(np.int32(i), junctions.shape[0]))
+            for layer in COUNT_LAYERS:
+                counts[layer].append(junctions[layer].values)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    junctions = index.junctions()
+    order = np.lexsort((junctions.stop.values, junctions.start.values,
+                        junctions.chrom.values.astype(str)))
+    rank = np.empty(order.shape[0], dtype=np.int64)
+    rank[order] = np.arange(order.shape[0])
+    junctions = junctions.iloc[order].reset_index(drop=True)
+    junctions['start'] = junctions.start.astype(np.int64)
+    junctions['stop'] = junctions.stop.astype(np.int64)
+
+    def concatenate(pieces, dtype):
+        return np.concatenate(pieces) if len(pieces) > 0 else \
+            np.zeros(0, dtype=dtype)
+
+    row = rank[concatenate(rows, np.int64)]
+    return SparseMatrix.from_coo(
+        row, concatenate(columns, np.int32),
+        dict((layer, concatenate(counts[layer], np.uint32))
+             for layer in COUNT_LAYERS),
+        junctions, list(sample_ids))
+
+
+def event_junctions(intervals, splice_type):
+    """Splice junctions of each isoform of splicing events
+
+    Parameters
+    ----------
+    intervals : pandas.DataFrame
+        Exon intervals of the events, as from
+        ``rnaseek.miso.miso_ids_to_intervals``
+    splice_type : 'SE' | 'MXE' | 'A5SS' | 'A3SS'
+        Type of splicing event. Retained introns (RI) aren't supported, as
+        the retained isoform has no splice junction
+
+    Returns
+    -------
+    junctions : pandas.DataFrame
+        Table with the columns "event_name", "isoform" (1 or 2), "chrom",
+        "start", "stop" and "strand", with each junction's intron in BED
+        coordinates. There's one block of rows per junction of each isoform
+        in ``SPLICE_TYPE_SCHEMAS``, each with the events in the order of
+        ``intervals``
+
+    Raises
+    ------
+    ValueError
+        If an isoform of the splice type has no splice junctions
+    """
+    from .miso import splice_type_schema
+
+    schema = splice_type_schema(splice_type)
+    exons = dict(list(intervals.groupby('feature', sort=False)))
+    blocks = []
+    empty = intervals.iloc[:0]
+    for isoform, exon_numbers in enumerate(schema['isoforms']):
+        pairs = list(zip(exon_numbers[:-1], exon_numbers[1:]))
+        if len(pairs) == 0:
+            raise ValueError('Isoform {} of {} events has no splice '
+                             'junctions, so its PSI cannot be estimated from '
+                             'junction reads'.format(isoform + 1, splice_type))
+        for i, j in pairs:
+            upstream = exons.get(schema['exons'][i], empty)
+            downstream = exons.get(schema['exons'][j], empty)
+            blocks.append(pd.DataFrame(
+                {'event_name': upstream.event_name.values,
+                 'isoform': isoform + 1,
+                 'chrom': upstream.chrom.values,
+                 'start': np.minimum(upstream.stop.values,
+                                     downstream.stop.values),
+                 'stop': np.maximum(upstream.start.values,
+                                    downstream.start.values),
+                 'strand': upstream.strand.values},
+                columns=['event_name', 'isoform', 'chrom', 'start', 'stop',
+                         'strand']))
+    return pd.concat(blocks, ignore_index=True)
+
+
+def junction_psi(intervals, splice_type, counts, layer='unique_reads',
+                 reads_min=10, ci_max=None, z=1.96, stranded=False):
+    """Estimate PSI of splicing events from junction read counts
+
+    The reads of each isoform are the mean reads of its splice junctions,
+    e.g. half of the reads on both inclusion junctions of a skipped exon, and
+    PSI is the fraction of reads of isoform2 in ``SPLICE_TYPE_SCHEMAS``,
+    which for SE and MXE events is the same isoform as MISO's PSI. All events
+    in all samples are estimated at once, from only the junctions the events
+    use.
+
+    Parameters
+    ----------
+    intervals : pandas.DataFrame
+        Exon intervals of the events, as from
+        ``rnaseek.miso.miso_ids_to_intervals``
+    splice_type : 'SE' | 'MXE' | 'A5SS' | 'A3SS'
+        Type of splicing event
+    counts : rnaseek.matrix.SparseMatrix
+        Junction x sample read counts, as from ``combine_junctions``
+    layer : str, optional
+        Which counts to use, "unique_reads" or "multi_reads"
+    reads_min : int, optional
+        Minimum number of reads on the event's junctions for PSI to be
+        estimated
+    ci_max : float, optional
+        If given, the maximum width of the confidence interval of PSI for it
+        to be kept
+    z : float, optional
+        Standard score of the Wilson confidence interval. Default is a 95%
+        interval
+    stranded : bool, optional
+        If True, junctions are also matched on their strand, so junctions
+        STAR gave no strand (".", for non-canonical motifs or unstranded
+        libraries) are never used. By default they're matched on their
+        chromosome and intron, which already imply the event's strand, and
+        the reads of an intron on several strands are added up
+
+    Returns
+    -------
+    results : dict
+        Mapping of "psi", "ci_low", "ci_high" and "reads" to
+        ((event_name, splice_type), samples) DataFrames, the same shape as
+        the psi.csv of combine_miso_output.py. Events with too few reads or
+        too wide a confidence interval are NaN in "psi"
+    """
+    from .miso import splice_type_schema
+
+    junctions = event_junctions(intervals, splice_type)
+
+    # Ids of the junctions of the matrix, where rows of the same intron on
+    # different strands share an id unless stranded
+    index = JunctionIndex(stranded=stranded)
+    keys = ['chrom', 'start', 'stop'] + (['strand'] if stranded else [])
+    index.intern(counts.rows.drop_duplicates(keys))
+    row_ids = index.get_ids(counts.rows)
+    ids = index.get_ids(junctions)
+    found = ids >= 0
+
+    # Reads of each junction the events use, from all of its rows
+    used = np.nonzero(np.isin(row_ids, ids[found]))[0]
+    used_ids, inverse = np.unique(row_ids[used], return_inverse=True)
+    used_reads = np.zeros((used_ids.shape[0], counts.shape[1]))
+    np.add.at(used_reads, inverse, counts.take(used).to_dense(layer))
+    junction_reads = np.zeros((junctions.shape[0], counts.shape[1]))
+    junction_reads[found] = used_reads[np.searchsorted(used_ids, ids[found])]
+
+    # The junctions are in one block of all the events per junction of
+    # each isoform, so the reads of each isoform are the mean of its blocks
+    schema = splice_type_schema(splice_type)
+    blocks = np.array([i + 1 for i, exons in enumerate(schema['isoforms'])
+                       for _ in range(len(exons) - 1)])
+    n_events = junctions.shape[0] // blocks.shape[0]
+    junction_reads = junction_reads.reshape(blocks.shape[0], n_events,
+                                            counts.shape[1])
+    isoform1 = junction_reads[blocks == 1].mean(axis=0)
+    isoform2 = junction_reads[blocks == 2].mean(axis=0)
+    reads = junction_reads.sum(axis=0)
+
+    # Wilson score interval of the fraction of isoform2 reads
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n = isoform1 + isoform2
+        psi = isoform2 / n
+        center = (psi + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+        half_width = z * np.sqrt(psi * (1 - psi) / n + z ** 2 / (4 * n ** 2)) \
+            / (1 + z ** 2 / n)
+    ci_low = center - half_width
+    ci_high = center + half_width
+
+    keep = reads >= reads_min
+    if ci_max is not None:
+        keep &= (ci_high - ci_low) <= ci_max
+    psi = np.where(keep, psi, np.nan)
+
+    index = pd.MultiIndex.from_arrays(
+        [junctions.event_name.values[:n_events],
+         np.repeat(splice_type, n_events)],
+        names=['event_name', 'splice_type'])
+    columns = pd.Index(counts.columns, name='sample_id')
+    return dict((name, pd.DataFrame(values, index=index, columns=columns))
+                for name, values in (('psi', psi), ('ci_low', ci_low),
+                                     ('ci_high', ci_high), ('reads', reads)))
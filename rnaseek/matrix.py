@@ -0,0 +1,268 @@
+"""Sparse matrices of counts with labelled rows and columns
+
+The matrices are kept in compressed sparse row (CSR) format as plain NumPy
+arrays, with one or more layers of values sharing the same nonzero
+positions, e.g. unique and multi-mapped reads of each junction in each
+sample. They're written as a single compressed ".npz" file, or as a folder
+of uncompressed ".npy" arrays that can be memory-mapped, with the row
+metadata stored once, and string metadata stored as categorical codes.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
+
+# Arrays of the folder format, besides one "data_<layer>.npy" per layer
+INDPTR_NPY = 'indptr.npy'
+INDICES_NPY = 'indices.npy'
+METADATA_NPZ = 'metadata.npz'
+
+
+def _row_pointers(row, n_rows):
+    """CSR row pointers of sorted row indices"""
+    return np.concatenate([[0], np.cumsum(np.bincount(row, minlength=n_rows))
+                           ]).astype(np.int64)
+
+
+class SparseMatrix(object):
+
+    def __init__(self, indptr, indices, data, rows, columns):
+        """A (n_rows, n_columns) sparse matrix with layers of values
+
+        Parameters
+        ----------
+        indptr : numpy.ndarray
+            (n_rows + 1,) CSR row pointers: the column indices and values of
+            row i are at indptr[i]:indptr[i + 1]
+        indices : numpy.ndarray
+            Column index of each nonzero position
+        data : dict
+            Mapping of layer names to arrays of the value at each nonzero
+            position
+        rows : pandas.DataFrame
+            Metadata of each row
+        columns : list-like
+            Names of the columns
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices)
+        self.data = dict(data)
+        self.rows = rows
+        self.columns = pd.Index(columns)
+        if self.indptr.shape[0] != rows.shape[0] + 1:
+            raise ValueError('"indptr" must have one more element than there '
+                             'are rows')
+        for name, values in self.data.items():
+            if values.shape != self.indices.shape:
+                raise ValueError('Layer "{}" has {} values for {} nonzero '
+                                 'positions'.format(name, values.shape[0],
+                                                    self.indices.shape[0]))
+
+    @classmethod
+    def from_coo(cls, row, col, data, rows, columns):
+        """Build a matrix from (row, column, value) triplets
+
+        Triplets may be in any order, but each (row, column) pair must only
+        appear once
+        """
+        row = np.asarray(row)
+        col = np.asarray(col)
+        order = np.lexsort((col, row))
+        data = dict((name, np.asarray(values)[order])
+                    for name, values in data.items())
+        return cls(_row_pointers(row[order], rows.shape[0]), col[order], data,
+                   rows, columns)
+
+    @property
+    def shape(self):
+        return self.rows.shape[0], len(self.columns)
+
+    @property
+    def nnz(self):
+        return self.indices.shape[0]
+
+    def row_indices(self):
+        """Row index of each nonzero position"""
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def take(self, rows):
+        """Sub-matrix of the given row positions, in that order"""
+        rows = np.asarray(rows)
+        starts, stops = self.indptr[rows], self.indptr[rows + 1]
+        lengths = stops - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths,
+                              lengths) + np.arange(lengths.sum())
+        return SparseMatrix(
+            np.concatenate([[0], np.cumsum(lengths)]),
+            self.indices[positions],
+            dict((name, values[positions])
+                 for name, values in self.data.items()),
+            self.rows.iloc[rows], self.columns)
+
+    def take_columns(self, columns):
+        """Sub-matrix of the given column positions, in that order"""
+        columns = np.asarray(columns, dtype=np.int64)
+        positions = np.repeat(np.int64(-1), self.shape[1])
+        positions[columns] = np.arange(columns.shape[0])
+        col = positions[self.indices]
+        keep = col >= 0
+        return SparseMatrix.from_coo(
+            self.row_indices()[keep], col[keep].astype(self.indices.dtype),
+            dict((name, values[keep]) for name, values in self.data.items()),
+            self.rows, self.columns[columns])
+
+    def sum_columns(self, groups):
+        """Sum the columns of each group, e.g. the transcripts of each gene
+
+        Parameters
+        ----------
+        groups : list-like
+            Group of each column
+
+        Returns
+        -------
+        summed : SparseMatrix
+            A (n_rows, n_groups) matrix with the groups in sorted order as
+            its columns, and the values summed in float64 and kept in the
+            dtype of each layer
+        """
+        codes, labels = pd.factorize(np.asarray(groups), sort=True)
+        n_groups = len(labels)
+        keys = self.row_indices().astype(np.int64) * n_groups + \
+            codes[self.indices]
+        keys, inverse = np.unique(keys, return_inverse=True)
+        data = dict((name, np.bincount(inverse, weights=values,
+                                       minlength=keys.shape[0]).astype(
+            values.dtype)) for name, values in self.data.items())
+        return SparseMatrix(_row_pointers(keys // n_groups, self.shape[0]),
+                            (keys % n_groups).astype(np.int32), data,
+                            self.rows, labels)
+
+    def to_dense(self, layer):
+        """A (n_rows, n_columns) NumPy array of one layer"""
+        dense = np.zeros(self.shape, dtype=self.data[layer].dtype)
+        dense[self.row_indices(), self.indices] = self.data[layer]
+        return dense
+
+    def to_frame(self, layer, index=None):
+        """A dense pandas DataFrame of one layer
+
+        Parameters
+        ----------
+        layer : str
+            Name of the layer of values
+        index : str or list of str, optional
+            Row metadata column(s) to use as the index. Defaults to the index
+            of the row metadata
+        """
+        if index is None:
+            labels = self.rows.index
+        elif isinstance(index, str):
+            labels = pd.Index(np.asarray(self.rows[index]), name=index)
+        else:
+            labels = pd.MultiIndex.from_frame(self.rows[index])
+        return pd.DataFrame(self.to_dense(layer), index=labels,
+                            columns=self.columns)
+
+    def to_scipy(self, layer):
+        """A scipy.sparse.csr_matrix of one layer"""
+        if scipy is None:
+            raise ImportError('scipy is needed to make scipy.sparse matrices')
+        return scipy.sparse.csr_matrix(
+            (self.data[layer], self.indices, self.indptr), shape=self.shape)
+
+    def _metadata(self):
+        """Arrays of the column names, layer names and row metadata"""
+        arrays = {'columns': np.array(self.columns.astype(str).tolist(),
+                                      dtype=str),
+                  'layers': np.array(sorted(self.data), dtype=str),
+                  'row_columns': np.array(self.rows.columns, dtype=str)}
+        for name, values in self.rows.items():
+            if values.dtype.kind in 'biuf':
+                arrays['row_' + name] = values.values
+            else:
+                codes, categories = pd.factorize(values)
+                arrays['row_' + name] = codes.astype(np.int32)
+                arrays['row_{}_categories'.format(name)] = np.array(
+                    categories.astype(str).tolist(), dtype=str)
+        return arrays
+
+    @staticmethod
+    def _read_rows(npz, n_rows):
+        """Row metadata from the arrays of ``_metadata``"""
+        rows = {}
+        for name in npz['row_columns']:
+            values = npz['row_' + name]
+            categories = 'row_{}_categories'.format(name)
+            if categories in npz.files:
+                values = pd.Categorical.from_codes(values, npz[categories])
+            rows[name] = values
+        return pd.DataFrame(rows, columns=list(npz['row_columns']),
+                            index=np.arange(n_rows))
+
+    def write(self, filename):
+        """Write the matrix and its metadata to a compressed ".npz" file"""
+        arrays = self._metadata()
+        arrays['indptr'] = self.indptr
+        arrays['indices'] = self.indices
+        for name, values in self.data.items():
+            arrays['data_' + name] = values
+        np.savez_compressed(filename, **arrays)
+        return filename
+
+    @classmethod
+    def read(cls, filename):
+        """Read a matrix written by ``write``"""
+        with np.load(filename, allow_pickle=False) as npz:
+            rows = cls._read_rows(npz, npz['indptr'].shape[0] - 1)
+            data = dict((name, npz['data_' + name])
+                        for name in npz['layers'])
+            return cls(npz['indptr'], npz['indices'], data, rows,
+                       npz['columns'])
+
+    def write_dir(self, directory):
+        """Write the matrix to a folder of ".npy" arrays, which can be read
+        back memory-mapped with ``read_dir``, and a small metadata.npz"""
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+        np.save(os.path.join(directory, INDPTR_NPY), self.indptr)
+        np.save(os.path.join(directory, INDICES_NPY), self.indices)
+        for name, values in self.data.items():
+            np.save(os.path.join(directory, 'data_{}.npy'.format(name)),
+                    values)
+        np.savez_compressed(os.path.join(directory, METADATA_NPZ),
+                            **self._metadata())
+        return directory
+
+    @classmethod
+    def read_dir(cls, directory, mmap_mode='r'):
+        """Read a matrix written by ``write_dir``
+
+        Parameters
+        ----------
+        directory : str
+            Folder of the matrix
+        mmap_mode : str or None, optional
+            How to memory-map the arrays of nonzero positions and values, as
+            in ``numpy.load``. If None, they're read into memory
+        """
+        def load(basename):
+            return np.load(os.path.join(directory, basename),
+                           mmap_mode=mmap_mode, allow_pickle=False)
+
+        indptr = load(INDPTR_NPY)
+        with np.load(os.path.join(directory, METADATA_NPZ),
+                     allow_pickle=False) as npz:
+            rows = cls._read_rows(npz, indptr.shape[0] - 1)
+            data = dict((name, load('data_{}.npy'.format(name)))
+                        for name in npz['layers'])
+            columns = npz['columns']
+        return cls(indptr, load(INDICES_NPY), data, rows, columns)
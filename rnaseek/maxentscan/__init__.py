@@ -0,0 +1,248 @@
+"""Maximum entropy splice site scores, as in MaxEntScan's score5.pl and
+score3.pl (Yeo and Burge, J Comput Biol 2004), for many splice sites at once
+
+The model tables are the ones distributed with MaxEntScan: ``me2x5``,
+``splicemodels/splice5sequences`` and ``splicemodels/me2x3acc1`` through
+``splicemodels/me2x3acc9``. By default they're read from this directory.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from ..bed import read_clusters
+from ..fasta import NUCLEOTIDE_CODES
+
+MODEL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Background and consensus ("GT" for 5' and "AG" for 3' splice sites) base
+# probabilities, in the order A, C, G, T
+BACKGROUND = np.array([0.27, 0.23, 0.23, 0.27])
+CONSENSUS5 = (np.array([0.004, 0.0032, 0.9896, 0.0032]),
+              np.array([0.0034, 0.0039, 0.0042, 0.9884]))
+CONSENSUS3 = (np.array([0.9903, 0.0032, 0.0034, 0.0030]),
+              np.array([0.0027, 0.0037, 0.9905, 0.0030]))
+
+# Exonic and intronic lengths of the 9-mer 5' and 23-mer 3' splice sites
+SCORE5_EXON, SCORE5_INTRON = 3, 6
+SCORE3_INTRON, SCORE3_EXON = 20, 3
+
+# (start, length) of the subsequences of the 21 non-consensus bases of 3'
+# splice sites that each me2x3acc table scores. The first five are
+# multiplied and the last four divided
+SCORE3_SUBSEQUENCES = ((0, 7), (7, 7), (14, 7), (4, 7), (11, 7),
+                       (4, 3), (7, 4), (11, 3), (14, 4))
+
+
+def read_table(filename):
+    """Read a MaxEntScan table of one value per line"""
+    with open(filename) as f:
+        return np.array([float(line) for line in f if line.strip()])
+
+
+def hash_columns(codes):
+    """Base-4 hash of each row of a matrix of nucleotide codes
+
+    >>> hash_columns(np.array([[0, 0, 1], [3, 2, 1]]))
+    array([ 1, 57])
+    """
+    weights = 4 ** np.arange(codes.shape[1] - 1, -1, -1)
+    return np.minimum(codes, 3).astype(np.int64).dot(weights)
+
+
+def encode(sequences, length):
+    """Encode splice site sequences of the same length as a code matrix"""
+    sequences = [x if isinstance(x, bytes) else x.encode('ascii')
+                 for x in sequences]
+    if any(len(x) != length for x in sequences):
+        raise ValueError('All splice site sequences must have length '
+                         '{}'.format(length))
+    buffer = np.frombuffer(b''.join(sequences), dtype=np.uint8)
+    return NUCLEOTIDE_CODES[buffer].reshape(len(sequences), length)
+
+
+class MaxEntScanScorer(object):
+
+    def __init__(self, model_dir=MODEL_DIR):
+        """Score 5' and 3' splice sites with the maximum entropy model
+
+        The model tables are read once, and rearranged so that every score
+        is a lookup by the base-4 hash of a subsequence.
+
+        Parameters
+        ----------
+        model_dir : str, optional
+            Directory with the MaxEntScan ``me2x5`` table and the
+            ``splicemodels`` directory
+        """
+        splicemodels = os.path.join(model_dir, 'splicemodels')
+        try:
+            me2x5 = read_table(os.path.join(model_dir, 'me2x5'))
+            with open(os.path.join(splicemodels, 'splice5sequences')) as f:
+                sequences = [line.strip() for line in f if line.strip()]
+            self.me2x3acc = [
+                read_table(os.path.join(splicemodels,
+                                        'me2x3acc{}'.format(i + 1)))
+                for i in range(len(SCORE3_SUBSEQUENCES))]
+        except IOError as e:
+            raise IOError('Could not read the MaxEntScan model tables in '
+                          '{}. Copy "me2x5" and the "splicemodels" '
+                          'directory from MaxEntScan there, or give their '
+                          'location as "model_dir": {}'.format(model_dir, e))
+
+        # The score of each 7-mer is on the same line of me2x5 as the 7-mer
+        # is in splice5sequences, so reorder me2x5 by the 7-mer hashes
+        self.me2x5 = np.repeat(np.nan, 4 ** 7)
+        self.me2x5[hash_columns(encode(sequences, 7))] = me2x5[:len(sequences)]
+
+    def score5(self, sites):
+        """Maximum entropy scores of 9-mer 5' (donor) splice sites
+
+        Parameters
+        ----------
+        sites : list of str or numpy.ndarray
+            Sequences of 3 exonic and 6 intronic bases, or a (n_sites, 9)
+            matrix of their nucleotide codes
+
+        Returns
+        -------
+        scores : numpy.ndarray
+            Score of each site, or NaN if it has bases other than ACGT
+        """
+        codes = sites if isinstance(sites, np.ndarray) else encode(sites, 9)
+        known = (codes < 4).all(axis=1)
+        codes = np.minimum(codes, 3)
+        consensus = CONSENSUS5[0][codes[:, 3]] * CONSENSUS5[1][codes[:, 4]] / \
+            (BACKGROUND[codes[:, 3]] * BACKGROUND[codes[:, 4]])
+        rest = codes[:, [0, 1, 2, 5, 6, 7, 8]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.log2(consensus * self.me2x5[hash_columns(rest)])
+        scores[~known] = np.nan
+        return scores
+
+    def score3(self, sites):
+        """Maximum entropy scores of 23-mer 3' (acceptor) splice sites
+
+        Parameters
+        ----------
+        sites : list of str or numpy.ndarray
+            Sequences of 20 intronic and 3 exonic bases, or a (n_sites, 23)
+            matrix of their nucleotide codes
+
+        Returns
+        -------
+        scores : numpy.ndarray
+            Score of each site, or NaN if it has bases other than ACGT
+        """
+        codes = sites if isinstance(sites, np.ndarray) else encode(sites, 23)
+        known = (codes < 4).all(axis=1)
+        codes = np.minimum(codes, 3)
+        consensus = CONSENSUS3[0][codes[:, 18]] * \
+            CONSENSUS3[1][codes[:, 19]] / \
+            (BACKGROUND[codes[:, 18]] * BACKGROUND[codes[:, 19]])
+        rest = np.hstack([codes[:, :18], codes[:, 20:]])
+
+        subscores = [table[hash_columns(rest[:, start:start + length])]
+                     for table, (start, length) in zip(self.me2x3acc,
+                                                       SCORE3_SUBSEQUENCES)]
+        maxent = np.prod(subscores[:5], axis=0) / np.prod(subscores[5:],
+                                                          axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.log2(consensus * maxent)
+        scores[~known] = np.nan
+        return scores
+
+    def score_intervals(self, intervals, genome):
+        """Score the 3' and 5' splice sites of every exon of every event
+
+        Parameters
+        ----------
+        intervals : pandas.DataFrame
+            Table of exon intervals, e.g. the exons of
+            ``SpliceAnnotator.intervals``
+        genome : pyfaidx.Fasta
+            Indexed genome, opened with ``as_raw=True``
+
+        Returns
+        -------
+        scores : pandas.DataFrame
+            A (n_events, n_exons * 2) table of scores, with (feature, site)
+            columns where site is "3ss" (the start of the exon) or "5ss"
+            (the end of the exon). Sites on chromosomes missing from the
+            genome, or running off the end of the chromosome, are NaN
+        """
+        sites3, sites5 = splice_site_windows(intervals, genome)
+        scores = pd.DataFrame({'3ss': self.score3(sites3),
+                               '5ss': self.score5(sites5)},
+                              columns=['3ss', '5ss'])
+        scores.index = pd.MultiIndex.from_arrays(
+            [intervals.event_name.values, intervals.feature.values],
+            names=['event_name', 'feature'])
+        scores = scores.unstack('feature')
+        scores.columns = scores.columns.swaplevel(0, 1)
+        return scores.sort_index(axis=1)
+
+
+def splice_site_windows(intervals, genome, max_gap=1000):
+    """Nucleotide codes of the 3' and 5' splice sites of many exons at once
+
+    Only clusters of nearby windows are read from the genome (see
+    ``rnaseek.bed.read_clusters``), and the windows around all the exon
+    boundaries of a chromosome are gathered with a single fancy index, and
+    reverse complemented for exons on the "-" strand.
+
+    Parameters
+    ----------
+    intervals : pandas.DataFrame
+        Table of exon intervals, in BED coordinates
+    genome : pyfaidx.Fasta
+        Indexed genome, opened with ``as_raw=True``
+    max_gap : int, optional
+        Largest number of bases between windows to read them together
+
+    Returns
+    -------
+    sites3 : numpy.ndarray
+        A (n_exons, 23) matrix of the 20 intronic and 3 exonic bases at the
+        start of each exon
+    sites5 : numpy.ndarray
+        A (n_exons, 9) matrix of the 3 exonic and 6 intronic bases at the end
+        of each exon
+    """
+    n = intervals.shape[0]
+    sites3 = np.repeat(np.uint8(4), n * 23).reshape(n, 23)
+    sites5 = np.repeat(np.uint8(4), n * 9).reshape(n, 9)
+
+    minus = (intervals.strand == '-').values
+    start, stop = intervals.start.values, intervals.stop.values
+    # Leftmost genomic position of each window. On the "-" strand, the 3'
+    # splice site is at the exon's (genomic) stop and the 5' at its start
+    left3 = np.where(minus, stop - SCORE3_EXON, start - SCORE3_INTRON)
+    left5 = np.where(minus, start - SCORE5_INTRON, stop - SCORE5_EXON)
+
+    for chrom, index in intervals.groupby('chrom').indices.items():
+        if chrom not in genome:
+            continue
+        chrom_length = len(genome[chrom])
+        windows = [(sites, left, width, index[(left[index] >= 0) &
+                                              (left[index] + width <=
+                                               chrom_length)])
+                   for sites, left, width in ((sites3, left3, 23),
+                                              (sites5, left5, 9))]
+        lefts = np.concatenate([left[inside]
+                                for _, left, _, inside in windows])
+        rights = np.concatenate([left[inside] + width
+                                 for _, left, width, inside in windows])
+        bases, first, _ = read_clusters(genome[chrom], lefts, rights,
+                                        max_gap)
+        codes = NUCLEOTIDE_CODES[np.frombuffer(bases.encode('ascii'),
+                                               dtype=np.uint8)]
+        for sites, left, width, inside in windows:
+            begin, first = first[:inside.shape[0]], first[inside.shape[0]:]
+            gathered = codes[begin[:, np.newaxis] + np.arange(width)]
+            reverse = minus[inside]
+            gathered[reverse] = np.where(gathered[reverse] < 4,
+                                         3 - gathered[reverse],
+                                         4)[:, ::-1]
+            sites[inside] = gathered
+    return sites3, sites5
@@ -1,4 +1,7 @@
 from collections import defaultdict
+import multiprocessing
+import os
+import subprocess
 import sys
 import warnings
 
@@ -9,8 +12,149 @@ import pybedtools
 from pyfaidx import Fasta
 
 from Bio import SeqIO
+from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
+from .bed import INTERVAL_COLUMNS, intervals_to_bedtool
+from .events import EVENT_IDS_CSV
+
+# Per-splice type schemas of the exons in the (expanded) MISO ID, which pairs
+# of those exons flank an intron, and which exons make up each isoform.
+# Alternative 5' (A5SS) and 3' (A3SS) splice site exons are expanded into one
+# exon per alternative end or start, and retained intron (RI) events get an
+# extra exon spanning both flanking exons and the intron between them.
+SPLICE_TYPE_SCHEMAS = {
+    'SE': {'exons': ('exon1', 'exon2', 'exon3'),
+           'introns': ((0, 1), (1, 2)),
+           'isoforms': ((0, 2), (0, 1, 2))},
+    'MXE': {'exons': ('exon1', 'exon2', 'exon3', 'exon4'),
+            'introns': ((0, 1), (1, 2), (2, 3)),
+            'isoforms': ((0, 2, 3), (0, 1, 3))},
+    'A5SS': {'exons': ('exon1_isoform1', 'exon1_isoform2', 'exon2'),
+             'introns': ((0, 2), (1, 2)),
+             'isoforms': ((0, 2), (1, 2))},
+    'A3SS': {'exons': ('exon1', 'exon2_isoform1', 'exon2_isoform2'),
+             'introns': ((0, 1), (0, 2)),
+             'isoforms': ((0, 1), (0, 2))},
+    'RI': {'exons': ('exon1', 'exon2', 'retained'),
+           'introns': ((0, 1),),
+           'isoforms': ((0, 1), (2,))},
+}
+
+MISO_EXON_REGEX = '^(?P<chrom>[^:]+):(?P<start>[0-9|]+)[:-]' \
+                  '(?P<stop>[0-9|]+):(?P<strand>[+-])$'
+
+
+def splice_type_schema(splice_type):
+    """Get the exon, intron and isoform schema of a splice type
+
+    >>> splice_type_schema('SE')['isoforms']
+    ((0, 2), (0, 1, 2))
+    """
+    try:
+        return SPLICE_TYPE_SCHEMAS[splice_type]
+    except KeyError:
+        raise ValueError('"{}" is not a supported splice type. Use one of: '
+                         '{}'.format(splice_type,
+                                     ', '.join(sorted(SPLICE_TYPE_SCHEMAS))))
+
+
+def intron_names(splice_type):
+    """Names of the introns of a splice type, e.g. ('intron1', 'intron2')"""
+    n_introns = len(splice_type_schema(splice_type)['introns'])
+    return tuple('intron{}'.format(i + 1) for i in range(n_introns))
+
+
+def miso_ids_to_intervals(miso_ids, splice_type):
+    """Convert MISO IDs to a columnar table of exon and intron intervals
+
+    All IDs are parsed at once, and the intervals are in BED coordinates
+    (0-based start, non-inclusive stop) with start < stop on both strands.
+    Exons are named as in the splice type's schema, and introns are named
+    "intron1", "intron2", etc.
+
+    Parameters
+    ----------
+    miso_ids : list-like
+        MISO ID strings, all of the same splice type
+    splice_type : 'SE' | 'MXE' | 'A5SS' | 'A3SS' | 'RI'
+        Type of splicing event
+
+    Returns
+    -------
+    intervals : pandas.DataFrame
+        A (n_events * (n_exons + n_introns), 6) table with the columns
+        "event_name", "feature", "chrom", "start", "stop" and "strand",
+        ordered by feature and then by the order of ``miso_ids``
+
+    Raises
+    ------
+    ValueError
+        If the splice type is unknown, or an ID does not have the number of
+        exons that its splice type requires
+
+    >>> miso_ids_to_intervals(['chr1:906066-906138:+@chr1:906259-906386:+'],
+    ...                       'RI')  # doctest: +SKIP
+                                      event_name          feature chrom   start    stop strand
+    0  chr1:906066-906138:+@chr1:906259-906386:+            exon1  chr1  906065  906138      +
+    1  chr1:906066-906138:+@chr1:906259-906386:+            exon2  chr1  906258  906386      +
+    2  chr1:906066-906138:+@chr1:906259-906386:+         retained  chr1  906065  906386      +
+    3  chr1:906066-906138:+@chr1:906259-906386:+          intron1  chr1  906138  906258      +
+    """
+    schema = splice_type_schema(splice_type)
+    miso_ids = pd.Series(list(miso_ids), dtype=object)
+    if len(miso_ids) == 0:
+        return pd.DataFrame(columns=INTERVAL_COLUMNS)
+
+    miso_exons = miso_ids.str.split('@', expand=True)
+
+    # Parse every MISO exon of every event at once, and expand the
+    # alternative ends or starts (separated by "|") into separate exons
+    exons = []
+    for column in miso_exons:
+        parsed = miso_exons[column].str.extract(MISO_EXON_REGEX, expand=True)
+        if parsed.chrom.isnull().any():
+            bad = miso_ids[parsed.chrom.isnull()].iloc[0]
+            raise ValueError('Could not parse {} MISO ID "{}"'.format(
+                splice_type, bad))
+        starts = parsed.start.str.split('|', expand=True)
+        stops = parsed.stop.str.split('|', expand=True)
+        n_alternatives = max(starts.shape[1], stops.shape[1])
+        for i in range(n_alternatives):
+            start = starts[min(i, starts.shape[1] - 1)].astype(int)
+            stop = stops[min(i, stops.shape[1] - 1)].astype(int)
+            exons.append(pd.DataFrame(
+                {'chrom': parsed.chrom, 'strand': parsed.strand,
+                 'start': np.minimum(start, stop) - 1,
+                 'stop': np.maximum(start, stop)}))
+    if splice_type == 'RI':
+        exons.append(pd.DataFrame(
+            {'chrom': exons[0].chrom, 'strand': exons[0].strand,
+             'start': np.minimum(exons[0].start, exons[1].start),
+             'stop': np.maximum(exons[0].stop, exons[1].stop)}))
+
+    if len(exons) != len(schema['exons']):
+        raise ValueError('{} MISO IDs must have {} exons (including '
+                         'alternative starts and ends), but found {}'.format(
+                             splice_type, len(schema['exons']), len(exons)))
+
+    # Introns are the gaps between pairs of exons, regardless of strand
+    introns = []
+    for i, j in schema['introns']:
+        upstream, downstream = exons[i], exons[j]
+        introns.append(pd.DataFrame(
+            {'chrom': upstream.chrom, 'strand': upstream.strand,
+             'start': np.minimum(upstream.stop, downstream.stop),
+             'stop': np.maximum(upstream.start, downstream.start)}))
+
+    features = list(schema['exons']) + list(intron_names(splice_type))
+    for feature, df in zip(features, exons + introns):
+        df['event_name'] = miso_ids
+        df['feature'] = feature
+    intervals = pd.concat(exons + introns, ignore_index=True)
+    return intervals[INTERVAL_COLUMNS]
+
+
 class SpliceAnnotator(object):
 
     def __init__(self, miso_ids, splice_type, genome, genome_fasta=None):
@@ -22,9 +166,10 @@ class SpliceAnnotator(object):
             List of strings of miso ids, e.g.
             "chr1:100:200:+@chr1:300:400:+@chr1:500:600:" is an example of
             a skipped exon MISO ID, where the middle exon is alternative.
-        splice_type : str
-            The type of splicing event. Currently only 'SE' (skipped exon) and
-             'MXE' (mutually exclusive exon) are supported
+        splice_type : 'SE' | 'MXE' | 'A5SS' | 'A3SS' | 'RI'
+            The type of splicing event: skipped exon, mutually exclusive
+            exon, alternative 5' splice site, alternative 3' splice site or
+            retained intron
         genome : str
             Name of the genome, e.g. "hg19" or "mm10"
         genome_fasta : str
@@ -35,12 +180,13 @@ class SpliceAnnotator(object):
         self.miso_ids = miso_ids
         self.splice_type = splice_type
         self.genome_fasta = genome_fasta
+        self.schema = splice_type_schema(splice_type)
 
         # Only use miso IDs that are in the genome fasta, so the order of the
         # exon_bedtools and exon_fastas are exactly the same.
         if self.genome_fasta is not None:
             fa = Fasta(self.genome_fasta)
-            chromosomes = fa.keys()
+            chromosomes = set(fa.keys())
             n_bad_chrom = sum(1 for x in self.miso_ids
                                             if x.split(':')[0] not in chromosomes)
             sys.stderr.write("Removing {} miso ids whose chromosomes do not match"
@@ -49,34 +195,174 @@ class SpliceAnnotator(object):
             self.miso_ids = [x for x in self.miso_ids
                              if x.split(':')[0] in chromosomes]
 
-        self.n_exons = None
-        if splice_type == 'SE':
-            self.n_exons = 3
-        elif splice_type == 'MXE':
-            self.n_exons = 4
-
-        self.exon_ids = map(self.miso_id_to_exon_ids, self.miso_ids)
-        self.exon_coords = map(lambda x: map(self.miso_exon_to_coords,
-                                             x.split('@')),
-                               self.miso_ids)
+        self.exon_names = self.schema['exons']
+        self.intron_names = intron_names(splice_type)
+        self.n_exons = len(self.exon_names)
+        self.n_introns = len(self.intron_names)
+
+        # Parse all the IDs at once into a table of exon and intron intervals
+        self.intervals = miso_ids_to_intervals(self.miso_ids, splice_type)
+        # With no events (e.g. none on the genome fasta's chromosomes) there
+        # are no groups, so every feature gets the empty table
+        empty = self.intervals.iloc[:0]
+        grouped = dict(list(self.intervals.groupby('feature', sort=False)))
+        grouped = dict((name, grouped.get(name, empty))
+                       for name in list(self.exon_names) +
+                       list(self.intron_names))
+
+        self.exon_ids = self.miso_ids_to_exon_ids(self.miso_ids)
+        self.exon_coords = list(zip(*[
+            list(zip(grouped[exon].chrom, (grouped[exon].start + 1).astype(str),
+                     grouped[exon].stop.astype(str), grouped[exon].strand))
+            for exon in self.exon_names]))
 
         # Make a bedtool for each exon
-        self.exon_bedtools = map(self.coords_to_bedtool,
-                                 zip(*self.exon_coords))
+        self.exon_bedtools = [intervals_to_bedtool(grouped[exon])
+                              for exon in self.exon_names]
         # Make a bedtool for each intron
-        self.intron_bedtools = \
-            map(lambda x: self.coords_to_intron_bedtool(self.exon_coords, x),
-                range(1, self.n_exons))
+        self.intron_bedtools = [intervals_to_bedtool(grouped[intron])
+                                for intron in self.intron_names]
 
         if genome_fasta is not None:
-            self.exon_fastas = map(lambda x: x.sequence(fi=self.genome_fasta,
-                                                        s=True).seqfn,
-                                  self.exon_bedtools)
-            self.intron_fastas = map(lambda x:
-                                     x.sequence(fi=self.genome_fasta,
-                                                s=True).seqfn,
-                                     self.intron_bedtools)
+            self.exon_fastas = [x.sequence(fi=self.genome_fasta, s=True).seqfn
+                                for x in self.exon_bedtools]
+            self.intron_fastas = [x.sequence(fi=self.genome_fasta,
+                                             s=True).seqfn
+                                  for x in self.intron_bedtools]
+
+
+    def splice_site_scores(self, scorer=None):
+        """Maximum entropy scores of the splice sites of every exon
+
+        Parameters
+        ----------
+        scorer : rnaseek.maxentscan.MaxEntScanScorer, optional
+            Scorer with the MaxEntScan model tables already loaded. If not
+            given, the tables are loaded from the default location
+
+        Returns
+        -------
+        scores : pandas.DataFrame
+            A (n_events, n_exons * 2) table of the 3' ("3ss") and 5' ("5ss")
+            splice site scores of each exon, with (feature, site) columns
+
+        Raises
+        ------
+        ValueError
+            If no genome fasta was given
+        """
+        from .maxentscan import MaxEntScanScorer
+
+        if self.genome_fasta is None:
+            raise ValueError('A genome fasta is needed to score splice sites')
+        if scorer is None:
+            scorer = MaxEntScanScorer()
+        exons = self.intervals.loc[self.intervals.feature.isin(
+            self.exon_names)]
+        return scorer.score_intervals(exons, Fasta(self.genome_fasta,
+                                                   as_raw=True))
+
+    def conservation(self, track, flank=100, threshold=1.0):
+        """Conservation of every exon, intron and intronic exon flank
+
+        Parameters
+        ----------
+        track : str
+            Location of a bigWig file or a directory of binary-packed arrays,
+            as in ``rnaseek.conservation.ConservationScorer``
+        flank : int, optional
+            Number of intronic bases upstream and downstream of each exon to
+            also summarize. If 0, flanks aren't summarized
+        threshold : float, optional
+            Bases with a score at least this high are counted as conserved
+
+        Returns
+        -------
+        summaries : pandas.DataFrame
+            A (n_events, n_features * 3) table of the mean, max and fraction
+            of conserved bases, with (feature, statistic) columns
+        """
+        from .conservation import ConservationScorer, exon_flanks
+
+        intervals = self.intervals
+        if flank > 0:
+            exons = intervals.loc[intervals.feature.isin(self.exon_names)]
+            intervals = pd.concat([intervals, exon_flanks(exons, flank)],
+                                  ignore_index=True)
+        scorer = ConservationScorer(track, threshold=threshold)
+        return scorer.score_intervals(intervals)
+
+    def junction_psi(self, junctions, layer='unique_reads', reads_min=10,
+                     ci_max=None, stranded=False):
+        """Estimate PSI of every event in every sample from junction reads
+
+        A fast alternative to running MISO, from the reads on the inclusion
+        and exclusion junctions of each event
+
+        Parameters
+        ----------
+        junctions : rnaseek.matrix.SparseMatrix
+            Junction x sample read counts, e.g. the junctions.npz of
+            combine_star_mapping_stats.py read with
+            ``rnaseek.matrix.SparseMatrix.read``
+        layer : str, optional
+            Which counts to use, "unique_reads" or "multi_reads"
+        reads_min : int, optional
+            Minimum number of reads on the event's junctions for PSI to be
+            estimated
+        ci_max : float, optional
+            If given, the maximum width of the confidence interval of PSI
+        stranded : bool, optional
+            If True, also match junctions on their strand, which ignores the
+            junctions STAR gave no strand
+
+        Returns
+        -------
+        results : dict
+            Mapping of "psi", "ci_low", "ci_high" and "reads" to
+            ((event_name, splice_type), samples) DataFrames, as in
+            ``rnaseek.junctions.junction_psi``
+        """
+        from .junctions import junction_psi
+
+        return junction_psi(self.intervals, self.splice_type, junctions,
+                            layer=layer, reads_min=reads_min, ci_max=ci_max,
+                            stranded=stranded)
+
+    def reading_frames(self, cds, nmd_distance=50, exons=None):
+        """Classify every event as frame-preserving, frame-shifting or
+        NMD-inducing, without translating any transcripts
+
+        Parameters
+        ----------
+        cds : pandas.DataFrame or gffutils.FeatureDB
+            Coding sequences of every transcript, as from
+            ``rnaseek.frames.cds_table_from_gtf``, or a database made by
+            ``rnaseek.create_gffutils_db.create_db`` to read them from. Index
+            the table with ``rnaseek.frames.index_cds`` once to reuse it for
+            several splice types
+        nmd_distance : int, optional
+            Minimum distance of a premature stop codon upstream of the last
+            exon-exon junction to trigger NMD
+        exons : pandas.DataFrame, optional
+            Exons of every transcript, as from
+            ``rnaseek.frames.cds_table_from_gtf(gtf, 'exon')``, to find the
+            last junctions of transcripts whose last exons are UTR. Read from
+            the database if ``cds`` is one
+
+        Returns
+        -------
+        frames : pandas.DataFrame
+            One row per event, as in ``rnaseek.frames.reading_frames``
+        """
+        from .frames import cds_table_from_db, reading_frames
 
+        if not isinstance(cds, pd.DataFrame):
+            if exons is None:
+                exons = cds_table_from_db(cds, 'exon')
+            cds = cds_table_from_db(cds)
+        return reading_frames(self.intervals, self.splice_type, cds,
+                              nmd_distance=nmd_distance, exons=exons)
 
     def miso_exon_to_gencode_exon(self, exon):
         """Convert a single miso exon to one or more gffutils database exon id
@@ -101,7 +387,9 @@ class SpliceAnnotator(object):
         """Convert a MISO-style alternative event ID to a gffutils exon id of
         all exons in all possible transcripts
 
-        Split on the pipe ("|") to account for Alt 5'/3' splice site events
+        Alternative 5'/3' splice site exons (separated by a pipe, "|") are
+        expanded into one exon per alternative, and retained intron events
+        also get the exon spanning the intron, as in ``SPLICE_TYPE_SCHEMAS``
 
         # A skipped exon (SE) ID
         >>> miso_id_to_exon_ids('chr2:9624561:9624679:+@chr2:9627585:9627676:+@chr2:9628276:9628591:+')
@@ -111,15 +399,37 @@ class SpliceAnnotator(object):
         ['exon:chr16:89288500-89288591:+', 'exon:chr16:89289565-89289691:+', 'exon:chr16:89291127-89291210:+', 'exon:chr16:89291963-89292039:+']
         >>> # An Alt 5' splice site (A5SS) ID
         >>> miso_id_to_exon_ids("chr15:42565276:42565087|42565161:-@chr15:42564261:42564321:-")
-        ['exon:chr15:42565276-42565161:-', 'exon:chr15:42564261-42564321:-']
+        ['exon:chr15:42565087-42565276:-', 'exon:chr15:42565161-42565276:-', 'exon:chr15:42564261-42564321:-']
         >>> # An Alt 3' splice site (A3SS) ID
         >>> miso_id_to_exon_ids('chr2:130914824:130914969:-@chr2:130914199|130914248:130914158:-')
-        ['exon:chr2:130914824-130914969:-', 'exon:chr2:130914199-130914158:-']
+        ['exon:chr2:130914824-130914969:-', 'exon:chr2:130914158-130914199:-', 'exon:chr2:130914158-130914248:-']
         >>> # A retained intron (RI) ID
         >>> miso_id_to_exon_ids('chr1:906066-906138:+@chr1:906259-906386:+')
         ['exon:chr1:906066-906138:+', 'exon:chr1:906259-906386:+', 'exon:chr1:906066-906386:+']
         """
-        return map(self.miso_exon_to_gencode_exon, miso_id.split('@'))
+        return self.miso_ids_to_exon_ids([miso_id])[0]
+
+    def miso_ids_to_exon_ids(self, miso_ids):
+        """Convert many MISO IDs of this splice type to gffutils exon ids
+
+        Parameters
+        ----------
+        miso_ids : list-like
+            MISO ID strings of ``self.splice_type``
+
+        Returns
+        -------
+        exon_ids : list
+            One list of gffutils exon ids per MISO ID, ordered as the exons
+            in the splice type's schema
+        """
+        miso_ids = list(miso_ids)
+        intervals = miso_ids_to_intervals(miso_ids, self.splice_type)
+        exons = intervals.loc[intervals.feature.isin(self.schema['exons'])]
+        ids = 'exon:' + exons.chrom + ':' + (exons.start + 1).astype(str) \
+              + '-' + exons.stop.astype(str) + ':' + exons.strand
+        ids = ids.values.reshape(len(self.schema['exons']), len(miso_ids))
+        return [list(x) for x in ids.T]
 
 
     def miso_exon_to_coords(self, exon):
@@ -189,6 +499,9 @@ class SpliceAnnotator(object):
 
             (("chr1", "100", "200", "+"), ("chr1", "300", "400", "+"),
              ("chr1", "500", "600", "+"))
+        intron_number : int
+            1-based number of the intron in the splice type's schema. The
+            flanking exons of each intron are in ``SPLICE_TYPE_SCHEMAS``
 
         Returns
         -------
@@ -203,33 +516,20 @@ class SpliceAnnotator(object):
         ...            ("chr2", "100", "200", "-"))]
         >>> bt = self.coords_to_intron_bedtool(coords, 1)
         >>> print(bt)
-        chr1    200 300 1000    +
-        chr2    400 500 1000    -
+        chr1    200 299 1000    +
+        chr2    400 499 1000    -
         """
+        i, j = self.schema['introns'][intron_number - 1]
         intervals = []
         for miso_id, exons in zip(self.miso_ids, coords):
-            exon1, exon2 = exons[(intron_number - 1):(intron_number + 1)]
-            chrom1, start1, stop1, strand1 = exon1
-            chrom2, start2, stop2, strand2 = exon2
-
-            chrom = chrom1
-            strand = strand1
-            if strand == '+':
-                start = stop1
-                stop = start2
-            elif strand == '-':
-                start = stop2
-                stop = start1
-
-            # Base-0-ify, and stop is non-inclusive in beds
-            start = int(start) - 1
-            stop = int(stop)
+            chrom, start1, stop1, strand = exons[i]
+            chrom, start2, stop2, strand = exons[j]
 
-            if start > stop:
-                start_original = start
-                stop_original = stop
-                start = stop_original
-                stop = start_original
+            # The intron is the gap between the exons on either strand. The
+            # exon stops are already base-0 starts of the intron, and the
+            # exon starts are non-inclusive stops of the intron in beds
+            start = min(int(stop1), int(stop2))
+            stop = max(int(start1), int(start2)) - 1
 
             intervals.append(
                 pybedtools.Interval(chrom, start, stop, strand=strand,
@@ -239,7 +539,7 @@ class SpliceAnnotator(object):
 
     def convert_miso_ids_to_everything(self, miso_ids, db,
                                        event_type,
-                                       out_dir):
+                                       out_dir, event_ids=None):
         """Given a list of miso IDs and a gffutils database, pull out the
         ensembl/gencode/gene name/gene type/transcript names, and write files
         into the out directory. Does not return a value.
@@ -254,6 +554,12 @@ class SpliceAnnotator(object):
             The type of splicing event. This is used for naming only
         out_dir : str
             Where to write the files to.
+        event_ids : rnaseek.events.EventDictionary, optional
+            If given, the files are keyed on the integer "event_id" of each
+            miso id instead of the id itself, and the dictionary (with any
+            new miso ids added) is written to miso_event_ids.csv in the out
+            directory, e.g. to join them to the outputs of CombineMiso with
+            the same dictionary
         """
         out_dir = out_dir.rstrip('/')
         event_type = event_type.lower()
@@ -275,13 +581,16 @@ class SpliceAnnotator(object):
             'into {}.'.format(n_miso_ids, event_type, str(db),
                               out_dir))
 
-        for i, miso_id in enumerate(miso_ids):
+        # Parse the exon ids of all events at once
+        exon_ids = self.miso_ids_to_exon_ids(miso_ids)
+        keys = miso_ids if event_ids is None else event_ids.intern(miso_ids)
+        key_name = 'event_name' if event_ids is None else 'event_id'
+
+        for i, (miso_id, exons) in enumerate(zip(keys, exon_ids)):
             if i % 100 == 0:
                 sys.stdout.write('On {}/{} {} miso ids'.format(i, n_miso_ids,
                                                                event_type))
 
-            exons = self.miso_id_to_exon_ids(miso_id)
-
             gencode = set([])
             ensembl = set([])
             gene_name = set([])
@@ -377,21 +686,26 @@ class SpliceAnnotator(object):
                     'gene_name': gene_name_to_miso,
                     'gencode_gene': gencode_to_miso}
 
-        for name, d in miso_tos.iteritems():
+        for name, d in miso_tos.items():
             df = pd.DataFrame.from_dict(d, orient='index')
-            df.index.name = 'event_name'
+            df.index.name = key_name
             df.columns = [name]
             tsv = '{}/miso_{}_to_{}.tsv'.format(out_dir, event_type, name)
             df.to_csv(tsv, sep='\t')
             sys.stdout.write('Wrote {}\n'.format(tsv))
 
-        for name, d in to_misos.iteritems():
+        for name, d in to_misos.items():
             tsv = '{}/{}_to_miso_{}.tsv'.format(out_dir, name, event_type)
             with open(tsv, 'w') as f:
-                for k, v in d.iteritems():
-                    f.write('{}\t{}\n'.format(k, '\t'.join(v)))
+                for k, v in d.items():
+                    f.write('{}\t{}\n'.format(k, '\t'.join(map(str, v))))
             sys.stdout.write('Wrote {}\n'.format(tsv))
 
+        if event_ids is not None:
+            csv = '{}/{}'.format(out_dir, EVENT_IDS_CSV)
+            event_ids.to_frame().to_csv(csv)
+            sys.stdout.write('Wrote {}\n'.format(csv))
+
 
             # if isoform == 1:
             # return isoform1
@@ -404,7 +718,8 @@ class SpliceAnnotator(object):
 
         Parameters
         ----------
-
+        splice_type : 'SE' | 'MXE' | 'A5SS' | 'A3SS' | 'RI'
+            Name of the type of splicing event
         transcripts : list
             List of gffutils iterators of transcripts, where the position indicates
             the exon for which this transcript corresponds.
@@ -421,18 +736,14 @@ class SpliceAnnotator(object):
 
         Raises
         ------
+        ValueError
+            If the splice type is not supported
         """
-        isoform1s, isoform2s = None, None
-        if splice_type == 'SE':
-            isoform1s = set(transcripts[0]) & set(transcripts[2])
-            isoform2s = set(transcripts[1]) & isoform1s
-        elif splice_type == 'MXE':
-            # Isoform 1 is inclusion of the far, second alternative exon
-            isoform1s = set(transcripts[0]) & set(transcripts[2]) & \
-                        set(transcripts[3])
-            # Isoform 2 is inclusion of the near, first alternative exon
-            isoform2s = set(transcripts[0]) & set(transcripts[1]) & \
-                        set(transcripts[3])
+        # Use sets so gffutils iterators can be intersected more than once
+        transcripts = [set(t) for t in transcripts]
+        isoform1s, isoform2s = (
+            set.intersection(*[transcripts[i] for i in isoform])
+            for isoform in splice_type_schema(splice_type)['isoforms'])
         return isoform1s, isoform2s
 
 
@@ -510,8 +821,8 @@ class SpliceAnnotator(object):
                 # print exon1
                 #         print
 
-            cds_ids = map(lambda x: ':'.join(['CDS', x.split('exon:')[1]]),
-                          exon_ids)
+            cds_ids = [':'.join(['CDS', x.split('exon:')[1]])
+                       for x in exon_ids]
             transcripts = [gffdb.parents(e, featuretype='transcript')
                            for e in exons]
             transcripts_per_isoform = self.splice_type_isoforms(
@@ -541,21 +852,22 @@ class SpliceAnnotator(object):
                     cds = list(gffdb.children(t, featuretype='CDS',
                                               reverse=reverse,
                                               order_by='start'))
-                    cds_in_splice_form = [(i, c) for c in cds if
-                                          sum(map(lambda x: x.startswith(c.id),
-                                                  cds_isoform)) > 0]
+                    # CDS ids also have the frame, e.g. CDS:chr1:100-200:+:0
+                    cds_in_splice_form = [(k, c) for k, c in enumerate(cds)
+                                          if any(c.id.startswith(x + ':')
+                                                 for x in cds_isoform)]
                     correct_number_of_cds = \
                         len(cds_in_splice_form) == len(cds_isoform)
                     cds_in_correct_order = True
-                    for (i, c), (j, d) in zip(cds_in_splice_form,
+                    for (k, c), (l, d) in zip(cds_in_splice_form,
                                               cds_in_splice_form[1:]):
-                        if i + 1 != j:
+                        if k + 1 != l:
                             cds_in_correct_order = False
                     if cds_in_correct_order and correct_number_of_cds:
                         frame = cds[0].frame
                         cds_seqs = [c.sequence(self.genome_fasta,
                                                use_strand=True) for c in cds]
-                        seq = ''.join(s.seq for s in cds_seqs)
+                        seq = Seq(''.join(cds_seqs))
                         seq_translated = seq[int(frame):].translate()
                         if seq_translated in isoform_translations[i]:
                             continue
@@ -573,20 +885,29 @@ class SpliceAnnotator(object):
         """Get exons corresponding to a particular isoform of a splice type
 
         For SE:
-            isoform1: exon1, exon2
+            isoform1: exon1, exon3
             isoform2: exon1, exon2, exon3
         for MXE:
             isoform1: exon1, exon3, exon4
             isoform2: exon1, exon2, exon4
+        for A5SS:
+            isoform1: exon1_isoform1, exon2
+            isoform2: exon1_isoform2, exon2
+        for A3SS:
+            isoform1: exon1, exon2_isoform1
+            isoform2: exon1, exon2_isoform2
+        for RI:
+            isoform1: exon1, exon2
+            isoform2: retained
 
         Parameters
         ----------
-        splice_type : 'SE' | 'MXE'
-            String specifying the splice type. Currently only SE (skipped exon) and
-            MXE (mutually exclusive exon) are supported
+        splice_type : 'SE' | 'MXE' | 'A5SS' | 'A3SS' | 'RI'
+            String specifying the splice type
         exons : list
             List of exons or CDS's (ids, strings, you name it) in the exact order
-            of the splice type, e.g. (exon1_id, exon2_id, exon3_id) for SE
+            of the splice type's schema, e.g. (exon1_id, exon2_id, exon3_id)
+            for SE
 
         Returns
         -------
@@ -595,16 +916,127 @@ class SpliceAnnotator(object):
         isoform2_exons : tuple
             Tuple of exons corresponding to isoform 2
         """
-        isoform1, isoform2 = None, None
-        if splice_type == 'SE':
-            isoform1 = exons[0], exons[2]
-            isoform2 = exons[0], exons[1], exons[2]
-        elif splice_type == 'MXE':
-            isoform1 = exons[0], exons[1], exons[3]
-            isoform2 = exons[0], exons[2], exons[3]
+        isoform1, isoform2 = (
+            tuple(exons[i] for i in isoform)
+            for isoform in splice_type_schema(splice_type)['isoforms'])
         return isoform1, isoform2
 
 
+# Settings file for MISO's sashimi_plot, with one field per setting
+SASHIMI_SETTINGS_TEMPLATE = """
+[data]
+# directory where BAM files are
+bam_prefix = {bam_prefix}
+# directory where MISO output is
+miso_prefix = {miso_prefix}
+
+bam_files = {bam_files}
+miso_files = {miso_files}
+
+[plotting]
+# Dimensions of figure to be plotted (in inches)
+fig_width = {fig_width}
+fig_height = {fig_height}
+# Factor to scale down introns and exons by
+intron_scale = {intron_scale}
+exon_scale = {exon_scale}
+# Whether to use a log scale or not when plotting
+logged = {logged}
+font_size = {font_size}
+
+# Max y-axis
+ymax = {ymax}
+
+# Whether to plot posterior distributions inferred by MISO
+show_posteriors = {show_posteriors}
+
+# Whether to show posterior distributions as bar summaries
+bar_posteriors = {bar_posteriors}
+
+# Whether to plot the number of reads in each junction
+number_junctions = {number_junctions}
+
+resolution = {resolution}
+posterior_bins = {posterior_bins}
+gene_posterior_ratio = {gene_posterior_ratio}
+
+# List of colors for read denisites of each sample
+{colors}
+
+# Number of mapped reads in each sample
+# (Used to normalize the read density for RPKM calculation)
+coverages = {coverages}
+
+# Bar color for Bayes factor distribution
+# plots (--plot-bf-dist)
+# Paint them Seaborn "deep" palette blue
+bar_color = "{bar_color}"
+
+# Bayes factors thresholds to use for --plot-bf-dist
+bf_thresholds = {bf_thresholds}
+
+# Renamed sample ids
+{sample_labels}
+
+# Whether or not to reverse the minus strand events
+reverse_minus = {reverse_minus}
+
+"""
+
+# Mapping stats column with the number of reads in each sample, as in the
+# mapping_stats.csv from combine_star_mapping_stats.py
+MAPPED_READS_COLUMN = 'Uniquely mapped reads number'
+
+# Settings whose defaults are whole numbers, which are written as ints even
+# if they come from a float column of a table of specs (e.g. a column with
+# missing values)
+SASHIMI_INTEGER_SETTINGS = ('fig_width', 'fig_height', 'intron_scale',
+                            'exon_scale', 'font_size', 'ymax',
+                            'posterior_bins', 'gene_posterior_ratio')
+
+
+def _settings_list(items, template='"{0}"'):
+    return '[{0}]'.format(',\n\t'.join(template.format(x) for x in items))
+
+
+def sashimi_plot_settings(bam_prefix, miso_prefix, bam_files, miso_files,
+                          mapped_reads, colors, splice_type='SE',
+                          fig_width=7, fig_height=5, intron_scale=1,
+                          exon_scale=1, logged=False, font_size=6, ymax=150,
+                          show_posteriors=True, bar_posteriors=True,
+                          number_junctions=True, resolution=0.5,
+                          posterior_bins=40, gene_posterior_ratio=5,
+                          bar_color='#4c72b0',
+                          bf_thresholds=(0, 1, 2, 5, 10, 20),
+                          sample_labels=None, reverse_minus=False):
+    """Contents of a Sashimi plot settings file
+
+    Takes the same parameters as ``write_sashimi_plot_settings``, besides
+    the filename, and returns the settings as a string
+    """
+    if colors is not None:
+        colors = 'colors = {0}'.format(_settings_list(colors))
+    else:
+        colors = ''
+    if sample_labels is not None:
+        sample_labels = 'sample_labels = {0}'.format(
+            _settings_list(sample_labels))
+    else:
+        sample_labels = ''
+    miso_files = ['{0}/{1}'.format(x, splice_type) for x in miso_files]
+    return SASHIMI_SETTINGS_TEMPLATE.format(
+        bam_prefix=bam_prefix, miso_prefix=miso_prefix,
+        bam_files=_settings_list(bam_files),
+        miso_files=_settings_list(miso_files),
+        fig_width=fig_width, fig_height=fig_height,
+        intron_scale=intron_scale, exon_scale=exon_scale, logged=logged,
+        font_size=font_size, ymax=ymax, show_posteriors=show_posteriors,
+        bar_posteriors=bar_posteriors, number_junctions=number_junctions,
+        resolution=resolution, posterior_bins=posterior_bins,
+        gene_posterior_ratio=gene_posterior_ratio, colors=colors,
+        coverages=_settings_list((int(x) for x in mapped_reads), '{0}'),
+        bar_color=bar_color, bf_thresholds=bf_thresholds,
+        sample_labels=sample_labels, reverse_minus=reverse_minus)
 
 
 def write_sashimi_plot_settings(filename,  bam_prefix, miso_prefix,
@@ -677,85 +1109,176 @@ def write_sashimi_plot_settings(filename,  bam_prefix, miso_prefix,
     """
     sys.stdout.write('Writing Sashimi plot settings to {0} ...\n'.format(filename))
 
-    if colors is not None:
-        colors_list = '[{0}]'.format(',\n\t'.join(map(lambda x: '"{0}"'.format(x), colors)))
-        colors = 'colors = {0}'.format(colors_list)
-    else:
-        colors = ''
-    if sample_labels is not None:
-        sample_labels_list = '[{0}]'.format(',\n\t'.join(map(lambda x: '"{0}"'.format(x), sample_labels)))
-        sample_labels = 'sample_labels = {0}'.format(sample_labels_list)
-    else:
-        sample_labels = ''
-
     with open(filename, 'w') as f:
-        f.write("""
-[data]
-# directory where BAM files are
-bam_prefix = {0}
-# directory where MISO output is
-miso_prefix = {1}
-
-bam_files = {2}
-miso_files = {3}
-
-[plotting]
-# Dimensions of figure to be plotted (in inches)
-fig_width = {4}
-fig_height = {5}
-# Factor to scale down introns and exons by
-intron_scale = {6}
-exon_scale = {7}
-# Whether to use a log scale or not when plotting
-logged = {8}
-font_size = {9}
-
-# Max y-axis
-ymax = {10}
+        f.write(sashimi_plot_settings(
+            bam_prefix, miso_prefix, bam_files, miso_files, mapped_reads,
+            colors, splice_type=splice_type, fig_width=fig_width,
+            fig_height=fig_height, intron_scale=intron_scale,
+            exon_scale=exon_scale, logged=logged, font_size=font_size,
+            ymax=ymax, show_posteriors=show_posteriors,
+            bar_posteriors=bar_posteriors, number_junctions=number_junctions,
+            resolution=resolution, posterior_bins=posterior_bins,
+            gene_posterior_ratio=gene_posterior_ratio, bar_color=bar_color,
+            bf_thresholds=bf_thresholds, sample_labels=sample_labels,
+            reverse_minus=reverse_minus))
+    sys.stdout.write('\tDone.')
+
+
+def _as_list(x, sep=','):
+    """Lists in a table of plot specs may also be delimited strings"""
+    if isinstance(x, str):
+        return [y.strip() for y in x.split(sep) if y.strip()]
+    return list(x)
+
+
+def write_sashimi_plot_settings_batch(specs, mapping_stats, out_dir,
+                                      bam_prefix, miso_prefix, index_dir,
+                                      bam_template='{sample}.bam',
+                                      miso_template='{sample}',
+                                      mapped_reads_column=MAPPED_READS_COLUMN,
+                                      **kwargs):
+    """Write the settings files of many Sashimi plots, and a manifest of them
+
+    Specs which end up with identical settings (e.g. the same samples and
+    colors for different event groups) share a single settings file, so
+    each unique settings file is only written once.
 
-# Whether to plot posterior distributions inferred by MISO
-show_posteriors = {11}
-
-# Whether to show posterior distributions as bar summaries
-bar_posteriors = {12}
-
-# Whether to plot the number of reads in each junction
-number_junctions = {13}
-
-resolution = {14}
-posterior_bins = {15}
-gene_posterior_ratio = {16}
-
-# List of colors for read denisites of each sample
-{17}
-
-# Number of mapped reads in each sample
-# (Used to normalize the read density for RPKM calculation)
-coverages = {18}
-
-# Bar color for Bayes factor distribution
-# plots (--plot-bf-dist)
-# Paint them Seaborn "deep" palette blue
-bar_color = "{19}"
-
-# Bayes factors thresholds to use for --plot-bf-dist
-bf_thresholds = {20}
-
-# Renamed sample ids
-{21}
+    Parameters
+    ----------
+    specs : pandas.DataFrame
+        One row per plot spec, with the columns "name", "events" (event
+        names, as a list or comma-separated string) and "samples" (sample
+        ids, likewise). Optional columns "colors", "sample_labels" and
+        "splice_type" and any other keyword argument of
+        ``write_sashimi_plot_settings`` override the defaults for that spec
+    mapping_stats : pandas.DataFrame or str
+        Table of mapping stats indexed by sample id, or the location of the
+        mapping_stats.csv from combine_star_mapping_stats.py. The mapped
+        reads of each sample are taken from it
+    out_dir : str
+        Directory to write the settings files and manifest to. Will be
+        created if it doesn't exist. The plots of each spec are written to
+        a subdirectory named after it
+    bam_prefix : str
+        Directory where BAM files are
+    miso_prefix : str
+        Directory where MISO output is
+    index_dir : str
+        Directory of the MISO index of the events. "{splice_type}" is
+        replaced by the splice type of each spec
+    bam_template, miso_template : str, optional
+        Names of the BAM file and MISO output of each sample, relative to
+        ``bam_prefix`` and ``miso_prefix``. "{sample}" is replaced by the
+        sample id
+    mapped_reads_column : str, optional
+        Column of ``mapping_stats`` with the number of mapped reads
+    kwargs
+        Defaults for all specs of the keyword arguments of
+        ``write_sashimi_plot_settings``
+
+    Returns
+    -------
+    manifest : pandas.DataFrame
+        One row per plot with the columns "name", "event_name",
+        "splice_type", "index_dir", "settings" and "output_dir", also
+        written to "manifest.csv" in ``out_dir``, for ``sashimi_plots``
+    """
+    out_dir = os.path.abspath(os.path.expanduser(out_dir))
+    try:
+        os.makedirs(out_dir)
+    except OSError:
+        pass
+    if not isinstance(mapping_stats, pd.DataFrame):
+        mapping_stats = pd.read_csv(mapping_stats, index_col=0)
+    mapped_reads = mapping_stats[mapped_reads_column]
+
+    settings_columns = set(specs.columns) - set(['name', 'events', 'samples'])
+    written = {}
+    manifest = []
+    for spec in specs.to_dict('records'):
+        samples = _as_list(spec['samples'])
+        missing = [x for x in samples if x not in mapped_reads.index]
+        if len(missing) > 0:
+            raise ValueError('No mapped reads in the mapping stats for the '
+                             'samples {} of "{}"'.format(missing,
+                                                         spec['name']))
+        options = dict(kwargs)
+        options.update((key, spec[key]) for key in settings_columns
+                       if np.all(pd.notnull(spec[key])))
+        for key in ('colors', 'sample_labels'):
+            if options.get(key) is not None:
+                options[key] = _as_list(options[key])
+        for key in SASHIMI_INTEGER_SETTINGS:
+            if isinstance(options.get(key), (float, np.floating)) and \
+                    float(options[key]).is_integer():
+                options[key] = int(options[key])
+        options.setdefault('colors', None)
+        settings = sashimi_plot_settings(
+            bam_prefix, miso_prefix,
+            [bam_template.format(sample=x) for x in samples],
+            [miso_template.format(sample=x) for x in samples],
+            mapped_reads[samples].values, **options)
+
+        if settings not in written:
+            filename = os.path.join(out_dir, 'sashimi_plot_settings_{}.txt'
+                                    .format(len(written) + 1))
+            with open(filename, 'w') as f:
+                f.write(settings)
+            written[settings] = filename
+
+        splice_type = options.get('splice_type', 'SE')
+        for event_name in _as_list(spec['events']):
+            manifest.append(
+                {'name': spec['name'], 'event_name': event_name,
+                 'splice_type': splice_type,
+                 'index_dir': index_dir.format(splice_type=splice_type),
+                 'settings': written[settings],
+                 'output_dir': os.path.join(out_dir, str(spec['name']))})
+
+    manifest = pd.DataFrame(manifest, columns=[
+        'name', 'event_name', 'splice_type', 'index_dir', 'settings',
+        'output_dir'])
+    manifest.to_csv(os.path.join(out_dir, 'manifest.csv'), index=False)
+    sys.stdout.write('Wrote {} Sashimi plot settings files for {} plots to '
+                     '{}\n'.format(len(written), manifest.shape[0], out_dir))
+    return manifest
+
+
+def _sashimi_plot(args):
+    event_name, index_dir, settings, output_dir, sashimi_plot = args
+    return subprocess.call([sashimi_plot, '--plot-event', event_name,
+                            index_dir, settings, '--output-dir', output_dir])
+
+
+def sashimi_plots(manifest, n_jobs=1, sashimi_plot='sashimi_plot'):
+    """Make every Sashimi plot of a manifest with a pool of processes
 
-# Whether or not to reverse the minus strand events
-reverse_minus = {22}
-
-""".format(
-                bam_prefix, miso_prefix,
-        '[{0}]'.format(',\n\t'.join(map(lambda x: '"{0}"'.format(x), bam_files))),
-        '[{0}]'.format(',\n\t'.join(map(lambda x: '"{0}/{1}"'.format(x, splice_type), miso_files))),
-                fig_width, fig_height, intron_scale, exon_scale, logged, font_size, ymax, show_posteriors,
-                bar_posteriors, number_junctions, resolution, posterior_bins, gene_posterior_ratio,
-                colors,
-                '[{0}]'.format(',\n\t'.join(map(lambda x: '{0}'.format(int(x)), mapped_reads))),
-                bar_color, bf_thresholds,
-                sample_labels, reverse_minus
-        ))
-    sys.stdout.write('\tDone.')
\ No newline at end of file
+    Parameters
+    ----------
+    manifest : pandas.DataFrame or str
+        Manifest from ``write_sashimi_plot_settings_batch``, or the location
+        of its "manifest.csv"
+    n_jobs : int, optional
+        Number of plots to make at once
+    sashimi_plot : str, optional
+        Location of MISO's sashimi_plot executable
+
+    Returns
+    -------
+    returncodes : pandas.Series
+        Exit status of sashimi_plot for each plot of the manifest
+    """
+    if not isinstance(manifest, pd.DataFrame):
+        manifest = pd.read_csv(manifest)
+    args = [(row.event_name, row.index_dir, row.settings, row.output_dir,
+             sashimi_plot) for row in manifest.itertuples()]
+    if n_jobs == 1:
+        returncodes = [_sashimi_plot(x) for x in args]
+    else:
+        pool = multiprocessing.Pool(n_jobs)
+        try:
+            returncodes = pool.map(_sashimi_plot, args)
+        finally:
+            pool.close()
+            pool.join()
+    return pd.Series(returncodes, index=manifest.index, name='returncode')
@@ -0,0 +1,250 @@
+import numpy as np
+import pandas as pd
+
+from .bed import interval_sequences
+from .fasta import (NUCLEOTIDE_CODES, concatenate, kmer_hashes,
+                    sequence_index, valid_windows)
+
+# Longest k-mer motif, as k-mers are hashed into 64-bit integers by
+# ``rnaseek.fasta.kmer_hashes``
+MAX_KMER_LENGTH = 31
+
+# Bases matched by each IUPAC nucleotide code, so degenerate motifs like
+# "YGCY" can be given as k-mers
+IUPAC = {'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+         'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+         'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT'}
+
+
+def expand_iupac(motif):
+    """All the k-mers matched by a motif with IUPAC nucleotide codes
+
+    >>> expand_iupac('UGCAY')
+    ['TGCAC', 'TGCAT']
+    """
+    kmers = ['']
+    for code in motif.upper():
+        try:
+            bases = IUPAC[code]
+        except KeyError:
+            raise ValueError('"{}" in motif "{}" is not an IUPAC nucleotide '
+                             'code'.format(code, motif))
+        kmers = [kmer + base for kmer in kmers for base in bases]
+    return kmers
+
+
+def kmer_hash(kmer):
+    """Base-4 hash of a k-mer, as in ``rnaseek.fasta.kmer_hashes``
+
+    >>> kmer_hash('CA')
+    4
+    """
+    codes = NUCLEOTIDE_CODES[np.frombuffer(kmer.encode('ascii'),
+                                           dtype=np.uint8)]
+    return int(np.sum(codes.astype(np.int64) *
+                      4 ** np.arange(len(kmer) - 1, -1, -1)))
+
+
+def pwm_to_log_odds(pwm, background=0.25, pseudocount=0.01):
+    """Convert a position weight matrix to log2 odds scores
+
+    Parameters
+    ----------
+    pwm : array-like
+        A (motif_length, 4) matrix for the bases A, C, G and T/U. If every
+        row is a probability distribution (non-negative and summing to 1),
+        it's converted to log2 odds against the background, otherwise it's
+        assumed to already be scores
+    background : float, optional
+        Background probability of each base
+    pseudocount : float, optional
+        Added to the probabilities so that absent bases have finite scores
+
+    Returns
+    -------
+    log_odds : numpy.ndarray
+        A (motif_length, 4) matrix of scores
+    """
+    pwm = np.asarray(pwm, dtype=float)
+    if pwm.ndim != 2 or pwm.shape[1] != 4:
+        raise ValueError('Position weight matrices must have 4 columns, for '
+                         'A, C, G and T/U')
+    if (pwm >= 0).all() and np.allclose(pwm.sum(axis=1), 1):
+        pwm = (pwm + pseudocount) / (1 + 4 * pseudocount)
+        return np.log2(pwm / background)
+    return pwm
+
+
+class MotifScanner(object):
+
+    def __init__(self, kmers=None, pwms=None, pwm_threshold=0.8,
+                 chunksize=10000):
+        """Count occurrences of many motifs in many sequences at once
+
+        Sequences are encoded as uint8 arrays and concatenated, every k-mer
+        motif of the same length is found with a single sliding window hash
+        over all the sequences, looked up in the sorted hashes of the
+        motifs, and position weight matrices are scored on every window with
+        one vectorized pass per motif position.
+
+        A k-mer motif matches at every position where any of its k-mers
+        starts, so overlapping matches are all counted, but a position is
+        only counted once per motif even if k-mers of different lengths
+        start there, e.g. "AC" and "ACA" in "ACA".
+
+        Parameters
+        ----------
+        kmers : dict, optional
+            Mapping of motif names to a k-mer or list of k-mers of up to
+            MAX_KMER_LENGTH bases, which may use IUPAC nucleotide codes, e.g.
+            {'FOX': 'UGCAUG'}
+        pwms : dict, optional
+            Mapping of motif names to (motif_length, 4) position weight
+            matrices of probabilities or log odds scores for A, C, G, T/U
+        pwm_threshold : float, optional
+            A window matches a position weight matrix when its score is at
+            least this fraction of the way from the minimum to the maximum
+            possible score
+        chunksize : int, optional
+            Number of sequences to scan at once
+        """
+        kmers = {} if kmers is None else kmers
+        pwms = {} if pwms is None else pwms
+        if len(kmers) + len(pwms) == 0:
+            raise ValueError('At least one k-mer or position weight matrix '
+                             'is needed')
+        if chunksize < 1:
+            raise ValueError('"chunksize" must be 1 or greater')
+        self.chunksize = chunksize
+        self.motifs = list(sorted(kmers)) + list(sorted(pwms))
+
+        # For each length of k-mer, the sorted hashes used by any motif, and
+        # the motif columns of each of those hashes, in compressed sparse row
+        # format
+        by_length = {}
+        for column, name in enumerate(sorted(kmers)):
+            motif = kmers[name]
+            motif = [motif] if isinstance(motif, str) else motif
+            for kmer in motif:
+                if not 0 < len(kmer) <= MAX_KMER_LENGTH:
+                    raise ValueError('The k-mer "{}" of motif "{}" must be '
+                                     '1 to {} bases long'.format(
+                                         kmer, name, MAX_KMER_LENGTH))
+                for expanded in expand_iupac(kmer):
+                    by_length.setdefault(len(expanded), []).append(
+                        (kmer_hash(expanded), column))
+        self.kmer_tables = {}
+        for k, pairs in by_length.items():
+            hashes, columns = (np.array(x) for x in zip(*sorted(set(pairs))))
+            unique, n_columns = np.unique(hashes, return_counts=True)
+            indptr = np.concatenate([[0], np.cumsum(n_columns)])
+            self.kmer_tables[k] = unique.astype(np.int64), indptr, columns
+
+        # Position weight matrices have a 5th column of "other" bases, which
+        # are never counted because those windows are invalid
+        self.pwms = []
+        for column, name in enumerate(sorted(pwms), start=len(kmers)):
+            log_odds = pwm_to_log_odds(pwms[name])
+            low, high = log_odds.min(axis=1).sum(), log_odds.max(axis=1).sum()
+            threshold = low + pwm_threshold * (high - low)
+            log_odds = np.hstack([log_odds, np.zeros((log_odds.shape[0], 1))])
+            self.pwms.append((column, log_odds, threshold))
+
+    def _scan(self, sequences):
+        buffer, lengths = concatenate(sequences)
+        codes = NUCLEOTIDE_CODES[buffer]
+        index = sequence_index(lengths)
+        n_sequences = lengths.shape[0]
+        counts = np.zeros((n_sequences, len(self.motifs)), dtype=np.int64)
+
+        n_motifs = len(self.motifs)
+        matches = []
+        for k, (unique, indptr, columns) in self.kmer_tables.items():
+            hashes = kmer_hashes(codes, lengths, k)
+            position = np.nonzero(hashes >= 0)[0]
+            hashes = hashes[position]
+            compact = np.minimum(np.searchsorted(unique, hashes),
+                                 unique.shape[0] - 1)
+            hit = unique[compact] == hashes
+            position, compact = position[hit], compact[hit]
+
+            # Each hit matches every motif that includes its k-mer
+            n_columns = (indptr[1:] - indptr[:-1])[compact]
+            first = np.repeat(indptr[compact], n_columns)
+            offset = np.arange(first.shape[0]) - \
+                np.repeat(np.cumsum(n_columns) - n_columns, n_columns)
+            matches.append(np.repeat(position, n_columns) * n_motifs +
+                           columns[first + offset])
+        if len(matches) > 0:
+            # Positions matched by k-mers of several lengths of a motif are
+            # only counted once
+            matches = np.unique(np.concatenate(matches)) if \
+                len(matches) > 1 else matches[0]
+            flat = index[matches // n_motifs] * n_motifs + matches % n_motifs
+            counts += np.bincount(flat, minlength=n_sequences * n_motifs
+                                  ).reshape(n_sequences, n_motifs)
+
+        n = codes.shape[0]
+        for column, log_odds, threshold in self.pwms:
+            scores = np.zeros(n)
+            for j in range(log_odds.shape[0]):
+                shifted = np.repeat(np.uint8(4), n)
+                shifted[:max(n - j, 0)] = codes[j:]
+                scores += log_odds[j][shifted]
+            hit = valid_windows(codes, lengths, log_odds.shape[0]) & \
+                (scores >= threshold)
+            counts[:, column] = np.bincount(index[hit],
+                                            minlength=n_sequences)
+        return counts
+
+    def scan(self, sequences, names=None):
+        """Count the occurrences of every motif in every sequence
+
+        Parameters
+        ----------
+        sequences : list-like of str or bytes
+            Nucleotide sequences, already on the strand of interest
+        names : list-like, optional
+            Names of the sequences, to use as the index
+
+        Returns
+        -------
+        counts : pandas.DataFrame
+            A (n_sequences, n_motifs) table of the number of (possibly
+            overlapping) matches of each motif in each sequence
+        """
+        sequences = list(sequences)
+        counts = [self._scan(sequences[i:i + self.chunksize])
+                  for i in range(0, len(sequences), self.chunksize)]
+        counts = np.vstack(counts) if len(counts) > 0 else \
+            np.zeros((0, len(self.motifs)), dtype=np.int64)
+        return pd.DataFrame(counts, index=names, columns=self.motifs)
+
+    def scan_intervals(self, intervals, genome):
+        """Count motifs in the sequences of every feature of every event
+
+        Parameters
+        ----------
+        intervals : pandas.DataFrame
+            Table of intervals, e.g. ``SpliceAnnotator.intervals`` or a chunk
+            of ``BedAnnotator.intervals()``
+        genome : pyfaidx.Fasta
+            Indexed genome, opened with ``as_raw=True``
+
+        Returns
+        -------
+        counts : pandas.DataFrame
+            A (n_events, n_features * n_motifs) table of motif counts, with
+            (feature, motif) columns. Features on chromosomes missing from
+            the genome are NaN
+        """
+        sequences = interval_sequences(intervals, genome).sequence
+        found = sequences.notnull().values
+        counts = self.scan(sequences[found].values)
+        counts.index = pd.MultiIndex.from_arrays(
+            [intervals.event_name.values[found],
+             intervals.feature.values[found]],
+            names=['event_name', 'feature'])
+        counts = counts.unstack('feature')
+        counts.columns = counts.columns.swaplevel(0, 1)
+        return counts.sort_index(axis=1)
@@ -0,0 +1,250 @@
+"""Partial results of combine jobs, to run them as map/reduce cluster tasks
+
+Each "map" task combines a batch of the samples into a partial result: a
+folder of csv tables and a partial.json manifest of what made it (the kind
+of job, its options, every input file) and how to read and merge each table.
+A "reduce" task merges any number of partials, in any order and any
+grouping, and finishes the job as if one process had read every file. The
+merge of partials is itself a partial, so reductions can be tree-structured.
+Partials keep the number of rows each map task added to their stacked
+tables, so however they're grouped, those rows end up in the order of the
+map tasks' input files.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .accumulators import EventStatistics
+
+PARTIAL_JSON = 'partial.json'
+PARTIAL_VERSION = 1
+
+# How the tables of partials are merged: by stacking their rows, by
+# stacking their rows and keeping the first of any duplicated index, or by
+# merging the accumulators of EventStatistics tables
+MERGE_RULES = ('rows', 'unique_rows', 'event_statistics')
+
+
+def select_batch(files, batch, n_batches):
+    """Files of one batch of samples
+
+    The samples are split into ``n_batches`` contiguous batches of about the
+    same number of samples, so every file of a sample is in the same batch
+
+    Parameters
+    ----------
+    files : pandas.DataFrame
+        Table of files with a "sample_id" column, as from
+        ``rnaseek.discovery.discover_files``
+    batch : int
+        0-based number of the batch, e.g. the task id of an array job
+    n_batches : int
+        Total number of batches
+
+    Returns
+    -------
+    files : pandas.DataFrame
+        The rows of ``files`` of the samples in the batch
+    """
+    if not 0 <= batch < n_batches:
+        raise ValueError('"batch" must be between 0 and {}, not {}'.format(
+            n_batches - 1, batch))
+    sample_ids = np.array(sorted(files.sample_id.unique()), dtype=object)
+    batch_ids = np.array_split(sample_ids, n_batches)[batch]
+    return files.loc[files.sample_id.isin(batch_ids)].reset_index(drop=True)
+
+
+def _write_table(df, filename):
+    """Write a table as csv, and describe how to read it back"""
+    names = ['__index_{}'.format(i) if x is None else x
+             for i, x in enumerate(df.index.names)]
+    flat = df.copy()
+    flat.index = flat.index.set_names(names)
+    flat = flat.reset_index()
+    strings = [str(x) for x, dtype in flat.dtypes.items()
+               if dtype.kind not in 'biufc']
+    flat.to_csv(filename, index=False)
+    return {'filename': os.path.basename(filename), 'index': names,
+            'index_names': list(df.index.names),
+            'columns_name': df.columns.name, 'strings': strings}
+
+
+def _read_table(directory, description):
+    df = pd.read_csv(os.path.join(directory, description['filename']),
+                     dtype=dict((x, str) for x in description['strings']),
+                     keep_default_na=False, na_values=[''])
+    df = df.set_index(description['index'])
+    df.index = df.index.set_names(description['index_names'])
+    df.columns.name = description['columns_name']
+    return df
+
+
+def _segment_key(files):
+    return files[0] if len(files) > 0 else ''
+
+
+class Partial(object):
+
+    def __init__(self, kind, options, files, tables, merge=None,
+                 segments=None):
+        """Partial result of a combine job over some of the input files
+
+        Parameters
+        ----------
+        kind : str
+            Name of the job, e.g. "combine_miso". Only partials of the same
+            kind and options can be merged
+        options : dict
+            Options of the job that change its results, e.g. thresholds
+        files : list of str
+            Every input file that went into the partial
+        tables : dict
+            Mapping of names to pandas DataFrames
+        merge : dict, optional
+            Mapping of table names to how they are merged, one of
+            MERGE_RULES. Defaults to "rows"
+        segments : list, optional
+            The [key, {table: n_rows}] of each map task merged into the
+            partial, in order, where the key is the task's first input file
+            and the rows are of the tables merged by "rows". Defaults to the
+            partial being one map task
+        """
+        self.kind = kind
+        self.options = options
+        self.files = sorted(files)
+        self.tables = tables
+        self.merge = dict((name, 'rows') for name in tables)
+        self.merge.update(merge or {})
+        for name, rule in self.merge.items():
+            if rule not in MERGE_RULES:
+                raise ValueError('"{}" is not a merge rule. Use one of: '
+                                 '{}'.format(rule, ', '.join(MERGE_RULES)))
+        if segments is None:
+            segments = [[_segment_key(self.files),
+                         dict((name, int(self.tables[name].shape[0]))
+                              for name in self.stacked)]]
+        self.segments = [[key, dict(n_rows)] for key, n_rows in segments]
+        for name in self.stacked:
+            n_rows = sum(x[name] for _, x in self.segments)
+            if n_rows != self.tables[name].shape[0]:
+                raise ValueError('The segments of table "{}" have {} rows, '
+                                 'but it has {}'.format(
+                                     name, n_rows,
+                                     self.tables[name].shape[0]))
+
+    @property
+    def stacked(self):
+        """Names of the tables merged by stacking their rows"""
+        return sorted(name for name, rule in self.merge.items()
+                      if rule == 'rows')
+
+    def split(self, name):
+        """Rows of a stacked table from each segment, in order"""
+        df = self.tables[name]
+        stops = np.cumsum([n_rows[name] for _, n_rows in self.segments])
+        return [df.iloc[stop - n_rows[name]:stop]
+                for stop, (_, n_rows) in zip(stops, self.segments)]
+
+    def write(self, directory):
+        """Write the tables and the partial.json manifest to a folder"""
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+        manifest = {'kind': self.kind, 'version': PARTIAL_VERSION,
+                    'options': self.options, 'files': self.files,
+                    'segments': self.segments, 'tables': {}}
+        for name, df in self.tables.items():
+            description = _write_table(
+                df, os.path.join(directory, '{}.csv'.format(name)))
+            description['merge'] = self.merge[name]
+            manifest['tables'][name] = description
+        with open(os.path.join(directory, PARTIAL_JSON), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        return directory
+
+    @classmethod
+    def read(cls, directory):
+        """Read a partial written by ``write``"""
+        with open(os.path.join(directory, PARTIAL_JSON)) as f:
+            manifest = json.load(f)
+        if manifest['version'] > PARTIAL_VERSION:
+            raise ValueError('{} is a newer version ({}) of partial result '
+                             'than can be read'.format(directory,
+                                                       manifest['version']))
+        tables = dict((name, _read_table(directory, description))
+                      for name, description in manifest['tables'].items())
+        merge = dict((name, description['merge'])
+                     for name, description in manifest['tables'].items())
+        return cls(manifest['kind'], manifest['options'], manifest['files'],
+                   tables, merge, manifest.get('segments'))
+
+
+def merge_partials(partials):
+    """Merge partial results into one
+
+    The merge is associative and doesn't depend on the order of the
+    partials: stacked tables are split back into the rows of each map task,
+    which are put in the order of the tasks' first input files, as the input
+    files of partials are disjoint
+
+    Parameters
+    ----------
+    partials : list of Partial or str
+        Partials, or the folders they were written to
+
+    Returns
+    -------
+    partial : Partial
+        A partial of all the input files
+
+    Raises
+    ------
+    ValueError
+        If the partials are of different kinds of jobs or options, or share
+        input files
+    """
+    partials = [Partial.read(x) if isinstance(x, str) else x
+                for x in partials]
+    if len(partials) == 0:
+        raise ValueError('There are no partial results to merge')
+    first = partials[0]
+    for partial in partials[1:]:
+        if (partial.kind, partial.options) != (first.kind, first.options):
+            raise ValueError('Cannot merge partial results of {} {} and '
+                             '{} {}'.format(first.kind, first.options,
+                                            partial.kind, partial.options))
+        if set(partial.tables) != set(first.tables):
+            raise ValueError('Cannot merge partial results with tables {} '
+                             'and {}'.format(sorted(first.tables),
+                                             sorted(partial.tables)))
+    files = [x for partial in partials for x in partial.files]
+    if len(set(files)) < len(files):
+        raise ValueError('Partial results share input files, so merging '
+                         'them would count those files twice')
+    partials = sorted(partials, key=lambda x: _segment_key(x.files))
+    segments = sorted(
+        ((key, i, j) for i, partial in enumerate(partials)
+         for j, (key, _) in enumerate(partial.segments)),
+        key=lambda x: x[:2])
+
+    tables = {}
+    for name, rule in first.merge.items():
+        if rule == 'event_statistics':
+            statistics = EventStatistics.from_frame(partials[0].tables[name])
+            for partial in partials[1:]:
+                statistics.merge(EventStatistics.from_frame(
+                    partial.tables[name]))
+            tables[name] = statistics.to_frame()
+            continue
+        if rule == 'rows':
+            pieces = [x.split(name) for x in partials]
+            df = pd.concat([pieces[i][j] for _, i, j in segments])
+        else:
+            df = pd.concat([x.tables[name] for x in partials])
+            df = df.loc[~df.index.duplicated()].sort_index()
+        tables[name] = df
+    return Partial(first.kind, first.options, files, tables, first.merge,
+                   [partials[i].segments[j] for _, i, j in segments])
@@ -0,0 +1,298 @@
+"""Read MISO's posterior samples of PSI (.miso files) into one array store
+
+MISO writes one ".miso" file per event per sample, e.g.
+"miso/<sample_id>/SE/chr1/<event_name>.miso", with a header line of the
+event's isoforms and sampler settings, and then one line per draw from the
+posterior of PSI. These are read in parallel into a single float32
+(events, samples, draws) NumPy array on disk, which can be memory-mapped to
+read just the events or samples needed, with the header metadata stored once
+per event. Which events were quantified in which samples is stored as a
+separate (events, samples) mask, so the cells of the array that no file fills
+are never written.
+"""
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .discovery import discover_files, file_table
+
+# Template of the sample id, splice type and event name in the paths of
+# .miso files, as <sample_id>/<splice_type>/<chrom>/<event_name>.miso
+MISO_POSTERIOR_TEMPLATE = r'(?P<sample_id>[^/]+)/(?P<splice_type>[^/]+)/' \
+                          r'[^/]+/(?P<event_name>[^/]+)\.miso$'
+
+# Header fields that are the same for an event in every sample
+EVENT_HEADER_FIELDS = ['isoforms', 'exon_lens', 'iters', 'burn_in', 'lag',
+                       'proposal_type']
+
+PSI_NPY = 'psi.npy'
+OBSERVED_NPY = 'observed.npy'
+EVENTS_CSV = 'events.csv'
+SAMPLES_CSV = 'samples.csv'
+
+
+def parse_miso_header(line):
+    """Parse the header line of a .miso file into a dict of strings
+
+    >>> header = parse_miso_header("#isoforms=['A','B']\\titers=5000\\n")
+    >>> header['isoforms'], header['iters']
+    ("['A','B']", '5000')
+    """
+    header = {}
+    for field in line.lstrip('#').rstrip('\n').split('\t'):
+        key, _, value = field.partition('=')
+        header[key] = value
+    return header
+
+
+def read_miso_posterior(filename):
+    """Read the header and posterior samples of PSI of a .miso file
+
+    Parameters
+    ----------
+    filename : str
+        Location of the .miso file
+
+    Returns
+    -------
+    header : dict
+        The fields of the header line, as strings
+    psi : numpy.ndarray
+        float32 draws of the PSI of the first isoform, which for two-isoform
+        events is the same PSI as "miso_posterior_mean" in the summaries
+    """
+    with open(filename) as f:
+        header = parse_miso_header(f.readline())
+        # Skip the "sampled_psi\tlog_score" column names
+        f.readline()
+        psi = np.array([line.split('\t', 1)[0].split(',', 1)[0]
+                        for line in f if line.strip()], dtype=np.float32)
+    return header, psi
+
+
+def _count_draws(filename):
+    """Number of posterior samples in a .miso file"""
+    with open(filename) as f:
+        return sum(1 for line in f if line.strip()) - 2
+
+
+def _read_chunk(args):
+    """Read a chunk of .miso files into a (n_files, n_draws) array, padded
+    with NaN, and their headers"""
+    filenames, n_draws = args
+    psi = np.full((len(filenames), n_draws), np.nan, dtype=np.float32)
+    headers = []
+    n_truncated = 0
+    for i, filename in enumerate(filenames):
+        header, draws = read_miso_posterior(filename)
+        n_truncated += draws.shape[0] > n_draws
+        draws = draws[:n_draws]
+        psi[i, :draws.shape[0]] = draws
+        headers.append(dict((key, header.get(key))
+                            for key in EVENT_HEADER_FIELDS))
+    return psi, headers, n_truncated
+
+
+class PosteriorStore(object):
+
+    def __init__(self, directory):
+        """Posterior samples of PSI written by ``read_miso_posteriors``
+
+        The (events, samples, draws) array is memory-mapped, so only the
+        parts that are indexed are read from disk.
+
+        Parameters
+        ----------
+        directory : str
+            Folder with the psi.npy, observed.npy, events.csv and samples.csv
+            files
+
+        Attributes
+        ----------
+        psi : numpy.memmap
+            float32 (events, samples, draws) posterior samples, which are
+            NaN where an event had fewer draws than others. Cells of events
+            that weren't quantified in a sample are left unwritten (zero), so
+            read it with ``take`` or ``posterior``, which make them NaN
+        observed : numpy.ndarray
+            Boolean (events, samples) mask of the events quantified in each
+            sample
+        events : pandas.DataFrame
+            Header metadata of each event, indexed by (event_name,
+            splice_type) in the order of the first axis of ``psi``
+        samples : pandas.Index
+            Sample ids in the order of the second axis of ``psi``
+        """
+        self.directory = directory
+        self.psi = np.load(os.path.join(directory, PSI_NPY), mmap_mode='r')
+        self.observed = np.load(os.path.join(directory, OBSERVED_NPY))
+        self.events = pd.read_csv(os.path.join(directory, EVENTS_CSV),
+                                  index_col=[0, 1], keep_default_na=False)
+        self.samples = pd.Index(pd.read_csv(
+            os.path.join(directory, SAMPLES_CSV), dtype=str).sample_id,
+            name='sample_id')
+
+    @property
+    def shape(self):
+        return self.psi.shape
+
+    def posterior(self, event_name, splice_type, sample_id):
+        """Posterior samples of one event in one sample, without padding"""
+        i = self.events.index.get_loc((event_name, splice_type))
+        j = self.samples.get_loc(sample_id)
+        if not self.observed[i, j]:
+            return np.empty(0, dtype=self.psi.dtype)
+        draws = np.asarray(self.psi[i, j])
+        return draws[~np.isnan(draws)]
+
+    def take(self, events=None, samples=None):
+        """Posterior samples of some events and samples, as an in-memory
+        (events, samples, draws) array
+
+        Parameters
+        ----------
+        events : list of (event_name, splice_type) tuples or slice, optional
+            Defaults to all events. A slice takes a range of the positions of
+            the events, and reads just that range from disk
+        samples : list of str, optional
+            Defaults to all samples
+
+        Returns
+        -------
+        psi : numpy.ndarray
+            float32 (events, samples, draws) posterior samples, NaN where an
+            event wasn't quantified in a sample
+        """
+        if events is None:
+            i = slice(None)
+        elif isinstance(events, slice):
+            i = events
+        else:
+            i = self.events.index.get_indexer(events)
+        j = slice(None) if samples is None else \
+            self.samples.get_indexer(samples)
+        psi = np.array(self.psi[i][:, j])
+        psi[~self.observed[i][:, j]] = np.nan
+        return psi
+
+
+def read_miso_posteriors(files, out_dir, n_jobs=1, n_draws=None,
+                         chunk_size=1000, template=MISO_POSTERIOR_TEMPLATE,
+                         n_progress=10):
+    """Read .miso files into a memory-mappable (events, samples, draws) store
+
+    Parameters
+    ----------
+    files : str or pandas.DataFrame or list of str
+        A glob of .miso files, e.g. "miso/*/SE/*/*.miso", a table of files
+        from ``rnaseek.discovery.discover_files`` with "sample_id",
+        "splice_type" and "event_name" columns, or a list of their locations
+    out_dir : str
+        Folder to write the store to. Does not need to exist already
+    n_jobs : int, optional
+        Number of processes to read files with
+    n_draws : int, optional
+        Number of posterior samples to keep per event and sample. Defaults to
+        the number in the first file. Files with fewer are padded with NaN,
+        and files with more are truncated
+    chunk_size : int, optional
+        Number of files each process reads at a time
+    template : str, optional
+        Regular expression with the named groups "sample_id", "splice_type"
+        and "event_name", to search for in each path
+    n_progress : int, optional
+        Show progress after every this many chunks
+
+    Returns
+    -------
+    store : PosteriorStore
+        The written store, memory-mapped
+
+    Raises
+    ------
+    ValueError
+        If no files were found, or more than one file is of the same event,
+        splice type and sample (e.g. from a rerun in another folder), as
+        their posteriors would overwrite each other
+    """
+    if isinstance(files, str):
+        files = discover_files(files, template)
+    elif not isinstance(files, pd.DataFrame):
+        files = file_table(files, template)
+    if files.shape[0] == 0:
+        raise ValueError('No .miso files were found')
+    duplicated = files.duplicated(['event_name', 'splice_type', 'sample_id'],
+                                  keep=False)
+    if duplicated.any():
+        raise ValueError('More than one .miso file of the same event, splice '
+                         'type and sample, e.g. {}'.format(', '.join(
+                             files.filename[duplicated].iloc[:2])))
+    if n_draws is None:
+        n_draws = _count_draws(files.filename.iloc[0])
+
+    keys = pd.MultiIndex.from_arrays([files.event_name, files.splice_type],
+                                     names=['event_name', 'splice_type'])
+    events = pd.DataFrame(index=keys.unique())
+    samples = pd.Index(files.sample_id.unique(), name='sample_id')
+    event_positions = events.index.get_indexer(keys)
+    sample_positions = samples.get_indexer(files.sample_id)
+
+    try:
+        os.makedirs(out_dir)
+    except OSError:
+        pass
+    # Only the cells of the files read are written, and the others are
+    # masked by "observed" rather than filled with NaN
+    psi = np.lib.format.open_memmap(
+        os.path.join(out_dir, PSI_NPY), mode='w+', dtype=np.float32,
+        shape=(events.shape[0], samples.shape[0], n_draws))
+    observed = np.zeros((events.shape[0], samples.shape[0]), dtype=bool)
+    observed[event_positions, sample_positions] = True
+
+    filenames = files.filename.tolist()
+    chunks = [(filenames[i:i + chunk_size], n_draws)
+              for i in range(0, len(filenames), chunk_size)]
+    headers = dict((key, np.empty(events.shape[0], dtype=object))
+                   for key in EVENT_HEADER_FIELDS)
+    n_truncated = 0
+    sys.stdout.write('Reading {} .miso files of {} events in {} samples '
+                     '...\n'.format(len(filenames), events.shape[0],
+                                    samples.shape[0]))
+
+    pool = multiprocessing.Pool(n_jobs) if n_jobs > 1 else None
+    try:
+        reader = pool.imap(_read_chunk, chunks) if pool is not None \
+            else (_read_chunk(x) for x in chunks)
+        for i, (chunk_psi, chunk_headers, truncated) in enumerate(reader):
+            rows = slice(i * chunk_size, i * chunk_size + len(chunk_headers))
+            psi[event_positions[rows], sample_positions[rows]] = chunk_psi
+            # The header of an event is the same in every sample, so keep
+            # the last one read
+            for key in EVENT_HEADER_FIELDS:
+                headers[key][event_positions[rows]] = [
+                    x[key] for x in chunk_headers]
+            n_truncated += truncated
+            if (i + 1) % n_progress == 0:
+                sys.stdout.write('\t{}/{} chunks read\n'.format(
+                    i + 1, len(chunks)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    psi.flush()
+    del psi
+    if n_truncated > 0:
+        sys.stderr.write('Kept only the first {} posterior samples of {} '
+                         'files with more\n'.format(n_draws, n_truncated))
+
+    np.save(os.path.join(out_dir, OBSERVED_NPY), observed)
+    for key in EVENT_HEADER_FIELDS:
+        events[key] = headers[key]
+    events.to_csv(os.path.join(out_dir, EVENTS_CSV))
+    pd.DataFrame({'sample_id': samples}).to_csv(
+        os.path.join(out_dir, SAMPLES_CSV), index=False)
+    sys.stdout.write('\tWrote {}\n'.format(out_dir))
+    return PosteriorStore(out_dir)
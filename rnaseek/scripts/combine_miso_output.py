@@ -3,13 +3,78 @@
 __author__ = 'olga'
 
 import argparse
-from glob import iglob
 import os
 import re
 import sys
 
 import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+
+from rnaseek.accumulators import EventStatistics
+from rnaseek.discovery import discover_files, file_table
+from rnaseek.events import EVENT_IDS_CSV, EventDictionary
+from rnaseek.instrumentation import (RunReport, file_bytes, frame_bytes,
+                                     log_to_stderr)
+from rnaseek.partials import Partial, merge_partials, select_batch
+
+# Templates of the metadata in the paths of MISO summary files, as
+# <sample_id>/<splice_type>/summary/<splice_type>.miso_summary
+MISO_TEMPLATE = (r'(?P<sample_id>[^/]+)/[^/]+/[^/]+/'
+                 r'(?P<splice_type>[^/.]*)[^/]*$')
+MISO_DOWNSAMPLED_TEMPLATE = (
+    r'(?P<sample_id>(?P<real_id>[^/]+)_prob(?P<probability>[^/_]+)'
+    r'_iter(?P<iteration>[^/_]+))/[^/]+/[^/]+/(?P<splice_type>[^/.]*)[^/]*$')
+MISO_DOWNSAMPLED_DTYPES = {'probability': float, 'iteration': int}
+
+# The compact schema of the tall summary keeps the columns that are the same
+# for an event in every sample in a separate per-event table, stores the
+# confidence intervals as float32 and the isoform counts as integers
+EVENT_COLUMNS = ['event_name', 'isoforms', 'chrom', 'strand', 'mRNA_starts',
+                 'mRNA_ends', 'genome_location']
+FLOAT32_COLUMNS = ['miso_posterior_mean', 'ci_low', 'ci_high', 'ci_diff',
+                   'ci_left_half', 'ci_right_half', 'ci_halves_max']
+ISOFORM_COUNTS = {'counts_00': '(0,0)', 'counts_10': '(1,0)',
+                  'counts_11': '(1,1)', 'counts_01': '(0,1)'}
+ASSIGNED_COUNTS = {'assigned_counts_0': '0', 'assigned_counts_1': '1'}
+
+
+def concat_categoricals(dfs):
+    '''Concatenate tables, keeping categorical columns categorical
+
+    ``pandas.concat`` turns categoricals with different categories into
+    objects, so their categories are unioned instead
+    '''
+    columns = {}
+    for column in dfs[0].columns:
+        pieces = [df[column] for df in dfs]
+        if isinstance(pieces[0].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals(pieces)
+        else:
+            columns[column] = pd.concat(pieces, ignore_index=True)
+    return pd.DataFrame(columns, columns=dfs[0].columns)
+
+
+def uncategorize(index):
+    '''Convert a categorical index back to the dtype of its categories'''
+    if not isinstance(index.dtype, pd.CategoricalDtype):
+        return index
+    return index.astype(index.categories.dtype)
+
+
+def compact_dtypes(summary):
+    '''Convert the columns of a summary read from a csv back to the compact
+    schema'''
+    summary = summary.copy()
+    for column in ('event_name', 'sample_id', 'splice_type'):
+        if column in summary:
+            summary[column] = summary[column].astype('category')
+    for column in FLOAT32_COLUMNS:
+        summary[column] = summary[column].astype(np.float32)
+    for column in list(ISOFORM_COUNTS) + list(ASSIGNED_COUNTS):
+        summary[column] = summary[column].astype(np.int32)
+    return summary
+
 
 class CommandLine(object):
     def __init__(self, inOpts=None):
@@ -58,6 +123,75 @@ class CommandLine(object):
                                  '<current_directory>/miso/<sample_id>_prob<p>'
                                  '_iter<i>/<splice_type>/summary/<splice_type>'
                                  '.miso_summary')
+        parser.add_argument('--report', required=False, type=str,
+                            action='store', default=None,
+                            help='Where to write a JSON report of the time '
+                                 'and memory used by each stage')
+        parser.add_argument('--log-json', required=False,
+                            action='store_true', default=False,
+                            help='If given, log each finished stage as a '
+                                 'line of JSON to stderr')
+        parser.add_argument('--template', required=False, type=str,
+                            action='store', default=None,
+                            help='Regular expression with the named groups '
+                                 '"sample_id" and "splice_type" (and '
+                                 '"probability" and "iteration" if '
+                                 'downsampled) to get from the path of each '
+                                 'summary file')
+        parser.add_argument('--compact', required=False,
+                            action='store_true', default=False,
+                            help='If given, keep the combined summaries in '
+                                 'a compact schema, with per-event columns '
+                                 'in a separate miso_events.csv, the '
+                                 'confidence intervals as 32-bit floats and '
+                                 'the isoform counts as integer columns. '
+                                 'Uses several times less memory')
+        parser.add_argument('--event-statistics', required=False,
+                            action='store_true', default=False,
+                            help='If given, also write the number of '
+                                 'samples, mean, variance, min, max, mean '
+                                 'confidence interval and histogram of PSI '
+                                 'of each event that passes filtering to '
+                                 'miso_event_statistics.csv, accumulated '
+                                 'while the files are read')
+        parser.add_argument('--sweep-ci-max', required=False, type=float,
+                            nargs='+', default=None, action='store',
+                            help='Grid of maximum confidence interval sizes '
+                                 'to count the events that pass filtering '
+                                 'at, with each of --sweep-reads-min, in '
+                                 'one pass. Written to miso_filter_sweep.csv '
+                                 'and miso_filter_sweep_samples.csv')
+        parser.add_argument('--sweep-reads-min', required=False, type=int,
+                            nargs='+', default=None, action='store',
+                            help='Grid of minimum numbers of reads unique to '
+                                 'one isoform to count the events that pass '
+                                 'filtering at, with each of --sweep-ci-max')
+        parser.add_argument('--event-ids', required=False, type=str,
+                            nargs='?', const=True, default=False,
+                            action='store', metavar='CSV',
+                            help='If given, key every output on integer '
+                                 '"event_id"s instead of the long MISO event '
+                                 'names, which are written once to '
+                                 'miso_event_ids.csv. The ids of an existing '
+                                 'miso_event_ids.csv in --out-dir, or of the '
+                                 'given CSV, are kept and extended')
+        parser.add_argument('--map', required=False, type=str,
+                            action='store', default=None,
+                            help='If given, only read the summaries of one '
+                                 'batch of samples (see --batch), and write '
+                                 'them to this folder as a partial result, '
+                                 'e.g. from one task of a cluster array job')
+        parser.add_argument('--batch', required=False, type=int, nargs=2,
+                            action='store', default=(0, 1),
+                            metavar=('BATCH', 'N_BATCHES'),
+                            help='With --map, the 0-based number of the '
+                                 'batch of samples to read, and the total '
+                                 'number of batches. Default is all samples')
+        parser.add_argument('--reduce', required=False, type=str,
+                            nargs='+', action='store', default=None,
+                            help='If given, merge these partial results from '
+                                 '--map instead of reading summaries, and '
+                                 'write the combined outputs to --out-dir')
         if inOpts is None:
             self.args = vars(self.parser.parse_args())
         else:
@@ -72,7 +206,7 @@ class CommandLine(object):
         '''
         import sys
 
-        print >> sys.stderr, str
+        sys.stderr.write('{}\n'.format(str))
         self.parser.print_usage()
         return 2
 
@@ -90,129 +224,556 @@ class Usage(Exception):
 class CombineMiso(object):
     def __init__(self, glob_command, out_dir='./combined_outputs',
                  n_progress=100, ci_max=0.5,
-                 per_isoform_reads_min=10, downsampled=False):
-        """Combine MISO output files and write to disk
+                 per_isoform_reads_min=10, downsampled=False,
+                 report_json=None, log=False, template=None,
+                 compact=False, event_statistics=False, sweep_ci_max=None,
+                 sweep_reads_min=None, event_ids=False):
+        """Combine MISO output files
+
+        Nothing is read until ``run`` is called, or the stages ``discover``,
+        ``read``, ``filter``, ``aggregate`` and ``write`` are called one at a
+        time, each returning its results in memory.
 
         Parameters
         ----------
         glob_command : str
             Where to find sailfish output directories
-        out_dir : str
+        out_dir : str or None
             Where to output the combined matrices. Will be created if it
-            doesn't exist
+            doesn't exist. If None, ``run`` doesn't write any files
         n_progress : int
             Integer step size to show progress. E.g. for 10/58 completed
-
+        ci_max : float, optional
+            Maximum confidence interval size of the percent spliced in value
+        per_isoform_reads_min : int, optional
+            Minimum number of reads unique to one isoform
+        downsampled : bool, optional
+            If True, the sample ids are "<sample_id>_prob<p>_iter<i>"
+        report_json : str, optional
+            Where to write a JSON report of the wall time, CPU time, peak
+            memory, rows and bytes of each stage. The report is also kept as
+            the attribute "report"
+        log : bool, optional
+            If True, log each finished stage as a line of JSON
+        template : str, optional
+            Regular expression with the named groups "sample_id" and
+            "splice_type" (and "probability" and "iteration" if downsampled)
+            to search for in each path. Defaults to ``MISO_TEMPLATE`` or
+            ``MISO_DOWNSAMPLED_TEMPLATE``
+        compact : bool, optional
+            If True, read the summaries into the compact schema of
+            ``read_miso_summary_compact``: "event_name", "sample_id" and
+            "splice_type" are categoricals, the columns in EVENT_COLUMNS are
+            moved to the per-event table "events", and the "counts" and
+            "assigned_counts" strings are parsed into integer columns
+        event_statistics : bool, optional
+            If True, accumulate statistics of the PSI of each event that
+            passes filtering while the files are read, in the attribute
+            "statistics" (an ``rnaseek.accumulators.EventStatistics``), which
+            can be merged with those of other runs. Each ``read`` starts
+            them afresh. If downsampled, iterations with too few events are
+            only removed by ``filter``, so they are accumulated there instead
+        sweep_ci_max, sweep_reads_min : list of numbers, optional
+            Grids of ``ci_max`` and ``per_isoform_reads_min`` to count the
+            events passing each combination of, with ``sweep``. If only one
+            is given, the other is just the value used for filtering
+        event_ids : bool or str, optional
+            If True, replace the event names in every result with integer
+            "event_id"s from an ``rnaseek.events.EventDictionary``, kept in
+            the attribute "event_ids" and written to miso_event_ids.csv. If
+            out_dir already has a miso_event_ids.csv, or if this is the
+            location of one, its ids are kept and new events are added
         """
-        out_dir = out_dir.rstrip('/')
-        out_dir = os.path.abspath(os.path.expanduser(out_dir))
-
         if n_progress < 1:
             raise ValueError('"n_progress" must be 1 or greater')
 
-        # Make the directory if it's not there already
-        out_dir = os.path.abspath(os.path.expanduser(out_dir))
-        try:
-            os.mkdir(out_dir)
-        except OSError:
-            pass
-        dfs = []
+        if out_dir is not None:
+            out_dir = os.path.abspath(os.path.expanduser(out_dir.rstrip('/')))
+        self.glob_command = glob_command
+        self.out_dir = out_dir
+        self.n_progress = n_progress
+        self.ci_max = ci_max
+        self.per_isoform_reads_min = per_isoform_reads_min
+        self.downsampled = downsampled
+        if template is None:
+            template = MISO_DOWNSAMPLED_TEMPLATE if downsampled \
+                else MISO_TEMPLATE
+        self.template = template
+        self.dtypes = MISO_DOWNSAMPLED_DTYPES if downsampled else None
+        self.compact = compact
+        self.events = None
+        self.statistics = EventStatistics() if event_statistics else None
+        if sweep_ci_max is None and sweep_reads_min is None:
+            self.sweep_grid = None
+        else:
+            self.sweep_grid = (
+                [ci_max] if sweep_ci_max is None else list(sweep_ci_max),
+                [per_isoform_reads_min] if sweep_reads_min is None
+                else list(sweep_reads_min))
+        if event_ids is True and out_dir is not None and os.path.exists(
+                os.path.join(out_dir, EVENT_IDS_CSV)):
+            event_ids = os.path.join(out_dir, EVENT_IDS_CSV)
+        if isinstance(event_ids, str):
+            self.event_ids = EventDictionary.read(event_ids)
+        else:
+            self.event_ids = EventDictionary() if event_ids else None
+        self.report_json = report_json
+        self.report = RunReport('combine_miso', log=log)
+
+    def run(self):
+        """Read, filter and aggregate all the MISO summaries
+
+        Returns
+        -------
+        results : dict
+            The "summary_raw" and "summary_filtered" tall tables of all
+            samples and splice types, and (unless the samples are
+            downsampled) the ((event_name, splice_type), samples) "psi"
+            matrix. If compact, also the per-event table "events", and with
+            event_statistics, the "event_statistics" table, and with a sweep
+            grid, the "filter_sweep" and "filter_sweep_samples" tables. These
+            are also written to out_dir, if it's not None. With event_ids,
+            every table is keyed on "event_id" instead of "event_name", and
+            the names are in the "event_ids" table
+        """
+        return self.finish(self.read(self.discover()))
+
+    def finish(self, summary):
+        """Filter and aggregate the summaries, and write the results
+
+        Returns
+        -------
+        results : dict
+            See ``run``
+        """
+        events = self.events
+        summary_filtered = self.filter(summary)
+        statistics = None if self.statistics is None \
+            else self.statistics.to_frame()
+        if self.event_ids is not None:
+            with self.report.stage('encode_events') as stage:
+                summary = self.event_ids.encode(summary)
+                summary_filtered = self.event_ids.encode(summary_filtered)
+                if events is not None:
+                    events = self.event_ids.encode(events)
+                if statistics is not None:
+                    statistics = self.event_ids.encode(statistics)
+                stage['rows'] = len(self.event_ids)
+                stage['bytes'] = frame_bytes(summary)
+        results = {'summary_raw': summary}
+        if self.compact:
+            results['events'] = events
+        if statistics is not None:
+            results['event_statistics'] = statistics
+        if self.event_ids is not None:
+            results['event_ids'] = self.event_ids.to_frame()
+        if self.sweep_grid is not None:
+            results['filter_sweep'], results['filter_sweep_samples'] = \
+                self.sweep(summary, *self.sweep_grid)
+        results['summary_filtered'] = summary_filtered
+        if not self.downsampled:
+            results['psi'] = self.aggregate(results['summary_filtered'])
+        if self.out_dir is not None:
+            self.write(results)
+        if self.report_json is not None:
+            self.report.write(self.report_json)
+            sys.stdout.write("Wrote run report {}\n".format(self.report_json))
+        return results
 
-        filenames = iglob(glob_command)
-        n_files = sum(1 for i in filenames)
+    @property
+    def partial_options(self):
+        """Options that partial results must share to be merged"""
+        return {'ci_max': self.ci_max,
+                'per_isoform_reads_min': self.per_isoform_reads_min,
+                'downsampled': self.downsampled, 'compact': self.compact,
+                'event_statistics': self.statistics is not None}
+
+    def map(self, partial_dir, batch=0, n_batches=1):
+        """Read the summaries of one batch of samples into a partial result
+
+        Parameters
+        ----------
+        partial_dir : str
+            Folder to write the partial result to
+        batch : int, optional
+            0-based number of the batch of samples, e.g. an array task id
+        n_batches : int, optional
+            Total number of batches
+
+        Returns
+        -------
+        partial : rnaseek.partials.Partial
+            The raw summary of the batch (and its events and event
+            statistics, if compact or accumulated), to merge with ``reduce``
+        """
+        files = select_batch(self.discover(), batch, n_batches)
+        tables = {'summary': self.read(files)}
+        merge = {}
+        if self.compact:
+            tables['events'] = self.events
+            merge['events'] = 'unique_rows'
+        if self.statistics is not None:
+            tables['event_statistics'] = self.statistics.to_frame()
+            merge['event_statistics'] = 'event_statistics'
+        partial = Partial('combine_miso', self.partial_options,
+                          files.filename.tolist(), tables, merge)
+        with self.report.stage('write_partial') as stage:
+            partial.write(partial_dir)
+            stage['rows'] = tables['summary'].shape[0]
+        sys.stdout.write("Wrote partial result {}\n".format(partial_dir))
+        if self.report_json is not None:
+            self.report.write(self.report_json)
+        return partial
+
+    def reduce(self, partials):
+        """Merge partial results from ``map`` and finish combining them
+
+        Parameters
+        ----------
+        partials : list of str or rnaseek.partials.Partial
+            Partial results, or the folders they were written to, in any
+            order
+
+        Returns
+        -------
+        results : dict
+            The same as from ``run`` over all the partials' files
+        """
+        with self.report.stage('merge_partials') as stage:
+            partial = merge_partials(partials)
+            if partial.kind != 'combine_miso' or \
+                    partial.options != self.partial_options:
+                raise ValueError('Partial results of {} {} cannot be reduced '
+                                 'with the options {}'.format(
+                                     partial.kind, partial.options,
+                                     self.partial_options))
+            summary = partial.tables['summary']
+            if self.compact:
+                summary = compact_dtypes(summary).reset_index(drop=True)
+                self.events = partial.tables['events']
+            if self.statistics is not None:
+                self.statistics = EventStatistics.from_frame(
+                    partial.tables['event_statistics'])
+            stage['rows'] = summary.shape[0]
+            stage['bytes'] = frame_bytes(summary)
+        return self.finish(summary)
+
+    def discover(self):
+        """Table of all the MISO summary files, with their size and the
+        metadata in their paths (see ``rnaseek.discovery.file_table``)"""
+        with self.report.stage('discover') as stage:
+            files = discover_files(self.glob_command, self.template,
+                                   self.dtypes)
+            stage['rows'] = files.shape[0]
+            stage['bytes'] = int(files['size'].sum())
+        return files
+
+    def read(self, files):
+        """Read MISO summary files into one tall table
+
+        Parameters
+        ----------
+        files : pandas.DataFrame or list of str
+            Table of MISO summary files from ``discover``, or their
+            locations, as
+            <sample_id>/<splice_type>/summary/<splice_type>.miso_summary
+
+        Returns
+        -------
+        summary : pandas.DataFrame
+            All the summaries, with "sample_id" and "splice_type" columns
+            (and "probability" and "iteration" if downsampled). If compact,
+            the per-event columns are kept in the attribute "events" instead
+        """
+        if not isinstance(files, pd.DataFrame):
+            files = file_table(files, self.template, self.dtypes)
+        n_files = files.shape[0]
+        if self.statistics is not None:
+            self.statistics = EventStatistics(self.statistics.n_bins)
         sys.stdout.write("Reading {} MISO summary files ...\n".format(n_files))
+        dfs = []
+        events = []
+        with self.report.stage('read') as stage:
+            n_bytes = 0
+            for i, row in enumerate(files.itertuples()):
+                filename = row.filename
+                # Check that more than just the header is there
+                if row.size > 113:
+                    n_bytes += row.size
+                    if self.compact:
+                        df, event = self.read_miso_summary_compact(filename)
+                        events.append(event)
+                    else:
+                        df = self.read_miso_summary(filename)
 
-        # re-initialize iterator
-        filenames = iglob(glob_command)
-
-        n_files_true = 0
-        for i, filename in enumerate(filenames):
-            # Check that more than just the header is there
-            if os.path.getsize(filename) > 113:
-                n_files_true += 1
-                df = self.read_miso_summary(filename)
-
-                splice_type = os.path.basename(filename).split('.')[0]
-                sample_id = filename.split('/')[-4]
-
-                if downsampled:
-                    fragments = sample_id.split('_')
-                    real_id = '_'.join(fragments[:-2])
-                    probability = float(fragments[-2].lstrip('prob'))
-                    iteration = int(fragments[-1].lstrip('iter'))
-                    sys.stdout.write('\t{}\t{}\t{}\t{}\n'.format(i, real_id,
-                                                                 probability,
-                                                                 iteration))
-
-                df['sample_id'] = sample_id
-                df['splice_type'] = splice_type
-
-                if downsampled:
-                    df['probability'] = probability
-                    df['iteration'] = iteration
-
-                dfs.append(df.reset_index())
-                if (i + 1) % n_progress == 0:
-                    sys.stdout.write(
-                        "\t{}/{} files attempted to read\n".format(i + 1, n_files))
-            else:
-                sys.stdout.write("\tOnly found header and an empty table for "
-                                 "{}\n".format(filename))
+                    if self.downsampled:
+                        sys.stdout.write('\t{}\t{}\t{}\t{}\n'.format(
+                            i, row.real_id, row.probability, row.iteration))
+
+                    if self.compact:
+                        # Categoricals of one value cost one byte per row
+                        n = df.shape[0]
+                        df['sample_id'] = pd.Categorical.from_codes(
+                            np.zeros(n, dtype=np.int8), [row.sample_id])
+                        df['splice_type'] = pd.Categorical.from_codes(
+                            np.zeros(n, dtype=np.int8), [row.splice_type])
+                    else:
+                        df['sample_id'] = row.sample_id
+                        df['splice_type'] = row.splice_type
+
+                    if self.downsampled:
+                        df['probability'] = row.probability
+                        df['iteration'] = row.iteration
+
+                    if self.statistics is not None and not self.downsampled:
+                        passed = (df.ci_diff <= self.ci_max).values & (
+                            self.junction_reads(df) >=
+                            self.per_isoform_reads_min).values
+                        self.statistics.update(
+                            df.event_name.values[passed], row.splice_type,
+                            df.miso_posterior_mean.values[passed],
+                            df.ci_diff.values[passed])
+
+                    dfs.append(df if self.compact else df.reset_index())
+                    if (i + 1) % self.n_progress == 0:
+                        sys.stdout.write(
+                            "\t{}/{} files attempted to read\n".format(
+                                i + 1, n_files))
+                else:
+                    sys.stdout.write("\tOnly found header and an empty "
+                                     "table for {}\n".format(filename))
+            stage['rows'] = sum(df.shape[0] for df in dfs)
+            stage['bytes'] = n_bytes
         sys.stdout.write("\tDone.\n")
 
         sys.stdout.write("Merging all {} MISO summaries into a gigantic "
-                         "one ...\n".format(n_files_true))
-        summary = pd.concat(dfs)
+                         "one ...\n".format(len(dfs)))
+        with self.report.stage('merge') as stage:
+            if self.compact:
+                summary = concat_categoricals(dfs)
+                self.events = pd.concat(events).drop_duplicates(
+                    'event_name').set_index('event_name').sort_index()
+            else:
+                summary = pd.concat(dfs)
+            del dfs
+            stage['rows'] = summary.shape[0]
+            stage['bytes'] = frame_bytes(summary)
         sys.stdout.write("\tDone.\n")
+        return summary
 
-        sys.stdout.write("Writing raw MISO summary files ...\n")
-        csv = '{}/miso_summary_raw.csv'.format(out_dir)
-        summary.to_csv(csv)
-        sys.stdout.write("\tWrote {}\n".format(csv))
-
+    def filter(self, summary):
+        """Filter the summaries on confidence intervals and read depth, and
+        remove downsampled iterations with too few events"""
         sys.stdout.write("Filtering MISO summaries with ci_max={}, "
                          "per_isoform_counts={} ...\n".format(
-            ci_max, per_isoform_reads_min))
-        summary = self.filter_miso_summary(summary, ci_max,
-                                           per_isoform_reads_min)
+            self.ci_max, self.per_isoform_reads_min))
+        with self.report.stage('filter') as stage:
+            summary = self.filter_miso_summary(summary, self.ci_max,
+                                               self.per_isoform_reads_min)
+            stage['rows'] = summary.shape[0]
+            stage['bytes'] = frame_bytes(summary)
+        sys.stdout.write("\tDone.\n")
+
+        if self.downsampled:
+            with self.report.stage('remove_inconsistent') as stage:
+                sys.stdout.write("Sorting downsampled files by probability "
+                                 "and iteration...\n")
+                summary = summary.sort_values(['probability', 'iteration'])
+                sys.stdout.write("\tDone.\n")
+
+                summary.index = np.arange(summary.shape[0])
+
+                def remove_inconsistent(x, thresh=0.8):
+                    """Remove iterations with fewer events than the threshold
+                    fraction
+                    """
+                    size = x.groupby('iteration').size()
+                    return x.groupby('iteration').filter(
+                        lambda y: len(y) > (thresh * size.mean()))
+
+                sys.stdout.write("Removing iterations that had too few "
+                                 "events ...\n")
+                summary = summary.groupby(
+                    ['splice_type', 'probability']).apply(remove_inconsistent)
+                stage['rows'] = summary.shape[0]
+                sys.stdout.write("\tDone.\n")
+
+            if self.statistics is not None:
+                with self.report.stage('event_statistics') as stage:
+                    self.statistics = EventStatistics(self.statistics.n_bins)
+                    for splice_type, df in summary.groupby(
+                            'splice_type', observed=True):
+                        self.statistics.update(
+                            df.event_name.values, splice_type,
+                            df.miso_posterior_mean.values,
+                            df.ci_diff.values)
+                    stage['rows'] = len(self.statistics)
+        return summary
+
+    def sweep(self, summary, ci_maxes, reads_mins):
+        """Count the events passing filters at every pair of thresholds
+
+        Instead of filtering once per pair, every row of the summary is
+        binned by the strictest thresholds it passes, and the counts at all
+        thresholds are cumulative sums of the bins
+
+        Parameters
+        ----------
+        summary : pandas.DataFrame
+            Tall table of all the samples and splice types, as from ``read``
+        ci_maxes : list of float
+            Maximum confidence interval sizes, as in ``ci_max``
+        reads_mins : list of int
+            Minimum numbers of reads unique to one isoform, as in
+            ``per_isoform_reads_min``
+
+        Returns
+        -------
+        sweep : pandas.DataFrame
+            Table with the columns "splice_type", "ci_max",
+            "per_isoform_reads_min", "n_events" (events passing in at least
+            one sample) and "n_event_samples" (event-sample pairs passing)
+        sweep_samples : pandas.DataFrame
+            Table with the columns "splice_type", "sample_id", "ci_max",
+            "per_isoform_reads_min" and "n_events"
+        """
+        sys.stdout.write("Counting events passing {} ci_max and {} "
+                         "per_isoform_reads_min thresholds ...\n".format(
+                             len(ci_maxes), len(reads_mins)))
+        with self.report.stage('sweep') as stage:
+            ci_maxes = np.sort(np.asarray(ci_maxes, dtype=float))
+            reads_mins = np.sort(np.asarray(reads_mins))
+            n_ci, n_reads = len(ci_maxes), len(reads_mins)
+
+            # Index of the strictest ci_max each row passes (n_ci if none),
+            # and of the strictest reads minimum plus one (0 if none)
+            # Compared at the precision of the summary, as when filtering
+            ci_diff = summary.ci_diff.values
+            ci_bin = np.searchsorted(ci_maxes.astype(ci_diff.dtype), ci_diff,
+                                     side='left')
+            reads_bin = np.searchsorted(
+                reads_mins, self.junction_reads(summary).values,
+                side='right')
+
+            groups = summary[['splice_type', 'sample_id']].astype(str)
+            group_codes, group_keys = pd.factorize(pd.MultiIndex.from_frame(
+                groups))
+            n_groups = len(group_keys)
+            size = (n_ci + 1) * (n_reads + 1)
+            counts = np.bincount(
+                group_codes * size + ci_bin * (n_reads + 1) + reads_bin,
+                minlength=n_groups * size).reshape(
+                n_groups, n_ci + 1, n_reads + 1)
+            # A row passes every looser ci_max and every lower reads minimum
+            counts = counts.cumsum(axis=1)[:, :n_ci]
+            counts = counts[:, :, ::-1].cumsum(axis=2)[:, :, ::-1][:, :, 1:]
+
+            sweep_samples = pd.DataFrame(
+                {'splice_type': np.repeat(
+                    group_keys.get_level_values(0), n_ci * n_reads),
+                 'sample_id': np.repeat(
+                     group_keys.get_level_values(1), n_ci * n_reads),
+                 'ci_max': np.tile(np.repeat(ci_maxes, n_reads), n_groups),
+                 'per_isoform_reads_min': np.tile(reads_mins,
+                                                  n_groups * n_ci),
+                 'n_events': counts.ravel()},
+                columns=['splice_type', 'sample_id', 'ci_max',
+                         'per_isoform_reads_min', 'n_events'])
+            sweep = sweep_samples.groupby(
+                ['splice_type', 'ci_max', 'per_isoform_reads_min'],
+                sort=False).n_events.sum().rename('n_event_samples')
+
+            # An event passes if its loosest sample does. For each reads
+            # minimum, find the strictest ci_max each event passes in any
+            # sample
+            event_codes, event_keys = pd.factorize(pd.MultiIndex.from_arrays(
+                [summary.event_id.values if 'event_id' in summary
+                 else summary.event_name.astype(str).values,
+                 groups.splice_type.values]))
+            splice_types = pd.Index(group_keys.get_level_values(0).unique())
+            splice_type_codes = splice_types.get_indexer(
+                event_keys.get_level_values(1))
+            n_events = np.zeros((len(splice_types), n_ci, n_reads),
+                                dtype=np.int64)
+            for j in range(n_reads):
+                best = np.repeat(n_ci, len(event_keys))
+                passed = reads_bin > j
+                np.minimum.at(best, event_codes[passed], ci_bin[passed])
+                n_events[:, :, j] = np.bincount(
+                    splice_type_codes * (n_ci + 1) + best,
+                    minlength=len(splice_types) * (n_ci + 1)).reshape(
+                    len(splice_types), n_ci + 1).cumsum(axis=1)[:, :n_ci]
+            sweep = pd.DataFrame(
+                {'splice_type': np.repeat(splice_types, n_ci * n_reads),
+                 'ci_max': np.tile(np.repeat(ci_maxes, n_reads),
+                                   len(splice_types)),
+                 'per_isoform_reads_min': np.tile(
+                     reads_mins, len(splice_types) * n_ci),
+                 'n_events': n_events.ravel()}).join(
+                sweep, on=['splice_type', 'ci_max', 'per_isoform_reads_min'])
+            stage['rows'] = sweep_samples.shape[0]
+            stage['bytes'] = frame_bytes(sweep_samples)
+        sys.stdout.write("\tDone.\n")
+        return sweep, sweep_samples
+
+    def aggregate(self, summary):
+        """((event_name, splice_type), samples) matrix of PSI scores, or
+        ((event_id, splice_type), samples) if the events are encoded"""
+        event = 'event_id' if 'event_id' in summary else 'event_name'
+        sys.stdout.write("Creating (({}, splice_type), samples) "
+                         "PSI matrix ...\n".format(event))
+        with self.report.stage('aggregate') as stage:
+            psi = summary.pivot_table(
+                index=(event, 'splice_type'), columns='sample_id',
+                values='miso_posterior_mean', observed=True)
+            if self.compact:
+                # Same index, columns and dtype as from a regular summary
+                psi = psi.astype(float)
+                psi.index = pd.MultiIndex.from_arrays(
+                    [uncategorize(psi.index.get_level_values(i))
+                     for i in range(psi.index.nlevels)],
+                    names=psi.index.names)
+                psi.columns = uncategorize(psi.columns)
+            stage['rows'] = psi.shape[0]
+            stage['bytes'] = frame_bytes(psi)
         sys.stdout.write("\tDone.\n")
+        return psi
 
-        if downsampled:
-            sys.stdout.write("Sorting downsampled files by probability "
-                             "and iteration...\n")
-            summary = summary.sort(columns=['probability', 'iteration'])
-            sys.stdout.write("\tDone.\n")
-
-            summary.index = np.arange(summary.shape[0])
-
-            def remove_inconsistent(x, thresh=0.8):
-                """Remove iterations with fewer events than the threshold
-                fraction
-                """
-                size = x.groupby('iteration').size()
-                return x.groupby('iteration').filter(
-                    lambda y: len(y) > (thresh * size.mean()))
-
-            sys.stdout.write("Removing iterations that had too few "
-                             "events ...\n")
-            summary = summary.groupby(['splice_type', 'probability']).apply(
-                remove_inconsistent)
-            sys.stdout.write("\tDone.\n")
-
-        sys.stdout.write("Writing filtered MISO summary files ...\n")
-        csv = '{}/miso_summary_filtered.csv'.format(out_dir)
-        summary.to_csv(csv)
-        sys.stdout.write("\tWrote {}\n".format(csv))
-
-        if not downsampled:
-            sys.stdout.write("Creating ((event_name, splice_type), samples) "
-                             "PSI matrix ...\n")
-            psi = summary.pivot_table(index=('event_name', 'splice_type'),
-                                      columns='sample_id',
-                                      values='miso_posterior_mean')
-            csv = '{}/psi.csv'.format(out_dir)
-            psi.to_csv(csv)
-            sys.stdout.write("\tWrote {}\n".format(csv))
+    def write(self, results):
+        """Write the results of ``run`` as csv files to out_dir
+
+        Returns
+        -------
+        filenames : list of str
+            Locations of the written files
+        """
+        # Make the directory if it's not there already
+        try:
+            os.mkdir(self.out_dir)
+        except OSError:
+            pass
+        names = (('summary_raw', 'miso_summary_raw.csv'),
+                 ('summary_filtered', 'miso_summary_filtered.csv'),
+                 ('psi', 'psi.csv'),
+                 ('events', 'miso_events.csv'),
+                 ('event_statistics', 'miso_event_statistics.csv'),
+                 ('filter_sweep', 'miso_filter_sweep.csv'),
+                 ('filter_sweep_samples', 'miso_filter_sweep_samples.csv'),
+                 ('event_ids', EVENT_IDS_CSV))
+        written = []
+        sys.stdout.write("Writing combined MISO files ...\n")
+        with self.report.stage('write') as stage:
+            for key, basename in names:
+                if key not in results:
+                    continue
+                csv = '{}/{}'.format(self.out_dir, basename)
+                results[key].to_csv(csv)
+                written.append(csv)
+                sys.stdout.write("\tWrote {}\n".format(csv))
+            stage['rows'] = sum(results[key].shape[0] for key, _ in names
+                                if key in results)
+            stage['bytes'] = file_bytes(written)
+        return written
 
     @staticmethod
     def max_csv(x):
@@ -293,6 +854,68 @@ class CombineMiso(object):
         return pd.concat([df, genome_location, ci_diff, ci_halves,
                           ci_halves_max], axis=1)
 
+    def read_miso_summary_compact(self, filename):
+        '''Read a miso summary file into the compact schema
+
+        The same columns are added as by ``read_miso_summary``, but the
+        confidence intervals are float32, the "counts" and "assigned_counts"
+        are parsed into the integer columns in ISOFORM_COUNTS and
+        ASSIGNED_COUNTS, "event_name" is a categorical, and the columns in
+        EVENT_COLUMNS are returned in a separate table with one row per event
+
+        Parameters
+        ----------
+        filename : str
+            Full path location of the miso output file
+
+        Returns
+        -------
+        summary : pandas.DataFrame
+            A (n_events, n_columns) dataframe of the per-sample columns
+        events : pandas.DataFrame
+            A (n_events, len(EVENT_COLUMNS)) dataframe
+        '''
+        df = pd.read_table(filename)
+        df['ci_diff'] = df.ci_high - df.ci_low
+        df['ci_left_half'] = df.ci_high - df.miso_posterior_mean
+        df['ci_right_half'] = df.miso_posterior_mean - df.ci_low
+        df['ci_halves_max'] = df[['ci_left_half', 'ci_right_half']].max(axis=1)
+
+        events = df.drop_duplicates('event_name')
+        starts = events.mRNA_starts.astype(str).str.split(',', expand=True)
+        stops = events.mRNA_ends.astype(str).str.split(',', expand=True)
+        events = events.assign(genome_location=(
+            events.chrom.astype(str) + ':' +
+            starts.astype(float).min(axis=1).astype(np.int64).astype(str) +
+            '-' +
+            stops.astype(float).max(axis=1).astype(np.int64).astype(str)))
+        events = events[EVENT_COLUMNS].reset_index(drop=True)
+
+        summary = pd.DataFrame(
+            {'event_name': pd.Categorical(df.event_name)},
+            index=np.arange(df.shape[0]))
+        for column in FLOAT32_COLUMNS:
+            summary[column] = df[column].values.astype(np.float32)
+        for column, counts, key in (
+                [(c, 'counts', k) for c, k in ISOFORM_COUNTS.items()] +
+                [(c, 'assigned_counts', k)
+                 for c, k in ASSIGNED_COUNTS.items()]):
+            pattern = r'(?:^|,){}:(\d+)'.format(re.escape(key))
+            summary[column] = df[counts].astype(str).str.extract(
+                pattern, expand=False).fillna(0).astype(np.int32).values
+        return summary, events
+
+    @staticmethod
+    def junction_reads(summary):
+        '''Number of reads unique to either isoform of each event, from the
+        "counts" strings or the integer counts of compact summaries'''
+        if 'counts' not in summary:
+            return summary.counts_01 + summary.counts_10
+        counts = summary.counts.astype(str)
+        return sum(counts.str.extract(
+            r'(?:^|,)\({}\):(\d+)'.format(key), expand=False).fillna(
+            0).astype(np.int64) for key in ('0,1', '1,0'))
+
     @staticmethod
     def counts_pair_to_ints(x):
         """Convert a string of isoform and counts to tuples of python integers
@@ -331,7 +954,7 @@ class CombineMiso(object):
             A dictionary of events to a dictionary of isoform counts
         """
         return dict(
-            map(self.counts_pair_to_ints, re.findall('\(\d,\d\):\d+,?',
+            map(self.counts_pair_to_ints, re.findall(r'\(\d,\d\):\d+,?',
                                                      counts)))
 
 
@@ -356,19 +979,24 @@ class CombineMiso(object):
 
         """
         original_events = summary.shape[0]
-        summary = summary.ix[summary.ci_diff <= ci_max]
+        summary = summary.loc[summary.ci_diff <= ci_max]
         after_ci_events = summary.shape[0]
-        isoform_counts = pd.DataFrame.from_dict(
-            dict(zip(summary.index,
-                     summary.counts.map(self.counts_col_to_dict).values)),
-            orient='index')
+        if 'counts' in summary:
+            isoform_counts = pd.DataFrame.from_dict(
+                dict(zip(summary.index,
+                         summary.counts.map(self.counts_col_to_dict).values)),
+                orient='index')
 
-        # Get counts that support only one specific isoform "junction reads"
-        specific_isoform_counts = isoform_counts.ix[:, [(0, 1), (1, 0)]].sum(
-            axis=1)
+            # Get counts that support only one specific isoform "junction
+            # reads"
+            specific_isoform_counts = isoform_counts.reindex(
+                columns=[(0, 1), (1, 0)]).sum(axis=1)
+        else:
+            # Compact summaries already have integer counts
+            specific_isoform_counts = summary.counts_01 + summary.counts_10
 
         # Filter on at least 10 "junction reads"
-        summary = summary.ix[
+        summary = summary.loc[
             specific_isoform_counts >= per_isoform_reads_min]
         after_counts_events = summary.shape[0]
 
@@ -389,9 +1017,25 @@ class CombineMiso(object):
 if __name__ == '__main__':
     try:
         cl = CommandLine()
-        CombineMiso(cl.args['glob_command'], cl.args['out_dir'],
-                        cl.args['n_progress'], cl.args['ci_max'],
-                        cl.args['per_isoform_reads_min'],
-                        downsampled=cl.args['downsampled'])
-    except Usage, err:
-        cl.do_usage_and_die()
\ No newline at end of file
+        if cl.args['log_json']:
+            log_to_stderr()
+        combine = CombineMiso(cl.args['glob_command'], cl.args['out_dir'],
+                              cl.args['n_progress'], cl.args['ci_max'],
+                              cl.args['per_isoform_reads_min'],
+                              downsampled=cl.args['downsampled'],
+                              report_json=cl.args['report'],
+                              log=cl.args['log_json'],
+                              template=cl.args['template'],
+                              compact=cl.args['compact'],
+                              event_statistics=cl.args['event_statistics'],
+                              sweep_ci_max=cl.args['sweep_ci_max'],
+                              sweep_reads_min=cl.args['sweep_reads_min'],
+                              event_ids=cl.args['event_ids'])
+        if cl.args['map'] is not None:
+            combine.map(cl.args['map'], *cl.args['batch'])
+        elif cl.args['reduce'] is not None:
+            combine.reduce(cl.args['reduce'])
+        else:
+            combine.run()
+    except Usage as err:
+        cl.do_usage_and_die(err.msg)
\ No newline at end of file
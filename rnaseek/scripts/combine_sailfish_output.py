@@ -3,12 +3,146 @@
 __author__ = 'olga'
 
 import argparse
-from glob import iglob
 import os
 import sys
 
+import numpy as np
 import pandas as pd
 
+from rnaseek.discovery import discover_files, file_table
+from rnaseek.instrumentation import (RunReport, file_bytes, frame_bytes,
+                                     log_to_stderr)
+from rnaseek.matrix import SparseMatrix
+from rnaseek.partials import Partial, merge_partials, select_batch
+
+# Template of the sample id in the paths of sailfish output files, as
+# <sample_id>.<anything>/quant_bias_corrected.sf
+SAILFISH_TEMPLATE = r'(?P<sample_id>[^/.]*)[^/]*/[^/]+$'
+SAILFISH_COLUMNS = ['transcript', 'length', 'tpm', 'rpkm', 'kpkm',
+                    'EstimatedNumKmers', 'EstimatedNumReads']
+
+
+def is_spikein(transcript):
+    """Whether a transcript is a spike-in, i.e. not an ensembl transcript"""
+    return not transcript.startswith('ENST')
+
+
+def gene_id(transcript):
+    """Unversioned ensembl gene id of a transcript, from names like
+    "ENST00000456328.2|ENSG00000223972.5|..."
+
+    >>> gene_id('ENST00000456328.2|ENSG00000223972.5|DDX11L1-002')
+    'ENSG00000223972'
+    """
+    return transcript.split('|')[1].split('.')[0]
+
+
+class ExpressionQC(object):
+
+    def __init__(self, tpm_mins=(1, 10), top_n=10):
+        """Per-sample expression quality metrics, computed one file at a time
+
+        Parameters
+        ----------
+        tpm_mins : list of float, optional
+            Count the genes detected with a TPM above each of these
+        top_n : int, optional
+            Fraction of the TPM of each sample in its this many most
+            expressed transcripts, a measure of library complexity
+        """
+        self.tpm_mins = sorted(tpm_mins)
+        self.top_n = top_n
+        self.rows = []
+        self._transcripts = None
+
+    @property
+    def columns(self):
+        return (['transcripts_detected'] +
+                ['genes_detected_tpm_{:g}'.format(x) for x in self.tpm_mins] +
+                ['spikein_fraction', 'estimated_reads',
+                 'top_{}_fraction'.format(self.top_n)])
+
+    def _annotate(self, transcripts):
+        """Spike-ins and gene codes of transcripts, which are only worked out
+        again if the transcripts aren't in the same order as the last file"""
+        if self._transcripts is not None and \
+                np.array_equal(transcripts, self._transcripts):
+            return
+        self._transcripts = transcripts
+        self._spikeins = np.array([is_spikein(x) for x in transcripts],
+                                  dtype=bool)
+        codes, genes = pd.factorize(np.array(
+            [gene_id(x) for x in transcripts[~self._spikeins]], dtype=object))
+        self._gene_codes = codes
+        self._n_genes = len(genes)
+
+    def update(self, sample_id, transcripts, tpm, reads):
+        """Add the metrics of one sample
+
+        Parameters
+        ----------
+        sample_id : str
+            Id of the sample
+        transcripts : numpy.ndarray
+            Names of the transcripts, including spike-ins
+        tpm, reads : numpy.ndarray
+            TPM and estimated number of reads of each transcript
+        """
+        self._annotate(transcripts)
+        tpm = np.asarray(tpm, dtype=float)
+        total = tpm.sum()
+        genes = np.bincount(self._gene_codes,
+                            weights=tpm[~self._spikeins],
+                            minlength=self._n_genes)
+        top = tpm if tpm.shape[0] <= self.top_n \
+            else np.partition(tpm, -self.top_n)[-self.top_n:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = ([int((tpm > 0).sum())] +
+                      [int((genes > x).sum()) for x in self.tpm_mins] +
+                      [tpm[self._spikeins].sum() / total,
+                       float(np.sum(reads)), top.sum() / total])
+        self.rows.append([sample_id] + values)
+        return self
+
+    def to_frame(self):
+        """Table of the metrics of each sample, indexed by sample id"""
+        return pd.DataFrame(self.rows, columns=['sample_id'] + self.columns
+                            ).set_index('sample_id').sort_index()
+
+
+def sparse_tpm(sample_ids, transcripts, row, col, tpm):
+    """(samples, transcripts) sparse matrix of the nonzero TPMs
+
+    Parameters
+    ----------
+    sample_ids, transcripts : list-like
+        Labels of the rows and columns, which are sorted
+    row, col : numpy.ndarray
+        Positions of each TPM in ``sample_ids`` and ``transcripts``
+    tpm : numpy.ndarray
+        Nonzero TPMs
+
+    Returns
+    -------
+    tpm : rnaseek.matrix.SparseMatrix
+        A matrix with the float32 layer "tpm", and "sample_id" as the row
+        metadata
+    """
+    sample_ids = np.asarray(sample_ids, dtype=object)
+    transcripts = np.asarray(transcripts, dtype=object)
+    sample_order = np.argsort(sample_ids, kind='stable')
+    transcript_order = np.argsort(transcripts, kind='stable')
+    sample_rank = np.empty(sample_order.shape[0], dtype=np.int64)
+    sample_rank[sample_order] = np.arange(sample_order.shape[0])
+    transcript_rank = np.empty(transcript_order.shape[0], dtype=np.int32)
+    transcript_rank[transcript_order] = np.arange(transcript_order.shape[0])
+    return SparseMatrix.from_coo(
+        sample_rank[row], transcript_rank[col],
+        {'tpm': np.asarray(tpm, dtype=np.float32)},
+        pd.DataFrame({'sample_id': sample_ids[sample_order]}),
+        transcripts[transcript_order])
+
+
 class CommandLine(object):
     def __init__(self, inOpts=None):
         self.parser = parser = argparse.ArgumentParser(
@@ -32,6 +166,67 @@ class CommandLine(object):
                                  "20/58 files completed. Can increase this if"
                                  "you have thousands of files, or decrease to"
                                  "1 if you only have a few")
+        parser.add_argument('--report', required=False, type=str,
+                            action='store', default=None,
+                            help='Where to write a JSON report of the time '
+                                 'and memory used by each stage')
+        parser.add_argument('--log-json', required=False,
+                            action='store_true', default=False,
+                            help='If given, log each finished stage as a '
+                                 'line of JSON to stderr')
+        parser.add_argument('--template', required=False, type=str,
+                            action='store', default=None,
+                            help='Regular expression with the named group '
+                                 '"sample_id" to get from the path of each '
+                                 'file')
+        parser.add_argument('--map', required=False, type=str,
+                            action='store', default=None,
+                            help='If given, only read the sailfish outputs '
+                                 'of one batch of samples (see --batch), and '
+                                 'write them to this folder as a partial '
+                                 'result, e.g. from one task of a cluster '
+                                 'array job')
+        parser.add_argument('--batch', required=False, type=int, nargs=2,
+                            action='store', default=(0, 1),
+                            metavar=('BATCH', 'N_BATCHES'),
+                            help='With --map, the 0-based number of the '
+                                 'batch of samples to read, and the total '
+                                 'number of batches. Default is all samples')
+        parser.add_argument('--reduce', required=False, type=str,
+                            nargs='+', action='store', default=None,
+                            help='If given, merge these partial results from '
+                                 '--map instead of reading sailfish outputs, '
+                                 'and write the combined outputs to '
+                                 '--out-dir')
+        parser.add_argument('--sparse', required=False,
+                            action='store_true', default=False,
+                            help='If given, keep the (samples, transcripts) '
+                                 'and (samples, genes) TPMs as sparse '
+                                 'matrices of 32-bit floats, from reading '
+                                 'the files to writing them as the folders '
+                                 'tpm_transcripts, tpm_spikein and '
+                                 'tpm_genes, which can be memory-mapped with '
+                                 'rnaseek.matrix.SparseMatrix.read_dir. '
+                                 'For single-cell cohorts, where most TPMs '
+                                 'are zero')
+        parser.add_argument('--qc', required=False, action='store_true',
+                            default=False,
+                            help='If given, compute per-sample expression QC '
+                                 'while the files are read: the number of '
+                                 'transcripts detected, of genes detected '
+                                 'above each --qc-tpm-min, the spike-in '
+                                 'fraction of TPM, the total estimated reads '
+                                 'and the fraction of TPM in the top '
+                                 '--qc-top-n transcripts. Written to '
+                                 'expression_qc.csv')
+        parser.add_argument('--qc-tpm-min', required=False, type=float,
+                            nargs='+', default=[1, 10], action='store',
+                            help='TPMs above which a gene is detected, for '
+                                 '--qc. Default is 1 and 10')
+        parser.add_argument('--qc-top-n', required=False, type=int,
+                            default=10, action='store',
+                            help='Number of most expressed transcripts whose '
+                                 'fraction of TPM to compute, for --qc')
         if inOpts is None:
             self.args = vars(self.parser.parse_args())
         else:
@@ -46,7 +241,7 @@ class CommandLine(object):
         '''
         import sys
 
-        print >> sys.stderr, str
+        sys.stderr.write('{}\n'.format(str))
         self.parser.print_usage()
         return 2
 
@@ -62,105 +257,452 @@ class Usage(Exception):
 
 
 class CombineSailfish(object):
-    def __init__(self, glob_command, out_dir, n_progress):
-        """Combine sailfish output files and write them to disk
+    def __init__(self, glob_command, out_dir, n_progress,
+                 report_json=None, log=False, template=None, sparse=False,
+                 qc=False, qc_tpm_mins=(1, 10), qc_top_n=10):
+        """Combine sailfish output files
+
+        Nothing is read until ``run`` is called, or the stages ``discover``,
+        ``read``, ``transform``, ``aggregate`` and ``write`` are called one
+        at a time, each returning its results in memory.
 
         Parameters
         ----------
         glob_command : str
             Where to find sailfish output directories
-        out_dir : str
+        out_dir : str or None
             Where to output the combined matrices. Will be created if it
-            doesn't exist
+            doesn't exist. If None, ``run`` doesn't write any files
         n_progress : int
             Integer step size to show progress. E.g. for 10/58 completed
+        report_json : str, optional
+            Where to write a JSON report of the wall time, CPU time, peak
+            memory, rows and bytes of each stage. The report is also kept as
+            the attribute "report"
+        log : bool, optional
+            If True, log each finished stage as a line of JSON
+        template : str, optional
+            Regular expression with the named group "sample_id" to search for
+            in each path. Defaults to ``SAILFISH_TEMPLATE``
+        sparse : bool, optional
+            If True, the TPMs are kept as ``rnaseek.matrix.SparseMatrix``
+            matrices with a float32 "tpm" layer and only the nonzero values,
+            with samples and transcripts (or genes) in sorted order, and are
+            written as folders of arrays that ``SparseMatrix.read_dir``
+            memory-maps
+        qc : bool, optional
+            If True, compute the per-sample metrics of an ``ExpressionQC``
+            while the files are read, in the attribute "qc"
+        qc_tpm_mins, qc_top_n : optional
+            Gene detection thresholds and number of top transcripts of the
+            ``ExpressionQC``
         """
         if n_progress < 1:
             raise ValueError('"n_progress" must be 1 or greater')
 
-        # Make the directory if it's not there already
-        out_dir = os.path.abspath(os.path.expanduser(out_dir))
-        try:
-            os.mkdir(out_dir)
-        except OSError:
-            pass
+        if out_dir is not None:
+            out_dir = os.path.abspath(os.path.expanduser(out_dir))
+        self.glob_command = glob_command
+        self.out_dir = out_dir
+        self.n_progress = n_progress
+        self.template = SAILFISH_TEMPLATE if template is None else template
+        self.sparse = sparse
+        self.qc = ExpressionQC(qc_tpm_mins, qc_top_n) if qc else None
+        self.report_json = report_json
+        self.report = RunReport('combine_sailfish', log=log)
 
-        tpm_dfs = []
-        columns = ['transcript', 'length', 'tpm', 'rpkm', 'kpkm',
-                   'EstimatedNumKmers', 'EstimatedNumReads']
+    def run(self):
+        """Read all the sailfish outputs and sum the TPMs of each gene
+
+        Returns
+        -------
+        results : dict
+            (samples, transcripts) "tpm", (samples, spike-ins)
+            "tpm_spikein" and (samples, genes) "tpm_genes" matrices. The
+            last two are also written to out_dir, if it's not None, and if
+            sparse, all three are SparseMatrix and are all written. With qc,
+            also the per-sample "qc" table
+        """
+        return self.finish(self.read(self.discover()))
+
+    def finish(self, tpm):
+        """Separate the spike-ins, sum the TPMs of each gene and write the
+        results
+
+        Returns
+        -------
+        results : dict
+            See ``run``
+        """
+        tpm_spikein, tpm_transcripts = self.transform(tpm)
+        results = {'tpm': tpm, 'tpm_spikein': tpm_spikein,
+                   'tpm_genes': self.aggregate(tpm_transcripts)}
+        if self.qc is not None:
+            results['qc'] = self.qc.to_frame()
+        if self.out_dir is not None:
+            self.write(results)
+        if self.report_json is not None:
+            self.report.write(self.report_json)
+            sys.stdout.write("Wrote run report {}\n".format(self.report_json))
+        sys.stdout.write("Done, son.\n")
+        return results
+
+    @property
+    def partial_options(self):
+        """Options that partial results must share to be merged"""
+        qc = None if self.qc is None else {'tpm_mins': self.qc.tpm_mins,
+                                           'top_n': self.qc.top_n}
+        return {'sparse': self.sparse, 'qc': qc}
+
+    def map(self, partial_dir, batch=0, n_batches=1):
+        """Read the TPMs of one batch of samples into a partial result
+
+        Parameters
+        ----------
+        partial_dir : str
+            Folder to write the partial result to
+        batch : int, optional
+            0-based number of the batch of samples, e.g. an array task id
+        n_batches : int, optional
+            Total number of batches
 
-        glob_command = '{}/quant_bias_corrected.sf'.format(glob_command)
-        filenames = iglob(glob_command)
-        n_files = sum(1 for i in filenames)
+        Returns
+        -------
+        partial : rnaseek.partials.Partial
+            The (samples, transcripts) TPMs of the batch, to merge with
+            ``reduce``
+        """
+        files = select_batch(self.discover(), batch, n_batches)
+        tpm = self.read(files)
+        if self.sparse:
+            # The nonzero TPMs as a long table, and every sample and
+            # transcript, even if all their TPMs are zero
+            tables = {
+                'tpm': pd.DataFrame(
+                    {'sample_id': np.asarray(tpm.rows.sample_id)[
+                        tpm.row_indices()],
+                     'transcript': tpm.columns.values[tpm.indices],
+                     'tpm': tpm.data['tpm']},
+                    columns=['sample_id', 'transcript', 'tpm']),
+                'samples': pd.DataFrame(index=pd.Index(
+                    np.asarray(tpm.rows.sample_id), name='sample_id')),
+                'transcripts': pd.DataFrame(index=pd.Index(
+                    tpm.columns.values, name='transcript'))}
+            merge = {'transcripts': 'unique_rows'}
+        else:
+            tables, merge = {'tpm': tpm}, {}
+        if self.qc is not None:
+            tables['qc'] = self.qc.to_frame()
+        partial = Partial('combine_sailfish', self.partial_options,
+                          files.filename.tolist(), tables, merge)
+        with self.report.stage('write_partial') as stage:
+            partial.write(partial_dir)
+            stage['rows'] = partial.tables['tpm'].shape[0]
+        sys.stdout.write("Wrote partial result {}\n".format(partial_dir))
+        if self.report_json is not None:
+            self.report.write(self.report_json)
+        return partial
+
+    def reduce(self, partials):
+        """Merge partial results from ``map`` and finish combining them
+
+        Parameters
+        ----------
+        partials : list of str or rnaseek.partials.Partial
+            Partial results, or the folders they were written to, in any
+            order
+
+        Returns
+        -------
+        results : dict
+            The same as from ``run`` over all the partials' files
+        """
+        with self.report.stage('merge_partials') as stage:
+            partial = merge_partials(partials)
+            if partial.kind != 'combine_sailfish' or \
+                    partial.options != self.partial_options:
+                raise ValueError('Partial results of {} {} cannot be reduced '
+                                 'into sailfish outputs with the options '
+                                 '{}'.format(partial.kind, partial.options,
+                                             self.partial_options))
+            if self.qc is not None:
+                self.qc.rows = partial.tables['qc'].reset_index(
+                    ).values.tolist()
+            tpm = partial.tables['tpm']
+            if self.sparse:
+                sample_ids = partial.tables['samples'].index
+                transcripts = partial.tables['transcripts'].index
+                tpm = sparse_tpm(sample_ids, transcripts,
+                                 sample_ids.get_indexer(tpm.sample_id),
+                                 transcripts.get_indexer(tpm.transcript),
+                                 tpm.tpm.values)
+                stage['rows'] = tpm.shape[0]
+                stage['bytes'] = self.matrix_bytes(tpm)
+            else:
+                tpm = tpm.sort_index()
+                stage['rows'] = tpm.shape[0]
+                stage['bytes'] = frame_bytes(tpm)
+        return self.finish(tpm)
+
+    def discover(self):
+        """Table of all the quant_bias_corrected.sf files, with their size
+        and sample id (see ``rnaseek.discovery.file_table``)"""
+        glob_command = '{}/quant_bias_corrected.sf'.format(self.glob_command)
+        with self.report.stage('discover') as stage:
+            files = discover_files(glob_command, self.template)
+            stage['rows'] = files.shape[0]
+            stage['bytes'] = int(files['size'].sum())
+        return files
+
+    def read(self, files):
+        """Read the TPMs of sailfish output files into one matrix
+
+        Parameters
+        ----------
+        files : pandas.DataFrame or list of str
+            Table of files from ``discover``, or the locations of
+            <sample_id>.<anything>/quant_bias_corrected.sf files
+
+        Returns
+        -------
+        tpm : pandas.DataFrame
+            A (samples, transcripts) matrix of TPMs
+        """
+        if not isinstance(files, pd.DataFrame):
+            files = file_table(files, self.template)
+        if self.sparse:
+            return self.read_sparse(files)
+        n_files = files.shape[0]
         sys.stdout.write("Reading {} of sailfish's quant_bias_corrected.sf "
                          "files ...\n".format(n_files))
+        tpm_dfs = []
+        columns = SAILFISH_COLUMNS
+
+        with self.report.stage('read') as stage:
+            n_bytes = 0
+            for i, (filename, size, sample_id) in enumerate(zip(
+                    files.filename, files['size'], files.sample_id)):
+                # Read "tabluar" data, separated by tabs.
+                # Arguments:
+                # skiprows=5      Skip the first 5 rows
+                # names=columns   Use the column names in the list "columns"
+                # index_col=0     The first column is the row names (the row
+                #                 names are called the "index" in pandas terms)
+                df = pd.read_table(filename, skiprows=5, names=columns,
+                                   index_col=0)
+                n_bytes += size
+                if self.qc is not None:
+                    self.qc.update(sample_id, df.index.values, df.tpm.values,
+                                   df.EstimatedNumReads.values)
+
+                # Get the "series" (aka single column) of TPM
+                tpm = df.tpm
 
-        # re-initialize iterator
-        filenames = iglob(glob_command)
-
-        for i, filename in enumerate(filenames):
-            # Read "tabluar" data, separated by tabs.
-            # Arguments:
-            # skiprows=5      Skip the first 5 rows
-            # names=columns   Use the column names in the list "columns"
-            # index_col=0     The first column is the row names (the row names
-            #                 are called the "index" in pandas terms)
-            df = pd.read_table(filename, skiprows=5, names=columns,
-                               index_col=0)
-
-            # Get the "series" (aka single column) of TPM
-            tpm = df.tpm
-
-            # To get the sample ID, split by the folder identifier, "/",
-            # and take the second-to-last item (via "[-2]"), which has the
-            # sample id, then split on the period, and take the first item
-            # via "[0]"
-            sample_id = filename.split('/')[-2].split('.')[0]
-
-            # Change the name of the series to the sample id
-            tpm.name = sample_id
-            tpm_dfs.append(tpm)
-
-            if (i+1) % n_progress == 0:
-                sys.stdout.write("\t{}/{} files read\n".format(i+1, n_files))
+                # Change the name of the series to the sample id
+                tpm.name = sample_id
+                tpm_dfs.append(tpm)
+
+                if (i+1) % self.n_progress == 0:
+                    sys.stdout.write("\t{}/{} files read\n".format(i+1,
+                                                                   n_files))
+            stage['rows'] = sum(x.shape[0] for x in tpm_dfs)
+            stage['bytes'] = n_bytes
         sys.stdout.write("\tDone.\n")
-        tpm = pd.concat(tpm_dfs, axis=1).T.sort_index()
+        with self.report.stage('merge') as stage:
+            tpm = pd.concat(tpm_dfs, axis=1).T.sort_index()
+            del tpm_dfs
+            stage['rows'] = tpm.shape[0]
+            stage['bytes'] = frame_bytes(tpm)
+        return tpm
+
+    def read_sparse(self, files):
+        """Read the nonzero TPMs of sailfish output files into a sparse
+        matrix, without ever making the dense matrix
+
+        Parameters
+        ----------
+        files : pandas.DataFrame
+            Table of files from ``discover``
 
+        Returns
+        -------
+        tpm : rnaseek.matrix.SparseMatrix
+            A (samples, transcripts) matrix of float32 TPMs, as from
+            ``sparse_tpm``
+        """
+        n_files = files.shape[0]
+        sys.stdout.write("Reading the nonzero TPMs of {} of sailfish's "
+                         "quant_bias_corrected.sf files ...\n".format(n_files))
+        # Transcripts are usually in the same order in every file, so they
+        # only need to be looked up when they're not
+        transcripts = pd.Index([], dtype=object)
+        rows, cols, values = [], [], []
+        with self.report.stage('read') as stage:
+            n_bytes = 0
+            usecols = ['transcript', 'tpm']
+            if self.qc is not None:
+                usecols.append('EstimatedNumReads')
+            for i, (filename, size, sample_id) in enumerate(zip(
+                    files.filename, files['size'], files.sample_id)):
+                df = pd.read_table(filename, skiprows=5,
+                                   names=SAILFISH_COLUMNS, usecols=usecols,
+                                   dtype={'transcript': object,
+                                          'tpm': np.float32})
+                n_bytes += size
+                names = df.transcript.values
+                if self.qc is not None:
+                    self.qc.update(sample_id, names, df.tpm.values,
+                                   df.EstimatedNumReads.values)
+                if np.array_equal(names, transcripts.values):
+                    positions = np.arange(names.shape[0])
+                else:
+                    positions = transcripts.get_indexer(names)
+                    if (positions < 0).any():
+                        transcripts = transcripts.append(pd.Index(
+                            names[positions < 0], dtype=object))
+                        positions = transcripts.get_indexer(names)
+                tpm = df.tpm.values
+                nonzero = tpm != 0
+                rows.append(np.repeat(np.int64(i), nonzero.sum()))
+                cols.append(positions[nonzero])
+                values.append(tpm[nonzero])
+
+                if (i+1) % self.n_progress == 0:
+                    sys.stdout.write("\t{}/{} files read\n".format(i+1,
+                                                                   n_files))
+            stage['rows'] = sum(x.shape[0] for x in values)
+            stage['bytes'] = n_bytes
+        sys.stdout.write("\tDone.\n")
+        with self.report.stage('merge') as stage:
+            tpm = sparse_tpm(
+                files.sample_id.values, transcripts.values,
+                np.concatenate(rows) if rows else np.zeros(0, np.int64),
+                np.concatenate(cols) if cols else np.zeros(0, np.int64),
+                np.concatenate(values) if values else np.zeros(0))
+            del rows, cols, values
+            stage['rows'] = tpm.shape[0]
+            stage['bytes'] = self.matrix_bytes(tpm)
+        return tpm
+
+    @staticmethod
+    def matrix_bytes(matrix):
+        """Bytes of the nonzero positions and values of a SparseMatrix"""
+        return int(matrix.indptr.nbytes + matrix.indices.nbytes + sum(
+            x.nbytes for x in matrix.data.values()))
+
+    def transform(self, tpm):
+        """Separate out spike-ins from the transcripts
+
+        Returns
+        -------
+        tpm_spikein : pandas.DataFrame
+            TPMs of everything that's not an ensembl transcript
+        tpm_transcripts : pandas.DataFrame
+            TPMs of the ensembl transcripts
+        """
         sys.stdout.write("Separating out spike-ins from regular genes ...\n")
-        # Get nonstandard genes, i.e. everything that's not an ensembl ID
-        spikein_columns = tpm.columns.map(lambda x: not x.startswith('ENST'))
-        tpm_spikein = tpm.ix[:, spikein_columns]
+        with self.report.stage('transform') as stage:
+            # Get nonstandard genes, i.e. everything that's not an ensembl ID
+            spikein_columns = np.array([is_spikein(x) for x in tpm.columns],
+                                       dtype=bool)
+            if self.sparse:
+                tpm_spikein = tpm.take_columns(np.flatnonzero(spikein_columns))
+                tpm_transcripts = tpm.take_columns(
+                    np.flatnonzero(~spikein_columns))
+                stage['bytes'] = self.matrix_bytes(tpm_spikein)
+            else:
+                tpm_spikein = tpm.loc[:, spikein_columns]
+                tpm_transcripts = tpm.loc[:, ~spikein_columns]
+                stage['bytes'] = frame_bytes(tpm_spikein)
+            stage['rows'] = tpm_spikein.shape[1]
         sys.stdout.write("\tDone.\n")
+        return tpm_spikein, tpm_transcripts
+
+    def aggregate(self, tpm_transcripts):
+        """Sum the TPMs of all the transcripts of each gene
 
+        Returns
+        -------
+        tpm_genes : pandas.DataFrame
+            A (samples, genes) matrix with unversioned ensembl gene ids
+        """
         sys.stdout.write("Summing TPM expression of all transcripts in a "
                          "gene ...\n")
-        # Sum expression of all transcripts of a gene
-        tpm_transcripts = tpm.ix[:, ~spikein_columns]
-        ensembl_ids = tpm_transcripts.columns.map(
-            lambda x: x.split('|')[1].split('.')[0])
-        tpm_transcripts.columns = ensembl_ids
-        tpm_genes = tpm_transcripts.groupby(level=0, axis=1).sum()
+        with self.report.stage('aggregate') as stage:
+            ensembl_ids = tpm_transcripts.columns.map(gene_id)
+            if self.sparse:
+                tpm_genes = tpm_transcripts.sum_columns(ensembl_ids)
+                stage['bytes'] = self.matrix_bytes(tpm_genes)
+            else:
+                tpm_genes = tpm_transcripts.T.groupby(ensembl_ids).sum().T
+                stage['bytes'] = frame_bytes(tpm_genes)
+            stage['rows'] = tpm_genes.shape[1]
         sys.stdout.write("\tDone.\n")
+        return tpm_genes
+
+    def write(self, results):
+        """Write the spike-in and gene TPMs of ``run`` as csv files to
+        out_dir
+
+        Returns
+        -------
+        filenames : list of str
+            Locations of the written files
+        """
+        # Make the directory if it's not there already
+        try:
+            os.mkdir(self.out_dir)
+        except OSError:
+            pass
 
         # Save the output files
-        filename_to_df = {'tpm_spikein.csv': tpm_spikein,
-                          'tpm_genes.csv': tpm_genes}
+        if self.sparse:
+            filename_to_df = {'tpm_transcripts': results['tpm'],
+                              'tpm_spikein': results['tpm_spikein'],
+                              'tpm_genes': results['tpm_genes']}
+        else:
+            filename_to_df = {'tpm_spikein.csv': results['tpm_spikein'],
+                              'tpm_genes.csv': results['tpm_genes']}
+        if 'qc' in results:
+            filename_to_df['expression_qc.csv'] = results['qc']
 
         sys.stdout.write("Writing output files ...\n")
-        for filename, df in filename_to_df.items():
-            full_filename = '{}/{}'.format(out_dir, filename)
-            df.to_csv(full_filename)
-            sys.stdout.write("\tWrote {}\n".format(full_filename))
-        sys.stdout.write("Done, son.\n")
+        with self.report.stage('write') as stage:
+            written = []
+            for filename, df in filename_to_df.items():
+                full_filename = '{}/{}'.format(self.out_dir, filename)
+                if isinstance(df, SparseMatrix):
+                    df.write_dir(full_filename)
+                    written.extend(os.path.join(full_filename, x)
+                                   for x in os.listdir(full_filename))
+                else:
+                    df.to_csv(full_filename)
+                    written.append(full_filename)
+                sys.stdout.write("\tWrote {}\n".format(full_filename))
+            stage['rows'] = sum(df.shape[0] for df in filename_to_df.values())
+            stage['bytes'] = file_bytes(written)
+        return written
 
 
 if __name__ == '__main__':
     try:
         cl = CommandLine()
-
-
-
-        CombineSailfish(cl.args['glob_command'], cl.args['out_dir'],
-                        cl.args['n_progress'])
-    except Usage, err:
-        cl.do_usage_and_die()
\ No newline at end of file
+        if cl.args['log_json']:
+            log_to_stderr()
+        combine = CombineSailfish(cl.args['glob_command'], cl.args['out_dir'],
+                                  cl.args['n_progress'],
+                                  report_json=cl.args['report'],
+                                  log=cl.args['log_json'],
+                                  template=cl.args['template'],
+                                  sparse=cl.args['sparse'],
+                                  qc=cl.args['qc'],
+                                  qc_tpm_mins=cl.args['qc_tpm_min'],
+                                  qc_top_n=cl.args['qc_top_n'])
+        if cl.args['map'] is not None:
+            combine.map(cl.args['map'], *cl.args['batch'])
+        elif cl.args['reduce'] is not None:
+            combine.reduce(cl.args['reduce'])
+        else:
+            combine.run()
+    except Usage as err:
+        cl.do_usage_and_die(err.msg)
\ No newline at end of file
@@ -3,7 +3,6 @@
 __author__ = 'olga'
 
 import argparse
-from glob import iglob
 import os
 import string
 import sys
@@ -11,6 +10,21 @@ import sys
 import numpy as np
 import pandas as pd
 
+from rnaseek.discovery import discover_files, file_table
+from rnaseek.instrumentation import (RunReport, file_bytes, frame_bytes,
+                                     log_to_stderr)
+from rnaseek.junctions import (COUNT_LAYERS, JUNCTION_COLUMNS,
+                               combine_junctions)
+from rnaseek.matrix import SparseMatrix
+from rnaseek.partials import Partial, merge_partials, select_batch
+
+# Template of the sample id in the paths of STAR logs, as
+# <sample_id>.<anything>Log.final.out
+STAR_TEMPLATE = r'(?P<sample_id>[^/.]*)[^/]*$'
+
+# Subfolder of the partial results of --map with the SJ.out.tab junctions
+JUNCTIONS_PARTIAL = 'junctions'
+
 class CommandLine(object):
     def __init__(self, inOpts=None):
         self.parser = parser = argparse.ArgumentParser(
@@ -34,6 +48,56 @@ class CommandLine(object):
                                  "20/58 files completed. Can increase this if"
                                  "you have thousands of files, or decrease to"
                                  "1 if you only have a few")
+        parser.add_argument('--report', required=False, type=str,
+                            action='store', default=None,
+                            help='Where to write a JSON report of the time '
+                                 'and memory used by each stage. The report '
+                                 'of --sj-glob-command is written next to '
+                                 'it, with ".junctions" before the '
+                                 'extension')
+        parser.add_argument('--log-json', required=False,
+                            action='store_true', default=False,
+                            help='If given, log each finished stage as a '
+                                 'line of JSON to stderr')
+        parser.add_argument('--template', required=False, type=str,
+                            action='store', default=None,
+                            help='Regular expression with the named group '
+                                 '"sample_id" to get from the path of each '
+                                 'file')
+        parser.add_argument('--sj-glob-command', required=False, type=str,
+                            action='store', default=None,
+                            help='Where to find STAR\'s SJ.out.tab files, '
+                                 'e.g. "./*SJ.out.tab". If given, their '
+                                 'junction counts are also combined into a '
+                                 'sparse junction x sample matrix, written '
+                                 'to the output folder as junctions.npz. '
+                                 'With --map and --reduce, the junctions '
+                                 'are mapped and reduced with the logs, in '
+                                 'the subfolder "junctions" of each partial '
+                                 'result')
+        parser.add_argument('--n-jobs', required=False, type=int,
+                            action='store', default=1,
+                            help='Number of processes to read SJ.out.tab '
+                                 'files with. Default is 1')
+        parser.add_argument('--map', required=False, type=str,
+                            action='store', default=None,
+                            help='If given, only read the Log.final.out '
+                                 'files of one batch of samples (see '
+                                 '--batch), and write them to this folder as '
+                                 'a partial result, e.g. from one task of a '
+                                 'cluster array job')
+        parser.add_argument('--batch', required=False, type=int, nargs=2,
+                            action='store', default=(0, 1),
+                            metavar=('BATCH', 'N_BATCHES'),
+                            help='With --map, the 0-based number of the '
+                                 'batch of samples to read, and the total '
+                                 'number of batches. Default is all samples')
+        parser.add_argument('--reduce', required=False, type=str,
+                            nargs='+', action='store', default=None,
+                            help='If given, merge these partial results from '
+                                 '--map instead of reading Log.final.out '
+                                 'files, and write the combined mapping stats '
+                                 'to --out-dir')
         if inOpts is None:
             self.args = vars(self.parser.parse_args())
         else:
@@ -48,7 +112,7 @@ class CommandLine(object):
         '''
         import sys
 
-        print >> sys.stderr, str
+        sys.stderr.write('{}\n'.format(str))
         self.parser.print_usage()
         return 2
 
@@ -64,95 +128,233 @@ class Usage(Exception):
 
 
 class CombineSTARLogFinalOut(object):
-    def __init__(self, glob_command, out_dir, n_progress):
+    def __init__(self, glob_command, out_dir, n_progress,
+                 report_json=None, log=False, template=None):
         """
-        Given a glob command describing where all the Log.final.out files are from
-        STAR, return a pd.DataFrame with each sample (id) as its own column.
+        Given a glob command describing where all the Log.final.out files are
+        from STAR, combine them into a pd.DataFrame with each sample (id) as
+        its own row.
+
+        Nothing is read until ``run`` is called, or the stages ``discover``,
+        ``read``, ``transform`` and ``write`` are called one at a time, each
+        returning its results in memory.
 
         @param glob_command: A string that will be passed to glob
-        @param ids_function: A function (could be an anonymous function like a
-        lambda) that specifies how to get the sample ID from the filename. Could
-        also be a list of IDs, but they must be in the exact order as in the
-        directories, which is why a function can be easier.
-
-        Example:
-        >>> glob_command = '/Users/olga/workspace-git/single_cell/analysis/mapping_stats/*.Log.final.out'
-        >>> mapping_stats = self.log_final_out(glob_command,
-        ...             lambda x: '_'.join(x.split('/')[-1].split('_')[:2]))
+        @param out_dir: Where to write mapping_stats.csv. If None, ``run``
+        doesn't write any files
+        @param n_progress: Integer step size to show progress
+        @param report_json: Where to write a JSON report of the wall time, CPU
+        time, peak memory, rows and bytes of each stage. The report is also
+        kept as the attribute "report"
+        @param log: If True, log each finished stage as a line of JSON
+        @param template: Regular expression with the named group "sample_id"
+        to search for in each path. Defaults to ``STAR_TEMPLATE``
+
+        Example::
+
+            glob_command = '/Users/olga/workspace-git/single_cell/analysis/mapping_stats/*.Log.final.out'
+            mapping_stats = CombineSTARLogFinalOut(glob_command, None, 100).run()
         """
-        out_dir = out_dir.rstrip('/')
-        out_dir = os.path.abspath(os.path.expanduser(out_dir))
-
         if n_progress < 1:
             raise ValueError('"n_progress" must be 1 or greater')
 
-        # Make the directory if it's not there already
-        out_dir = os.path.abspath(os.path.expanduser(out_dir))
-        try:
-            os.mkdir(out_dir)
-        except OSError:
-            pass
+        if out_dir is not None:
+            out_dir = os.path.abspath(os.path.expanduser(out_dir.rstrip('/')))
+        self.glob_command = glob_command
+        self.out_dir = out_dir
+        self.n_progress = n_progress
+        self.template = STAR_TEMPLATE if template is None else template
+        self.report_json = report_json
+        self.report = RunReport('combine_star_mapping_stats', log=log)
+
+    def run(self):
+        """Read all the Log.final.out files and add splicing percentages
+
+        Returns
+        -------
+        mapping_stats : pandas.DataFrame
+            A (samples, statistics) table, which is also written to out_dir
+            as mapping_stats.csv, if it's not None
+        """
+        return self.finish(self.read(self.discover()))
 
-        series = []
+    def finish(self, mapping_stats):
+        """Add splicing percentages to the (statistics, samples) table
+        from ``read``, and write it
 
-        filenames = iglob(glob_command)
-        n_files = sum(1 for i in filenames)
+        Returns
+        -------
+        mapping_stats : pandas.DataFrame
+            See ``run``
+        """
+        mapping_stats = self.transform(mapping_stats)
+        if self.out_dir is not None:
+            self.write(mapping_stats)
+        if self.report_json is not None:
+            self.report.write(self.report_json)
+            sys.stdout.write("Wrote run report {}\n".format(self.report_json))
+        return mapping_stats
+
+    def map(self, partial_dir, batch=0, n_batches=1):
+        """Read the Log.final.out files of one batch of samples into a
+        partial result
+
+        Parameters
+        ----------
+        partial_dir : str
+            Folder to write the partial result to
+        batch : int, optional
+            0-based number of the batch of samples, e.g. an array task id
+        n_batches : int, optional
+            Total number of batches
+
+        Returns
+        -------
+        partial : rnaseek.partials.Partial
+            The (samples, statistics) table of the batch, to merge with
+            ``reduce``
+        """
+        files = select_batch(self.discover(), batch, n_batches)
+        mapping_stats = self.read(files).T.infer_objects()
+        partial = Partial('combine_star_mapping_stats', {},
+                          files.filename.tolist(),
+                          {'mapping_stats': mapping_stats})
+        with self.report.stage('write_partial') as stage:
+            partial.write(partial_dir)
+            stage['rows'] = mapping_stats.shape[0]
+        sys.stdout.write("Wrote partial result {}\n".format(partial_dir))
+        if self.report_json is not None:
+            self.report.write(self.report_json)
+        return partial
+
+    def reduce(self, partials):
+        """Merge partial results from ``map`` and finish combining them
+
+        Parameters
+        ----------
+        partials : list of str or rnaseek.partials.Partial
+            Partial results, or the folders they were written to, in any
+            order
+
+        Returns
+        -------
+        mapping_stats : pandas.DataFrame
+            The same as from ``run`` over all the partials' files
+        """
+        with self.report.stage('merge_partials') as stage:
+            partial = merge_partials(partials)
+            if partial.kind != 'combine_star_mapping_stats':
+                raise ValueError('Partial results of {} cannot be reduced '
+                                 'into mapping stats'.format(partial.kind))
+            mapping_stats = partial.tables['mapping_stats'].T
+            stage['rows'] = mapping_stats.shape[1]
+            stage['bytes'] = frame_bytes(mapping_stats)
+        return self.finish(mapping_stats)
+
+    def discover(self):
+        """Table of all the Log.final.out files, with their size and
+        sample id (see ``rnaseek.discovery.file_table``)"""
+        with self.report.stage('discover') as stage:
+            files = discover_files(self.glob_command, self.template)
+            stage['rows'] = files.shape[0]
+            stage['bytes'] = int(files['size'].sum())
+        return files
+
+    def read(self, files):
+        """Read Log.final.out files into a (statistics, samples) table
+
+        ``files`` is the table of files from ``discover``, or a list of their
+        locations, where by default the sample id is the part of the file
+        name before the first "."
+        """
+        if not isinstance(files, pd.DataFrame):
+            files = file_table(files, self.template)
+        n_files = files.shape[0]
         sys.stdout.write("Reading {} of STAR's *Log.final.out "
                          "files ...\n".format(n_files))
-
-        # re-initialize iterator
-        filenames = iglob(glob_command)
-
-        for i, filename in enumerate(filenames):
-            s = pd.read_table(filename, header=None, index_col=0, squeeze=True)
-            s.index = s.index.map(
-                lambda x: x.rstrip(' |').rstrip(':').rstrip().lstrip())
-            converted = [self.maybe_convert_to_float(x.strip('%'))
-                         if type(x) != float else x for x in s]
-            sample_id = os.path.basename(filename).split('.')[0]
-            series.append(pd.Series(converted, index=s.index, name=sample_id))
-
-            if (i + 1) % n_progress == 0:
-                sys.stdout.write("\t{}/{} files read\n".format(i + 1, n_files))
+        series = []
+        with self.report.stage('read') as stage:
+            n_bytes = 0
+            for i, (filename, size, sample_id) in enumerate(zip(
+                    files.filename, files['size'], files.sample_id)):
+                s = pd.read_table(filename, header=None,
+                                  index_col=0).iloc[:, 0]
+                n_bytes += size
+                s.index = s.index.map(
+                    lambda x: x.rstrip(' |').rstrip(':').rstrip().lstrip())
+                converted = [self.maybe_convert_to_float(x.strip('%'))
+                             if type(x) != float else x for x in s]
+                series.append(pd.Series(converted, index=s.index,
+                                        name=sample_id))
+
+                if (i + 1) % self.n_progress == 0:
+                    sys.stdout.write("\t{}/{} files read\n".format(i + 1,
+                                                                   n_files))
+            stage['rows'] = len(series)
+            stage['bytes'] = n_bytes
         sys.stdout.write("\tDone.\n")
 
         sys.stdout.write("Merging STAR outputs into a single dataframe...\n")
-        mapping_stats = pd.concat(series, axis=1)
+        with self.report.stage('merge') as stage:
+            mapping_stats = pd.concat(series, axis=1)
+            stage['rows'] = mapping_stats.shape[1]
+            stage['bytes'] = frame_bytes(mapping_stats)
         sys.stdout.write("\tDone.\n")
+        return mapping_stats
 
-
+    def transform(self, mapping_stats):
+        """Add the percentages of each type of splice, and make samples the
+        rows"""
         sys.stdout.write("Adding percentages of splicing events ...\n")
-        # Turn all the number of splicing events into percentages for
-        # statistical testing
-        number_splicing_event_names = ['Number of splices: Annotated (sjdb)',
-                                       'Number of splices: GT/AG',
-                                       'Number of splices: GC/AG',
-                                       'Number of splices: AT/AC',
-                                       'Number of splices: Non-canonical']
-        percent_splicing_event_names = [x.replace('Number of', '%')
-                                        for x in number_splicing_event_names]
-
-        total_splicing_events = mapping_stats.ix['Number of splices: Total',
-                                :].replace(0, np.nan).values.astype(float)
-
-        pieces = []
-        for num_events in zip(number_splicing_event_names):
-            pieces.append(100.0 * mapping_stats.ix[num_events,
-                                  :].values \
-                          / total_splicing_events)
-        pieces = [np.reshape(piece, len(mapping_stats.columns)) for piece in
-                  pieces]
-        percent_splicing = pd.DataFrame(pieces,
-                                        index=percent_splicing_event_names,
-                                        columns=mapping_stats.columns)
-        df = pd.concat((mapping_stats, percent_splicing)).T.sort_index()
+        with self.report.stage('transform') as stage:
+            # Turn all the number of splicing events into percentages for
+            # statistical testing
+            number_splicing_event_names = [
+                'Number of splices: Annotated (sjdb)',
+                'Number of splices: GT/AG',
+                'Number of splices: GC/AG',
+                'Number of splices: AT/AC',
+                'Number of splices: Non-canonical']
+            percent_splicing_event_names = [
+                x.replace('Number of', '%')
+                for x in number_splicing_event_names]
+
+            total_splicing_events = mapping_stats.loc[
+                'Number of splices: Total', :].replace(
+                0, np.nan).values.astype(float)
+
+            pieces = []
+            for num_events in zip(number_splicing_event_names):
+                pieces.append(100.0 * mapping_stats.loc[list(num_events),
+                                      :].values.astype(float) \
+                              / total_splicing_events)
+            pieces = [np.reshape(piece, len(mapping_stats.columns))
+                      for piece in pieces]
+            percent_splicing = pd.DataFrame(
+                pieces, index=percent_splicing_event_names,
+                columns=mapping_stats.columns)
+            df = pd.concat((mapping_stats, percent_splicing)).T.sort_index()
+            stage['rows'] = df.shape[0]
+            stage['bytes'] = frame_bytes(df)
         sys.stdout.write("\tDone.\n")
+        return df
 
-        csv = '{}/mapping_stats.csv'.format(out_dir)
+    def write(self, mapping_stats):
+        """Write the mapping stats to out_dir as mapping_stats.csv"""
+        # Make the directory if it's not there already
+        try:
+            os.mkdir(self.out_dir)
+        except OSError:
+            pass
+        csv = '{}/mapping_stats.csv'.format(self.out_dir)
 
         sys.stdout.write("Writing mapping stats ...\n")
-        df.to_csv(csv)
+        with self.report.stage('write') as stage:
+            mapping_stats.to_csv(csv)
+            stage['rows'] = mapping_stats.shape[0]
+            stage['bytes'] = file_bytes([csv])
         sys.stdout.write("\tWrote {}\n".format(csv))
+        return csv
 
     @staticmethod
     def maybe_convert_to_float(x):
@@ -214,7 +416,7 @@ class CombineSTARLogFinalOut(object):
             stat2 = s2[ind]
 
             try:
-                stat1_float = np.float(stat1)
+                stat1_float = float(stat1)
             except ValueError:
                 S[ind] = stat1
                 continue
@@ -263,7 +465,7 @@ class CombineSTARLogFinalOut(object):
         for col in duplicate_columns:
             original_col = col[:-1]
             merged_columns[original_col] = self.merge_mapping_stats(
-                mapping_stats.ix[:, col], mapping_stats.ix[:, original_col])
+                mapping_stats.loc[:, col], mapping_stats.loc[:, original_col])
 
         # Remove duplicately-named columns, e.g. M1_01 and M1_01a
         mapping_stats = mapping_stats.drop((x for x in duplicate_columns),
@@ -307,20 +509,245 @@ class CombineSTARLogFinalOut(object):
             # but in new ones:
             if marker in seen:
                 seen[marker] += 1
-                result.append(item + string.lowercase[seen[marker] - 2])
+                result.append(item + string.ascii_lowercase[seen[marker] - 2])
                 continue
             seen[marker] = 1
             result.append(item)
         return result
 
 
+class CombineSTARJunctions(object):
+    def __init__(self, glob_command, out_dir, n_progress, n_jobs=1,
+                 report_json=None, log=False, template=None):
+        """
+        Given a glob command describing where all the SJ.out.tab files are
+        from STAR, combine their unique and multi-mapped junction read counts
+        into one sparse (junctions, samples) matrix. Each junction is stored
+        once, with its strand, intron motif and whether it was annotated.
+
+        Nothing is read until ``run`` is called, or the stages ``discover``,
+        ``read`` and ``write`` are called one at a time, each returning its
+        results in memory.
+
+        @param glob_command: A string that will be passed to glob
+        @param out_dir: Where to write junctions.npz. If None, ``run``
+        doesn't write any files
+        @param n_progress: Integer step size to show progress
+        @param n_jobs: Number of processes to read the files with
+        @param report_json: Where to write a JSON report of the wall time, CPU
+        time, peak memory, rows and bytes of each stage. The report is also
+        kept as the attribute "report"
+        @param log: If True, log each finished stage as a line of JSON
+        @param template: Regular expression with the named group "sample_id"
+        to search for in each path. Defaults to ``STAR_TEMPLATE``
+
+        Example::
+
+            junctions = CombineSTARJunctions('./*SJ.out.tab', None, 100).run()
+            unique_reads = junctions.to_frame(
+                'unique_reads', index=['chrom', 'start', 'stop', 'strand'])
+        """
+        if n_progress < 1:
+            raise ValueError('"n_progress" must be 1 or greater')
+        if n_jobs < 1:
+            raise ValueError('"n_jobs" must be 1 or greater')
+
+        if out_dir is not None:
+            out_dir = os.path.abspath(os.path.expanduser(out_dir.rstrip('/')))
+        self.glob_command = glob_command
+        self.out_dir = out_dir
+        self.n_progress = n_progress
+        self.n_jobs = n_jobs
+        self.template = STAR_TEMPLATE if template is None else template
+        self.report_json = report_json
+        self.report = RunReport('combine_star_junctions', log=log)
+
+    def run(self):
+        """Read all the SJ.out.tab files into a sparse matrix
+
+        Returns
+        -------
+        junctions : rnaseek.matrix.SparseMatrix
+            A (junctions, samples) matrix of "unique_reads" and
+            "multi_reads", which is also written to out_dir as
+            junctions.npz, if it's not None
+        """
+        return self.finish(self.read(self.discover()))
+
+    def map(self, partial_dir, batch=0, n_batches=1):
+        """Read the SJ.out.tab files of one batch of samples into a
+        partial result
+
+        The partial has the "counts" of each junction and sample as a long
+        table, the metadata of the batch's "junctions", and its "samples"
+
+        Parameters
+        ----------
+        partial_dir : str
+            Folder to write the partial result to
+        batch : int, optional
+            0-based number of the batch of samples, e.g. an array task id
+        n_batches : int, optional
+            Total number of batches
+
+        Returns
+        -------
+        partial : rnaseek.partials.Partial
+            The junction counts of the batch, to merge with ``reduce``
+        """
+        files = select_batch(self.discover(), batch, n_batches)
+        junctions = self.read(files)
+        keys = ['chrom', 'start', 'stop']
+        rows = junctions.rows.iloc[junctions.row_indices()]
+        counts = pd.DataFrame(
+            dict([(key, rows[key].values) for key in keys] +
+                 [('sample_id', junctions.columns.values[junctions.indices])] +
+                 [(layer, junctions.data[layer]) for layer in COUNT_LAYERS]),
+            columns=keys + ['sample_id'] + COUNT_LAYERS)
+        samples = pd.DataFrame(
+            {'n_junctions': np.bincount(junctions.indices,
+                                        minlength=junctions.shape[1])},
+            index=pd.Index(junctions.columns, name='sample_id'))
+        partial = Partial('combine_star_junctions', {},
+                          files.filename.tolist(),
+                          {'counts': counts.set_index(keys + ['sample_id']),
+                           'junctions': junctions.rows.set_index(keys),
+                           'samples': samples},
+                          merge={'junctions': 'unique_rows'})
+        with self.report.stage('write_partial') as stage:
+            partial.write(partial_dir)
+            stage['rows'] = counts.shape[0]
+        sys.stdout.write("Wrote partial result {}\n".format(partial_dir))
+        if self.report_json is not None:
+            self.report.write(self.report_json)
+        return partial
+
+    def reduce(self, partials):
+        """Merge partial results from ``map`` and finish combining them
+
+        Parameters
+        ----------
+        partials : list of str or rnaseek.partials.Partial
+            Partial results, or the folders they were written to, in any
+            order
+
+        Returns
+        -------
+        junctions : rnaseek.matrix.SparseMatrix
+            The same as from ``run`` over all the partials' files
+        """
+        with self.report.stage('merge_partials') as stage:
+            partial = merge_partials(partials)
+            if partial.kind != 'combine_star_junctions':
+                raise ValueError('Partial results of {} cannot be reduced '
+                                 'into junctions'.format(partial.kind))
+            counts = partial.tables['counts']
+            rows = partial.tables['junctions']
+            sample_ids = partial.tables['samples'].index
+            row = rows.index.get_indexer(counts.index.droplevel('sample_id'))
+            col = sample_ids.get_indexer(
+                counts.index.get_level_values('sample_id'))
+            rows = rows.reset_index()[JUNCTION_COLUMNS]
+            rows = rows.astype({'start': np.int64, 'stop': np.int64,
+                                'motif': np.int8, 'annotated': bool})
+            junctions = SparseMatrix.from_coo(
+                row, col.astype(np.int32),
+                dict((layer, counts[layer].values.astype(np.uint32))
+                     for layer in COUNT_LAYERS),
+                rows, list(sample_ids))
+            stage['rows'] = junctions.nnz
+        return self.finish(junctions)
+
+    def finish(self, junctions):
+        """Write the junction counts from ``read`` or ``reduce``, and the
+        run report"""
+        if self.out_dir is not None:
+            self.write(junctions)
+        if self.report_json is not None:
+            self.report.write(self.report_json)
+            sys.stdout.write("Wrote run report {}\n".format(self.report_json))
+        return junctions
+
+    def discover(self):
+        """Table of all the SJ.out.tab files, with their size and sample id
+        (see ``rnaseek.discovery.file_table``)"""
+        with self.report.stage('discover') as stage:
+            files = discover_files(self.glob_command, self.template)
+            stage['rows'] = files.shape[0]
+            stage['bytes'] = int(files['size'].sum())
+        return files
+
+    def read(self, files):
+        """Read SJ.out.tab files into a sparse (junctions, samples) matrix
+
+        ``files`` is the table of files from ``discover``, or a list of their
+        locations, where by default the sample id is the part of the file
+        name before the first "."
+        """
+        if not isinstance(files, pd.DataFrame):
+            files = file_table(files, self.template)
+        sys.stdout.write("Reading {} of STAR's *SJ.out.tab files with {} "
+                         "processes ...\n".format(files.shape[0],
+                                                  self.n_jobs))
+        with self.report.stage('read') as stage:
+            junctions = combine_junctions(files.filename.tolist(),
+                                          files.sample_id.tolist(),
+                                          n_jobs=self.n_jobs)
+            stage['rows'] = junctions.nnz
+            stage['bytes'] = int(files['size'].sum())
+        sys.stdout.write("\tDone. {} junctions in {} samples\n".format(
+            *junctions.shape))
+        return junctions
+
+    def write(self, junctions):
+        """Write the junction counts to out_dir as junctions.npz"""
+        try:
+            os.mkdir(self.out_dir)
+        except OSError:
+            pass
+        npz = '{}/junctions.npz'.format(self.out_dir)
+
+        sys.stdout.write("Writing junction counts ...\n")
+        with self.report.stage('write') as stage:
+            junctions.write(npz)
+            stage['rows'] = junctions.nnz
+            stage['bytes'] = file_bytes([npz])
+        sys.stdout.write("\tWrote {}\n".format(npz))
+        return npz
 
 
 if __name__ == '__main__':
     try:
         cl = CommandLine()
-
-        CombineSTARLogFinalOut(cl.args['glob_command'], cl.args['out_dir'],
-                        cl.args['n_progress'])
-    except Usage, err:
-        cl.do_usage_and_die()
\ No newline at end of file
+        if cl.args['log_json']:
+            log_to_stderr()
+        combine = CombineSTARLogFinalOut(
+            cl.args['glob_command'], cl.args['out_dir'],
+            cl.args['n_progress'], report_json=cl.args['report'],
+            log=cl.args['log_json'], template=cl.args['template'])
+        if cl.args['map'] is not None:
+            combine.map(cl.args['map'], *cl.args['batch'])
+        elif cl.args['reduce'] is not None:
+            combine.reduce(cl.args['reduce'])
+        else:
+            combine.run()
+        if cl.args['sj_glob_command'] is not None:
+            report_json = cl.args['report']
+            if report_json is not None:
+                report_json = '{0}.junctions{1}'.format(
+                    *os.path.splitext(report_json))
+            junctions = CombineSTARJunctions(
+                cl.args['sj_glob_command'], cl.args['out_dir'],
+                cl.args['n_progress'], n_jobs=cl.args['n_jobs'],
+                report_json=report_json, log=cl.args['log_json'],
+                template=cl.args['template'])
+            if cl.args['map'] is not None:
+                junctions.map(os.path.join(cl.args['map'], JUNCTIONS_PARTIAL),
+                              *cl.args['batch'])
+            elif cl.args['reduce'] is not None:
+                junctions.reduce([os.path.join(x, JUNCTIONS_PARTIAL)
+                                  for x in cl.args['reduce']])
+            else:
+                junctions.run()
+    except Usage as err:
+        cl.do_usage_and_die(err.msg)
\ No newline at end of file
@@ -46,7 +46,7 @@ class CommandLine(object):
         '''
         import sys
 
-        print >> sys.stderr, str
+        sys.stderr.write('{}\n'.format(str))
         self.parser.print_usage()
         return 2
 
@@ -151,5 +151,5 @@ if __name__ == '__main__':
 
         CombineSailfish(cl.args['glob_command'], cl.args['out_dir'],
                         cl.args['n_progress'])
-    except Usage, err:
-        cl.do_usage_and_die()
\ No newline at end of file
+    except Usage as err:
+        cl.do_usage_and_die(err.msg)
\ No newline at end of file
@@ -36,10 +36,13 @@ setup(
     url='https://github.com/olgabot/rnaseek',
     packages=[
         'rnaseek',
+        'rnaseek.maxentscan',
+        'rnaseek.scripts',
     ],
     scripts=scripts,
     package_dir={'rnaseek':
                  'rnaseek'},
+    package_data={'rnaseek.maxentscan': ['me2x5', 'splicemodels/*']},
     include_package_data=True,
     install_requires=requirements,
     license="BSD",
@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 import pytest
 
 
@@ -19,9 +20,37 @@ def mxe_miso_ids():
             'chr2:700:800:-@chr2:500:600:-@chr2:300:400:-@chr2:100:200:-']
 
 
-@pytest.fixture(params=['SE', 'MXE'])
-def miso_ids_splice_type(request, se_miso_ids, mxe_miso_ids):
-    if request.param == 'SE':
-        return request, se_miso_ids
-    elif request.param == 'MXE':
-        return request, mxe_miso_ids
+@pytest.fixture
+def a5ss_miso_ids():
+    return ['chr1:100:200|250:+@chr1:500:600:+',
+            'chr1:1600:1500|1450:-@chr1:1200:1100:-',
+            # This last event should be excluded from analyses because the test
+            # fasta file only has a "chr1"
+            'chr2:600:500|450:-@chr2:200:100:-']
+
+
+@pytest.fixture
+def a3ss_miso_ids():
+    return ['chr1:100:200:+@chr1:500|550:600:+',
+            'chr1:1600:1500:-@chr1:1200|1150:1100:-',
+            # This last event should be excluded from analyses because the test
+            # fasta file only has a "chr1"
+            'chr2:600:500:-@chr2:200|150:100:-']
+
+
+@pytest.fixture
+def ri_miso_ids():
+    return ['chr1:100-200:+@chr1:300-400:+',
+            'chr1:1300-1400:-@chr1:1100-1200:-',
+            # This last event should be excluded from analyses because the test
+            # fasta file only has a "chr1"
+            'chr2:300-400:-@chr2:100-200:-']
+
+
+@pytest.fixture(params=['SE', 'MXE', 'A5SS', 'A3SS', 'RI'])
+def miso_ids_splice_type(request, se_miso_ids, mxe_miso_ids, a5ss_miso_ids,
+                         a3ss_miso_ids, ri_miso_ids):
+    miso_ids = {'SE': se_miso_ids, 'MXE': mxe_miso_ids,
+                'A5SS': a5ss_miso_ids, 'A3SS': a3ss_miso_ids,
+                'RI': ri_miso_ids}
+    return miso_ids[request.param], request.param
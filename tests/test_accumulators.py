@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+
+def test_event_statistics():
+    from rnaseek.accumulators import EventStatistics
+
+    statistics = EventStatistics(n_bins=10)
+    statistics.update(['a', 'b'], 'SE', [0.1, 0.5], [0.2, 0.4])
+    statistics.update(['a', 'b', 'a'], 'SE', [0.3, np.nan, 0.95])
+    df = statistics.to_frame()
+
+    assert df.index.tolist() == [('a', 'SE'), ('b', 'SE')]
+    assert df.n_samples.tolist() == [3, 1]
+    np.testing.assert_allclose(df.psi_mean, [0.45, 0.5])
+    np.testing.assert_allclose(df.psi_variance.iloc[0],
+                               np.var([0.1, 0.3, 0.95], ddof=1))
+    assert np.isnan(df.psi_variance.iloc[1])
+    assert df.psi_min.tolist() == [0.1, 0.5]
+    assert df.psi_max.tolist() == [0.95, 0.5]
+    assert df.loc[('a', 'SE'), ['psi_hist_1', 'psi_hist_3',
+                                'psi_hist_9']].tolist() == [1, 1, 1]
+
+
+def test_event_statistics_merge(tmpdir):
+    from rnaseek.accumulators import EventStatistics
+
+    psi = np.random.RandomState(0).uniform(size=(6, 4))
+    events = ['e1', 'e2', 'e3', 'e4']
+    everything = EventStatistics()
+    runs = [EventStatistics(), EventStatistics(), EventStatistics()]
+    for i, sample in enumerate(psi):
+        everything.update(events[:4 - i % 2], 'SE', sample[:4 - i % 2])
+        runs[i % 3].update(events[:4 - i % 2], 'SE', sample[:4 - i % 2])
+
+    # Through a csv, and in a different order
+    filename = str(tmpdir.join('statistics.csv'))
+    runs[0].to_frame().to_csv(filename)
+    merged = runs[2].merge(runs[1]).merge(EventStatistics.from_frame(
+        pd.read_csv(filename, index_col=[0, 1])))
+    pdt.assert_frame_equal(merged.to_frame(), everything.to_frame())
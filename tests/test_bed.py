@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pybedtools
+import pytest
+
+
+@pytest.fixture
+def bed12(tmpdir):
+    filename = str(tmpdir.join('transcripts.bed'))
+    with open(filename, 'w') as f:
+        f.write('track name=transcripts\n'
+                'chr1\t10\t100\ttx1\t0\t+\t10\t100\t0\t3\t10,20,5,\t0,30,85,\n'
+                'chr1\t50\t90\ttx2\t0\t-\t50\t90\t0\t2\t5,10\t0,30\n')
+    return filename
+
+
+def test_bed_to_intervals(bed12):
+    from rnaseek.bed import read_bed, bed_to_intervals, INTERVAL_COLUMNS
+    intervals = pd.concat(map(bed_to_intervals, read_bed(bed12)))
+
+    assert list(intervals.columns) == INTERVAL_COLUMNS
+    tx1 = intervals.loc[intervals.event_name == 'tx1'].set_index('feature')
+    assert list(tx1.start) == [10, 40, 95, 20, 60]
+    assert list(tx1.stop) == [20, 60, 100, 40, 95]
+    # Exons are numbered from the 5' end, so backwards on the "-" strand
+    tx2 = intervals.loc[intervals.event_name == 'tx2'].set_index('feature')
+    assert tx2.loc['exon1', 'start'] == 80
+    assert tx2.loc['intron1', 'start'] == 55
+    assert tx2.loc['intron1', 'stop'] == 80
+
+
+def test_bed_annotator_write(bed12, tmpdir):
+    from rnaseek.bed import BedAnnotator
+    genome_fasta = pybedtools.example_filename('test.fa')
+    csv = str(tmpdir.join('annotated.csv'))
+
+    # One BED line per chunk, so the output is written incrementally
+    BedAnnotator(bed12, genome_fasta, chunksize=1).write(csv, sequences=True)
+
+    annotated = pd.read_csv(csv)
+    assert annotated.shape[0] == 8
+    assert (annotated.length == annotated.sequence.str.len()).all()
+    gc = annotated.sequence.map(
+        lambda x: (x.count('G') + x.count('C')) / float(len(x)))
+    assert np.allclose(annotated.gc.values, gc.values)
+
+
+def test_interval_sequences_clusters():
+    from pyfaidx import Fasta
+    from rnaseek.bed import interval_sequences, reverse_complement
+
+    genome = Fasta(pybedtools.example_filename('test.fa'), as_raw=True)
+    fetched = []
+
+    class Chromosome(object):
+        def __getitem__(self, key):
+            fetched.append((key.start, key.stop))
+            return genome['chr1'][key]
+
+    # Unsorted, overlapping and far apart, with one past the end
+    intervals = pd.DataFrame(
+        {'chrom': 'chr1', 'start': [1500, 10, 40, 1000, 25, 1790],
+         'stop': [1510, 30, 60, 1020, 35, 1900],
+         'strand': ['+', '-', '+', '+', '-', '+']})
+    annotations = interval_sequences(intervals, {'chr1': Chromosome()},
+                                     max_gap=10)
+    assert sorted(fetched) == [(10, 60), (1000, 1020), (1500, 1510),
+                               (1790, 1900)]
+
+    for (_, row), sequence, gc in zip(intervals.iterrows(),
+                                      annotations.sequence, annotations.gc):
+        expected = genome['chr1'][row.start:row.stop].upper()
+        if row.strand == '-':
+            expected = reverse_complement(expected)
+        assert sequence == expected
+        n_gc = expected.count('G') + expected.count('C')
+        assert np.isclose(gc, n_gc / float(row.stop - row.start))
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_contrast_weights():
+    from rnaseek.compare import contrast_weights
+
+    weights, first, second, names = contrast_weights(
+        [('a', 'b'), (['a', 'b'], 'c')], ['a', 'b', 'c'])
+    assert names == ['a_vs_b', 'a,b_vs_c']
+    assert weights.tolist() == [[1, 0, 0], [0, 1, 0], [1, 1, 0], [0, 0, 1]]
+    assert first.tolist() == [0, 2]
+    assert second.tolist() == [1, 3]
+
+    with pytest.raises(ValueError):
+        contrast_weights([('a', 'd')], ['a', 'b', 'c'])
+
+
+def test_bin_posterior_samples():
+    from rnaseek.compare import bin_posterior_samples
+
+    psi = np.array([[[0.05, 0.15, 0.15, np.nan], [np.nan] * 4]])
+    histograms, means = bin_posterior_samples(psi, n_bins=10)
+    np.testing.assert_allclose(histograms[0, 0, :2], [1. / 3, 2. / 3])
+    assert (histograms[0, 1] == 0).all()
+    np.testing.assert_allclose(means[0, 0], 0.35 / 3, rtol=1e-6)
+    assert np.isnan(means[0, 1])
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_compare_miso_summary(n_jobs):
+    from rnaseek.compare import compare_miso
+
+    # The first event is different between sample1 and the others, and the
+    # second event is only in sample1 and sample2
+    summary = pd.DataFrame(
+        {'event_name': ['event1'] * 3 + ['event2'] * 2,
+         'splice_type': 'SE',
+         'sample_id': ['sample1', 'sample2', 'sample3', 'sample1',
+                       'sample2'],
+         'miso_posterior_mean': [0.1, 0.9, 0.9, 0.5, 0.5],
+         'ci_low': [0.05, 0.85, 0.85, 0.3, 0.3],
+         'ci_high': [0.15, 0.95, 0.95, 0.7, 0.7]})
+    comparisons = compare_miso(summary, n_jobs=n_jobs, chunk_size=1)
+    comparisons = comparisons.set_index(['event_name', 'contrast'])
+    assert comparisons.shape[0] == 4
+    assert comparisons.loc[('event1', 'sample1_vs_sample2'),
+                           'delta_psi'] == pytest.approx(-0.8)
+    assert comparisons.loc[('event1', 'sample1_vs_sample2'),
+                           'bayes_factor'] > 1e6
+    assert comparisons.loc[('event1', 'sample2_vs_sample3'),
+                           'bayes_factor'] < 1
+    assert comparisons.loc[('event2', 'sample1_vs_sample2'),
+                           'bayes_factor'] < 1
+    assert ('event2', 'sample1_vs_sample3') not in comparisons.index
+
+
+def test_compare_miso_posteriors(tmpdir):
+    from rnaseek.compare import compare_miso
+    from rnaseek.posteriors import PosteriorStore
+
+    out_dir = tmpdir.join('posteriors')
+    out_dir.ensure(dir=True)
+    psi = np.empty((1, 3, 100), dtype=np.float32)
+    psi[0, 0] = np.linspace(0.05, 0.15, 100)
+    psi[0, 1:] = np.linspace(0.85, 0.95, 100)
+    np.save(str(out_dir.join('psi.npy')), psi)
+    np.save(str(out_dir.join('observed.npy')), np.ones((1, 3), dtype=bool))
+    pd.DataFrame({'event_name': ['event1'], 'splice_type': ['SE']}).to_csv(
+        str(out_dir.join('events.csv')), index=False)
+    pd.DataFrame({'sample_id': ['sample1', 'sample2', 'sample3']}).to_csv(
+        str(out_dir.join('samples.csv')), index=False)
+
+    filename = str(tmpdir.join('comparisons.csv'))
+    comparisons = compare_miso(
+        PosteriorStore(str(out_dir)),
+        contrasts={'1_vs_rest': ('sample1', ['sample2', 'sample3'])},
+        filename=filename)
+    assert comparisons.contrast.tolist() == ['1_vs_rest']
+    assert comparisons.delta_psi[0] == pytest.approx(-0.8, rel=1e-5)
+    assert comparisons.bayes_factor[0] == 1e12
+    pd.testing.assert_frame_equal(pd.read_csv(filename), comparisons,
+                                  check_dtype=False)
+
+
+def test_compare_binned_memory():
+    import tracemalloc
+    from rnaseek.compare import (all_pairs, compare_binned,
+                                 contrast_weights)
+
+    # Every pair of 100 samples, whose gathered posteriors would be 200 MB
+    n_events, n_samples, n_bins = 50, 100, 100
+    rng = np.random.RandomState(0)
+    histograms = rng.dirichlet(np.ones(n_bins), size=(n_events, n_samples))
+    means = rng.uniform(size=(n_events, n_samples))
+    sample_ids = [str(x) for x in range(n_samples)]
+    weights, first, second, names = contrast_weights(all_pairs(sample_ids),
+                                                     sample_ids)
+    assert len(names) * n_events * n_bins * 8 > 150e6
+
+    tracemalloc.start()
+    psi_1, psi_2, bayes_factor = compare_binned(histograms, means, weights,
+                                                first, second)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 150e6
+
+    overlap = (histograms[:, first[:10]] * histograms[:, second[:10]]).sum(
+        axis=2)
+    np.testing.assert_allclose(bayes_factor[:, :10],
+                               1.0 / (overlap * n_bins))
+    np.testing.assert_allclose(psi_1, means[:, first])
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def track(tmpdir):
+    filename = str(tmpdir.join('phylop.wig'))
+    with open(filename, 'w') as f:
+        f.write('track type=wiggle_0\n'
+                'fixedStep chrom=chr1 start=11 step=1\n'
+                '1.0\n2.0\n-1.0\n3.0\n'
+                'variableStep chrom=chr2 span=2\n'
+                '5 0.5\n9 2.5\n')
+    from rnaseek.conservation import wig_to_binary
+    out_dir = str(tmpdir.join('phylop'))
+    wig_to_binary(filename, out_dir, {'chr1': 100, 'chr2': 20})
+    return out_dir
+
+
+def test_wig_to_binary(track):
+    chr1 = np.load('{}/chr1.npy'.format(track))
+    assert chr1.dtype == np.float32
+    assert chr1.shape == (100,)
+    assert np.isnan(chr1[9]) and np.isnan(chr1[14])
+    assert list(chr1[10:14]) == [1, 2, -1, 3]
+    chr2 = np.load('{}/chr2.npy'.format(track))
+    assert list(np.nonzero(~np.isnan(chr2))[0]) == [4, 5, 8, 9]
+
+
+def test_summarize(track):
+    from rnaseek.conservation import ConservationScorer
+    intervals = pd.DataFrame(
+        {'event_name': ['a', 'a', 'b', 'c'],
+         'feature': ['exon1', 'intron1', 'exon1', 'exon1'],
+         'chrom': ['chr1', 'chr1', 'chr2', 'chr3'],
+         'start': [10, 12, 0, 0], 'stop': [14, 20, 10, 5],
+         'strand': ['+', '+', '-', '+']})
+
+    # A tiny block size splits the sweep, which shouldn't change anything
+    for block_size in (3, 1000):
+        scorer = ConservationScorer(track, threshold=1.0,
+                                    block_size=block_size)
+        summaries = scorer.summarize(intervals)
+        assert np.allclose(summaries.values,
+                           [[1.25, 3, 0.75], [1, 3, 0.5], [1.5, 2.5, 0.5],
+                            [np.nan] * 3], equal_nan=True)
+
+
+def test_values_bigwig(tmpdir):
+    pyBigWig = pytest.importorskip('pyBigWig')
+    from rnaseek.conservation import ConservationScorer
+    filename = str(tmpdir.join('phylop.bw'))
+    bigwig = pyBigWig.open(filename, 'w')
+    bigwig.addHeader([('chr1', 100)])
+    bigwig.addEntries('chr1', [10, 11, 12, 13], values=[1.0, 2.0, -1.0, 3.0],
+                      span=1)
+    bigwig.close()
+
+    values = ConservationScorer(filename).values('chr1', 8, 200)
+    assert values.dtype == float
+    assert values.shape == (92,)
+    assert np.isnan(values[:2]).all() and np.isnan(values[6:]).all()
+    assert list(values[2:6]) == [1, 2, -1, 3]
+
+
+def test_summarize_random(tmpdir):
+    from rnaseek.conservation import ConservationScorer
+    np.random.seed(0)
+    values = np.random.randn(10000).astype(np.float32)
+    values[np.random.rand(10000) < 0.1] = np.nan
+    np.save(str(tmpdir.join('chrR.npy')), values)
+    start = np.random.randint(0, 9500, 200)
+    stop = start + np.random.randint(0, 500, 200)
+    intervals = pd.DataFrame({'event_name': 'event', 'feature': 'exon',
+                              'chrom': 'chrR', 'start': start, 'stop': stop,
+                              'strand': '+'})
+
+    summaries = ConservationScorer(str(tmpdir), block_size=2000).summarize(
+        intervals)
+
+    for i, (a, b) in enumerate(zip(start, stop)):
+        x = values[a:b][~np.isnan(values[a:b])].astype(float)
+        expected = [x.mean(), x.max(), (x >= 1).mean()] if len(x) > 0 \
+            else [np.nan] * 3
+        assert np.allclose(summaries.iloc[i].values, expected,
+                           equal_nan=True)
+
+
+def test_exon_flanks():
+    from rnaseek.conservation import exon_flanks
+    exons = pd.DataFrame({'event_name': ['a', 'b'], 'feature': 'exon1',
+                          'chrom': 'chr1', 'start': [50, 50],
+                          'stop': [60, 60], 'strand': ['+', '-']})
+    flanks = exon_flanks(exons, 10).set_index(['event_name', 'feature'])
+    assert list(flanks.loc[('a', 'exon1_upstream')][['start', 'stop']]) == \
+        [40, 50]
+    assert list(flanks.loc[('b', 'exon1_upstream')][['start', 'stop']]) == \
+        [60, 70]
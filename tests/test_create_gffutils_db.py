@@ -0,0 +1,164 @@
+import json
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def gtf(tmpdir):
+    filename = str(tmpdir.join('annotation.gtf'))
+    attributes = 'gene_id "G1"; transcript_id "{}"; exon_number {};'
+    lines = [
+        '##provider: GENCODE',
+        'chr1\tHAVANA\tgene\t100\t900\t.\t+\t.\tgene_id "G1";',
+        'chr1\tHAVANA\ttranscript\t100\t900\t.\t+\t.\tgene_id "G1"; '
+        'transcript_id "T1"; tag "basic"; tag "CCDS";',
+        'chr1\tHAVANA\texon\t100\t200\t.\t+\t.\t' + attributes.format('T1', 1),
+        'chr1\tHAVANA\tCDS\t150\t200\t.\t+\t0\t' + attributes.format('T1', 1),
+        'chr1\tHAVANA\tSelenocysteine\t160\t162\t.\t+\t.\t' +
+        attributes.format('T1', 1),
+        'chr1\tHAVANA\texon\t800\t900\t.\t+\t.\t' + attributes.format('T1', 2),
+        'chr1\tENSEMBL\ttranscript\t100\t900\t.\t+\t.\tgene_id "G1"; '
+        'transcript_id "T2";',
+        # Shared with T1, so the attributes and sources are merged
+        'chr1\tENSEMBL\texon\t100\t200\t.\t+\t.\t' + attributes.format('T2', 1),
+        # Same location but a different frame, so a different fancy_id
+        'chr1\tENSEMBL\tCDS\t150\t200\t.\t+\t2\t' + attributes.format('T2', 1),
+        'chr1\tENSEMBL\texon\t500\t900\t.\t+\t.\t' + attributes.format('T2', 2),
+        # Same gene_id on another chromosome, so it's made unique
+        'chrY\tHAVANA\tgene\t100\t900\t.\t+\t.\tgene_id "G1";']
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return filename
+
+
+def dump(db_filename):
+    conn = sqlite3.connect(db_filename)
+    tables = {}
+    features = conn.execute('SELECT * FROM features').fetchall()
+    tables['features'] = dict(
+        (row[0], row[1:9] + (dict((k, sorted(v)) for k, v in json.loads(
+            row[9]).items()),) + row[10:]) for row in features)
+    for table in ('relations', 'duplicates', 'directives', 'autoincrements',
+                  'meta'):
+        tables[table] = sorted(conn.execute(
+            'SELECT * FROM {}'.format(table)).fetchall())
+    tables['indexes'] = sorted(conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index'").fetchall())
+    conn.close()
+    return tables
+
+
+def test_create_db_fast(gtf, tmpdir):
+    from rnaseek.create_gffutils_db import create_db
+    slow = str(tmpdir.join('slow.db'))
+    fast = str(tmpdir.join('fast.db'))
+    create_db(gtf, slow)
+    db = create_db(gtf, fast, fast=True)
+
+    assert dump(fast) == dump(slow)
+    exon = db['exon:chr1:100-200:+']
+    assert exon.source == 'ENSEMBL,HAVANA'
+    assert sorted(exon.attributes['transcript_id']) == ['T1', 'T2']
+    assert db['G1_1'].seqid == 'chrY'
+    assert len(list(db.children('T2', featuretype='exon'))) == 2
+
+
+
+def test_create_db_fast_failure(gtf, tmpdir, monkeypatch):
+    from rnaseek import create_gffutils_db
+
+    # An index of a column that doesn't exist fails after the inserts
+    monkeypatch.setattr(create_gffutils_db, 'INDEXES',
+                        [('broken', 'features (nonexistent)')])
+    with pytest.raises(sqlite3.OperationalError):
+        create_gffutils_db.create_db_fast(gtf, str(tmpdir.join('fast.db')))
+    assert not tmpdir.listdir(lambda x: x.basename.startswith('fast.db'))
+
+def test_annotation_cache(gtf, tmpdir, monkeypatch):
+    import threading
+    import time
+    from rnaseek import create_gffutils_db
+    cache_dir = str(tmpdir.join('cache'))
+    builds = []
+
+    def build_db(gff_filename, db_filename, fast=False):
+        builds.append(gff_filename)
+        # Slow enough that the other job has to wait for the lock
+        time.sleep(0.2)
+        return create_gffutils_db.create_db_fast(gff_filename, db_filename)
+    monkeypatch.setattr(create_gffutils_db, 'build_db', build_db)
+
+    # Concurrent jobs only build once
+    jobs = [threading.Thread(target=create_gffutils_db.create_db,
+                             args=(gtf,), kwargs={'cache_dir': cache_dir})
+            for _ in range(2)]
+    for job in jobs:
+        job.start()
+    for job in jobs:
+        job.join()
+    assert len(builds) == 1
+
+    # A copy of the same GTF under another name is a hit
+    copy = str(tmpdir.join('copy.gtf'))
+    with open(gtf) as f, open(copy, 'w') as g:
+        g.write(f.read())
+    db = create_gffutils_db.create_db(copy, str(tmpdir.join('project.db')),
+                                      cache_dir=cache_dir)
+    assert len(builds) == 1
+    assert db['G1_1'].seqid == 'chrY'
+
+
+def test_annotation_cache_evict(gtf, tmpdir):
+    import os
+    from rnaseek.create_gffutils_db import AnnotationCache
+    cache = AnnotationCache(str(tmpdir.join('cache')))
+    for i, key in enumerate(['old', 'recent', 'new']):
+        path = cache.path(key)
+        with open(path, 'w') as f:
+            f.write('x' * 100)
+        os.utime(path, (i, i))
+
+    cache.max_bytes = 250
+    cache.evict(keep=('new',))
+    assert list(cache.databases().index) == ['recent', 'new']
+    cache.max_bytes = 0
+    cache.evict(keep=('new',))
+    assert list(cache.databases().index) == ['new']
+
+
+def test_annotation_cache_isolated(gtf, tmpdir, monkeypatch):
+    import os
+    from rnaseek import create_gffutils_db
+    from rnaseek.create_gffutils_db import AnnotationCache, locked
+    cache = AnnotationCache(str(tmpdir.join('cache')))
+
+    # Changing a project's database doesn't change the cached one, which is
+    # opened read-only
+    project = cache.create_db(gtf, str(tmpdir.join('project.db')))
+    project.execute("DELETE FROM features WHERE featuretype = 'gene'")
+    project.conn.commit()
+    cached = cache.create_db(gtf)
+    assert len(list(cached.features_of_type('gene'))) > 0
+    with pytest.raises(sqlite3.OperationalError):
+        cached.execute("DELETE FROM features")
+
+    # A database that another job has open is not evicted
+    key = cache.key(gtf)
+    cache.max_bytes = 0
+    with locked(cache.path(key) + '.lock', shared=True):
+        cache.evict()
+    assert list(cache.databases().index) == [key]
+    cache.evict()
+    assert cache.databases().shape[0] == 0
+
+    # A failed build leaves nothing behind
+    def build_db(gff_filename, db_filename, fast=False):
+        with open(db_filename, 'w') as f:
+            f.write('partial')
+        raise RuntimeError('build failed')
+    monkeypatch.setattr(create_gffutils_db, 'build_db', build_db)
+    with pytest.raises(RuntimeError):
+        cache.create_db(gtf)
+    assert not [x for x in os.listdir(cache.cache_dir)
+                if not x.endswith('.lock')]
@@ -0,0 +1,62 @@
+import glob
+import os
+
+import pytest
+
+
+@pytest.fixture
+def miso_dir(tmpdir):
+    for sample_id in ('a_prob0.5_iter1', 'a_prob0.5_iter2', 'b_prob1_iter1'):
+        for splice_type in ('SE', 'MXE'):
+            summary_dir = tmpdir.join('miso', sample_id, splice_type,
+                                      'summary')
+            summary_dir.ensure(dir=True)
+            summary_dir.join('{}.miso_summary'.format(splice_type)).write(
+                'header\n')
+    tmpdir.join('miso', '.hidden', 'SE', 'summary').ensure(dir=True)
+    tmpdir.join('miso', '.hidden', 'SE', 'summary',
+                'SE.miso_summary').write('header\n')
+    return tmpdir
+
+
+def test_walk_glob(miso_dir):
+    from rnaseek.discovery import walk_glob
+
+    for glob_command in ('miso/*/*/summary/*.miso_summary',
+                         'miso/a_*/SE/summary/SE.miso_summary',
+                         'miso/?_prob1_iter[0-9]/*/*/*',
+                         'nothing/*'):
+        for prefix in (str(miso_dir) + '/', ''):
+            with miso_dir.as_cwd():
+                paths = walk_glob(prefix + glob_command)
+                assert [x[0] for x in paths] == \
+                    sorted(glob.glob(prefix + glob_command))
+                assert all(x[1].st_size == os.path.getsize(x[0])
+                           for x in paths)
+
+
+def test_discover_files(miso_dir):
+    from rnaseek.discovery import discover_files
+    from rnaseek.scripts.combine_miso_output import (
+        MISO_DOWNSAMPLED_DTYPES, MISO_DOWNSAMPLED_TEMPLATE)
+
+    glob_command = str(miso_dir.join('*', '*', '*', 'summary', '*'))
+    files = discover_files(glob_command, MISO_DOWNSAMPLED_TEMPLATE,
+                           MISO_DOWNSAMPLED_DTYPES)
+    assert files.shape[0] == 6
+    assert list(files.columns) == ['filename', 'size', 'mtime', 'sample_id',
+                                   'real_id', 'probability', 'iteration',
+                                   'splice_type']
+    assert files['size'].tolist() == [7] * 6
+    first = files.iloc[0]
+    assert first.sample_id == 'a_prob0.5_iter1'
+    assert first.real_id == 'a'
+    assert first.probability == 0.5
+    assert first.iteration == 1
+    assert first.splice_type == 'MXE'
+
+    # Files that don't match the template are skipped
+    files = discover_files(glob_command, r'(?P<sample_id>b)_[^/]+/SE/')
+    assert files.filename.tolist() == [
+        str(miso_dir.join('miso', 'b_prob1_iter1', 'SE', 'summary',
+                          'SE.miso_summary'))]
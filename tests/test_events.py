@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+
+def test_event_dictionary(tmpdir):
+    from rnaseek.events import EventDictionary
+
+    events = EventDictionary(['b', 'a', 'b'])
+    assert events.event_names.tolist() == ['a', 'b']
+    assert events.get_ids(['b', 'c', 'a']).tolist() == [1, -1, 0]
+    # New names get the next ids, and existing ids don't change
+    assert events.intern(pd.Categorical(['d', 'b', 'c'])).tolist() == \
+        [3, 1, 2]
+    assert events.names([3, 0]).tolist() == ['d', 'a']
+    with pytest.raises(ValueError):
+        events.names([4])
+
+    filename = str(tmpdir.join('miso_event_ids.csv'))
+    events.to_frame().to_csv(filename)
+    read = EventDictionary.read(filename)
+    pdt.assert_index_equal(read.event_names, events.event_names)
+
+
+def test_event_dictionary_encode():
+    from rnaseek.events import EventDictionary
+
+    summary = pd.DataFrame({'event_name': ['x', 'y', 'x'],
+                            'psi': [0.1, 0.2, 0.3]})
+    psi = summary.set_index(['event_name', 'psi'])
+    events = EventDictionary()
+    encoded = events.encode(summary)
+    assert encoded.columns.tolist() == ['event_id', 'psi']
+    assert encoded.event_id.tolist() == [0, 1, 0]
+    assert events.encode(psi).index.names == ['event_id', 'psi']
+    pdt.assert_frame_equal(events.decode(encoded), summary)
+    pdt.assert_frame_equal(events.decode(events.encode(psi)), psi)
+    assert np.issubdtype(encoded.event_id.dtype, np.integer)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def fasta_filename(tmpdir):
+    filename = str(tmpdir.join('sequences.fa'))
+    with open(filename, 'w') as f:
+        f.write('>seq1 first sequence\nACGT\nGGCC\n'
+                '>seq2\nNNATAT\n'
+                '>seq3\nacgtac\n')
+    return filename
+
+
+def test_read_fasta(fasta_filename):
+    from rnaseek.fasta import read_fasta
+    batches = list(read_fasta(fasta_filename, chunksize=2))
+    assert [names for names, sequences in batches] == [['seq1', 'seq2'],
+                                                       ['seq3']]
+    assert batches[0][1] == [b'ACGTGGCC', b'NNATAT']
+
+
+def test_kmer_counts():
+    from rnaseek.fasta import kmer_counts, kmer_names
+    counts = kmer_counts(['ACGTA', 'NNACG', 'ac'], k=2)
+    names = kmer_names(2)
+
+    assert counts.shape == (3, 16)
+    # K-mers with Ns or crossing into the next sequence aren't counted
+    assert counts.sum(axis=1).tolist() == [4, 2, 1]
+    assert counts[1, names.index('AC')] == 1
+    assert counts[2, names.index('AC')] == 1
+
+
+def test_fasta_annotator(fasta_filename):
+    from rnaseek.fasta import FastaAnnotator
+    features = list(FastaAnnotator(fasta_filename, k=1,
+                                   chunksize=1).annotate())
+
+    assert len(features) == 3
+    seq1 = features[0].loc['seq1']
+    assert seq1['length'] == 8
+    assert seq1['gc'] == 0.75
+    assert seq1[['A', 'C', 'G', 'T']].tolist() == [1, 3, 3, 1]
+
+
+def test_gravy():
+    from rnaseek.fasta import gravy
+    assert np.allclose(gravy(['MA*', 'KR', 'ILV']),
+                       [1.85, -4.2, (4.5 + 3.8 + 4.2) / 3])
+
+
+def test_fasta_annotator_kmer_batches(fasta_filename):
+    from rnaseek.fasta import FastaAnnotator, MAX_KMER_CELLS
+
+    # Dense counts of long k-mers are made a few sequences at a time
+    annotator = FastaAnnotator(fasta_filename, k=11, chunksize=10000)
+    assert annotator.chunksize * 4 ** 11 <= MAX_KMER_CELLS
+    features = list(annotator.annotate())
+    assert [x.shape[0] for x in features] == [3]
+    assert FastaAnnotator(fasta_filename, k=12).chunksize == 1
+    assert FastaAnnotator(fasta_filename, k=3, chunksize=2).chunksize == 2
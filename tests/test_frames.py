@@ -0,0 +1,162 @@
+import pandas.testing as pdt
+import pytest
+
+# Coding exons of each transcript in BED coordinates, in transcript order
+TRANSCRIPTS = {
+    # Includes a 30 nt exon, and T2 skips it
+    'T1': ('+', [(100, 200), (300, 330), (400, 500), (600, 700)]),
+    'T2': ('+', [(100, 200), (400, 500), (600, 700)]),
+    # A 31 nt exon, with two more exons after the downstream one
+    'T3': ('+', [(1000, 1100), (1200, 1231), (1300, 1400), (1500, 1600),
+                 (1700, 1800)]),
+    # A 2 nt exon, whose downstream exon is the last
+    'T4': ('+', [(2000, 2100), (2200, 2202), (2300, 2400)]),
+    'T5': ('-', [(5000, 5100), (4800, 4830), (4600, 4700)]),
+    # Annotated in another frame after the 31 nt exon, so not counted
+    'T6': ('+', [(1000, 1100), (1200, 1231), (1300, 1400)]),
+}
+# Exons of transcripts with UTRs, whose other exons are their CDS. The CDS of
+# T4 ends 80 nt before the end of its exon, and a UTR-only exon follows
+UTR_EXONS = {'T4': [(1950, 2100), (2200, 2202), (2300, 2480), (2500, 2600)]}
+
+SE_MISO_IDS = ['chr1:101:200:+@chr1:301:330:+@chr1:401:500:+',
+               'chr1:1001:1100:+@chr1:1201:1231:+@chr1:1301:1400:+',
+               'chr1:2001:2100:+@chr1:2201:2202:+@chr1:2301:2400:+',
+               'chr1:5001:5100:-@chr1:4801:4830:-@chr1:4601:4700:-',
+               # Not coding
+               'chr1:8001:8100:+@chr1:8201:8230:+@chr1:8301:8400:+']
+
+
+@pytest.fixture
+def gtf(tmpdir):
+    filename = str(tmpdir.join('annotation.gtf'))
+    lines = []
+    for transcript_id, (strand, exons) in sorted(TRANSCRIPTS.items()):
+        attributes = 'gene_id "G{0}"; transcript_id "{0}";'.format(
+            transcript_id)
+        # The frame is the number of bases before the first whole codon
+        coding_start = 0
+        for start, stop in exons:
+            frame = -coding_start % 3 if transcript_id != 'T6' or \
+                start < 1300 else 0
+            coding_start += stop - start
+            lines.append('\t'.join(['chr1', 'HAVANA', 'CDS', str(start + 1),
+                                    str(stop), '.', strand, str(frame),
+                                    attributes]))
+        for start, stop in UTR_EXONS.get(transcript_id, exons):
+            lines.append('\t'.join(['chr1', 'HAVANA', 'exon', str(start + 1),
+                                    str(stop), '.', strand, '.',
+                                    attributes]))
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return filename
+
+
+def test_parse_fancy_cds_ids():
+    from rnaseek.frames import parse_fancy_cds_ids
+
+    cds = parse_fancy_cds_ids(['CDS:chr1:101-200:+:0', 'CDS:chrX:5-10:-:.'])
+    assert cds.start.tolist() == [100, 4]
+    assert cds.stop.tolist() == [200, 10]
+    assert cds.frame.tolist() == [0, 0]
+    with pytest.raises(ValueError):
+        parse_fancy_cds_ids(['exon:chr1:101-200:+'])
+
+
+def test_index_cds(gtf):
+    from rnaseek.frames import cds_table_from_gtf, index_cds
+
+    cds = index_cds(cds_table_from_gtf(gtf))
+    t5 = cds.loc[cds.transcript_id == 'T5']
+    assert t5.start.tolist() == [5000, 4800, 4600]
+    assert t5.coding_stop.tolist() == [100, 130, 230]
+    assert t5.reading_frame.tolist() == [0, 0, 0]
+    assert t5.last_junction.tolist() == [130, 130, 130]
+    assert t5.five_prime.tolist() == [5100, 4830, 4700]
+    assert cds.loc[cds.transcript_id == 'T6'].reading_frame.tolist() == [
+        0, 0, 2]
+
+    # The last junction of T4 is after the 80 nt of UTR in its last CDS exon
+    t4 = cds.loc[cds.transcript_id == 'T4']
+    assert t4.last_junction.tolist() == [102, 102, 102]
+    exons = cds_table_from_gtf(gtf, 'exon')
+    t4 = index_cds(cds_table_from_gtf(gtf), exons).query(
+        'transcript_id == "T4"')
+    assert t4.last_junction.tolist() == [282, 282, 282]
+    t5 = index_cds(cds_table_from_gtf(gtf), exons).query(
+        'transcript_id == "T5"')
+    assert t5.last_junction.tolist() == [130, 130, 130]
+
+
+def test_reading_frames(gtf):
+    from rnaseek.frames import cds_table_from_gtf, reading_frames
+    from rnaseek.miso import miso_ids_to_intervals
+
+    frames = reading_frames(miso_ids_to_intervals(SE_MISO_IDS, 'SE'), 'SE',
+                            cds_table_from_gtf(gtf))
+    assert frames.index.tolist() == SE_MISO_IDS
+    assert frames.length_difference.tolist() == [30, 31, 2, 30, 30]
+    assert frames.frame_shift.tolist() == [0, 1, 2, 0, 0]
+    assert frames.n_transcripts.tolist() == [2, 1, 1, 1, 0]
+    # The last junction of T3 is 100 nt after the downstream exon
+    assert frames.nmd_distance.tolist() == [0, 100, 0, 0, 0]
+    assert frames.classification.tolist() == [
+        'frame_preserving', 'nmd', 'frame_shifting', 'frame_preserving',
+        'noncoding']
+
+    # Only a shift of more than nmd_distance triggers NMD
+    frames = reading_frames(miso_ids_to_intervals(SE_MISO_IDS, 'SE'), 'SE',
+                            cds_table_from_gtf(gtf), nmd_distance=100)
+    assert frames.classification.iloc[1] == 'frame_shifting'
+
+    # A PTC in the downstream exon of T4 is 80 nt before its last junction,
+    # in its 3' UTR
+    frames = reading_frames(miso_ids_to_intervals(SE_MISO_IDS, 'SE'), 'SE',
+                            cds_table_from_gtf(gtf),
+                            exons=cds_table_from_gtf(gtf, 'exon'))
+    assert frames.nmd_distance.tolist() == [0, 100, 80, 0, 0]
+    assert frames.classification.iloc[2] == 'nmd'
+
+    frames = reading_frames(miso_ids_to_intervals([], 'SE'), 'SE',
+                            cds_table_from_gtf(gtf))
+    assert frames.shape == (0, 5)
+
+
+def test_reading_frames_mxe(gtf):
+    from rnaseek.frames import cds_table_from_gtf, reading_frames
+    from rnaseek.miso import miso_ids_to_intervals
+
+    miso_ids = ['chr1:101:200:+@chr1:301:330:+@chr1:351:381:+@'
+                'chr1:401:500:+']
+    frames = reading_frames(miso_ids_to_intervals(miso_ids, 'MXE'), 'MXE',
+                            cds_table_from_gtf(gtf))
+    assert frames.length_difference.tolist() == [-1]
+    assert frames.frame_shift.tolist() == [2]
+    # Only T1 splices through an isoform, whose downstream exon is the
+    # second to last, so a PTC escapes NMD
+    assert frames.n_transcripts.tolist() == [1]
+    assert frames.classification.tolist() == ['frame_shifting']
+
+    with pytest.raises(ValueError):
+        reading_frames(miso_ids_to_intervals(miso_ids[:0], 'RI'), 'RI',
+                       cds_table_from_gtf(gtf))
+
+
+def test_cds_table_from_db(gtf, tmpdir):
+    from rnaseek.create_gffutils_db import create_db
+    from rnaseek.frames import cds_table_from_db, cds_table_from_gtf
+
+    db = create_db(gtf, str(tmpdir.join('annotation.db')))
+    columns = ['transcript_id', 'start']
+    from_db = cds_table_from_db(db).sort_values(columns).reset_index(
+        drop=True)
+    from_gtf = cds_table_from_gtf(gtf).sort_values(columns).reset_index(
+        drop=True)
+    pdt.assert_frame_equal(from_db, from_gtf, check_dtype=False)
+
+    columns = ['transcript_id', 'start']
+    from_db = cds_table_from_db(db, 'exon').sort_values(columns).reset_index(
+        drop=True)
+    from_gtf = cds_table_from_gtf(gtf, 'exon').sort_values(
+        columns).reset_index(drop=True)
+    pdt.assert_frame_equal(from_db, from_gtf, check_dtype=False)
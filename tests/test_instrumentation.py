@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+
+def test_run_report(tmpdir):
+    from rnaseek.instrumentation import RunReport
+
+    report = RunReport('test')
+    with report.stage('read') as stage:
+        stage['rows'] = 3
+        stage['bytes'] = 100
+    with pytest.raises(ValueError):
+        with report.stage('fail'):
+            raise ValueError('oops')
+
+    filename = report.write(str(tmpdir.join('report.json')))
+    with open(filename) as f:
+        written = json.load(f)
+    assert written['name'] == 'test'
+    assert [x['stage'] for x in written['stages']] == ['read', 'fail']
+    read, fail = written['stages']
+    assert read['rows'] == 3
+    assert read['bytes'] == 100
+    assert 'failed' not in read
+    assert fail['failed']
+    for stage in written['stages']:
+        assert stage['wall_seconds'] >= 0
+        assert stage['cpu_seconds'] >= 0
+        assert stage['peak_rss_bytes'] > 0
+
+
+def test_run_report_log(caplog):
+    import logging
+    from rnaseek.instrumentation import RunReport
+
+    report = RunReport('test', log=True)
+    with caplog.at_level(logging.INFO, logger='rnaseek.instrumentation'):
+        with report.stage('read') as stage:
+            stage['rows'] = 1
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record['run'] == 'test'
+    assert record['stage'] == 'read'
+    assert record['rows'] == 1
@@ -0,0 +1,143 @@
+import pytest
+
+SAMPLE1 = """\
+chr1\t101\t200\t1\t1\t1\t5\t1\t30
+chr1\t301\t400\t2\t2\t0\t3\t0\t20
+chr2\t11\t50\t0\t0\t0\t1\t2\t10
+"""
+
+SAMPLE2 = """\
+chr1\t301\t400\t2\t2\t0\t7\t1\t20
+chr1\t51\t90\t1\t1\t1\t2\t0\t30
+"""
+
+
+@pytest.fixture
+def sj_out_tabs(tmpdir):
+    filenames = []
+    for sample_id, text in (('sample1', SAMPLE1), ('sample2', SAMPLE2)):
+        filename = tmpdir.join('{}.SJ.out.tab'.format(sample_id))
+        filename.write(text)
+        filenames.append(str(filename))
+    return filenames
+
+
+def test_read_sj_out_tab(sj_out_tabs):
+    from rnaseek.junctions import read_sj_out_tab
+
+    junctions = read_sj_out_tab(sj_out_tabs[0])
+    assert junctions.start.tolist() == [100, 300, 10]
+    assert junctions.stop.tolist() == [200, 400, 50]
+    assert junctions.strand.tolist() == ['+', '-', '.']
+    assert junctions.annotated.tolist() == [True, False, False]
+    assert junctions.multi_reads.tolist() == [1, 0, 2]
+
+
+def test_junction_index(sj_out_tabs):
+    from rnaseek.junctions import JunctionIndex, read_sj_out_tab
+
+    index = JunctionIndex()
+    assert index.intern(read_sj_out_tab(sj_out_tabs[0])).tolist() == [0, 1, 2]
+    assert index.intern(read_sj_out_tab(sj_out_tabs[1])).tolist() == [1, 3]
+    assert index.n_junctions == 4
+    assert index.junctions().start.tolist() == [100, 300, 10, 50]
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_combine_junctions(sj_out_tabs, n_jobs):
+    from rnaseek.junctions import combine_junctions
+
+    junctions = combine_junctions(sj_out_tabs, ['sample1', 'sample2'],
+                                  n_jobs=n_jobs)
+    assert junctions.shape == (4, 2)
+    assert junctions.nnz == 5
+    unique_reads = junctions.to_frame(
+        'unique_reads', index=['chrom', 'start', 'stop', 'strand'])
+    assert unique_reads.index.tolist() == [
+        ('chr1', 50, 90, '+'), ('chr1', 100, 200, '+'),
+        ('chr1', 300, 400, '-'), ('chr2', 10, 50, '.')]
+    assert unique_reads.values.tolist() == [[0, 2], [5, 0], [3, 7], [1, 0]]
+    assert junctions.to_dense('multi_reads').tolist() == [
+        [0, 0], [1, 0], [0, 1], [2, 0]]
+
+
+def test_event_junctions():
+    from rnaseek.junctions import event_junctions
+    from rnaseek.miso import miso_ids_to_intervals
+
+    intervals = miso_ids_to_intervals(
+        ['chr1:100:200:+@chr1:300:400:+@chr1:500:600:+'], 'SE')
+    junctions = event_junctions(intervals, 'SE')
+    # The exclusion junction, then the two inclusion junctions
+    assert junctions.isoform.tolist() == [1, 2, 2]
+    assert junctions.start.tolist() == [200, 200, 400]
+    assert junctions.stop.tolist() == [499, 299, 499]
+
+    with pytest.raises(ValueError):
+        event_junctions(miso_ids_to_intervals(
+            ['chr1:906066-906138:+@chr1:906259-906386:+'], 'RI'), 'RI')
+
+
+def test_junction_psi():
+    import numpy as np
+    import pandas as pd
+    from rnaseek.junctions import junction_psi
+    from rnaseek.matrix import SparseMatrix
+    from rnaseek.miso import miso_ids_to_intervals
+
+    miso_ids = ['chr1:100:200:+@chr1:300:400:+@chr1:500:600:+',
+                'chr2:500:600:-@chr2:300:400:-@chr2:100:200:-']
+    rows = pd.DataFrame({'chrom': ['chr1', 'chr1', 'chr1', 'chr2'],
+                         'start': [200, 400, 200, 400],
+                         'stop': [299, 499, 499, 499],
+                         'strand': ['+', '+', '+', '-'],
+                         'motif': 1, 'annotated': True})
+    counts = SparseMatrix.from_coo(
+        [0, 1, 2, 0, 1, 3], [0, 0, 0, 1, 1, 1],
+        {'unique_reads': np.array([10, 10, 10, 40, 40, 5], dtype=np.uint32)},
+        rows, ['sample1', 'sample2'])
+
+    results = junction_psi(miso_ids_to_intervals(miso_ids, 'SE'), 'SE',
+                           counts)
+    psi = results['psi']
+    assert psi.index.tolist() == [(miso_ids[0], 'SE'), (miso_ids[1], 'SE')]
+    assert psi.columns.tolist() == ['sample1', 'sample2']
+    assert psi.loc[(miso_ids[0], 'SE')].tolist() == [0.5, 1.0]
+    # The second event only has 5 reads on its exclusion junction
+    assert psi.loc[(miso_ids[1], 'SE')].isnull().all()
+    assert results['reads'].loc[(miso_ids[1], 'SE'), 'sample2'] == 5
+    first = (miso_ids[0], 'SE')
+    assert (results['ci_low'].loc[first] < psi.loc[first]).all()
+    assert (results['ci_high'].loc[first] >= psi.loc[first]).all()
+
+
+def test_junction_psi_unstranded():
+    import numpy as np
+    import pandas as pd
+    from rnaseek.junctions import junction_psi
+    from rnaseek.matrix import SparseMatrix
+    from rnaseek.miso import miso_ids_to_intervals
+
+    # STAR gave the exclusion junction no strand, and the first inclusion
+    # junction is on both "+" and "."
+    miso_ids = ['chr1:100:200:+@chr1:300:400:+@chr1:500:600:+']
+    rows = pd.DataFrame({'chrom': 'chr1', 'start': [200, 200, 400, 200],
+                         'stop': [299, 299, 499, 499],
+                         'strand': ['+', '.', '+', '.'],
+                         'motif': [1, 0, 1, 0], 'annotated': False})
+    counts = SparseMatrix.from_coo(
+        [0, 1, 2, 3], [0, 0, 0, 0],
+        {'unique_reads': np.array([6, 4, 10, 10], dtype=np.uint32)},
+        rows, ['sample1'])
+    intervals = miso_ids_to_intervals(miso_ids, 'SE')
+
+    results = junction_psi(intervals, 'SE', counts)
+    assert results['psi'].values.tolist() == [[0.5]]
+    assert results['reads'].values.tolist() == [[30]]
+
+    # Matched on strand, the "." junctions are ignored, so the event looks
+    # fully included
+    results = junction_psi(intervals, 'SE', counts, stranded=True)
+    assert results['reads'].values.tolist() == [[16]]
+    assert results['psi'].values.tolist() == [[1.0]]
+
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+
+def _matrix():
+    from rnaseek.matrix import SparseMatrix
+
+    rows = pd.DataFrame({'chrom': ['chr1', 'chr1', 'chr2'],
+                         'start': [10, 20, 30]})
+    return SparseMatrix.from_coo(
+        [2, 0, 0, 1], [1, 1, 0, 2],
+        {'counts': np.array([4, 2, 1, 3], dtype=np.uint32)},
+        rows, ['a', 'b', 'c'])
+
+
+def test_from_coo():
+    matrix = _matrix()
+    assert matrix.shape == (3, 3)
+    assert matrix.indptr.tolist() == [0, 2, 3, 4]
+    assert matrix.to_dense('counts').tolist() == [
+        [1, 2, 0], [0, 0, 3], [0, 4, 0]]
+
+
+def test_take():
+    matrix = _matrix().take([2, 0])
+    assert matrix.to_dense('counts').tolist() == [[0, 4, 0], [1, 2, 0]]
+    assert matrix.rows.start.tolist() == [30, 10]
+
+
+def test_write_read(tmpdir):
+    from rnaseek.matrix import SparseMatrix
+
+    matrix = _matrix()
+    filename = str(tmpdir.join('matrix.npz'))
+    matrix.write(filename)
+    read = SparseMatrix.read(filename)
+
+    assert read.columns.tolist() == ['a', 'b', 'c']
+    assert read.rows.chrom.tolist() == ['chr1', 'chr1', 'chr2']
+    assert read.rows.start.tolist() == [10, 20, 30]
+    pdt.assert_frame_equal(read.to_frame('counts'),
+                           matrix.to_frame('counts'), check_column_type=False)
+
+
+def test_take_columns():
+    matrix = _matrix().take_columns([2, 1])
+    assert matrix.columns.tolist() == ['c', 'b']
+    assert matrix.to_dense('counts').tolist() == [[0, 2], [3, 0], [0, 4]]
+
+
+def test_sum_columns():
+    matrix = _matrix()
+    summed = matrix.sum_columns(['y', 'x', 'y'])
+    assert summed.columns.tolist() == ['x', 'y']
+    assert summed.data['counts'].dtype == np.uint32
+    expected = matrix.to_frame('counts').T.groupby(
+        np.array(['y', 'x', 'y'])).sum().T
+    assert summed.to_dense('counts').tolist() == expected.values.tolist()
+
+
+def test_write_read_dir(tmpdir):
+    from rnaseek.matrix import SparseMatrix
+
+    matrix = _matrix()
+    directory = str(tmpdir.join('matrix'))
+    matrix.write_dir(directory)
+    read = SparseMatrix.read_dir(directory)
+
+    assert isinstance(read.data['counts'], np.memmap)
+    assert read.rows.chrom.tolist() == ['chr1', 'chr1', 'chr2']
+    pdt.assert_frame_equal(read.to_frame('counts'),
+                           matrix.to_frame('counts'), check_column_type=False)
@@ -0,0 +1,136 @@
+import itertools
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import pybedtools
+import pytest
+from pyfaidx import Fasta
+
+
+@pytest.fixture
+def model_dir(tmpdir):
+    """Randomly-valued model tables in the MaxEntScan layout"""
+    rng = np.random.RandomState(0)
+    tmpdir.mkdir('splicemodels')
+    kmers = [''.join(x) for x in itertools.product('ACGT', repeat=7)]
+    # Shuffle the 7-mers to make sure they're looked up, not assumed sorted
+    rng.shuffle(kmers)
+    tmpdir.join('splicemodels', 'splice5sequences').write('\n'.join(kmers))
+    tmpdir.join('me2x5').write('\n'.join(map(str, rng.rand(4 ** 7))))
+    for i, length in enumerate((7, 7, 7, 7, 7, 3, 4, 3, 4)):
+        tmpdir.join('splicemodels', 'me2x3acc{}'.format(i + 1)).write(
+            '\n'.join(map(str, rng.rand(4 ** length) + 0.1)))
+    return str(tmpdir)
+
+
+def read(filename):
+    with open(filename) as f:
+        return [line.strip() for line in f]
+
+
+def hashseq(seq):
+    return sum('ACGT'.index(x) * 4 ** (len(seq) - i - 1)
+               for i, x in enumerate(seq))
+
+
+def reference_score5(seq, model_dir):
+    """Straight port of MaxEntScan's score5.pl"""
+    me2x5 = [float(x) for x in read(os.path.join(model_dir, 'me2x5'))]
+    sequences = read(os.path.join(model_dir, 'splicemodels',
+                                  'splice5sequences'))
+    bgd = {'A': 0.27, 'C': 0.23, 'G': 0.23, 'T': 0.27}
+    cons1 = {'A': 0.004, 'C': 0.0032, 'G': 0.9896, 'T': 0.0032}
+    cons2 = {'A': 0.0034, 'C': 0.0039, 'G': 0.0042, 'T': 0.9884}
+    consensus = cons1[seq[3]] * cons2[seq[4]] / (bgd[seq[3]] * bgd[seq[4]])
+    rest = seq[:3] + seq[5:]
+    return math.log(consensus * me2x5[sequences.index(rest)], 2)
+
+
+def reference_score3(seq, model_dir):
+    """Straight port of MaxEntScan's score3.pl"""
+    tables = [[float(x) for x in read(os.path.join(
+        model_dir, 'splicemodels', 'me2x3acc{}'.format(i + 1)))]
+        for i in range(9)]
+    bgd = {'A': 0.27, 'C': 0.23, 'G': 0.23, 'T': 0.27}
+    cons1 = {'A': 0.9903, 'C': 0.0032, 'G': 0.0034, 'T': 0.0030}
+    cons2 = {'A': 0.0027, 'C': 0.0037, 'G': 0.9905, 'T': 0.0030}
+    consensus = cons1[seq[18]] * cons2[seq[19]] / (bgd[seq[18]] *
+                                                   bgd[seq[19]])
+    rest = seq[:18] + seq[20:]
+    sc = [tables[0][hashseq(rest[0:7])], tables[1][hashseq(rest[7:14])],
+          tables[2][hashseq(rest[14:21])], tables[3][hashseq(rest[4:11])],
+          tables[4][hashseq(rest[11:18])], tables[5][hashseq(rest[4:7])],
+          tables[6][hashseq(rest[7:11])], tables[7][hashseq(rest[11:14])],
+          tables[8][hashseq(rest[14:18])]]
+    maxent = sc[0] * sc[1] * sc[2] * sc[3] * sc[4] / (sc[5] * sc[6] * sc[7] *
+                                                      sc[8])
+    return math.log(consensus * maxent, 2)
+
+
+def test_scores_match_reference(model_dir):
+    from rnaseek.maxentscan import MaxEntScanScorer
+    rng = np.random.RandomState(1)
+    sites5 = [''.join(rng.choice(list('ACGT'), 9)) for i in range(20)]
+    sites3 = [''.join(rng.choice(list('ACGT'), 23)) for i in range(20)]
+
+    scorer = MaxEntScanScorer(model_dir)
+
+    assert np.allclose(scorer.score5(sites5),
+                       [reference_score5(x, model_dir) for x in sites5])
+    assert np.allclose(scorer.score3(sites3),
+                       [reference_score3(x, model_dir) for x in sites3])
+    assert np.isnan(scorer.score5(['CAGGTNAGT'])[0])
+
+
+def test_missing_tables(tmpdir):
+    from rnaseek.maxentscan import MaxEntScanScorer
+    with pytest.raises(IOError):
+        MaxEntScanScorer(str(tmpdir))
+
+
+def test_splice_site_windows():
+    from rnaseek.bed import reverse_complement
+    from rnaseek.maxentscan import splice_site_windows
+    genome = Fasta(pybedtools.example_filename('test.fa'), as_raw=True)
+    chr1 = str(genome['chr1'][:]).upper()
+    exons = pd.DataFrame({'event_name': ['a', 'b'], 'feature': 'exon2',
+                          'chrom': 'chr1', 'start': [299, 1299],
+                          'stop': [400, 1400], 'strand': ['+', '-']})
+
+    sites3, sites5 = splice_site_windows(exons, genome)
+
+    decode = lambda x: ''.join('ACGTN'[i] for i in x)
+    assert decode(sites3[0]) == chr1[279:302]
+    assert decode(sites5[0]) == chr1[397:406]
+    assert decode(sites3[1]) == reverse_complement(chr1[1397:1420])
+    assert decode(sites5[1]) == reverse_complement(chr1[1293:1302])
+
+
+def test_splice_site_windows_clusters():
+    from rnaseek.maxentscan import splice_site_windows
+    genome = Fasta(pybedtools.example_filename('test.fa'), as_raw=True)
+    fetched = []
+
+    class Chromosome(object):
+        def __len__(self):
+            return len(genome['chr1'])
+
+        def __getitem__(self, key):
+            fetched.append((key.start, key.stop))
+            return genome['chr1'][key]
+
+    exons = pd.DataFrame({'event_name': ['a', 'b', 'c'], 'feature': 'exon2',
+                          'chrom': 'chr1', 'start': [1299, 299, 10],
+                          'stop': [1400, 400, 1795],
+                          'strand': ['-', '+', '+']})
+    expected = splice_site_windows(exons, genome)
+    observed = splice_site_windows(exons, {'chr1': Chromosome()}, max_gap=10)
+
+    # The windows of "c" run off the chromosome and are left as "N"
+    assert sorted(fetched) == [(279, 302), (397, 406), (1293, 1302),
+                               (1397, 1420)]
+    assert (observed[0][2] == 4).all() and (observed[1][2] == 4).all()
+    for e, o in zip(expected, observed):
+        np.testing.assert_array_equal(e, o)
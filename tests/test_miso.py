@@ -1,5 +1,6 @@
-
 import pybedtools
+import pytest
+
 
 class TestSpliceAnnotator(object):
 
@@ -8,4 +9,91 @@ class TestSpliceAnnotator(object):
         miso_ids, splice_type = miso_ids_splice_type
         genome_fasta = pybedtools.example_filename('test.fa')
         sa = miso.SpliceAnnotator(miso_ids, splice_type,
-                                  'test', genome_fasta)
\ No newline at end of file
+                                  'test', genome_fasta)
+
+    @pytest.mark.parametrize('splice_type', ['SE', 'MXE', 'A5SS', 'A3SS',
+                                             'RI'])
+    def test_init_empty(self, splice_type):
+        from rnaseek import miso
+        sa = miso.SpliceAnnotator([], splice_type, 'test')
+        assert sa.exon_ids == []
+        assert sa.exon_coords == []
+        assert len(sa.exon_bedtools) == sa.n_exons
+        assert len(sa.intron_bedtools) == sa.n_introns
+        assert all(x.count() == 0 for x in sa.exon_bedtools)
+
+
+def test_miso_ids_to_intervals(miso_ids_splice_type):
+    from rnaseek.miso import miso_ids_to_intervals, SPLICE_TYPE_SCHEMAS
+    miso_ids, splice_type = miso_ids_splice_type
+    schema = SPLICE_TYPE_SCHEMAS[splice_type]
+
+    intervals = miso_ids_to_intervals(miso_ids, splice_type)
+
+    n_features = len(schema['exons']) + len(schema['introns'])
+    assert intervals.shape[0] == len(miso_ids) * n_features
+    assert (intervals.start < intervals.stop).all()
+    for feature, df in intervals.groupby('feature'):
+        assert list(df.event_name) == miso_ids
+
+
+def test_miso_ids_to_intervals_introns():
+    from rnaseek.miso import miso_ids_to_intervals
+    intervals = miso_ids_to_intervals(
+        ['chr1:100:200:+@chr1:300:400:+@chr1:500:600:+',
+         'chr1:1500:1600:-@chr1:1300:1400:-@chr1:1100:1200:-'], 'SE')
+    introns = intervals.loc[intervals.feature == 'intron1']
+    assert list(introns.start) == [200, 1400]
+    assert list(introns.stop) == [299, 1499]
+
+
+def test_miso_ids_to_intervals_wrong_splice_type(se_miso_ids):
+    from rnaseek.miso import miso_ids_to_intervals
+    with pytest.raises(ValueError):
+        miso_ids_to_intervals(se_miso_ids, 'MXE')
+    with pytest.raises(ValueError):
+        miso_ids_to_intervals(se_miso_ids, 'AFE')
+
+
+def test_write_sashimi_plot_settings_batch(tmpdir):
+    import pandas as pd
+    from rnaseek.miso import (write_sashimi_plot_settings_batch,
+                              sashimi_plots)
+    mapping_stats = pd.DataFrame(
+        {'Uniquely mapped reads number': [1000000, 2000000, 3000000]},
+        index=['M1', 'M2', 'P1'])
+    specs = pd.DataFrame(
+        {'name': ['group1', 'group2', 'group3'],
+         'events': ['event1,event2', ['event3'], 'event4'],
+         'samples': ['M1,M2', 'M1,M2', 'P1'],
+         'colors': ['#4c72b0,#55a868', '#4c72b0,#55a868', None],
+         'ymax': [None, None, 50]})
+    out_dir = str(tmpdir.join('sashimi'))
+
+    manifest = write_sashimi_plot_settings_batch(
+        specs, mapping_stats, out_dir, 'bams', 'miso',
+        'indexed_{splice_type}_events')
+
+    assert list(manifest.event_name) == ['event1', 'event2', 'event3',
+                                         'event4']
+    assert (manifest.index_dir == 'indexed_SE_events').all()
+    # The first two groups have the same settings, so they share a file
+    assert manifest.settings.nunique() == 2
+    assert manifest.settings[0] == manifest.settings[2]
+    with open(manifest.settings[0]) as f:
+        settings = f.read()
+    assert 'coverages = [1000000,\n\t2000000]' in settings
+    assert '"M2/SE"' in settings
+    assert '\nymax = 150\n' in settings
+    with open(manifest.settings[3]) as f:
+        assert '\nymax = 50\n' in f.read()
+    assert (pd.read_csv(str(tmpdir.join('sashimi', 'manifest.csv'))).values
+            == manifest.values).all()
+
+    returncodes = sashimi_plots(manifest, n_jobs=2, sashimi_plot='true')
+    assert (returncodes == 0).all()
+
+    with pytest.raises(ValueError):
+        specs.loc[0, 'samples'] = 'M1,M3'
+        write_sashimi_plot_settings_batch(specs, mapping_stats, out_dir,
+                                          'bams', 'miso', 'indexed')
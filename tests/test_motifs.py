@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+
+def test_expand_iupac():
+    from rnaseek.motifs import expand_iupac
+    assert expand_iupac('YGCY') == ['CGCC', 'CGCT', 'TGCC', 'TGCT']
+    with pytest.raises(ValueError):
+        expand_iupac('UGJ')
+
+
+def test_motif_scanner_kmers():
+    from rnaseek.motifs import MotifScanner
+    scanner = MotifScanner(kmers={'FOX': 'UGCAUG', 'YGCY': 'YGCY',
+                                  'AC': ['AC', 'ACA']}, chunksize=2)
+    counts = scanner.scan(['UGCAUGCAUG', 'ACACNAC', 'TGCT'],
+                          names=['a', 'b', 'c'])
+
+    assert list(counts.columns) == ['AC', 'FOX', 'YGCY']
+    assert counts.loc['a', 'FOX'] == 2
+    # Overlapping matches are counted, but "AC" and "ACA" starting at the
+    # same position are one match
+    assert counts.loc['b', 'AC'] == 3
+    assert counts.loc['c', 'YGCY'] == 1
+
+
+def test_motif_scanner_long_kmers():
+    from rnaseek.motifs import MotifScanner, MAX_KMER_LENGTH
+    # Much longer k-mers than would fit in a table of every k-mer
+    kmer = 'ACGT' * 7
+    counts = MotifScanner(kmers={'long': [kmer, kmer[:3]]}).scan(
+        [kmer + 'A' + kmer, 'ACGACG'])
+    # Both matches of the long k-mer start where "ACG" does
+    assert counts.long.tolist() == [14, 2]
+    counts = MotifScanner(kmers={'long': kmer}).scan([kmer + 'A' + kmer])
+    assert counts.long.tolist() == [2]
+    with pytest.raises(ValueError):
+        MotifScanner(kmers={'long': 'A' * (MAX_KMER_LENGTH + 1)})
+
+
+def test_motif_scanner_pwms():
+    from rnaseek.motifs import MotifScanner
+    # Probabilities of "GG", with the last position allowing "A" as well
+    pwm = np.array([[0, 0, 1, 0], [0.5, 0, 0.5, 0]])
+    counts = MotifScanner(pwms={'GR': pwm}).scan(['GGG', 'GAC', 'GNG', 'C'])
+    assert counts.GR.tolist() == [2, 1, 0, 0]
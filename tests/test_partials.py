@@ -0,0 +1,43 @@
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+
+def _partial(files, values):
+    from rnaseek.partials import Partial
+
+    return Partial('test', {}, files,
+                   {'values': pd.DataFrame({'x': values},
+                                           index=pd.Index(files, name='file')),
+                    'names': pd.DataFrame({'name': files},
+                                          index=pd.Index(files, name='file'))},
+                   merge={'names': 'unique_rows'})
+
+
+def test_merge_partials_tree(tmpdir):
+    from rnaseek.partials import Partial, merge_partials
+
+    a = _partial(['a1', 'a2'], [1, 2])
+    b = _partial(['b1'], [3])
+    c = _partial(['c1', 'c2'], [4, 5])
+    flat = merge_partials([a, b, c])
+    assert flat.tables['values'].x.tolist() == [1, 2, 3, 4, 5]
+
+    # Merging the first and last batches first, and reading them back
+    ac = merge_partials([c, a]).write(str(tmpdir.join('ac')))
+    for tree in (merge_partials([merge_partials([a, c]), b]),
+                 merge_partials([b, ac]),
+                 merge_partials([b, merge_partials([Partial.read(ac)])])):
+        for name in flat.tables:
+            pdt.assert_frame_equal(tree.tables[name], flat.tables[name],
+                                   check_dtype=False)
+        assert tree.segments == flat.segments
+        assert tree.files == flat.files
+
+
+def test_partial_segments():
+    from rnaseek.partials import Partial
+
+    with pytest.raises(ValueError):
+        Partial('test', {}, ['a'], {'values': pd.DataFrame({'x': [1, 2]})},
+                segments=[['a', {'values': 1}]])
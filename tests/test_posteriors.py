@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+HEADER = ("#isoforms=['{0}.A','{0}.B']\texon_lens=('chr1:100:200:+',101)\t"
+          "iters=5000\tburn_in=500\tlag=10\tpercent_accept=90.1\t"
+          "proposal_type=drift\n")
+
+EVENTS = ['chr1:100:200:+@chr1:300:400:+@chr1:500:600:+',
+          'chr1:1100:1200:+@chr1:1300:1400:+@chr1:1500:1600:+']
+
+
+def _write_miso(filename, event_name, psi):
+    lines = ['{0:.4f},{1:.4f}\t-5.0'.format(x, 1 - x) for x in psi]
+    filename.write(HEADER.format(event_name) + 'sampled_psi\tlog_score\n' +
+                   '\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def miso_glob(tmpdir):
+    # The second event is only in the first sample, and with fewer draws
+    for sample_id, n_events in (('sample1', 2), ('sample2', 1)):
+        chrom_dir = tmpdir.join('miso', sample_id, 'SE', 'chr1')
+        chrom_dir.ensure(dir=True)
+        for i, event_name in enumerate(EVENTS[:n_events]):
+            psi = [0.1 * (i + 1)] * (4 - i)
+            _write_miso(chrom_dir.join(event_name + '.miso'), event_name, psi)
+    return str(tmpdir.join('miso', '*', '*', '*', '*.miso'))
+
+
+def test_read_miso_posterior(miso_glob):
+    import glob
+    from rnaseek.posteriors import read_miso_posterior
+
+    header, psi = read_miso_posterior(sorted(glob.glob(miso_glob))[0])
+    assert header['iters'] == '5000'
+    assert header['isoforms'] == "['{0}.A','{0}.B']".format(EVENTS[0])
+    assert psi.dtype == np.float32
+    np.testing.assert_allclose(psi, [0.1] * 4, rtol=1e-6)
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_read_miso_posteriors(miso_glob, tmpdir, n_jobs):
+    from rnaseek.posteriors import PosteriorStore, read_miso_posteriors
+
+    out_dir = str(tmpdir.join('posteriors'))
+    store = read_miso_posteriors(miso_glob, out_dir, n_jobs=n_jobs,
+                                 chunk_size=1)
+    assert store.shape == (2, 2, 4)
+    assert store.samples.tolist() == ['sample1', 'sample2']
+    assert store.events.index.tolist() == [(x, 'SE') for x in EVENTS]
+    assert store.events.lag.tolist() == [10, 10]
+
+    np.testing.assert_allclose(store.posterior(EVENTS[1], 'SE', 'sample1'),
+                               [0.2] * 3, rtol=1e-6)
+    assert store.observed.tolist() == [[True, True], [True, False]]
+    assert np.isnan(store.take()[1, 1]).all()
+    assert store.posterior(EVENTS[1], 'SE', 'sample2').shape == (0,)
+
+    reopened = PosteriorStore(out_dir)
+    np.testing.assert_array_equal(reopened.take(samples=['sample2']),
+                                  store.take()[:, [1]])
+    np.testing.assert_array_equal(reopened.take(slice(1, 2)),
+                                  store.take([(EVENTS[1], 'SE')]))
+
+
+def test_read_miso_posteriors_duplicates(miso_glob, tmpdir):
+    import glob
+    from rnaseek.posteriors import read_miso_posteriors
+
+    # A rerun of the first sample in another output folder
+    chrom_dir = tmpdir.join('rerun', 'sample1', 'SE', 'chr1')
+    chrom_dir.ensure(dir=True)
+    _write_miso(chrom_dir.join(EVENTS[0] + '.miso'), EVENTS[0], [0.9] * 4)
+    filenames = glob.glob(miso_glob) + [str(chrom_dir.join(EVENTS[0] +
+                                                           '.miso'))]
+    with pytest.raises(ValueError):
+        read_miso_posteriors(filenames, str(tmpdir.join('posteriors')))
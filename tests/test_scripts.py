@@ -0,0 +1,414 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+MISO_SUMMARY = """\
+event_name\tmiso_posterior_mean\tci_low\tci_high\tisoforms\tcounts\tassigned_counts\tchrom\tstrand\tmRNA_starts\tmRNA_ends
+chr1:100:200:+@chr1:300:400:+@chr1:500:600:+\t0.50\t0.40\t0.60\t'A','B'\t(0,0):1,(1,0):20,(1,1):5,(0,1):20\t0:25,1:21\tchr1\t+\t100,100\t600,600
+chr1:1100:1200:+@chr1:1300:1400:+@chr1:1500:1600:+\t0.90\t0.10\t0.99\t'A','B'\t(0,0):1,(1,0):20,(1,1):5,(0,1):20\t0:25,1:21\tchr1\t+\t1100,1100\t1600,1600
+chr1:2100:2200:+@chr1:2300:2400:+@chr1:2500:2600:+\t0.20\t0.15\t0.25\t'A','B'\t(0,0):1,(1,0):2,(1,1):5,(0,1):3\t0:7,1:4\tchr1\t+\t2100,2100\t2600,2600
+"""
+
+SAILFISH_HEADER = '# sailfish\n# a\n# b\n# c\n# Transcript\tLength\tTPM\n'
+
+STAR_LOG = """\
+                          Number of input reads |\t100
+                   Uniquely mapped reads number |\t80
+                        Uniquely mapped reads % |\t80.00%
+                       Number of splices: Total |\t{total}
+            Number of splices: Annotated (sjdb) |\t{total}
+                       Number of splices: GT/AG |\t{total}
+                       Number of splices: GC/AG |\t0
+                       Number of splices: AT/AC |\t0
+               Number of splices: Non-canonical |\t0
+"""
+
+
+@pytest.fixture
+def miso_glob(tmpdir):
+    for sample_id in ('sample1', 'sample2'):
+        summary_dir = tmpdir.join('miso', sample_id, 'SE', 'summary')
+        summary_dir.ensure(dir=True)
+        summary_dir.join('SE.miso_summary').write(MISO_SUMMARY)
+    return str(tmpdir.join('miso', '*', '*', 'summary', '*.miso_summary'))
+
+
+def test_combine_miso(miso_glob, tmpdir):
+    from rnaseek.scripts.combine_miso_output import CombineMiso
+
+    out_dir = str(tmpdir.join('combined'))
+    combine = CombineMiso(miso_glob, out_dir=out_dir, ci_max=0.5,
+                          per_isoform_reads_min=10)
+    results = combine.run()
+
+    assert results['summary_raw'].shape[0] == 6
+    # The second event has too wide a confidence interval, and the third too
+    # few junction reads
+    assert results['summary_filtered'].shape[0] == 2
+    psi = results['psi']
+    assert list(psi.columns) == ['sample1', 'sample2']
+    assert psi.index.tolist() == [
+        ('chr1:100:200:+@chr1:300:400:+@chr1:500:600:+', 'SE')]
+    written = pd.read_csv(os.path.join(out_dir, 'psi.csv'), index_col=[0, 1])
+    pdt.assert_frame_equal(written, psi, check_names=False)
+    assert [x['stage'] for x in combine.report.stages] == [
+        'discover', 'read', 'merge', 'filter', 'aggregate', 'write']
+
+
+def test_combine_miso_stages(miso_glob):
+    from rnaseek.scripts.combine_miso_output import CombineMiso
+
+    combine = CombineMiso(miso_glob, out_dir=None)
+    filenames = combine.discover()
+    assert len(filenames) == 2
+    summary = combine.read(filenames)
+    assert set(summary.sample_id) == {'sample1', 'sample2'}
+    assert set(summary.splice_type) == {'SE'}
+    psi = combine.aggregate(combine.filter(summary))
+    pdt.assert_frame_equal(psi, combine.run()['psi'])
+
+
+def test_combine_miso_compact(miso_glob, tmpdir):
+    from rnaseek.scripts.combine_miso_output import CombineMiso
+
+    results = CombineMiso(miso_glob, out_dir=None).run()
+    out_dir = str(tmpdir.join('combined'))
+    compact = CombineMiso(miso_glob, out_dir=out_dir, compact=True).run()
+
+    summary = compact['summary_raw']
+    assert summary.event_name.dtype == 'category'
+    assert summary.sample_id.dtype == 'category'
+    assert summary.miso_posterior_mean.dtype == np.float32
+    assert 'counts' not in summary
+    assert summary.counts_10.tolist() == [20, 20, 2] * 2
+    assert summary.assigned_counts_0.tolist() == [25, 25, 7] * 2
+
+    events = compact['events']
+    assert events.shape[0] == 3
+    assert events.loc['chr1:100:200:+@chr1:300:400:+@chr1:500:600:+',
+                      'genome_location'] == 'chr1:100-600'
+    assert os.path.exists(os.path.join(out_dir, 'miso_events.csv'))
+
+    assert compact['summary_filtered'].shape[0] == \
+        results['summary_filtered'].shape[0]
+    pdt.assert_frame_equal(compact['psi'], results['psi'])
+
+
+@pytest.fixture
+def sailfish_glob(tmpdir):
+    transcripts = ['ENST1.1|ENSG1.1|x', 'ENST2.1|ENSG1.1|x',
+                   'ENST3.1|ENSG2.1|x', 'ERCC-00001']
+    for sample_id, tpm in (('sample1', [1, 2, 3, 4]),
+                           ('sample2', [10, 20, 30, 40]),
+                           ('sample3', [0.5, 0, 0, 100])):
+        sample_dir = tmpdir.join('{}.sailfish'.format(sample_id))
+        sample_dir.ensure(dir=True)
+        lines = ['{}\t100\t{}\t0\t0\t0\t{}'.format(t, x, 2 * x)
+                 for t, x in zip(transcripts, tpm)]
+        sample_dir.join('quant_bias_corrected.sf').write(
+            SAILFISH_HEADER + '\n'.join(lines) + '\n')
+    return str(tmpdir.join('*.sailfish'))
+
+
+@pytest.fixture
+def star_glob(tmpdir):
+    for sample_id, total in (('sample1', 10), ('sample2', 0),
+                             ('sample3', 5)):
+        tmpdir.join('{}.Log.final.out'.format(sample_id)).write(
+            STAR_LOG.format(total=total))
+    return str(tmpdir.join('*.Log.final.out'))
+
+
+def test_combine_sailfish(sailfish_glob, tmpdir):
+    from rnaseek.scripts.combine_sailfish_output import CombineSailfish
+
+    results = CombineSailfish(sailfish_glob, None, 1).run()
+    tpm_genes = results['tpm_genes']
+    assert tpm_genes.loc['sample1', 'ENSG1'] == 3
+    assert tpm_genes.loc['sample2', 'ENSG2'] == 30
+    assert results['tpm_spikein'].columns.tolist() == ['ERCC-00001']
+    assert results['tpm'].shape == (3, 4)
+    assert not tmpdir.join('None').check()
+
+
+def test_combine_sailfish_sparse(sailfish_glob, tmpdir):
+    from rnaseek.matrix import SparseMatrix
+    from rnaseek.scripts.combine_sailfish_output import CombineSailfish
+
+    results = CombineSailfish(sailfish_glob, None, 1).run()
+    out_dir = str(tmpdir.join('combined'))
+    sparse = CombineSailfish(sailfish_glob, out_dir, 1, sparse=True).run()
+    # Only the nonzero TPMs are kept
+    assert sparse['tpm'].nnz == 10
+    assert sparse['tpm'].data['tpm'].dtype == np.float32
+    for key in results:
+        pdt.assert_frame_equal(sparse[key].to_frame('tpm', 'sample_id'),
+                               results[key].astype(np.float32),
+                               check_names=False)
+
+    tpm_genes = SparseMatrix.read_dir(os.path.join(out_dir, 'tpm_genes'))
+    assert isinstance(tpm_genes.data['tpm'], np.memmap)
+    pdt.assert_frame_equal(tpm_genes.to_frame('tpm', 'sample_id'),
+                           sparse['tpm_genes'].to_frame('tpm', 'sample_id'),
+                           check_column_type=False)
+    assert os.path.exists(os.path.join(out_dir, 'tpm_transcripts',
+                                       'indptr.npy'))
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_combine_sailfish_qc(sailfish_glob, tmpdir, sparse):
+    from rnaseek.scripts.combine_sailfish_output import CombineSailfish
+
+    out_dir = str(tmpdir.join('combined'))
+    results = CombineSailfish(sailfish_glob, out_dir, 1, qc=True,
+                              qc_tpm_mins=[1, 20], qc_top_n=2).run()
+    qc = results['qc']
+    assert qc.columns.tolist() == [
+        'transcripts_detected', 'genes_detected_tpm_1',
+        'genes_detected_tpm_20', 'spikein_fraction', 'estimated_reads',
+        'top_2_fraction']
+
+    # The same metrics as from the combined matrices
+    tpm, tpm_genes = results['tpm'], results['tpm_genes']
+    assert qc.transcripts_detected.tolist() == (tpm > 0).sum(axis=1).tolist()
+    assert qc.genes_detected_tpm_20.tolist() == \
+        (tpm_genes > 20).sum(axis=1).tolist()
+    np.testing.assert_allclose(
+        qc.spikein_fraction, results['tpm_spikein'].sum(axis=1) /
+        tpm.sum(axis=1))
+    assert qc.estimated_reads.tolist() == (2 * tpm.sum(axis=1)).tolist()
+    assert qc.loc['sample3', 'top_2_fraction'] == 1
+    written = pd.read_csv(os.path.join(out_dir, 'expression_qc.csv'),
+                          index_col=0)
+    pdt.assert_frame_equal(written, qc, check_names=False)
+
+    sparse_qc = CombineSailfish(sailfish_glob, None, 1, sparse=sparse,
+                                qc=True, qc_tpm_mins=[1, 20],
+                                qc_top_n=2).run()['qc']
+    pdt.assert_frame_equal(sparse_qc, qc)
+
+
+def test_combine_star(star_glob, tmpdir):
+    from rnaseek.scripts.combine_star_mapping_stats import \
+        CombineSTARLogFinalOut
+
+    out_dir = str(tmpdir.join('combined'))
+    mapping_stats = CombineSTARLogFinalOut(star_glob, out_dir, 1).run()
+    assert mapping_stats.index.tolist() == ['sample1', 'sample2', 'sample3']
+    assert mapping_stats.loc['sample1', '% splices: GT/AG'] == 100
+    assert pd.isnull(mapping_stats.loc['sample2', '% splices: GT/AG'])
+    assert os.path.exists(os.path.join(out_dir, 'mapping_stats.csv'))
+
+
+def test_combine_star_junctions(tmpdir):
+    from rnaseek.matrix import SparseMatrix
+    from rnaseek.scripts.combine_star_mapping_stats import \
+        CombineSTARJunctions
+
+    for sample_id, start in (('sample1', 101), ('sample2', 301)):
+        tmpdir.join('{}.SJ.out.tab'.format(sample_id)).write(
+            'chr1\t{}\t200\t1\t1\t1\t5\t1\t30\n'
+            'chr1\t501\t600\t2\t2\t0\t3\t0\t20\n'.format(start))
+
+    out_dir = str(tmpdir.join('combined'))
+    junctions = CombineSTARJunctions(str(tmpdir.join('*.SJ.out.tab')),
+                                     out_dir, 1).run()
+    assert junctions.columns.tolist() == ['sample1', 'sample2']
+    assert junctions.shape == (3, 2)
+    written = SparseMatrix.read(os.path.join(out_dir, 'junctions.npz'))
+    assert written.to_dense('unique_reads').tolist() == \
+        junctions.to_dense('unique_reads').tolist()
+
+
+def test_combine_star_junctions_map_reduce(tmpdir):
+    from rnaseek.partials import merge_partials
+    from rnaseek.scripts.combine_star_mapping_stats import \
+        CombineSTARJunctions
+
+    for sample_id, start in (('sample1', 101), ('sample2', 301),
+                             ('sample3', 101)):
+        tmpdir.join('{}.SJ.out.tab'.format(sample_id)).write(
+            'chr1\t{}\t200\t1\t1\t1\t5\t1\t30\n'
+            'chr1\t501\t600\t2\t2\t0\t3\t0\t20\n'.format(start))
+    glob_command = str(tmpdir.join('*.SJ.out.tab'))
+
+    junctions = CombineSTARJunctions(glob_command, None, 1).run()
+    partials = [str(tmpdir.join('partial{}'.format(i))) for i in range(3)]
+    for i, partial in enumerate(partials):
+        CombineSTARJunctions(glob_command, None, 1).map(partial, i, 3)
+    out_dir = str(tmpdir.join('combined'))
+    reduced = CombineSTARJunctions(glob_command, out_dir, 1).reduce(
+        [partials[1], merge_partials([partials[2], partials[0]])])
+    assert reduced.columns.tolist() == junctions.columns.tolist()
+    pdt.assert_frame_equal(reduced.rows, junctions.rows)
+    for layer in ('unique_reads', 'multi_reads'):
+        assert reduced.to_dense(layer).tolist() == \
+            junctions.to_dense(layer).tolist()
+    assert os.path.exists(os.path.join(out_dir, 'junctions.npz'))
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_combine_miso_event_statistics(miso_glob, tmpdir, compact):
+    from rnaseek.accumulators import EventStatistics
+    from rnaseek.scripts.combine_miso_output import CombineMiso
+
+    out_dir = str(tmpdir.join('combined'))
+    combine = CombineMiso(miso_glob, out_dir=out_dir, ci_max=0.5,
+                          per_isoform_reads_min=10, compact=compact,
+                          event_statistics=True)
+    results = combine.run()
+    statistics = results['event_statistics']
+    psi = results['psi']
+    # Only the events that pass filtering, as in psi.csv
+    assert statistics.index.tolist() == psi.index.tolist()
+    pdt.assert_series_equal(statistics.psi_mean, psi.mean(axis=1),
+                            check_names=False)
+    assert statistics.n_samples.tolist() == [2]
+    assert statistics.psi_hist_10.tolist() == [2]
+
+    written = pd.read_csv(os.path.join(out_dir, 'miso_event_statistics.csv'),
+                          index_col=[0, 1])
+    merged = EventStatistics.from_frame(written).merge(combine.statistics)
+    assert merged.to_frame().n_samples.tolist() == [4]
+
+    # Reading again, stage by stage or in another run, starts afresh
+    files = combine.discover()
+    combine.read(files)
+    combine.read(files)
+    assert combine.statistics.to_frame().n_samples.tolist() == [2]
+    assert combine.run()['event_statistics'].n_samples.tolist() == [2]
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_combine_miso_sweep(miso_glob, tmpdir, compact):
+    from rnaseek.scripts.combine_miso_output import CombineMiso
+
+    out_dir = str(tmpdir.join('combined'))
+    ci_maxes, reads_mins = [0.05, 0.2, 0.5, 1], [0, 5, 10, 50]
+    combine = CombineMiso(miso_glob, out_dir=out_dir, compact=compact,
+                          sweep_ci_max=ci_maxes, sweep_reads_min=reads_mins)
+    results = combine.run()
+    sweep = results['filter_sweep'].set_index(
+        ['splice_type', 'ci_max', 'per_isoform_reads_min'])
+    sweep_samples = results['filter_sweep_samples'].set_index(
+        ['splice_type', 'sample_id', 'ci_max', 'per_isoform_reads_min'])
+    assert sweep.shape[0] == 16
+    assert sweep_samples.shape[0] == 32
+
+    # The same counts as filtering at each pair of thresholds
+    summary = results['summary_raw']
+    for ci_max in ci_maxes:
+        for reads_min in reads_mins:
+            filtered = combine.filter_miso_summary(summary, ci_max,
+                                                   reads_min)
+            key = ('SE', ci_max, reads_min)
+            assert sweep.loc[key, 'n_events'] == \
+                filtered.event_name.nunique()
+            assert sweep.loc[key, 'n_event_samples'] == filtered.shape[0]
+            assert sweep_samples.loc[('SE', 'sample1', ci_max, reads_min),
+                                     'n_events'] == \
+                (filtered.sample_id == 'sample1').sum()
+    assert os.path.exists(os.path.join(out_dir, 'miso_filter_sweep.csv'))
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_combine_miso_event_ids(miso_glob, tmpdir, compact):
+    from rnaseek.events import EventDictionary
+    from rnaseek.scripts.combine_miso_output import CombineMiso
+
+    kwargs = dict(compact=compact, event_statistics=True,
+                  sweep_ci_max=[0.5])
+    results = CombineMiso(miso_glob, out_dir=None, **kwargs).run()
+    out_dir = str(tmpdir.join('combined'))
+    combine = CombineMiso(miso_glob, out_dir=out_dir, event_ids=True,
+                          **kwargs)
+    encoded = combine.run()
+
+    assert 'event_name' not in encoded['summary_raw']
+    assert encoded['psi'].index.names == ['event_id', 'splice_type']
+    events = EventDictionary.read(os.path.join(out_dir, 'miso_event_ids.csv'))
+    assert len(events) == 3
+    for key in ('summary_filtered', 'psi', 'event_statistics'):
+        pdt.assert_frame_equal(events.decode(encoded[key]), results[key],
+                               check_dtype=False, check_categorical=False)
+    pdt.assert_frame_equal(encoded['filter_sweep'], results['filter_sweep'])
+    if compact:
+        pdt.assert_frame_equal(events.decode(encoded['events']),
+                               results['events'])
+
+    # The ids of an existing dictionary are kept
+    events = EventDictionary(['chr2:1:2:+@chr2:3:4:+@chr2:5:6:+'])
+    events.to_frame().to_csv(os.path.join(out_dir, 'miso_event_ids.csv'))
+    encoded = CombineMiso(miso_glob, out_dir=out_dir, event_ids=True,
+                          **kwargs).run()
+    assert encoded['event_ids'].shape[0] == 4
+    assert 0 not in set(encoded['summary_raw'].event_id)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_combine_miso_map_reduce(miso_glob, tmpdir, compact):
+    from rnaseek.partials import merge_partials
+    from rnaseek.scripts.combine_miso_output import CombineMiso
+
+    kwargs = dict(compact=compact, event_statistics=True)
+    results = CombineMiso(miso_glob, out_dir=None, **kwargs).run()
+    partials = [str(tmpdir.join('partial{}'.format(i))) for i in range(2)]
+    for i, partial in enumerate(partials):
+        CombineMiso(miso_glob, out_dir=None, **kwargs).map(partial, i, 2)
+
+    # Reduced in a different order, and as a tree
+    reduced = CombineMiso(miso_glob, out_dir=None, **kwargs).reduce(
+        [merge_partials(partials[::-1])])
+    assert set(reduced) == set(results)
+    for key in ('summary_filtered', 'psi', 'event_statistics'):
+        pdt.assert_frame_equal(reduced[key], results[key],
+                               check_index_type=False)
+    if compact:
+        pdt.assert_frame_equal(reduced['events'], results['events'])
+
+    with pytest.raises(ValueError):
+        CombineMiso(miso_glob, out_dir=None, ci_max=0.1).reduce(partials)
+    with pytest.raises(ValueError):
+        merge_partials([partials[0], partials[0]])
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_combine_sailfish_map_reduce(sailfish_glob, tmpdir, sparse):
+    from rnaseek.scripts.combine_sailfish_output import CombineSailfish
+
+    results = CombineSailfish(sailfish_glob, None, 1, sparse=sparse,
+                              qc=True).run()
+    partials = [str(tmpdir.join('partial{}'.format(i))) for i in range(2)]
+    for i, partial in enumerate(partials):
+        CombineSailfish(sailfish_glob, None, 1, sparse=sparse, qc=True).map(
+            partial, i, 2)
+    reduced = CombineSailfish(sailfish_glob, None, 1, sparse=sparse,
+                              qc=True).reduce(partials[::-1])
+    for key in results:
+        if sparse and key != 'qc':
+            pdt.assert_frame_equal(reduced[key].to_frame('tpm', 'sample_id'),
+                                   results[key].to_frame('tpm', 'sample_id'))
+        else:
+            pdt.assert_frame_equal(reduced[key], results[key])
+    with pytest.raises(ValueError):
+        CombineSailfish(sailfish_glob, None, 1, sparse=not sparse,
+                        qc=True).reduce(partials)
+
+
+def test_combine_star_map_reduce(star_glob, tmpdir):
+    from rnaseek.partials import merge_partials
+    from rnaseek.scripts.combine_star_mapping_stats import \
+        CombineSTARLogFinalOut
+
+    mapping_stats = CombineSTARLogFinalOut(star_glob, None, 1).run()
+    partials = [str(tmpdir.join('partial{}'.format(i))) for i in range(3)]
+    for i, partial in enumerate(partials):
+        CombineSTARLogFinalOut(star_glob, None, 1).map(partial, i, 3)
+    out_dir = str(tmpdir.join('combined'))
+    reduced = CombineSTARLogFinalOut(star_glob, out_dir, 1).reduce(
+        [partials[1], merge_partials([partials[2], partials[0]])])
+    pdt.assert_frame_equal(reduced.astype(float), mapping_stats.astype(float))
+    assert os.path.exists(os.path.join(out_dir, 'mapping_stats.csv'))